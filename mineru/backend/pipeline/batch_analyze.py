@@ -5,13 +5,19 @@ from collections import defaultdict
 import numpy as np
 
 from .model_init import AtomModelSingleton
-from ...utils.config_reader import get_formula_enable, get_table_enable
+from ...utils.config_reader import get_formula_enable, get_table_enable, get_ocr_det_canvas_enable
 from ...utils.model_utils import crop_img, get_res_list_from_layout_res
-from ...utils.ocr_utils import get_adjusted_mfdetrec_res, get_ocr_result_list, OcrConfidence
+from ...utils.ocr_det_batch import batch_det
+from ...utils.ocr_utils import (
+    get_adjusted_mfdetrec_res, get_ocr_result_list, OcrConfidence, merge_det_boxes, update_det_boxes, sorted_boxes
+)
 
 YOLO_LAYOUT_BASE_BATCH_SIZE = 8
 MFD_BASE_BATCH_SIZE = 1
 MFR_BASE_BATCH_SIZE = 16
+OCR_DET_CANVAS_BASE_BATCH_SIZE = 2
+OCR_DET_PADDING_BASE_BATCH_SIZE = 16
+TABLE_DET_BASE_BATCH_SIZE = 2
 
 
 class BatchAnalyze:
@@ -123,13 +129,11 @@ class BatchAnalyze:
                 lang = crop_info[5]
                 lang_groups[lang].append(crop_info)
 
-            # 对每种语言按分辨率分组并批处理
-            for lang, lang_crop_list in lang_groups.items():
+            # 对每种语言批处理：小图拼接到画布上检测，放不进画布的大图按分辨率分组padding后检测
+            for lang, lang_crop_list in tqdm(lang_groups.items(), desc="OCR-det Predict"):
                 if not lang_crop_list:
                     continue
 
-                # logger.info(f"Processing OCR detection for language {lang} with {len(lang_crop_list)} images")
-
                 # 获取OCR模型
                 ocr_model = atom_model_manager.get_atom_model(
                     atom_model_name='ocr',
@@ -137,80 +141,44 @@ class BatchAnalyze:
                     lang=lang
                 )
 
-                # 按分辨率分组并同时完成padding
-                resolution_groups = defaultdict(list)
-                for crop_info in lang_crop_list:
-                    cropped_img = crop_info[0]
-                    h, w = cropped_img.shape[:2]
-                    # 使用更大的分组容差，减少分组数量
-                    # 将尺寸标准化到32的倍数
-                    normalized_h = ((h + 32) // 32) * 32  # 向上取整到32的倍数
-                    normalized_w = ((w + 32) // 32) * 32
-                    group_key = (normalized_h, normalized_w)
-                    resolution_groups[group_key].append(crop_info)
-
-                # 对每个分辨率组进行批处理
-                for group_key, group_crops in tqdm(resolution_groups.items(), desc=f"OCR-det {lang}"):
-
-                    # 计算目标尺寸（组内最大尺寸，向上取整到32的倍数）
-                    max_h = max(crop_info[0].shape[0] for crop_info in group_crops)
-                    max_w = max(crop_info[0].shape[1] for crop_info in group_crops)
-                    target_h = ((max_h + 32 - 1) // 32) * 32
-                    target_w = ((max_w + 32 - 1) // 32) * 32
-
-                    # 对所有图像进行padding到统一尺寸
-                    batch_images = []
-                    for crop_info in group_crops:
-                        img = crop_info[0]
-                        h, w = img.shape[:2]
-                        # 创建目标尺寸的白色背景
-                        padded_img = np.ones((target_h, target_w, 3), dtype=np.uint8) * 255
-                        # 将原图像粘贴到左上角
-                        padded_img[:h, :w] = img
-                        batch_images.append(padded_img)
-
-                    # 批处理检测
-                    batch_size = min(len(batch_images), self.batch_ratio * 16)  # 增加批处理大小
-                    # logger.debug(f"OCR-det batch: {batch_size} images, target size: {target_h}x{target_w}")
-                    batch_results = ocr_model.text_detector.batch_predict(batch_images, batch_size)
-
-                    # 处理批处理结果
-                    for i, (crop_info, (dt_boxes, elapse)) in enumerate(zip(group_crops, batch_results)):
-                        new_image, useful_list, ocr_res_list_dict, res, adjusted_mfdetrec_res, _lang = crop_info
-
-                        if dt_boxes is not None and len(dt_boxes) > 0:
-                            # 直接应用原始OCR流程中的关键处理步骤
-                            from mineru.utils.ocr_utils import (
-                                merge_det_boxes, update_det_boxes, sorted_boxes
+                dt_boxes_list = batch_det(
+                    ocr_model.text_detector,
+                    [crop_info[0] for crop_info in lang_crop_list],
+                    self.batch_ratio * OCR_DET_CANVAS_BASE_BATCH_SIZE,
+                    self.batch_ratio * OCR_DET_PADDING_BASE_BATCH_SIZE,
+                    canvas_enable=get_ocr_det_canvas_enable(),
+                )
+
+                # 处理批处理结果
+                for crop_info, dt_boxes in zip(lang_crop_list, dt_boxes_list):
+                    new_image, useful_list, ocr_res_list_dict, res, adjusted_mfdetrec_res, _lang = crop_info
+
+                    if dt_boxes is not None and len(dt_boxes) > 0:
+                        # 直接应用原始OCR流程中的关键处理步骤
+                        # 1. 排序检测框
+                        dt_boxes_sorted = sorted_boxes(dt_boxes)
+
+                        # 2. 合并相邻检测框
+                        if dt_boxes_sorted:
+                            dt_boxes_merged = merge_det_boxes(dt_boxes_sorted)
+                        else:
+                            dt_boxes_merged = []
+
+                        # 3. 根据公式位置更新检测框（关键步骤！）
+                        if dt_boxes_merged and adjusted_mfdetrec_res:
+                            dt_boxes_final = update_det_boxes(dt_boxes_merged, adjusted_mfdetrec_res)
+                        else:
+                            dt_boxes_final = dt_boxes_merged
+
+                        # 构造OCR结果格式
+                        ocr_res = [box.tolist() if hasattr(box, 'tolist') else box for box in dt_boxes_final]
+
+                        if ocr_res:
+                            ocr_result_list = get_ocr_result_list(
+                                ocr_res, useful_list, ocr_res_list_dict['ocr_enable'], new_image, _lang
                             )
 
-                            # 1. 排序检测框
-                            if len(dt_boxes) > 0:
-                                dt_boxes_sorted = sorted_boxes(dt_boxes)
-                            else:
-                                dt_boxes_sorted = []
-
-                            # 2. 合并相邻检测框
-                            if dt_boxes_sorted:
-                                dt_boxes_merged = merge_det_boxes(dt_boxes_sorted)
-                            else:
-                                dt_boxes_merged = []
-
-                            # 3. 根据公式位置更新检测框（关键步骤！）
-                            if dt_boxes_merged and adjusted_mfdetrec_res:
-                                dt_boxes_final = update_det_boxes(dt_boxes_merged, adjusted_mfdetrec_res)
-                            else:
-                                dt_boxes_final = dt_boxes_merged
-
-                            # 构造OCR结果格式
-                            ocr_res = [box.tolist() if hasattr(box, 'tolist') else box for box in dt_boxes_final]
-
-                            if ocr_res:
-                                ocr_result_list = get_ocr_result_list(
-                                    ocr_res, useful_list, ocr_res_list_dict['ocr_enable'], new_image, _lang
-                                )
-
-                                ocr_res_list_dict['layout_res'].extend(ocr_result_list)
+                            ocr_res_list_dict['layout_res'].extend(ocr_result_list)
         else:
             # 原始单张处理模式
             for ocr_res_list_dict in tqdm(ocr_res_list_all_page, desc="OCR-det Predict"):
@@ -246,26 +214,34 @@ class BatchAnalyze:
 
         # 表格识别 table recognition
         if self.table_enable:
-            for table_res_dict in tqdm(table_res_list_all_page, desc="Table Predict"):
-                _lang = table_res_dict['lang']
+            # 按语言分组，每种语言的表格分阶段批量识别
+            table_lang_groups = defaultdict(list)
+            for table_res_dict in table_res_list_all_page:
+                table_lang_groups[table_res_dict['lang']].append(table_res_dict)
+
+            for _lang, table_res_dicts in tqdm(table_lang_groups.items(), desc="Table Predict"):
                 table_model = atom_model_manager.get_atom_model(
                     atom_model_name='table',
                     lang=_lang,
                 )
-                html_code, table_cell_bboxes, logic_points, elapse = table_model.predict(table_res_dict['table_img'])
-                # 判断是否返回正常
-                if html_code:
-                    expected_ending = html_code.strip().endswith('</html>') or html_code.strip().endswith('</table>')
-                    if expected_ending:
-                        table_res_dict['table_res']['html'] = html_code
+                table_results = table_model.batch_predict(
+                    [table_res_dict['table_img'] for table_res_dict in table_res_dicts],
+                    det_batch_size=self.batch_ratio * TABLE_DET_BASE_BATCH_SIZE,
+                )
+                for table_res_dict, (html_code, table_cell_bboxes, logic_points, elapse) in zip(table_res_dicts, table_results):
+                    # 判断是否返回正常
+                    if html_code:
+                        expected_ending = html_code.strip().endswith('</html>') or html_code.strip().endswith('</table>')
+                        if expected_ending:
+                            table_res_dict['table_res']['html'] = html_code
+                        else:
+                            logger.warning(
+                                'table recognition processing fails, not found expected HTML table end'
+                            )
                     else:
                         logger.warning(
-                            'table recognition processing fails, not found expected HTML table end'
+                            'table recognition processing fails, not get html return'
                         )
-                else:
-                    logger.warning(
-                        'table recognition processing fails, not get html return'
-                    )
 
         # Create dictionaries to store items by language
         need_ocr_lists_by_lang = {}  # Dict of lists for each language
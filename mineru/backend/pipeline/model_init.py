@@ -9,6 +9,7 @@ from ...model.mfd.yolo_v8 import YOLOv8MFDModel
 from ...model.mfr.unimernet.Unimernet import UnimernetModel
 from ...model.ocr.paddleocr2pytorch.pytorch_paddle import PytorchPaddleOCR
 from ...model.table.rapid_table import RapidTableModel
+from ...utils.config_reader import get_ocr_engine
 from ...utils.enum_class import ModelPath
 from ...utils.models_download_utils import auto_download_and_get_model_root_path
 
@@ -47,19 +48,23 @@ def ocr_model_init(det_db_box_thresh=0.3,
                    lang=None,
                    use_dilation=True,
                    det_db_unclip_ratio=1.8,
+                   ocr_engine=None,
                    ):
+    ocr_engine = get_ocr_engine(ocr_engine)
     if lang is not None and lang != '':
         model = PytorchPaddleOCR(
             det_db_box_thresh=det_db_box_thresh,
             lang=lang,
             use_dilation=use_dilation,
             det_db_unclip_ratio=det_db_unclip_ratio,
+            ocr_engine=ocr_engine,
         )
     else:
         model = PytorchPaddleOCR(
             det_db_box_thresh=det_db_box_thresh,
             use_dilation=use_dilation,
             det_db_unclip_ratio=det_db_unclip_ratio,
+            ocr_engine=ocr_engine,
         )
     return model
 
@@ -79,7 +84,8 @@ class AtomModelSingleton:
         table_model_name = kwargs.get('table_model_name', None)
 
         if atom_model_name in [AtomicModel.OCR]:
-            key = (atom_model_name, lang)
+            kwargs['ocr_engine'] = get_ocr_engine(kwargs.get('ocr_engine'))
+            key = (atom_model_name, lang, kwargs['ocr_engine'])
         elif atom_model_name in [AtomicModel.Table]:
             key = (atom_model_name, table_model_name, lang)
         else:
@@ -110,6 +116,7 @@ def atom_model_init(model_name: str, **kwargs):
         atom_model = ocr_model_init(
             kwargs.get('det_db_box_thresh'),
             kwargs.get('lang'),
+            ocr_engine=kwargs.get('ocr_engine'),
         )
     elif model_name == AtomicModel.Table:
         atom_model = table_model_init(
@@ -8,26 +8,46 @@ from mineru.utils.config_reader import get_device, get_llm_aided_config, get_for
 from mineru.backend.pipeline.model_init import AtomModelSingleton
 from mineru.backend.pipeline.para_split import para_split
 from mineru.utils.block_pre_proc import prepare_block_bboxes, process_groups
-from mineru.utils.block_sort import sort_blocks_by_bbox
+from mineru.utils.block_sort import batch_sort_blocks_by_bbox, sort_blocks_by_bbox
 from mineru.utils.boxbase import calculate_overlap_area_in_bbox1_area_ratio
 from mineru.utils.cut_image import cut_image_and_table
 from mineru.utils.enum_class import ContentType
 from mineru.utils.llm_aided import llm_aided_title
 from mineru.utils.model_utils import clean_memory
+from mineru.utils.pdf_reader import pdfium_lock
 from mineru.backend.pipeline.pipeline_magic_model import MagicModel
 from mineru.utils.ocr_utils import OcrConfidence
 from mineru.utils.span_block_fix import fill_spans_in_blocks, fix_discarded_block, fix_block_spans
 from mineru.utils.span_pre_proc import remove_outside_spans, remove_overlaps_low_confidence_spans, \
     remove_overlaps_min_spans, txt_spans_extract
 from mineru.version import __version__
-from mineru.utils.hash_utils import str_md5
 
 
 def page_model_info_to_page_info(page_model_info, image_dict, page, image_writer, page_index, ocr_enable=False, formula_enabled=True):
+    page_blocks = page_model_info_to_page_blocks(
+        page_model_info, image_dict, page, image_writer, page_index, ocr_enable=ocr_enable, formula_enabled=formula_enabled
+    )
+    if page_blocks['blocks'] is None:
+        return None
+
+    """对block进行排序"""
+    sorted_blocks = sort_blocks_by_bbox(page_blocks['blocks'], page_blocks['page_w'], page_blocks['page_h'], page_blocks['footnote_blocks'])
+
+    """构造page_info"""
+    page_info = make_page_info_dict(sorted_blocks, page_index, page_blocks['page_w'], page_blocks['page_h'], page_blocks['discarded_blocks'])
+
+    return page_info
+
+
+def page_model_info_to_page_blocks(page_model_info, image_dict, page, image_writer, page_index, ocr_enable=False, formula_enabled=True):
+    """完成单页除block排序以外的所有处理，排序需要的信息放在返回的dict中，由调用方单独或者多页批量排序。
+    页面没有有效的bbox时，返回的dict中blocks为None
+    """
     scale = image_dict["scale"]
     page_pil_img = image_dict["img_pil"]
-    page_img_md5 = str_md5(image_dict["img_base64"])
-    page_w, page_h = map(int, page.get_size())
+    page_img_md5 = image_dict["img_md5"]
+    with pdfium_lock:
+        page_w, page_h = map(int, page.get_size())
     magic_model = MagicModel(page_model_info, scale)
 
     """从magic_model对象中获取后面会用到的区块信息"""
@@ -134,9 +154,18 @@ def page_model_info_to_page_info(page_model_info, image_dict, page, image_writer
     )
     fix_discarded_blocks = fix_discarded_block(discarded_block_with_spans)
 
+    page_blocks = {
+        'page_index': page_index,
+        'page_w': page_w,
+        'page_h': page_h,
+        'blocks': None,
+        'footnote_blocks': footnote_blocks,
+        'discarded_blocks': fix_discarded_blocks,
+    }
+
     """如果当前页面没有有效的bbox则跳过"""
     if len(all_bboxes) == 0:
-        return None
+        return page_blocks
 
     """对image/table/interline_equation截图"""
     for span in spans:
@@ -154,28 +183,54 @@ def page_model_info_to_page_info(page_model_info, image_dict, page, image_writer
     """同一行被断开的titile合并"""
     # merge_title_blocks(fix_blocks)
 
-    """对block进行排序"""
-    sorted_blocks = sort_blocks_by_bbox(fix_blocks, page_w, page_h, footnote_blocks)
-
-    """构造page_info"""
-    page_info = make_page_info_dict(sorted_blocks, page_index, page_w, page_h, fix_discarded_blocks)
-
-    return page_info
+    page_blocks['blocks'] = fix_blocks
+    return page_blocks
 
 
 def result_to_middle_json(model_list, images_list, pdf_doc, image_writer, lang=None, ocr_enable=False, formula_enabled=True):
     middle_json = {"pdf_info": [], "_backend":"pipeline", "_version_name": __version__}
     formula_enabled = get_formula_enable(formula_enabled)
+    page_blocks_list = []
     for page_index, page_model_info in tqdm(enumerate(model_list), total=len(model_list), desc="Processing pages"):
-        page = pdf_doc[page_index]
+        with pdfium_lock:
+            page = pdf_doc[page_index]
         image_dict = images_list[page_index]
-        page_info = page_model_info_to_page_info(
+        page_blocks = page_model_info_to_page_blocks(
             page_model_info, image_dict, page, image_writer, page_index, ocr_enable=ocr_enable, formula_enabled=formula_enabled
         )
-        if page_info is None:
-            page_w, page_h = map(int, page.get_size())
-            page_info = make_page_info_dict([], page_index, page_w, page_h, [])
-        middle_json["pdf_info"].append(page_info)
+        page_blocks_list.append(page_blocks)
+
+    """所有页面一起做阅读顺序排序"""
+    middle_json["pdf_info"] = page_blocks_to_middle_page_infos(page_blocks_list)
+
+    middle_json_post_process(middle_json, pdf_doc, lang)
+
+    return middle_json
+
+
+def page_blocks_to_middle_page_infos(page_blocks_list):
+    """对多页的block批量排序并构造middle_json中的page_info，页面没有有效区块时返回空的page_info"""
+    sortable_page_blocks = [page_blocks for page_blocks in page_blocks_list if page_blocks['blocks'] is not None]
+    sorted_blocks_list = batch_sort_blocks_by_bbox([
+        (page_blocks['blocks'], page_blocks['page_w'], page_blocks['page_h'], page_blocks['footnote_blocks'])
+        for page_blocks in sortable_page_blocks
+    ])
+    sorted_blocks_iter = iter(sorted_blocks_list)
+
+    page_infos = []
+    for page_blocks in page_blocks_list:
+        if page_blocks['blocks'] is None:
+            page_info = make_page_info_dict([], page_blocks['page_index'], page_blocks['page_w'], page_blocks['page_h'], [])
+        else:
+            page_info = make_page_info_dict(
+                next(sorted_blocks_iter), page_blocks['page_index'], page_blocks['page_w'], page_blocks['page_h'], page_blocks['discarded_blocks']
+            )
+        page_infos.append(page_info)
+    return page_infos
+
+
+def middle_json_post_process(middle_json, pdf_doc, lang=None):
+    """整篇文档的页面都转换完成后执行：后置ocr、分段、llm优化，最后关闭pdf_doc（为None时由调用方负责关闭）"""
 
     """后置ocr处理"""
     need_ocr_list = []
@@ -234,11 +289,11 @@ def result_to_middle_json(model_list, images_list, pdf_doc, image_writer, lang=N
                 logger.info(f'llm aided title time: {round(time.time() - llm_aided_title_start_time, 2)}')
 
     """清理内存"""
-    pdf_doc.close()
+    if pdf_doc is not None:
+        with pdfium_lock:
+            pdf_doc.close()
     clean_memory(get_device())
 
-    return middle_json
-
 
 def make_page_info_dict(blocks, page_id, page_w, page_h, discarded_blocks):
     return_dict = {
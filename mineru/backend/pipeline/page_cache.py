@@ -0,0 +1,228 @@
+# Copyright (c) Opendatalab. All rights reserved.
+"""pipeline后端的页面级推理结果缓存。
+
+以渲染后页面位图的md5和影响推理结果的参数作为key，缓存batch_image_analyze输出的单页layout_dets，
+封面、免责声明、重复附录等完全相同的页面只做一次layout/MFD/MFR/OCR推理。
+缓存分为按大小LRU淘汰的内存层和可选的sqlite持久层，两层都有容量上限。
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+import PIL.Image
+from loguru import logger
+
+from mineru.utils.config_reader import get_local_models_dir, get_ocr_det_canvas_enable, get_ocr_engine, \
+    get_page_cache_config
+from mineru.utils.enum_class import ModelPath
+from mineru.utils.hash_utils import dict_md5
+from mineru.version import __version__
+
+
+def get_model_options() -> dict:
+    """影响batch_image_analyze输出的模型来源和权重，更换后缓存的结果不能再使用"""
+    model_source = os.getenv('MINERU_MODEL_SOURCE', 'huggingface')
+    if model_source == 'local':
+        models_root = (get_local_models_dir() or {}).get('pipeline')
+    elif model_source == 'modelscope':
+        models_root = ModelPath.pipeline_root_modelscope
+    else:
+        models_root = ModelPath.pipeline_root_hf
+    return {
+        'model_source': model_source,
+        'models_root': models_root,
+        'weights': [
+            ModelPath.doclayout_yolo,
+            ModelPath.yolo_v8_mfd,
+            ModelPath.unimernet_small,
+            ModelPath.pytorch_paddle,
+            ModelPath.slanet_plus,
+        ],
+        'ocr_engine': get_ocr_engine(),
+        'ocr_det_canvas_enable': get_ocr_det_canvas_enable(),
+    }
+
+
+class MemoryPageStore:
+    """进程内的LRU存储，按value的总长度限制容量"""
+
+    def __init__(self, max_size: int):
+        self._max_size = max_size
+        self._entries = OrderedDict()
+        self._size = 0
+
+    def get(self, key: str) -> str | None:
+        value = self._entries.get(key)
+        if value is not None:
+            self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: str) -> int:
+        """写入并返回因超出容量被淘汰的条目数"""
+        if len(value) > self._max_size:
+            return 0
+        old_value = self._entries.pop(key, None)
+        if old_value is not None:
+            self._size -= len(old_value)
+        self._entries[key] = value
+        self._size += len(value)
+        evictions = 0
+        while self._size > self._max_size:
+            _, evicted_value = self._entries.popitem(last=False)
+            self._size -= len(evicted_value)
+            evictions += 1
+        return evictions
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SqlitePageStore:
+    """sqlite持久化存储，按最后访问时间做LRU淘汰，多进程共用同一个文件时淘汰是尽力而为的"""
+
+    def __init__(self, db_path: str, max_size: int):
+        db_dir = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(db_dir, exist_ok=True)
+        self._max_size = max_size
+        self._conn = sqlite3.connect(db_path, timeout=30, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute(
+            'CREATE TABLE IF NOT EXISTS page_cache '
+            '(key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, last_access REAL NOT NULL)'
+        )
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_page_cache_last_access ON page_cache (last_access)')
+        self._conn.commit()
+
+    def get(self, key: str) -> str | None:
+        row = self._conn.execute('SELECT value FROM page_cache WHERE key = ?', (key,)).fetchone()
+        if row is None:
+            return None
+        with self._conn:
+            self._conn.execute('UPDATE page_cache SET last_access = ? WHERE key = ?', (time.time(), key))
+        return row[0]
+
+    def put(self, key: str, value: str) -> int:
+        """写入并返回因超出容量被淘汰的条目数"""
+        if len(value) > self._max_size:
+            return 0
+        with self._conn:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO page_cache (key, value, size, last_access) VALUES (?, ?, ?, ?)',
+                (key, value, len(value), time.time())
+            )
+            total_size = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM page_cache').fetchone()[0]
+            if total_size <= self._max_size:
+                return 0
+            # 超过容量时按最后访问时间从旧到新淘汰
+            evict_keys = []
+            for old_key, size in self._conn.execute(
+                    'SELECT key, size FROM page_cache WHERE key != ? ORDER BY last_access, rowid', (key,)):
+                if total_size <= self._max_size:
+                    break
+                evict_keys.append((old_key,))
+                total_size -= size
+            self._conn.executemany('DELETE FROM page_cache WHERE key = ?', evict_keys)
+        return len(evict_keys)
+
+    def __len__(self):
+        return self._conn.execute('SELECT COUNT(*) FROM page_cache').fetchone()[0]
+
+    def close(self):
+        self._conn.close()
+
+
+class PageResultCache:
+    """页面级推理结果缓存，先查内存层，未命中再查sqlite层，sqlite命中的结果会回填到内存层。
+
+    缓存中保存的是结果的json文本，每次get都反序列化出新的对象，
+    调用方在后续转换middle_json时修改结果不会影响缓存内容。
+    """
+
+    def __init__(self, memory_max_size: int, db_path: str | None = None, db_max_size: int = 0):
+        self._lock = threading.Lock()
+        self._memory_store = MemoryPageStore(memory_max_size)
+        self._db_store = SqlitePageStore(db_path, db_max_size) if db_path else None
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(image: PIL.Image.Image, ocr_enable, lang, formula_enable, table_enable) -> str:
+        """渲染参数固定时相同的页面得到完全相同的位图，直接对像素做md5，不使用可能误判的感知哈希"""
+        hasher = hashlib.md5()
+        hasher.update(f'{image.mode}_{image.width}_{image.height}'.encode('utf-8'))
+        hasher.update(image.tobytes())
+        options = {
+            'ocr_enable': ocr_enable,
+            'lang': lang,
+            'formula_enable': formula_enable,
+            'table_enable': table_enable,
+            'version': __version__,
+            **get_model_options(),
+        }
+        return f'{hasher.hexdigest()}_{dict_md5(options)}'
+
+    def get(self, key: str) -> list | None:
+        with self._lock:
+            value = self._memory_store.get(key)
+            if value is None and self._db_store is not None:
+                value = self._db_store.get(key)
+                if value is not None:
+                    self.evictions += self._memory_store.put(key, value)
+            if value is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+        return json.loads(value)
+
+    def put(self, key: str, result: list):
+        try:
+            value = json.dumps(result, ensure_ascii=False)
+        except (TypeError, ValueError) as e:
+            logger.debug(f'page result can not be serialized, skip caching: {e}')
+            return
+        with self._lock:
+            self.evictions += self._memory_store.put(key, value)
+            if self._db_store is not None:
+                self.evictions += self._db_store.put(key, value)
+            self.writes += 1
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 4) if total > 0 else 0,
+            'writes': self.writes,
+            'evictions': self.evictions,
+        }
+
+    def log_stats(self):
+        stats = self.stats()
+        logger.info(
+            f"page cache: hits {stats['hits']}, misses {stats['misses']}, hit rate {stats['hit_rate']}, "
+            f"writes {stats['writes']}, evictions {stats['evictions']}"
+        )
+
+
+_page_cache = None
+_page_cache_config = None
+
+
+def get_page_cache() -> PageResultCache | None:
+    """按MINERU_PAGE_CACHE_*配置返回进程内共享的PageResultCache，未启用时返回None"""
+    global _page_cache, _page_cache_config
+    cache_config = get_page_cache_config()
+    if cache_config is None:
+        return None
+    if _page_cache is None or _page_cache_config != cache_config:
+        _page_cache = PageResultCache(
+            cache_config['memory_max_size'], cache_config['db_path'], cache_config['db_max_size']
+        )
+        _page_cache_config = cache_config
+    return _page_cache
@@ -1,14 +1,22 @@
+import copy
 import os
+import queue
+import threading
 import time
+from collections import defaultdict
 from typing import List, Tuple
 import PIL.Image
+import pypdfium2 as pdfium
 from loguru import logger
 
 from .model_init import MineruPipelineModel
-from mineru.utils.config_reader import get_device
+from .page_cache import get_page_cache
+from mineru.utils.config_reader import get_device, get_formula_enable, get_table_enable
 from ...utils.pdf_classify import classify
-from ...utils.pdf_image_tools import load_images_from_pdf
+from ...utils.pdf_image_tools import load_images_from_pdf, load_page_images
+from ...utils.pdf_reader import pdfium_lock
 from ...utils.model_utils import get_vram, clean_memory
+from ...utils.stage_queue import StageQueue
 
 
 os.environ['PYTORCH_ENABLE_MPS_FALLBACK'] = '1'  # 让mps可以fallback
@@ -128,6 +136,10 @@ def doc_analyze(
         batch_results = batch_image_analyze(batch_image, formula_enable, table_enable)
         results.extend(batch_results)
 
+    page_cache = get_page_cache()
+    if page_cache is not None:
+        page_cache.log_stats()
+
     # 构建返回结果
     infer_results = []
 
@@ -146,10 +158,258 @@ def doc_analyze(
     return infer_results, all_image_lists, all_pdf_docs, lang_list, ocr_enabled_list
 
 
+def doc_analyze_streaming(
+        pdf_bytes_list,
+        image_writer_list,
+        lang_list,
+        parse_method: str = 'auto',
+        formula_enable=True,
+        table_enable=True,
+):
+    """
+    流式版本的doc_analyze：按MINERU_MIN_BATCH_INFERENCE_SIZE大小的页面窗口逐批渲染、推理，
+    推理完成的页面立即转换为middle_json的page_info并释放页面图像，峰值内存只和窗口大小相关，与文档页数无关。
+    渲染、推理、middle_json构造三个阶段通过有界队列组成流水线：
+    第N+1批的渲染和第N批的middle_json构造都与第N批的推理重叠执行。
+    每当一篇文档的全部页面处理完成，yield (pdf_idx, model_list, middle_json, ocr_enable)。
+    """
+    from .model_json_to_middle_json import page_model_info_to_page_blocks, page_blocks_to_middle_page_infos, middle_json_post_process
+    from mineru.version import __version__
+
+    min_batch_inference_size = int(os.environ.get('MINERU_MIN_BATCH_INFERENCE_SIZE', 100))
+    formula_enabled = get_formula_enable(formula_enable)
+
+    # 只打开文档并统计页数，不渲染页面
+    pdf_docs = []
+    page_nums = []
+    ocr_enabled_list = []
+    for pdf_idx, pdf_bytes in enumerate(pdf_bytes_list):
+        _ocr_enable = False
+        if parse_method == 'auto':
+            if classify(pdf_bytes) == 'ocr':
+                _ocr_enable = True
+        elif parse_method == 'ocr':
+            _ocr_enable = True
+        ocr_enabled_list.append(_ocr_enable)
+        with pdfium_lock:
+            pdf_doc = pdfium.PdfDocument(pdf_bytes)
+        pdf_docs.append(pdf_doc)
+        page_nums.append(len(pdf_doc))
+
+    all_pages = [
+        (pdf_idx, page_idx)
+        for pdf_idx, page_num in enumerate(page_nums)
+        for page_idx in range(page_num)
+    ]
+    total_page_num = len(all_pages)
+    windows = [
+        all_pages[i:i + min_batch_inference_size]
+        for i in range(0, total_page_num, min_batch_inference_size)
+    ]
+
+    model_lists = [[] for _ in pdf_docs]
+    middle_jsons = [
+        {"pdf_info": [], "_backend": "pipeline", "_version_name": __version__}
+        for _ in pdf_docs
+    ]
+    next_pdf_idx = 0
+
+    # pdfium不是线程安全的，各阶段线程只在访问pdf_docs（取页面、渲染、读取文本层）时持有进程内共享的pdfium_lock，
+    # 渲染下一批、转换上一批middle_json的其余计算与推理并行
+    stop_event = threading.Event()
+    stage_errors = []
+    render_queue = StageQueue('render->infer', maxsize=1)
+    middle_json_queue = StageQueue('infer->middle_json', maxsize=1)
+
+    def put_unless_stopped(item):
+        # 调用方提前结束后没有消费者，渲染阶段不能一直阻塞在put上
+        while not stop_event.is_set():
+            try:
+                render_queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def render_stage():
+        try:
+            for window_pages in windows:
+                if stop_event.is_set():
+                    return
+                # 只渲染当前窗口内的页面
+                window_page_indices = defaultdict(list)
+                for pdf_idx, page_idx in window_pages:
+                    window_page_indices[pdf_idx].append(page_idx)
+                window_doc_images = {}
+                for pdf_idx, page_indices in window_page_indices.items():
+                    # load_page_images逐页持有pdfium_lock
+                    window_doc_images[pdf_idx] = iter(load_page_images(pdf_bytes_list[pdf_idx], pdf_docs[pdf_idx], page_indices))
+                window_image_dicts = [next(window_doc_images[pdf_idx]) for pdf_idx, _ in window_pages]
+                put_unless_stopped((window_pages, window_image_dicts))
+            put_unless_stopped(None)
+        except Exception as e:
+            put_unless_stopped(e)
+
+    def middle_json_stage():
+        try:
+            while True:
+                item = middle_json_queue.get()
+                if item is None:
+                    return
+                window_pages, window_image_dicts, batch_results = item
+                window_page_blocks = []
+                for (pdf_idx, page_idx), image_dict, result in zip(window_pages, window_image_dicts, batch_results):
+                    pil_img = image_dict['img_pil']
+                    page_info_dict = {'page_no': page_idx, 'width': pil_img.width, 'height': pil_img.height}
+                    page_dict = {'layout_dets': result, 'page_info': page_info_dict}
+                    # 模型结果会在转换middle_json的过程中被修改，先保留一份原始输出
+                    model_lists[pdf_idx].append(copy.deepcopy(page_dict))
+                    with pdfium_lock:
+                        pdf_page = pdf_docs[pdf_idx][page_idx]
+                    # 只在读取页面尺寸和文本层时持有pdfium_lock
+                    page_blocks = page_model_info_to_page_blocks(
+                        page_dict, image_dict, pdf_page, image_writer_list[pdf_idx], page_idx,
+                        ocr_enable=ocr_enabled_list[pdf_idx], formula_enabled=formula_enabled,
+                    )
+                    with pdfium_lock:
+                        pdf_page.close()
+                    window_page_blocks.append(page_blocks)
+                # 窗口内所有页面一起做阅读顺序排序
+                window_page_infos = page_blocks_to_middle_page_infos(window_page_blocks)
+                for (pdf_idx, _), page_info in zip(window_pages, window_page_infos):
+                    middle_jsons[pdf_idx]["pdf_info"].append(page_info)
+        except Exception as e:
+            stage_errors.append(e)
+            # 出错后继续取走队列中的数据，避免推理阶段阻塞在put上
+            while middle_json_queue.get() is not None:
+                pass
+
+    def pop_finished_docs():
+        # 所有页面都已完成的文档做整篇的后处理并交给调用方
+        nonlocal next_pdf_idx
+        if stage_errors:
+            raise stage_errors[0]
+        while next_pdf_idx < len(pdf_docs) and len(middle_jsons[next_pdf_idx]["pdf_info"]) == page_nums[next_pdf_idx]:
+            middle_json_post_process(middle_jsons[next_pdf_idx], None, lang_list[next_pdf_idx])
+            with pdfium_lock:
+                pdf_docs[next_pdf_idx].close()
+            yield next_pdf_idx, model_lists[next_pdf_idx], middle_jsons[next_pdf_idx], ocr_enabled_list[next_pdf_idx]
+            model_lists[next_pdf_idx], middle_jsons[next_pdf_idx] = None, None
+            next_pdf_idx += 1
+
+    render_thread = threading.Thread(target=render_stage, daemon=True)
+    middle_json_thread = threading.Thread(target=middle_json_stage, daemon=True)
+    render_thread.start()
+    middle_json_thread.start()
+
+    try:
+        # 没有页面的文档直接完成
+        yield from pop_finished_docs()
+
+        processed_images_count = 0
+        for index in range(len(windows)):
+            item = render_queue.get()
+            if isinstance(item, Exception):
+                raise item
+            window_pages, window_image_dicts = item
+            processed_images_count += len(window_pages)
+            logger.info(
+                f'Batch {index + 1}/{len(windows)}: '
+                f'{processed_images_count} pages/{total_page_num} pages'
+            )
+
+            images_with_extra_info = [
+                (image_dict['img_pil'], ocr_enabled_list[pdf_idx], lang_list[pdf_idx])
+                for image_dict, (pdf_idx, _) in zip(window_image_dicts, window_pages)
+            ]
+            batch_results = batch_image_analyze(images_with_extra_info, formula_enable, table_enable)
+            middle_json_queue.put((window_pages, window_image_dicts, batch_results))
+            # 页面图像交给middle_json阶段后由其释放
+            del item, window_image_dicts, images_with_extra_info, batch_results
+
+            yield from pop_finished_docs()
+
+        middle_json_queue.put(None)
+        middle_json_thread.join()
+        yield from pop_finished_docs()
+    finally:
+        # 提前结束或出错时让各阶段线程尽快退出
+        stop_event.set()
+        for stage_queue in (render_queue, middle_json_queue):
+            try:
+                while True:
+                    stage_queue.get_nowait()
+            except queue.Empty:
+                pass
+        if middle_json_thread.is_alive():
+            middle_json_queue.put_nowait(None)
+        # 等各阶段线程退出后再关闭还没交给调用方的文档，避免关闭线程正在使用的PdfDocument
+        render_thread.join()
+        middle_json_thread.join()
+        with pdfium_lock:
+            for pdf_doc in pdf_docs[next_pdf_idx:]:
+                pdf_doc.close()
+        render_queue.log_stats()
+        middle_json_queue.log_stats()
+        page_cache = get_page_cache()
+        if page_cache is not None:
+            page_cache.log_stats()
+
+
 def batch_image_analyze(
         images_with_extra_info: List[Tuple[PIL.Image.Image, bool, str]],
         formula_enable=True,
         table_enable=True):
+    """
+    启用页面缓存时（见get_page_cache_config），先按页面位图查找缓存的推理结果，
+    只把未命中的页面送去推理，同一批内重复的页面也只推理一次，新结果推理后写入缓存。
+    """
+    page_cache = get_page_cache()
+    if page_cache is None:
+        return _batch_image_analyze(images_with_extra_info, formula_enable, table_enable)
+
+    formula_enabled = get_formula_enable(formula_enable)
+    table_enabled = get_table_enable(table_enable)
+    results = [None] * len(images_with_extra_info)
+    # key -> 该key对应的所有页面序号，第一个页面送去推理
+    miss_indices_by_key = {}
+    for index, (image, ocr_enable, lang) in enumerate(images_with_extra_info):
+        key = page_cache.make_key(image, ocr_enable, lang, formula_enabled, table_enabled)
+        if key in miss_indices_by_key:
+            miss_indices_by_key[key].append(index)
+            continue
+        cached_result = page_cache.get(key)
+        if cached_result is None:
+            miss_indices_by_key[key] = [index]
+        else:
+            results[index] = cached_result
+
+    logger.info(
+        f'page cache: {len(images_with_extra_info) - len(miss_indices_by_key)}/{len(images_with_extra_info)} '
+        f'pages skip inference in this batch'
+    )
+    if len(miss_indices_by_key) == 0:
+        return results
+
+    miss_keys = list(miss_indices_by_key)
+    miss_results = _batch_image_analyze(
+        [images_with_extra_info[miss_indices_by_key[key][0]] for key in miss_keys],
+        formula_enable,
+        table_enable,
+    )
+    for key, result in zip(miss_keys, miss_results):
+        page_cache.put(key, result)
+        first_index, *duplicate_indices = miss_indices_by_key[key]
+        results[first_index] = result
+        # 结果在转换middle_json时会被修改，重复的页面各自持有一份拷贝
+        for index in duplicate_indices:
+            results[index] = copy.deepcopy(result)
+    return results
+
+
+def _batch_image_analyze(
+        images_with_extra_info: List[Tuple[PIL.Image.Image, bool, str]],
+        formula_enable=True,
+        table_enable=True):
     # os.environ['CUDA_VISIBLE_DEVICES'] = str(idx)
 
     from .batch_analyze import BatchAnalyze
@@ -1,4 +1,8 @@
-from mineru.utils.boxbase import bbox_relative_pos, calculate_iou, bbox_distance, is_in
+import numpy as np
+
+from mineru.utils.boxbase import calculate_iou
+from mineru.utils.boxbase_batch import bbox_distance_matrix, bbox_relative_pos_matrix, calculate_iou_matrix, \
+    is_in_matrix, matrix_over_threshold, to_bbox_array
 from mineru.utils.enum_class import CategoryId, ContentType
 
 
@@ -47,26 +51,23 @@ class MagicModel:
     def __fix_by_remove_high_iou_and_low_confidence(self):
         need_remove_list = []
         layout_dets = self.__page_model_info['layout_dets']
-        for layout_det1 in layout_dets:
-            for layout_det2 in layout_dets:
-                if layout_det1 == layout_det2:
-                    continue
-                if layout_det1['category_id'] in [0, 1, 2, 3, 4, 5, 6, 7, 8, 9] and layout_det2['category_id'] in [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]:
-                    if (
-                        calculate_iou(layout_det1['bbox'], layout_det2['bbox'])
-                        > 0.9
-                    ):
-                        if layout_det1['score'] < layout_det2['score']:
-                            layout_det_need_remove = layout_det1
-                        else:
-                            layout_det_need_remove = layout_det2
-
-                        if layout_det_need_remove not in need_remove_list:
-                            need_remove_list.append(layout_det_need_remove)
-                    else:
-                        continue
+        layout_det_bboxes = [layout_det['bbox'] for layout_det in layout_dets]
+        high_iou_matrix = matrix_over_threshold(
+            calculate_iou_matrix(layout_det_bboxes, layout_det_bboxes), 0.9,
+            layout_det_bboxes, layout_det_bboxes, calculate_iou
+        )
+        for i, j in zip(*np.nonzero(high_iou_matrix)):
+            layout_det1, layout_det2 = layout_dets[i], layout_dets[j]
+            if layout_det1 == layout_det2:
+                continue
+            if layout_det1['category_id'] in [0, 1, 2, 3, 4, 5, 6, 7, 8, 9] and layout_det2['category_id'] in [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]:
+                if layout_det1['score'] < layout_det2['score']:
+                    layout_det_need_remove = layout_det1
                 else:
-                    continue
+                    layout_det_need_remove = layout_det2
+
+                if layout_det_need_remove not in need_remove_list:
+                    need_remove_list.append(layout_det_need_remove)
         for need_remove in need_remove_list:
             layout_dets.remove(need_remove)
 
@@ -85,79 +86,40 @@ class MagicModel:
                 tables.append(obj)
             if len(footnotes) * len(figures) == 0:
                 continue
-        dis_figure_footnote = {}
-        dis_table_footnote = {}
-
-        for i in range(len(footnotes)):
-            for j in range(len(figures)):
-                pos_flag_count = sum(
-                    list(
-                        map(
-                            lambda x: 1 if x else 0,
-                            bbox_relative_pos(
-                                footnotes[i]['bbox'], figures[j]['bbox']
-                            ),
-                        )
-                    )
-                )
-                if pos_flag_count > 1:
-                    continue
-                dis_figure_footnote[i] = min(
-                    self._bbox_distance(figures[j]['bbox'], footnotes[i]['bbox']),
-                    dis_figure_footnote.get(i, float('inf')),
-                )
-        for i in range(len(footnotes)):
-            for j in range(len(tables)):
-                pos_flag_count = sum(
-                    list(
-                        map(
-                            lambda x: 1 if x else 0,
-                            bbox_relative_pos(
-                                footnotes[i]['bbox'], tables[j]['bbox']
-                            ),
-                        )
-                    )
-                )
-                if pos_flag_count > 1:
-                    continue
+        footnote_bboxes = [footnote['bbox'] for footnote in footnotes]
+        # 每个footnote到最近的figure/table的距离，以及是否存在可比较的figure/table
+        dis_figure_footnote, has_figure = self._nearest_distance(footnote_bboxes, [figure['bbox'] for figure in figures])
+        dis_table_footnote, _ = self._nearest_distance(footnote_bboxes, [table['bbox'] for table in tables])
 
-                dis_table_footnote[i] = min(
-                    self._bbox_distance(tables[j]['bbox'], footnotes[i]['bbox']),
-                    dis_table_footnote.get(i, float('inf')),
-                )
         for i in range(len(footnotes)):
-            if i not in dis_figure_footnote:
+            if not has_figure[i]:
                 continue
-            if dis_table_footnote.get(i, float('inf')) > dis_figure_footnote[i]:
+            if dis_table_footnote[i] > dis_figure_footnote[i]:
                 footnotes[i]['category_id'] = CategoryId.ImageFootnote
 
-    def _bbox_distance(self, bbox1, bbox2):
-        left, right, bottom, top = bbox_relative_pos(bbox1, bbox2)
-        flags = [left, right, bottom, top]
-        count = sum([1 if v else 0 for v in flags])
-        if count > 1:
-            return float('inf')
-        if left or right:
-            l1 = bbox1[3] - bbox1[1]
-            l2 = bbox2[3] - bbox2[1]
-        else:
-            l1 = bbox1[2] - bbox1[0]
-            l2 = bbox2[2] - bbox2[0]
-
-        if l2 > l1 and (l2 - l1) / l1 > 0.3:
-            return float('inf')
-
-        return bbox_distance(bbox1, bbox2)
+    def _nearest_distance(self, footnote_bboxes, bboxes):
+        """footnote与bboxes之间按_bbox_distance_matrix计算的最小距离，跳过相对位置标记超过1个的组合"""
+        left, right, bottom, top = bbox_relative_pos_matrix(footnote_bboxes, bboxes)
+        comparable = (left.astype(int) + right + bottom + top) <= 1
+        distance_matrix = np.where(comparable, self._bbox_distance_matrix(bboxes, footnote_bboxes).T, np.inf)
+        return distance_matrix.min(axis=1, initial=np.inf), comparable.any(axis=1)
+
+    def _bbox_distance_matrix(self, bboxes1, bboxes2):
+        """计算两组bbox之间的距离矩阵，相对位置标记超过1个或者bbox2比bbox1长出30%以上的组合距离记为inf"""
+        left, right, bottom, top = bbox_relative_pos_matrix(bboxes1, bboxes2)
+        count = left.astype(int) + right + bottom + top
+        boxes1, boxes2 = to_bbox_array(bboxes1), to_bbox_array(bboxes2)
+        l1 = np.where(left | right, (boxes1[:, 3] - boxes1[:, 1])[:, None], (boxes1[:, 2] - boxes1[:, 0])[:, None])
+        l2 = np.where(left | right, (boxes2[:, 3] - boxes2[:, 1])[None, :], (boxes2[:, 2] - boxes2[:, 0])[None, :])
+        with np.errstate(divide='ignore', invalid='ignore'):
+            too_long = (l2 > l1) & ((l2 - l1) / l1 > 0.3)
+        return np.where((count > 1) | too_long, np.inf, bbox_distance_matrix(bboxes1, bboxes2))
 
     def __reduct_overlap(self, bboxes):
         N = len(bboxes)
-        keep = [True] * N
-        for i in range(N):
-            for j in range(N):
-                if i == j:
-                    continue
-                if is_in(bboxes[i]['bbox'], bboxes[j]['bbox']):
-                    keep[i] = False
+        contained = is_in_matrix([bbox['bbox'] for bbox in bboxes], [bbox['bbox'] for bbox in bboxes])
+        np.fill_diagonal(contained, False)
+        keep = ~contained.any(axis=1)
         return [bboxes[i] for i in range(N) if keep[i]]
 
     def __tie_up_category_by_distance_v3(
@@ -196,6 +158,10 @@ class MagicModel:
         OBJ_IDX_OFFSET = 10000
         SUB_BIT_KIND, OBJ_BIT_KIND = 0, 1
 
+        # 所有subject和object之间的距离一次算好，后面循环中直接查表
+        sub_obj_dis = bbox_distance_matrix([sub['bbox'] for sub in subjects], [obj['bbox'] for obj in objects])
+        obj_sub_dis = bbox_distance_matrix([obj['bbox'] for obj in objects], [sub['bbox'] for sub in subjects])
+
         all_boxes_with_idx = [(i, SUB_BIT_KIND, sub['bbox'][0], sub['bbox'][1]) for i, sub in enumerate(subjects)] + [(i + OBJ_IDX_OFFSET , OBJ_BIT_KIND, obj['bbox'][0], obj['bbox'][1]) for i, obj in enumerate(objects)]
         seen_idx = set()
         seen_sub_idx = set()
@@ -232,11 +198,11 @@ class MagicModel:
             else:
                 sub_idx, obj_idx = nxt[0], fst_idx - OBJ_IDX_OFFSET
 
-            pair_dis = bbox_distance(subjects[sub_idx]['bbox'], objects[obj_idx]['bbox'])
-            nearest_dis = float('inf')
-            for i in range(N):
-                if i in seen_idx or i == sub_idx:continue
-                nearest_dis = min(nearest_dis, bbox_distance(subjects[i]['bbox'], objects[obj_idx]['bbox']))
+            pair_dis = sub_obj_dis[sub_idx, obj_idx]
+            other_sub = np.ones(N, dtype=bool)
+            other_sub[[i for i in seen_idx if i < N]] = False
+            other_sub[sub_idx] = False
+            nearest_dis = sub_obj_dis[other_sub, obj_idx].min(initial=np.inf)
 
             if pair_dis >= 3*nearest_dis:
                 seen_idx.add(sub_idx)
@@ -264,12 +230,7 @@ class MagicModel:
             if j in seen_idx:
                 continue
             seen_idx.add(j)
-            nearest_dis, nearest_sub_idx = float('inf'), -1
-            for k in range(len(subjects)):
-                dis = bbox_distance(objects[i]['bbox'], subjects[k]['bbox'])
-                if dis < nearest_dis:
-                    nearest_dis = dis
-                    nearest_sub_idx = k
+            nearest_sub_idx = int(np.argmin(obj_sub_dis[i])) if len(subjects) > 0 else -1
 
             for k in range(len(subjects)):
                 if k != nearest_sub_idx: continue
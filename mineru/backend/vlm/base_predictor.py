@@ -1,6 +1,10 @@
 import asyncio
 from abc import ABC, abstractmethod
-from typing import AsyncIterable, Iterable, List, Optional, Union
+from typing import AsyncIterable, Awaitable, Callable, Iterable, List, Optional, Tuple, Union
+
+from ...utils.config_reader import get_generation_guard_config
+from .generation_guard import RETRY_SAMPLING_PARAMS, GenerationGuard, check_output, generation_guard_stats
+from .utils import ImagePayload
 
 DEFAULT_SYSTEM_PROMPT = (
     "A conversation between a user and an LLM-based AI assistant. The assistant gives helpful and honest answers."
@@ -35,11 +39,12 @@ class BasePredictor(ABC):
         self.presence_penalty = presence_penalty
         self.no_repeat_ngram_size = no_repeat_ngram_size
         self.max_new_tokens = max_new_tokens
+        self.guard_config = get_generation_guard_config()
 
     @abstractmethod
     def predict(
         self,
-        image: str | bytes,
+        image: str | bytes | ImagePayload,
         prompt: str = "",
         temperature: Optional[float] = None,
         top_p: Optional[float] = None,
@@ -53,7 +58,7 @@ class BasePredictor(ABC):
     @abstractmethod
     def batch_predict(
         self,
-        images: List[str] | List[bytes],
+        images: List[str] | List[bytes] | List[ImagePayload],
         prompts: Union[List[str], str] = "",
         temperature: Optional[float] = None,
         top_p: Optional[float] = None,
@@ -61,13 +66,13 @@ class BasePredictor(ABC):
         repetition_penalty: Optional[float] = None,
         presence_penalty: Optional[float] = None,
         no_repeat_ngram_size: Optional[int] = None,
-        max_new_tokens: Optional[int] = None,
+        max_new_tokens: Union[int, List[int], None] = None,
     ) -> List[str]: ...
 
     @abstractmethod
     def stream_predict(
         self,
-        image: str | bytes,
+        image: str | bytes | ImagePayload,
         prompt: str = "",
         temperature: Optional[float] = None,
         top_p: Optional[float] = None,
@@ -80,7 +85,7 @@ class BasePredictor(ABC):
 
     async def aio_predict(
         self,
-        image: str | bytes,
+        image: str | bytes | ImagePayload,
         prompt: str = "",
         temperature: Optional[float] = None,
         top_p: Optional[float] = None,
@@ -105,7 +110,7 @@ class BasePredictor(ABC):
 
     async def aio_batch_predict(
         self,
-        images: List[str] | List[bytes],
+        images: List[str] | List[bytes] | List[ImagePayload],
         prompts: Union[List[str], str] = "",
         temperature: Optional[float] = None,
         top_p: Optional[float] = None,
@@ -113,7 +118,7 @@ class BasePredictor(ABC):
         repetition_penalty: Optional[float] = None,
         presence_penalty: Optional[float] = None,
         no_repeat_ngram_size: Optional[int] = None,
-        max_new_tokens: Optional[int] = None,
+        max_new_tokens: Union[int, List[int], None] = None,
     ) -> List[str]:
         return await asyncio.to_thread(
             self.batch_predict,
@@ -128,9 +133,36 @@ class BasePredictor(ABC):
             max_new_tokens,
         )
 
+    async def aio_batch_predict_as_iter(
+        self,
+        images: List[str] | List[bytes] | List[ImagePayload],
+        prompts: Union[List[str], str] = "",
+        temperature: Optional[float] = None,
+        top_p: Optional[float] = None,
+        top_k: Optional[int] = None,
+        repetition_penalty: Optional[float] = None,
+        presence_penalty: Optional[float] = None,
+        no_repeat_ngram_size: Optional[int] = None,
+        max_new_tokens: Union[int, List[int], None] = None,
+    ) -> AsyncIterable[Tuple[int, str]]:
+        # 默认整批推理完成后按顺序输出，能逐页返回结果的predictor需要重写该方法
+        outputs = await self.aio_batch_predict(
+            images,
+            prompts,
+            temperature,
+            top_p,
+            top_k,
+            repetition_penalty,
+            presence_penalty,
+            no_repeat_ngram_size,
+            max_new_tokens,
+        )
+        for idx, output in enumerate(outputs):
+            yield idx, output
+
     async def aio_stream_predict(
         self,
-        image: str | bytes,
+        image: str | bytes | ImagePayload,
         prompt: str = "",
         temperature: Optional[float] = None,
         top_p: Optional[float] = None,
@@ -169,6 +201,95 @@ class BasePredictor(ABC):
             assert isinstance(chunk, str)
             yield chunk
 
+    def get_page_max_new_tokens(self, max_new_tokens: Union[int, List[int], None], num_images: int) -> List[int]:
+        """batch接口的max_new_tokens可以是每页一个值的列表，None表示使用默认值"""
+        if not isinstance(max_new_tokens, list):
+            max_new_tokens = [max_new_tokens] * num_images
+        assert len(max_new_tokens) == num_images, "Length of max_new_tokens and images must match."
+        return [self.max_new_tokens if n is None else n for n in max_new_tokens]
+
+    @staticmethod
+    def schedule_order(page_max_new_tokens: List[int]) -> List[int]:
+        """预计输出越长的页面越先开始，减少整批的完成时间，预计相同时保持原顺序"""
+        return sorted(range(len(page_max_new_tokens)), key=lambda idx: -page_max_new_tokens[idx])
+
+    def new_generation_guard(self) -> GenerationGuard | None:
+        if self.guard_config is None:
+            return None
+        return GenerationGuard(self.guard_config["max_block_chars"], self.guard_config["max_repeated_blocks"])
+
+    def get_retry_sampling_params(
+        self,
+        repetition_penalty: Optional[float],
+        no_repeat_ngram_size: Optional[int],
+    ) -> dict:
+        """重试退化页面时使用的repetition_penalty和no_repeat_ngram_size，只会比原参数更严格"""
+        if repetition_penalty is None:
+            repetition_penalty = self.repetition_penalty
+        if no_repeat_ngram_size is None:
+            no_repeat_ngram_size = self.no_repeat_ngram_size
+        if no_repeat_ngram_size > 0:
+            no_repeat_ngram_size = min(no_repeat_ngram_size, RETRY_SAMPLING_PARAMS["no_repeat_ngram_size"])
+        else:
+            no_repeat_ngram_size = RETRY_SAMPLING_PARAMS["no_repeat_ngram_size"]
+        return {
+            "repetition_penalty": max(repetition_penalty, RETRY_SAMPLING_PARAMS["repetition_penalty"]),
+            "no_repeat_ngram_size": no_repeat_ngram_size,
+        }
+
+    def _find_degenerated(self, outputs: List[str]) -> List[int]:
+        degenerated = []
+        for idx, output in enumerate(outputs):
+            reason = check_output(output, self.guard_config)
+            generation_guard_stats.record(reason)
+            if reason is not None:
+                degenerated.append(idx)
+        return degenerated
+
+    def _merge_retry_outputs(self, outputs: List[str], retry_indices: List[int], retry_outputs: List[str]) -> List[str]:
+        outputs = list(outputs)
+        for idx, retry_output in zip(retry_indices, retry_outputs):
+            recovered = check_output(retry_output, self.guard_config) is None
+            generation_guard_stats.record_retry(recovered)
+            # 重试仍然退化时保留原来的输出
+            if recovered:
+                outputs[idx] = retry_output
+        return outputs
+
+    def guard_outputs(
+        self,
+        outputs: List[str],
+        retry_fn: Callable[[List[int], dict], List[str]],
+        repetition_penalty: Optional[float] = None,
+        no_repeat_ngram_size: Optional[int] = None,
+    ) -> List[str]:
+        """
+        对完整输出做退化检测并计入统计。
+        启用重试时调用retry_fn(退化页面的序号, 重试的采样参数)重新生成这些页面。
+        """
+        if self.guard_config is None:
+            return outputs
+        retry_indices = self._find_degenerated(outputs)
+        if not retry_indices or not self.guard_config["retry"]:
+            return outputs
+        retry_params = self.get_retry_sampling_params(repetition_penalty, no_repeat_ngram_size)
+        return self._merge_retry_outputs(outputs, retry_indices, retry_fn(retry_indices, retry_params))
+
+    async def aio_guard_outputs(
+        self,
+        outputs: List[str],
+        retry_fn: Callable[[List[int], dict], Awaitable[List[str]]],
+        repetition_penalty: Optional[float] = None,
+        no_repeat_ngram_size: Optional[int] = None,
+    ) -> List[str]:
+        if self.guard_config is None:
+            return outputs
+        retry_indices = self._find_degenerated(outputs)
+        if not retry_indices or not self.guard_config["retry"]:
+            return outputs
+        retry_params = self.get_retry_sampling_params(repetition_penalty, no_repeat_ngram_size)
+        return self._merge_retry_outputs(outputs, retry_indices, await retry_fn(retry_indices, retry_params))
+
     def build_prompt(self, prompt: str) -> str:
         if prompt.startswith("<|im_start|>"):
             return prompt
@@ -0,0 +1,107 @@
+# Copyright (c) Opendatalab. All rights reserved.
+"""sglang-client后端的多服务端负载均衡。
+
+每个页面请求分配给进行中请求数最少的健康服务端，请求失败的服务端会被摘除，
+由健康检查或之后成功的请求重新加入。
+"""
+import threading
+
+from loguru import logger
+
+
+class SglangEndpoint:
+    """单个sglang server的地址、健康状态和请求统计"""
+
+    def __init__(self, base_url: str):
+        self.base_url = base_url
+        self.generate_url = f"{base_url}/generate"
+        self.health_url = f"{base_url}/health_generate"
+        self.healthy = True
+        self.in_flight = 0
+        self.requests = 0
+        self.failures = 0
+        self.total_latency = 0.0
+        self.max_latency = 0.0
+        self.last_error = None
+
+    def stats(self) -> dict:
+        successes = self.requests - self.failures
+        return {
+            "url": self.base_url,
+            "healthy": self.healthy,
+            "in_flight": self.in_flight,
+            "requests": self.requests,
+            "failures": self.failures,
+            "avg_latency": round(self.total_latency / successes, 4) if successes > 0 else 0,
+            "max_latency": round(self.max_latency, 4),
+            "last_error": self.last_error,
+        }
+
+
+class EndpointPool:
+    def __init__(self, base_urls: list[str]):
+        if not base_urls:
+            raise ValueError("At least one server URL must be provided.")
+        self.endpoints = [SglangEndpoint(base_url) for base_url in base_urls]
+        self._lock = threading.Lock()
+        # 进行中请求数相同时按轮转顺序选择，串行请求也能分散到各个服务端
+        self._next_index = 0
+
+    def __len__(self):
+        return len(self.endpoints)
+
+    def acquire(self, exclude=()) -> SglangEndpoint:
+        """选择进行中请求数最少的健康服务端，没有健康的服务端时退回到所有未排除的服务端"""
+        with self._lock:
+            candidates = [endpoint for endpoint in self.endpoints if endpoint not in exclude]
+            if not candidates:
+                raise RuntimeError("No sglang server available.")
+            healthy_candidates = [endpoint for endpoint in candidates if endpoint.healthy] or candidates
+            num_endpoints = len(self.endpoints)
+            endpoint = min(
+                healthy_candidates,
+                key=lambda e: (e.in_flight, (self.endpoints.index(e) - self._next_index) % num_endpoints),
+            )
+            self._next_index = (self.endpoints.index(endpoint) + 1) % num_endpoints
+            endpoint.in_flight += 1
+            return endpoint
+
+    def release(self, endpoint: SglangEndpoint, latency: float | None = None, error: Exception | None = None):
+        """请求结束时调用，latency和error都为None表示请求被取消，只减少进行中的请求数"""
+        with self._lock:
+            endpoint.in_flight -= 1
+            if error is not None:
+                endpoint.requests += 1
+                endpoint.failures += 1
+                self._set_health(endpoint, False, error)
+            elif latency is not None:
+                endpoint.requests += 1
+                endpoint.total_latency += latency
+                endpoint.max_latency = max(endpoint.max_latency, latency)
+                self._set_health(endpoint, True)
+
+    def set_health(self, endpoint: SglangEndpoint, healthy: bool, error: Exception | str | None = None):
+        with self._lock:
+            self._set_health(endpoint, healthy, error)
+
+    @staticmethod
+    def _set_health(endpoint: SglangEndpoint, healthy: bool, error: Exception | str | None = None):
+        if error is not None:
+            endpoint.last_error = str(error) or type(error).__name__
+        if endpoint.healthy and not healthy:
+            logger.warning(f"sglang server {endpoint.base_url} is ejected: {endpoint.last_error}")
+        elif not endpoint.healthy and healthy:
+            logger.info(f"sglang server {endpoint.base_url} is healthy again")
+        endpoint.healthy = healthy
+
+    def stats(self) -> list[dict]:
+        with self._lock:
+            return [endpoint.stats() for endpoint in self.endpoints]
+
+    def log_stats(self):
+        for stats in self.stats():
+            logger.info(
+                f"sglang server {stats['url']}: healthy {stats['healthy']}, in flight {stats['in_flight']}, "
+                f"requests {stats['requests']}, failures {stats['failures']}, "
+                f"avg latency {stats['avg_latency']}s, max latency {stats['max_latency']}s"
+            )
@@ -0,0 +1,241 @@
+# Copyright (c) Opendatalab. All rights reserved.
+"""检测vlm生成过程中的结构性退化，在页面陷入重复循环时尽早结束生成。
+
+GenerationGuard逐段接收生成的文本，满足以下任一条件即判定为退化：
+- repeated_blocks：连续多个内容完全相同的块（只比较类型和内容，不比较坐标，不统计image块）
+- block_too_long：距离上一个块边界（<|box_start|>或<|md_end|>）的字符数过多，即一个块一直没有<|md_end|>
+  或长时间没有新的块。table块的内容本来就可能很长，不做这项检测，表格中的循环由repeated_tail检测
+- repeated_tail：最近一段文本由一个较短的片段循环重复构成
+
+检测只依赖文本，各后端共用：hf通过StoppingCriteria结束对应的序列，
+sglang通过Mineru2LogitProcessor在服务端结束请求，客户端再对完整输出做同样的检测用于统计和可选的重试。
+"""
+import threading
+
+from loguru import logger
+
+from .vlm_magic_model import BLOCK_PATTERN, BOX_START, MD_END, REF_END, REF_START
+
+# 约为默认max_new_tokens(16384)按每个token 4个字符估计的整页输出长度，正常的长段落不会触发
+DEFAULT_MAX_BLOCK_CHARS = 65536
+DEFAULT_MAX_REPEATED_BLOCKS = 10
+# 每增加CHECK_INTERVAL个字符，检查一次结尾TAIL_WINDOW个字符是否以不超过MAX_PERIOD的周期循环
+CHECK_INTERVAL = 512
+TAIL_WINDOW = 4096
+MAX_PERIOD = 512
+PROBE_LENGTH = 32
+# 重试时在原采样参数的基础上加强重复惩罚
+RETRY_SAMPLING_PARAMS = {
+    "repetition_penalty": 1.05,
+    "no_repeat_ngram_size": 35,
+}
+
+
+class GenerationGuard:
+    def __init__(
+        self,
+        max_block_chars: int = DEFAULT_MAX_BLOCK_CHARS,
+        max_repeated_blocks: int = DEFAULT_MAX_REPEATED_BLOCKS,
+    ):
+        self.max_block_chars = max_block_chars
+        self.max_repeated_blocks = max_repeated_blocks
+        self.reason = None
+        # 只保留最近的文本，位置都按从输出开头累计的字符数计算
+        self._tail = ""
+        self._length = 0
+        self._last_boundary = 0
+        self._block_start = None
+        self._block_type = None
+        self._last_block = None
+        self._repeated_blocks = 0
+        self._next_check = TAIL_WINDOW
+
+    def feed(self, text: str) -> bool:
+        """追加新生成的文本，判定为退化时返回True，原因记录在reason中。
+
+        所有检测都按事件在输出中的位置依次进行，结果与文本的分段方式无关。
+        """
+        if self.reason is not None:
+            return True
+        if not text:
+            return False
+        tail_start = self._length - len(self._tail)
+        new_start = self._length
+        self._tail += text
+        self._length += len(text)
+
+        # 结尾落在新文本中的标记才是新出现的，标记可能被拆到两段中
+        events = []
+        for marker in (BOX_START, REF_END, MD_END):
+            index = self._tail.find(marker, max(new_start - tail_start - len(marker) + 1, 0))
+            while index >= 0:
+                events.append((tail_start + index + len(marker), marker))
+                index = self._tail.find(marker, index + 1)
+        while self._next_check <= self._length:
+            events.append((self._next_check, None))
+            self._next_check += CHECK_INTERVAL
+        events.sort(key=lambda event: (event[0], event[1] is None))
+
+        for position, marker in events:
+            if self._is_block_too_long(position):
+                self.reason = "block_too_long"
+                return True
+            if marker == BOX_START:
+                self._last_boundary = position
+                self._block_start = position - len(BOX_START)
+                self._block_type = None
+            elif marker == REF_END:
+                self._block_type = self._parse_block_type(tail_start, position)
+            elif marker == MD_END:
+                self._last_boundary = position
+                self._block_type = None
+                if self._check_block(tail_start, position):
+                    return True
+            elif self._is_periodic(self._tail[position - TAIL_WINDOW - tail_start : position - tail_start]):
+                self.reason = "repeated_tail"
+                return True
+        if self._is_block_too_long(self._length):
+            self.reason = "block_too_long"
+            return True
+
+        if len(self._tail) > 2 * TAIL_WINDOW:
+            self._tail = self._tail[-(TAIL_WINDOW + len(BOX_START)) :]
+        return False
+
+    def _is_block_too_long(self, position: int) -> bool:
+        return self._block_type != "table" and position - self._last_boundary > self.max_block_chars
+
+    def _parse_block_type(self, tail_start: int, ref_end: int) -> str | None:
+        # 块头部很短，<|ref_end|>出现时还在_tail中
+        if self._block_start is None or self._block_start < tail_start:
+            return None
+        header = self._tail[self._block_start - tail_start : ref_end - tail_start]
+        index = header.find(REF_START)
+        if index < 0:
+            return None
+        return header[index + len(REF_START) : -len(REF_END)].strip()
+
+    def _check_block(self, tail_start: int, block_end: int) -> bool:
+        block_start, self._block_start = self._block_start, None
+        # 超过TAIL_WINDOW的块不再比较内容
+        if block_start is None or block_end - block_start > TAIL_WINDOW:
+            self._last_block = None
+            return False
+        match = BLOCK_PATTERN.fullmatch(self._tail, block_start - tail_start, block_end - tail_start)
+        if match is None:
+            return False
+        block_type, content = match.group(2).strip(), match.group(3).strip()
+        if block_type == "image":
+            self._last_block = None
+            return False
+        if (block_type, content) == self._last_block:
+            self._repeated_blocks += 1
+        else:
+            self._last_block = (block_type, content)
+            self._repeated_blocks = 1
+        if self._repeated_blocks >= self.max_repeated_blocks:
+            self.reason = "repeated_blocks"
+            return True
+        return False
+
+    @staticmethod
+    def _is_periodic(window: str) -> bool:
+        # 先用结尾的一小段文本找出候选周期，再比较整个窗口
+        probe_start = len(window) - PROBE_LENGTH
+        probe = window[probe_start:]
+        end = len(window) - 1
+        while True:
+            index = window.rfind(probe, 0, end)
+            if index < 0:
+                return False
+            period = probe_start - index
+            if period > MAX_PERIOD:
+                return False
+            if window[period:] == window[:-period]:
+                return True
+            end = index + PROBE_LENGTH - 1
+
+
+def check_output(text: str, guard_config: dict) -> str | None:
+    """对完整的输出做退化检测，返回触发的原因"""
+    guard = GenerationGuard(guard_config["max_block_chars"], guard_config["max_repeated_blocks"])
+    guard.feed(text)
+    return guard.reason
+
+
+def build_guard_params(guard_config: dict) -> dict:
+    """放到sampling_params的custom_params中，由服务端的Mineru2LogitProcessor使用"""
+    return {
+        "max_block_chars": guard_config["max_block_chars"],
+        "max_repeated_blocks": guard_config["max_repeated_blocks"],
+    }
+
+
+def build_retry_sampling_params(sampling_params: dict, retry_params: dict) -> dict:
+    """把重试参数合并到sglang格式的sampling_params中"""
+    return {
+        **sampling_params,
+        "repetition_penalty": retry_params["repetition_penalty"],
+        "custom_params": {
+            **sampling_params["custom_params"],
+            "no_repeat_ngram_size": retry_params["no_repeat_ngram_size"],
+        },
+    }
+
+
+class GenerationGuardStats:
+    """进程内的退化检测统计"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checked = 0
+        self.triggered = {}
+        self.retried = 0
+        self.recovered = 0
+
+    def record(self, reason: str | None):
+        with self._lock:
+            self.checked += 1
+            if reason is not None:
+                self.triggered[reason] = self.triggered.get(reason, 0) + 1
+
+    def record_retry(self, recovered: bool):
+        with self._lock:
+            self.retried += 1
+            if recovered:
+                self.recovered += 1
+
+    def stats(self, since: dict | None = None) -> dict:
+        """since为之前stats()的返回值时，返回此后新增的统计"""
+        with self._lock:
+            stats = {
+                "checked": self.checked,
+                "triggered": dict(self.triggered),
+                "retried": self.retried,
+                "recovered": self.recovered,
+            }
+        if since is not None:
+            stats = {
+                "checked": stats["checked"] - since["checked"],
+                "triggered": {
+                    reason: count - since["triggered"].get(reason, 0)
+                    for reason, count in stats["triggered"].items()
+                    if count > since["triggered"].get(reason, 0)
+                },
+                "retried": stats["retried"] - since["retried"],
+                "recovered": stats["recovered"] - since["recovered"],
+            }
+        return stats
+
+    def log_stats(self, since: dict | None = None):
+        """since为调用开始时stats()的返回值，只输出这次调用期间的统计（并发调用的页面也会计入）"""
+        stats = self.stats(since)
+        if not stats["triggered"]:
+            return
+        logger.warning(
+            f"generation guard: {sum(stats['triggered'].values())}/{stats['checked']} pages degenerated {stats['triggered']}, "
+            f"retried {stats['retried']}, recovered {stats['recovered']}"
+        )
+
+
+generation_guard_stats = GenerationGuardStats()
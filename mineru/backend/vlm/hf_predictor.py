@@ -1,10 +1,21 @@
+import copy
+import os
+import threading
 from io import BytesIO
-from typing import Iterable, List, Optional, Union
+from typing import Iterable, List, Optional, Tuple, Union
 
+import numpy as np
 import torch
 from PIL import Image
 from tqdm import tqdm
-from transformers import AutoTokenizer, BitsAndBytesConfig
+from transformers import (
+    AutoTokenizer,
+    BitsAndBytesConfig,
+    DynamicCache,
+    StoppingCriteria,
+    StoppingCriteriaList,
+    TextIteratorStreamer,
+)
 
 from ...model.vlm_hf_model import Mineru2QwenForCausalLM
 from ...model.vlm_hf_model.image_processing_mineru2 import process_images
@@ -18,7 +29,13 @@ from .base_predictor import (
     DEFAULT_TOP_P,
     BasePredictor,
 )
-from .utils import load_resource
+from .generation_guard import GenerationGuard
+from .utils import ImagePayload, load_resource
+
+# batch_predict每次generate的默认页数，可通过环境变量MINERU_VLM_HF_BATCH_SIZE设置
+DEFAULT_BATCH_SIZE = 8
+# 最多保留的prompt前缀KV cache个数，通常只有一个系统提示词
+MAX_PREFIX_CACHES = 4
 
 
 class HuggingfacePredictor(BasePredictor):
@@ -38,6 +55,8 @@ class HuggingfacePredictor(BasePredictor):
         presence_penalty: float = DEFAULT_PRESENCE_PENALTY,
         no_repeat_ngram_size: int = DEFAULT_NO_REPEAT_NGRAM_SIZE,
         max_new_tokens: int = DEFAULT_MAX_NEW_TOKENS,
+        batch_size: Optional[int] = None,
+        prefix_cache: Optional[bool] = None,
         **kwargs,
     ):
         super().__init__(
@@ -87,21 +106,26 @@ class HuggingfacePredictor(BasePredictor):
         self.image_processor = vision_tower.image_processor
         self.eos_token_id = self.model.config.eos_token_id
 
-    def predict(
+        if batch_size is None:
+            batch_size = int(os.getenv("MINERU_VLM_HF_BATCH_SIZE", DEFAULT_BATCH_SIZE))
+        self.batch_size = max(batch_size, 1)
+
+        # 复用系统提示词的KV cache，可通过环境变量MINERU_VLM_HF_PREFIX_CACHE=false关闭
+        if prefix_cache is None:
+            prefix_cache = os.getenv("MINERU_VLM_HF_PREFIX_CACHE", "true").lower() == "true"
+        self.prefix_cache = prefix_cache
+        self._prefix_caches = {}
+        self._prefix_cache_lock = threading.Lock()
+
+    def _build_generate_kwargs(
         self,
-        image: str | bytes,
-        prompt: str = "",
         temperature: Optional[float] = None,
         top_p: Optional[float] = None,
         top_k: Optional[int] = None,
         repetition_penalty: Optional[float] = None,
-        presence_penalty: Optional[float] = None,
         no_repeat_ngram_size: Optional[int] = None,
         max_new_tokens: Optional[int] = None,
-        **kwargs,
-    ) -> str:
-        prompt = self.build_prompt(prompt)
-
+    ) -> dict:
         if temperature is None:
             temperature = self.temperature
         if top_p is None:
@@ -127,25 +151,65 @@ class HuggingfacePredictor(BasePredictor):
             generate_kwargs["temperature"] = temperature
             generate_kwargs["top_p"] = top_p
             generate_kwargs["top_k"] = top_k
+        return generate_kwargs
 
-        if isinstance(image, str):
+    @staticmethod
+    def _load_image(image: str | bytes | ImagePayload) -> Image.Image:
+        if isinstance(image, ImagePayload):
+            image = image.data
+        elif isinstance(image, str):
             image = load_resource(image)
+        return Image.open(BytesIO(image))
+
+    def predict(
+        self,
+        image: str | bytes | ImagePayload,
+        prompt: str = "",
+        temperature: Optional[float] = None,
+        top_p: Optional[float] = None,
+        top_k: Optional[int] = None,
+        repetition_penalty: Optional[float] = None,
+        presence_penalty: Optional[float] = None,
+        no_repeat_ngram_size: Optional[int] = None,
+        max_new_tokens: Optional[int] = None,
+        **kwargs,
+    ) -> str:
+        prompt = self.build_prompt(prompt)
+
+        generate_kwargs = self._build_generate_kwargs(
+            temperature, top_p, top_k, repetition_penalty, no_repeat_ngram_size, max_new_tokens
+        )
 
-        image_obj = Image.open(BytesIO(image))
+        image_obj = self._load_image(image)
+        output = self._generate(image_obj, prompt, generate_kwargs, **kwargs)
+
+        def retry(indices, retry_params):
+            retry_generate_kwargs = self._build_generate_kwargs(
+                temperature, top_p, top_k, retry_params["repetition_penalty"], retry_params["no_repeat_ngram_size"], max_new_tokens
+            )
+            return [self._generate(image_obj, prompt, retry_generate_kwargs, **kwargs)]
+
+        return self.guard_outputs([output], retry, repetition_penalty, no_repeat_ngram_size)[0]
+
+    def _generate(self, image_obj: Image.Image, prompt: str, generate_kwargs: dict, **kwargs) -> str:
         image_tensor = process_images([image_obj], self.image_processor, self.model.config)
         image_tensor = image_tensor[0].unsqueeze(0)
         image_tensor = image_tensor.to(device=self.model.device, dtype=self.model.dtype)
         image_sizes = [[*image_obj.size]]
 
-        input_ids = self.tokenizer(prompt, return_tensors="pt").input_ids
-        input_ids = input_ids.to(device=self.model.device)
+        prompt_ids, prefix_key_values = self._tokenize_prompts([prompt])
+        input_ids = torch.tensor(prompt_ids, dtype=torch.long, device=self.model.device)
+
+        stopping_criteria = self._build_stopping_criteria(1, kwargs.pop("stopping_criteria", None))
 
         with torch.inference_mode():
             output_ids = self.model.generate(
                 input_ids,
                 images=image_tensor,
                 image_sizes=image_sizes,
+                prefix_key_values=prefix_key_values,
                 use_cache=True,
+                stopping_criteria=stopping_criteria,
                 **generate_kwargs,
                 **kwargs,
             )
@@ -161,9 +225,49 @@ class HuggingfacePredictor(BasePredictor):
 
         return output
 
+    def _tokenize_prompts(self, prompts: List[str]) -> Tuple[List[List[int]], Optional[DynamicCache]]:
+        """
+        prompt中<image>之前的部分（系统提示词）对每一页都相同，复用这部分的KV cache，只对之后的部分做prefill。
+        返回去掉前缀的token ids和复制到batch大小的前缀cache，不能复用时返回完整的token ids和None。
+        """
+        prompt_ids = [self.tokenizer(prompt).input_ids for prompt in prompts]
+        if not self.prefix_cache:
+            return prompt_ids, None
+        image_token_index = self.model.config.image_token_index
+        prefixes = {tuple(ids[: ids.index(image_token_index)]) if image_token_index in ids else () for ids in prompt_ids}
+        prefix = prefixes.pop()
+        if prefixes or not prefix:
+            return prompt_ids, None
+
+        prefix_key_values = self._get_prefix_cache(prefix)
+        # generate会在cache后面追加新的key/value，每次调用使用各自的副本
+        with torch.inference_mode():
+            prefix_key_values = copy.deepcopy(prefix_key_values)
+            if len(prompt_ids) > 1:
+                prefix_key_values.batch_repeat_interleave(len(prompt_ids))
+        return [ids[len(prefix) :] for ids in prompt_ids], prefix_key_values
+
+    def _get_prefix_cache(self, prefix: Tuple[int, ...]) -> DynamicCache:
+        with self._prefix_cache_lock:
+            prefix_key_values = self._prefix_caches.get(prefix)
+            if prefix_key_values is None:
+                input_ids = torch.tensor([prefix], dtype=torch.long, device=self.model.device)
+                with torch.inference_mode():
+                    prefix_key_values = self.model.get_model()(input_ids=input_ids, use_cache=True).past_key_values
+                if len(self._prefix_caches) >= MAX_PREFIX_CACHES:
+                    self._prefix_caches.pop(next(iter(self._prefix_caches)))
+                self._prefix_caches[prefix] = prefix_key_values
+            return prefix_key_values
+
+    def _build_stopping_criteria(self, batch_size: int, stopping_criteria=None) -> StoppingCriteriaList:
+        stopping_criteria = StoppingCriteriaList(stopping_criteria or [])
+        if self.guard_config is not None:
+            stopping_criteria.append(_GuardStoppingCriteria(self.tokenizer, [self.new_generation_guard() for _ in range(batch_size)]))
+        return stopping_criteria
+
     def batch_predict(
         self,
-        images: List[str] | List[bytes],
+        images: List[str] | List[bytes] | List[ImagePayload],
         prompts: Union[List[str], str] = "",
         temperature: Optional[float] = None,
         top_p: Optional[float] = None,
@@ -171,34 +275,157 @@ class HuggingfacePredictor(BasePredictor):
         repetition_penalty: Optional[float] = None,
         presence_penalty: Optional[float] = None,  # not supported by hf
         no_repeat_ngram_size: Optional[int] = None,
-        max_new_tokens: Optional[int] = None,
+        max_new_tokens: Union[int, List[int], None] = None,
+        batch_size: Optional[int] = None,
         **kwargs,
     ) -> List[str]:
+        """
+        按batch_size（默认self.batch_size）把多页拼成一个batch做generate：prompt左padding，
+        各页的anyres图像块按页传入并带上各自的image_sizes。
+        max_new_tokens可以按页设置，页面按max_new_tokens和预估的输出长度从长到短排序后再分batch，
+        减少同一batch内提前结束的序列空跑的padding。
+        greedy解码时每页的输出与逐页调用predict一致。
+        """
         if not isinstance(prompts, list):
             prompts = [prompts] * len(images)
 
         assert len(prompts) == len(images), "Length of prompts and images must match."
 
-        outputs = []
-        for prompt, image in tqdm(zip(prompts, images), total=len(images), desc="Predict"):
-            output = self.predict(
-                image,
-                prompt,
-                temperature=temperature,
-                top_p=top_p,
-                top_k=top_k,
-                repetition_penalty=repetition_penalty,
-                presence_penalty=presence_penalty,
-                no_repeat_ngram_size=no_repeat_ngram_size,
-                max_new_tokens=max_new_tokens,
+        if batch_size is None:
+            batch_size = self.batch_size
+
+        page_max_new_tokens = self.get_page_max_new_tokens(max_new_tokens, len(images))
+        image_objs = [self._load_image(image) for image in images]
+        prompts = [self.build_prompt(prompt) for prompt in prompts]
+
+        def generate(indices, repetition_penalty, no_repeat_ngram_size):
+            # 每个batch按其中最大的max_new_tokens生成，各页再由停止条件限制在自己的max_new_tokens内
+            batch_max_new_tokens = [page_max_new_tokens[i] for i in indices]
+            generate_kwargs = self._build_generate_kwargs(
+                temperature, top_p, top_k, repetition_penalty, no_repeat_ngram_size, max(batch_max_new_tokens)
+            )
+            return self._batch_generate(
+                [image_objs[i] for i in indices],
+                [prompts[i] for i in indices],
+                generate_kwargs,
+                row_max_new_tokens=batch_max_new_tokens,
                 **kwargs,
             )
-            outputs.append(output)
+
+        order = sorted(
+            range(len(images)),
+            key=lambda i: (page_max_new_tokens[i], self._estimate_output_length(image_objs[i])),
+            reverse=True,
+        )
+
+        outputs: List[str] = [""] * len(images)
+        with tqdm(total=len(images), desc="Predict") as pbar:
+            for start in range(0, len(order), batch_size):
+                batch_indices = order[start : start + batch_size]
+                batch_outputs = generate(batch_indices, repetition_penalty, no_repeat_ngram_size)
+                for i, output in zip(batch_indices, batch_outputs):
+                    outputs[i] = output
+                pbar.update(len(batch_indices))
+
+        def retry(indices, retry_params):
+            retry_outputs = []
+            for start in range(0, len(indices), batch_size):
+                retry_outputs.extend(
+                    generate(
+                        indices[start : start + batch_size],
+                        retry_params["repetition_penalty"],
+                        retry_params["no_repeat_ngram_size"],
+                    )
+                )
+            return retry_outputs
+
+        return self.guard_outputs(outputs, retry, repetition_penalty, no_repeat_ngram_size)
+
+    @staticmethod
+    def _estimate_output_length(image_obj: Image.Image) -> float:
+        """用缩略图中深色像素的占比估计页面文字量，作为输出token数的近似"""
+        thumbnail = np.asarray(image_obj.convert("L").resize((64, 64)))
+        return float((thumbnail < 128).mean())
+
+    def _batch_generate(
+        self,
+        image_objs: List[Image.Image],
+        prompts: List[str],
+        generate_kwargs: dict,
+        row_max_new_tokens: Optional[List[int]] = None,
+        **kwargs,
+    ) -> List[str]:
+        image_tensors = process_images(image_objs, self.image_processor, self.model.config)
+        if isinstance(image_tensors, list):
+            image_tensors = [x.to(device=self.model.device, dtype=self.model.dtype) for x in image_tensors]
+        else:
+            image_tensors = image_tensors.to(device=self.model.device, dtype=self.model.dtype)
+        image_sizes = [[*image_obj.size] for image_obj in image_objs]
+
+        # 左padding，padding位置的attention_mask为0，在合并图像特征时会被去掉再重新左padding
+        prompt_ids, prefix_key_values = self._tokenize_prompts(prompts)
+        max_len = max(len(ids) for ids in prompt_ids)
+        pad_token_id = self.tokenizer.pad_token_id
+        if pad_token_id is None:
+            pad_token_id = self.eos_token_id
+        input_ids = torch.full((len(prompt_ids), max_len), pad_token_id, dtype=torch.long)
+        attention_mask = torch.zeros((len(prompt_ids), max_len), dtype=torch.long)
+        for i, ids in enumerate(prompt_ids):
+            input_ids[i, max_len - len(ids) :] = torch.tensor(ids, dtype=torch.long)
+            attention_mask[i, max_len - len(ids) :] = 1
+        input_ids = input_ids.to(device=self.model.device)
+        attention_mask = attention_mask.to(device=self.model.device)
+
+        if "pad_token_id" not in kwargs and self.model.generation_config.pad_token_id is None:
+            kwargs["pad_token_id"] = pad_token_id
+        stopping_criteria = self._build_stopping_criteria(len(prompts), kwargs.pop("stopping_criteria", None))
+        if row_max_new_tokens is not None and min(row_max_new_tokens) < generate_kwargs["max_new_tokens"]:
+            stopping_criteria.append(_RowMaxNewTokensCriteria(row_max_new_tokens))
+
+        with torch.inference_mode():
+            output_ids = self.model.generate(
+                input_ids,
+                images=image_tensors,
+                image_sizes=image_sizes,
+                attention_mask=attention_mask,
+                prefix_key_values=prefix_key_values,
+                use_cache=True,
+                stopping_criteria=stopping_criteria,
+                **generate_kwargs,
+                **kwargs,
+            )
+
+        row_stop_lengths = [len(row) for row in output_ids]
+        for criteria in stopping_criteria:
+            if isinstance(criteria, _RowStoppingCriteria):
+                row_stop_lengths = [
+                    min(length, stop_length) if stop_length is not None else length
+                    for length, stop_length in zip(row_stop_lengths, criteria.stop_lengths)
+                ]
+
+        stop_token_ids = kwargs.get("eos_token_id", self.model.generation_config.eos_token_id)
+        if stop_token_ids is None:
+            stop_token_ids = self.eos_token_id
+        if not isinstance(stop_token_ids, (list, tuple)):
+            stop_token_ids = [stop_token_ids]
+
+        outputs = []
+        for row, stop_length in zip(output_ids.tolist(), row_stop_lengths):
+            # 已结束的序列后面是padding，截到停止条件结束的位置或第一个结束token为止，与单独生成时的输出对齐
+            row = row[:stop_length]
+            for end, token_id in enumerate(row):
+                if token_id in stop_token_ids:
+                    row = row[: end + 1]
+                    break
+            # Remove the last token if it is the eos_token_id
+            if len(row) > 0 and row[-1] == self.eos_token_id:
+                row = row[:-1]
+            outputs.append(self.tokenizer.decode(row, skip_special_tokens=False).strip())
         return outputs
 
     def stream_predict(
         self,
-        image: str | bytes,
+        image: str | bytes | ImagePayload,
         prompt: str = "",
         temperature: Optional[float] = None,
         top_p: Optional[float] = None,
@@ -207,5 +434,143 @@ class HuggingfacePredictor(BasePredictor):
         presence_penalty: Optional[float] = None,
         no_repeat_ngram_size: Optional[int] = None,
         max_new_tokens: Optional[int] = None,
+        **kwargs,
     ) -> Iterable[str]:
-        raise NotImplementedError("Streaming is not supported yet.")
+        """
+        在后台线程中generate，通过streamer逐段yield新生成的文本，与SglangClientPredictor.stream_predict的约定一致。
+        所有片段拼接后与predict的输出相同（predict会额外strip首尾空白）。
+        调用方提前停止迭代时，后台的generate会在下一个token处结束。
+        """
+        prompt = self.build_prompt(prompt)
+
+        generate_kwargs = self._build_generate_kwargs(
+            temperature, top_p, top_k, repetition_penalty, no_repeat_ngram_size, max_new_tokens
+        )
+
+        image_obj = self._load_image(image)
+        image_tensor = process_images([image_obj], self.image_processor, self.model.config)
+        image_tensor = image_tensor[0].unsqueeze(0)
+        image_tensor = image_tensor.to(device=self.model.device, dtype=self.model.dtype)
+        image_sizes = [[*image_obj.size]]
+
+        prompt_ids, prefix_key_values = self._tokenize_prompts([prompt])
+        input_ids = torch.tensor(prompt_ids, dtype=torch.long, device=self.model.device)
+
+        streamer = _EosSkippingStreamer(self.tokenizer, self.eos_token_id)
+        stop_event = threading.Event()
+        stopping_criteria = self._build_stopping_criteria(1, kwargs.pop("stopping_criteria", None))
+        stopping_criteria.append(_EventStoppingCriteria(stop_event))
+        generate_errors = []
+
+        def generate():
+            try:
+                with torch.inference_mode():
+                    self.model.generate(
+                        input_ids,
+                        images=image_tensor,
+                        image_sizes=image_sizes,
+                        prefix_key_values=prefix_key_values,
+                        use_cache=True,
+                        streamer=streamer,
+                        stopping_criteria=stopping_criteria,
+                        **generate_kwargs,
+                        **kwargs,
+                    )
+            except Exception as e:
+                generate_errors.append(e)
+                streamer.end()
+
+        generate_thread = threading.Thread(target=generate, daemon=True)
+        generate_thread.start()
+        try:
+            for chunk in streamer:
+                if chunk:
+                    yield chunk
+        finally:
+            stop_event.set()
+            generate_thread.join()
+        if generate_errors:
+            raise generate_errors[0]
+
+
+class _EosSkippingStreamer(TextIteratorStreamer):
+    """跳过prompt和结尾的eos token，与predict去掉最后一个eos token的处理一致"""
+
+    def __init__(self, tokenizer, eos_token_id):
+        super().__init__(tokenizer, skip_prompt=True, skip_special_tokens=False)
+        self.eos_token_id = eos_token_id
+
+    def put(self, value):
+        if not self.next_tokens_are_prompt and value.numel() == 1 and value.item() == self.eos_token_id:
+            return
+        super().put(value)
+
+
+class _EventStoppingCriteria(StoppingCriteria):
+    def __init__(self, stop_event: threading.Event):
+        self.stop_event = stop_event
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return torch.full((input_ids.shape[0],), self.stop_event.is_set(), dtype=torch.bool, device=input_ids.device)
+
+
+class _RowStoppingCriteria(StoppingCriteria):
+    """按序列判断是否结束，stop_lengths记录每个序列结束时的长度。
+
+    batch中提前结束的序列后面会被补上pad token，需要按stop_lengths截断。
+    generate使用inputs_embeds，input_ids中只有新生成的token。
+    """
+
+    def __init__(self, batch_size: int):
+        self.stop_lengths: List[Optional[int]] = [None] * batch_size
+
+    def _update(self, input_ids, is_done: List[bool]):
+        for i, done in enumerate(is_done):
+            if done and self.stop_lengths[i] is None:
+                self.stop_lengths[i] = input_ids.shape[1]
+        return torch.tensor(is_done, dtype=torch.bool, device=input_ids.device)
+
+
+class _GuardStoppingCriteria(_RowStoppingCriteria):
+    """逐个序列检测新生成的文本，判定为退化的序列提前结束。
+
+    与TextIteratorStreamer一样按序列增量解码：每个序列记录已经交给guard的token位置，
+    多字节字符被拆到几个token时，等字符完整后再交给guard，不会解码出U+FFFD。
+    """
+
+    def __init__(self, tokenizer, guards: List[GenerationGuard]):
+        super().__init__(len(guards))
+        self.tokenizer = tokenizer
+        self.guards = guards
+        # [prefix_offset, read_offset)是上一段已经交给guard的token，解码时作为上下文
+        self.prefix_offsets = [0] * len(guards)
+        self.read_offsets = [0] * len(guards)
+
+    def __call__(self, input_ids, scores, **kwargs):
+        start = min(self.prefix_offsets)
+        rows = input_ids[:, start:].tolist()
+        is_done = [self._feed(i, ids, start) for i, ids in enumerate(rows)]
+        return self._update(input_ids, is_done)
+
+    def _feed(self, row: int, ids: List[int], start: int) -> bool:
+        prefix_offset = self.prefix_offsets[row] - start
+        read_offset = self.read_offsets[row] - start
+        prefix_text = self.tokenizer.decode(ids[prefix_offset:read_offset], skip_special_tokens=False)
+        text = self.tokenizer.decode(ids[prefix_offset:], skip_special_tokens=False)
+        if len(text) <= len(prefix_text) or text.endswith("\ufffd"):
+            # 结尾的字符还不完整，留到下一步
+            return self.guards[row].feed("")
+        self.prefix_offsets[row] = self.read_offsets[row]
+        self.read_offsets[row] = start + len(ids)
+        return self.guards[row].feed(text[len(prefix_text):])
+
+
+class _RowMaxNewTokensCriteria(_RowStoppingCriteria):
+    """batch内每个序列使用各自的max_new_tokens"""
+
+    def __init__(self, row_max_new_tokens: List[int]):
+        super().__init__(len(row_max_new_tokens))
+        self.row_max_new_tokens = row_max_new_tokens
+
+    def __call__(self, input_ids, scores, **kwargs):
+        return self._update(input_ids, [input_ids.shape[1] >= max_new_tokens for max_new_tokens in self.row_max_new_tokens])
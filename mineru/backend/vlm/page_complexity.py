@@ -0,0 +1,117 @@
+# Copyright (c) Opendatalab. All rights reserved.
+"""按页面的文本层、图像和矢量图形的覆盖率以及渲染结果估计vlm的输出量。
+
+估计值用于设置每页的max_new_tokens，以及按预计输出从长到短调度请求；
+空白页（没有文本层、渲染后几乎没有深色像素）不需要推理。
+默认不启用，设置MINERU_VLM_PAGE_BUDGET_ENABLE=true后生效。
+"""
+import re
+
+import numpy as np
+import pypdfium2 as pdfium
+import pypdfium2.raw as pdfium_c
+from loguru import logger
+
+from mineru.utils.pdf_reader import pdfium_lock
+from .vlm_magic_model import MD_END
+
+# 文本层每个字符对应的输出token数上限，包含公式展开、表格标记和块坐标的余量
+TOKENS_PER_CHAR = 4
+BASE_TOKENS = 1024
+MIN_MAX_NEW_TOKENS = 2048
+# 图像和矢量图形（图表、流程图、手绘表格）覆盖超过该比例的页面，输出中有大量文本层之外的内容，
+# 按字符数估计容易截断，使用完整的max_new_tokens
+GRAPHICS_COVERAGE = 0.05
+# 灰度低于BLANK_GRAY_THRESHOLD的像素占比低于BLANK_INK_RATIO时视为空白页
+BLANK_GRAY_THRESHOLD = 200
+BLANK_INK_RATIO = 5e-5
+
+
+def get_text_chars(pdf_page: pdfium.PdfPage) -> int:
+    """文本层中去掉空白字符后的字符数"""
+    text_page = pdf_page.get_textpage()
+    try:
+        text = text_page.get_text_bounded()
+    finally:
+        text_page.close()
+    return len(re.sub(r'\s+', '', text))
+
+
+def get_object_coverage(pdf_page: pdfium.PdfPage, object_types: list[int]) -> float:
+    """页面中指定类型的对象覆盖的面积占比，重叠部分重复计算，最大为1"""
+    page_width, page_height = pdf_page.get_size()
+    page_area = page_width * page_height
+    if page_area <= 0:
+        return 0.0
+    object_area = 0.0
+    for pdf_object in pdf_page.get_objects(filter=object_types):
+        # pypdfium2 5.x中get_pos改名为get_bounds
+        get_bounds = getattr(pdf_object, 'get_bounds', None) or pdf_object.get_pos
+        left, bottom, right, top = get_bounds()
+        object_area += max(right - left, 0) * max(top - bottom, 0)
+    return min(object_area / page_area, 1.0)
+
+
+def get_image_coverage(pdf_page: pdfium.PdfPage) -> float:
+    """页面中图像对象覆盖的面积占比"""
+    return get_object_coverage(pdf_page, [pdfium_c.FPDF_PAGEOBJ_IMAGE])
+
+
+def get_graphics_coverage(pdf_page: pdfium.PdfPage) -> float:
+    """页面中图像和路径对象覆盖的面积占比，细线（表格线、分隔线）的面积可以忽略"""
+    return get_object_coverage(pdf_page, [pdfium_c.FPDF_PAGEOBJ_IMAGE, pdfium_c.FPDF_PAGEOBJ_PATH])
+
+
+def get_ink_ratio(pil_img) -> float:
+    """渲染结果中深色像素的占比"""
+    gray = np.asarray(pil_img.convert('L'))
+    return float(np.count_nonzero(gray < BLANK_GRAY_THRESHOLD)) / max(gray.size, 1)
+
+
+def estimate_max_new_tokens(pdf_page: pdfium.PdfPage, pil_img, max_new_tokens: int) -> int:
+    """
+    估计页面需要的max_new_tokens，不超过max_new_tokens，空白页返回0。
+    没有文本层或有明显的图像、矢量图形的页面无法只按文本层估计，使用max_new_tokens。
+    """
+    with pdfium_lock:
+        text_chars = get_text_chars(pdf_page)
+        graphics_coverage = get_graphics_coverage(pdf_page) if text_chars > 0 else 0.0
+    if text_chars == 0 and get_ink_ratio(pil_img) < BLANK_INK_RATIO:
+        return 0
+    if text_chars == 0 or graphics_coverage >= GRAPHICS_COVERAGE:
+        return max_new_tokens
+    budget = max(BASE_TOKENS + TOKENS_PER_CHAR * text_chars, MIN_MAX_NEW_TOKENS)
+    return min(budget, max_new_tokens)
+
+
+def estimate_page_budgets(pdf_doc: pdfium.PdfDocument, images_list, max_new_tokens: int) -> list[int]:
+    """按顺序估计images_list中每一页的max_new_tokens，逐页持有pdfium_lock"""
+    budgets = []
+    for page_idx, image_dict in enumerate(images_list):
+        with pdfium_lock:
+            pdf_page = pdf_doc[page_idx]
+        try:
+            budgets.append(estimate_max_new_tokens(pdf_page, image_dict['img_pil'], max_new_tokens))
+        finally:
+            with pdfium_lock:
+                pdf_page.close()
+    return budgets
+
+
+def check_budget_hit(page_idx: int, output: str, budget: int, max_new_tokens: int) -> bool:
+    """
+    按估计值限制了输出长度的页面，如果输出没有以完整的块结束，很可能是用完了max_new_tokens被截断，记录日志。
+    predictor不返回结束原因，这里只能根据输出的结尾判断，退化检测提前结束的页面也会被记录。
+    """
+    if budget >= max_new_tokens or not output:
+        return False
+    text = output.rstrip()
+    if text.endswith("<|im_end|>"):
+        text = text[:-len("<|im_end|>")].rstrip()
+    if text.endswith(MD_END):
+        return False
+    logger.warning(
+        f"page {page_idx} may have been truncated by its estimated max_new_tokens={budget} (default {max_new_tokens}), "
+        f"set MINERU_VLM_PAGE_BUDGET_ENABLE=false to disable per-page budgets"
+    )
+    return True
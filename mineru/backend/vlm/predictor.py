@@ -38,7 +38,7 @@ except Exception as e:
 def get_predictor(
     backend: str = "sglang-client",
     model_path: str | None = None,
-    server_url: str | None = None,
+    server_url: str | list[str] | None = None,
     temperature: float = DEFAULT_TEMPERATURE,
     top_p: float = DEFAULT_TOP_P,
     top_k: int = DEFAULT_TOP_K,
@@ -102,6 +102,7 @@ def get_predictor(
             no_repeat_ngram_size=no_repeat_ngram_size,
             max_new_tokens=max_new_tokens,
             http_timeout=http_timeout,
+            **kwargs,
         )
     else:
         raise ValueError(f"Unsupported backend: {backend}. Supports: transformers, sglang-engine, sglang-client.")
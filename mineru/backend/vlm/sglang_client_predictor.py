@@ -1,10 +1,14 @@
 import asyncio
+import concurrent.futures
 import json
 import re
+import threading
+import time
 from base64 import b64encode
 from typing import AsyncIterable, Iterable, List, Optional, Set, Tuple, Union
 
 import httpx
+from loguru import logger
 
 from .base_predictor import (
     DEFAULT_MAX_NEW_TOKENS,
@@ -16,13 +20,19 @@ from .base_predictor import (
     DEFAULT_TOP_P,
     BasePredictor,
 )
-from .utils import aio_load_resource, load_resource
+from .endpoint_pool import EndpointPool, SglangEndpoint
+from .generation_guard import build_guard_params, build_retry_sampling_params, generation_guard_stats
+from .utils import ImagePayload, aio_load_resource, load_resource
+
+
+class SglangServerError(Exception):
+    """sglang server返回5xx，可以在其他服务端上重试"""
 
 
 class SglangClientPredictor(BasePredictor):
     def __init__(
         self,
-        server_url: str,
+        server_url: str | List[str],
         temperature: float = DEFAULT_TEMPERATURE,
         top_p: float = DEFAULT_TOP_P,
         top_k: int = DEFAULT_TOP_K,
@@ -31,6 +41,13 @@ class SglangClientPredictor(BasePredictor):
         no_repeat_ngram_size: int = DEFAULT_NO_REPEAT_NGRAM_SIZE,
         max_new_tokens: int = DEFAULT_MAX_NEW_TOKENS,
         http_timeout: int = 600,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 100,
+        keepalive_expiry: float = 60,
+        http2: bool = False,
+        max_retries: Optional[int] = None,
+        health_check_interval: float = 10,
+        health_check_timeout: float = 30,
     ) -> None:
         super().__init__(
             temperature=temperature,
@@ -43,10 +60,57 @@ class SglangClientPredictor(BasePredictor):
         )
         self.http_timeout = http_timeout
 
-        base_url = self.get_base_url(server_url)
-        self.check_server_health(base_url)
-        self.model_path = self.get_model_path(base_url)
-        self.server_url = f"{base_url}/generate"
+        # 同步和异步请求都复用长连接，避免每页、每篇文档都重新建立到sglang server的TCP连接
+        self.http_limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        if http2:
+            try:
+                import h2  # noqa: F401
+            except ImportError:
+                logger.warning("h2 is not installed, fall back to HTTP/1.1. Install httpx[http2] to enable HTTP/2.")
+                http2 = False
+        self.http2 = http2
+        self._client = httpx.Client(timeout=self.http_timeout, limits=self.http_limits, http2=self.http2)
+        # httpx.AsyncClient的连接绑定在创建它的事件循环上，每个事件循环各用一个client
+        self._async_clients = {}
+        self._async_clients_lock = threading.Lock()
+        # 同步的batch_predict在这个常驻的事件循环上执行，异步client可以跨调用复用
+        self._loop = None
+        self._loop_thread = None
+
+        # server_url可以是多个服务端的列表，或者用逗号分隔的多个地址
+        if isinstance(server_url, str):
+            server_url = [url.strip() for url in server_url.split(",") if url.strip()]
+        self.endpoint_pool = EndpointPool([self.get_base_url(url) for url in server_url])
+        # 默认每个服务端最多尝试一次
+        self.max_retries = len(self.endpoint_pool) - 1 if max_retries is None else max_retries
+        self.health_check_timeout = health_check_timeout
+
+        self.model_path = None
+        for endpoint in self.endpoint_pool.endpoints:
+            try:
+                self.check_server_health(endpoint.base_url)
+                if self.model_path is None:
+                    self.model_path = self.get_model_path(endpoint.base_url)
+            except RuntimeError as e:
+                if len(self.endpoint_pool) == 1:
+                    raise
+                self.endpoint_pool.set_health(endpoint, False, e)
+        if self.model_path is None:
+            raise RuntimeError(f"None of the servers {server_url} is healthy. Please check if the servers are running.")
+        self.server_url = self.endpoint_pool.endpoints[0].generate_url
+
+        # 多个服务端时定期做健康检查，摘除失败的服务端并重新加入恢复的服务端
+        self._health_check_stop = threading.Event()
+        self._health_check_thread = None
+        if len(self.endpoint_pool) > 1 and health_check_interval > 0:
+            self._health_check_thread = threading.Thread(
+                target=self._health_check_loop, args=(health_check_interval,), daemon=True
+            )
+            self._health_check_thread.start()
 
     @staticmethod
     def get_base_url(server_url: str) -> str:
@@ -57,7 +121,7 @@ class SglangClientPredictor(BasePredictor):
 
     def check_server_health(self, base_url: str):
         try:
-            response = httpx.get(f"{base_url}/health_generate", timeout=self.http_timeout)
+            response = self._client.get(f"{base_url}/health_generate")
         except httpx.ConnectError:
             raise RuntimeError(f"Failed to connect to server {base_url}. Please check if the server is running.")
         if response.status_code != 200:
@@ -67,7 +131,7 @@ class SglangClientPredictor(BasePredictor):
 
     def get_model_path(self, base_url: str) -> str:
         try:
-            response = httpx.get(f"{base_url}/get_model_info", timeout=self.http_timeout)
+            response = self._client.get(f"{base_url}/get_model_info")
         except httpx.ConnectError:
             raise RuntimeError(f"Failed to connect to server {base_url}. Please check if the server is running.")
         if response.status_code != 200:
@@ -76,6 +140,135 @@ class SglangClientPredictor(BasePredictor):
             )
         return response.json()["model_path"]
 
+    def probe_endpoint(self, endpoint: SglangEndpoint) -> bool:
+        try:
+            response = self._client.get(endpoint.health_url, timeout=self.health_check_timeout)
+            if response.status_code != 200:
+                raise SglangServerError(f"health check status code {response.status_code}")
+        except (httpx.HTTPError, SglangServerError) as e:
+            self.endpoint_pool.set_health(endpoint, False, e)
+            return False
+        self.endpoint_pool.set_health(endpoint, True)
+        return True
+
+    def _health_check_loop(self, interval: float):
+        while not self._health_check_stop.wait(interval):
+            for endpoint in self.endpoint_pool.endpoints:
+                if self._health_check_stop.is_set():
+                    return
+                self.probe_endpoint(endpoint)
+
+    def get_endpoint_stats(self) -> List[dict]:
+        """每个服务端的健康状态、进行中的请求数、请求数、失败数和延迟"""
+        return self.endpoint_pool.stats()
+
+    def log_endpoint_stats(self):
+        self.endpoint_pool.log_stats()
+
+    def _handle_request_error(
+        self, endpoint: SglangEndpoint, error: Exception, tried: set, allow_retry: bool = True
+    ) -> bool:
+        """记录失败的请求，返回是否可以在其他服务端上重试"""
+        self.endpoint_pool.release(endpoint, error=error)
+        tried.add(endpoint)
+        can_retry = allow_retry and len(tried) <= self.max_retries and len(tried) < len(self.endpoint_pool)
+        if can_retry:
+            logger.warning(f"Request to {endpoint.base_url} failed: {error!r}, retry on another server.")
+        return can_retry
+
+    @staticmethod
+    def _check_response(response: httpx.Response):
+        if response.status_code >= 500:
+            raise SglangServerError(f"Server error {response.status_code}: {response.text}")
+
+    def _post_generate(self, request_body: dict) -> dict:
+        tried = set()
+        while True:
+            endpoint = self.endpoint_pool.acquire(tried)
+            start = time.time()
+            try:
+                response = self._client.post(endpoint.generate_url, json=request_body)
+                self._check_response(response)
+                response_body = response.json()
+            except (httpx.TransportError, SglangServerError) as e:
+                if self._handle_request_error(endpoint, e, tried):
+                    continue
+                raise
+            except BaseException:
+                self.endpoint_pool.release(endpoint)
+                raise
+            self.endpoint_pool.release(endpoint, time.time() - start)
+            return response_body
+
+    async def _aio_post_generate(self, request_body: dict, async_client: httpx.AsyncClient) -> dict:
+        tried = set()
+        while True:
+            endpoint = self.endpoint_pool.acquire(tried)
+            start = time.time()
+            try:
+                response = await async_client.post(endpoint.generate_url, json=request_body)
+                self._check_response(response)
+                response_body = response.json()
+            except (httpx.TransportError, SglangServerError) as e:
+                if self._handle_request_error(endpoint, e, tried):
+                    continue
+                raise
+            except BaseException:
+                self.endpoint_pool.release(endpoint)
+                raise
+            self.endpoint_pool.release(endpoint, time.time() - start)
+            return response_body
+
+    def get_async_client(self) -> httpx.AsyncClient:
+        """返回当前事件循环上复用的AsyncClient"""
+        loop = asyncio.get_running_loop()
+        with self._async_clients_lock:
+            # 丢弃已关闭的事件循环上的client，它们的连接已经不可用
+            for closed_loop in [key for key in self._async_clients if key.is_closed()]:
+                del self._async_clients[closed_loop]
+            client = self._async_clients.get(loop)
+            if client is None:
+                client = httpx.AsyncClient(timeout=self.http_timeout, limits=self.http_limits, http2=self.http2)
+                self._async_clients[loop] = client
+        return client
+
+    def _get_loop(self) -> asyncio.AbstractEventLoop:
+        with self._async_clients_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                self._loop_thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+                self._loop_thread.start()
+        return self._loop
+
+    def run_in_background(self, coro) -> concurrent.futures.Future:
+        """在常驻的事件循环上执行协程，协程中的请求复用该循环上的AsyncClient"""
+        return asyncio.run_coroutine_threadsafe(coro, self._get_loop())
+
+    def close(self):
+        self._health_check_stop.set()
+        if self._health_check_thread is not None:
+            self._health_check_thread.join()
+            self._health_check_thread = None
+        self._client.close()
+        with self._async_clients_lock:
+            async_clients = list(self._async_clients.items())
+            self._async_clients.clear()
+            loop, loop_thread = self._loop, self._loop_thread
+            self._loop, self._loop_thread = None, None
+        for client_loop, client in async_clients:
+            if client_loop.is_closed():
+                continue
+            if client_loop is loop:
+                asyncio.run_coroutine_threadsafe(client.aclose(), loop).result()
+            elif not client_loop.is_running():
+                client_loop.run_until_complete(client.aclose())
+            else:
+                client_loop.call_soon_threadsafe(lambda c=client: asyncio.ensure_future(c.aclose()))
+        if loop is not None:
+            loop.call_soon_threadsafe(loop.stop)
+            loop_thread.join()
+            loop.close()
+
     def build_sampling_params(
         self,
         temperature: Optional[float],
@@ -101,6 +294,13 @@ class SglangClientPredictor(BasePredictor):
         if max_new_tokens is None:
             max_new_tokens = self.max_new_tokens
 
+        custom_params = {
+            "no_repeat_ngram_size": no_repeat_ngram_size,
+        }
+        # 由服务端的Mineru2LogitProcessor检测退化，提前结束请求
+        if self.guard_config is not None:
+            custom_params["generation_guard"] = build_guard_params(self.guard_config)
+
         # see SamplingParams for more details
         return {
             "temperature": temperature,
@@ -108,20 +308,21 @@ class SglangClientPredictor(BasePredictor):
             "top_k": top_k,
             "repetition_penalty": repetition_penalty,
             "presence_penalty": presence_penalty,
-            "custom_params": {
-                "no_repeat_ngram_size": no_repeat_ngram_size,
-            },
+            "custom_params": custom_params,
             "max_new_tokens": max_new_tokens,
             "skip_special_tokens": False,
         }
 
     def build_request_body(
         self,
-        image: bytes,
+        image: bytes | ImagePayload,
         prompt: str,
         sampling_params: dict,
     ) -> dict:
-        image_base64 = b64encode(image).decode("utf-8")
+        if isinstance(image, ImagePayload):
+            image_base64 = image.base64
+        else:
+            image_base64 = b64encode(image).decode("utf-8")
         return {
             "text": prompt,
             "image_data": image_base64,
@@ -131,7 +332,7 @@ class SglangClientPredictor(BasePredictor):
 
     def predict(
         self,
-        image: str | bytes,
+        image: str | bytes | ImagePayload,
         prompt: str = "",
         temperature: Optional[float] = None,
         top_p: Optional[float] = None,
@@ -157,13 +358,17 @@ class SglangClientPredictor(BasePredictor):
             image = load_resource(image)
 
         request_body = self.build_request_body(image, prompt, sampling_params)
-        response = httpx.post(self.server_url, json=request_body, timeout=self.http_timeout)
-        response_body = response.json()
-        return response_body["text"]
+        response_body = self._post_generate(request_body)
+
+        def retry(indices, retry_params):
+            retry_body = {**request_body, "sampling_params": build_retry_sampling_params(sampling_params, retry_params)}
+            return [self._post_generate(retry_body)["text"]]
+
+        return self.guard_outputs([response_body["text"]], retry, repetition_penalty, no_repeat_ngram_size)[0]
 
     def batch_predict(
         self,
-        images: List[str] | List[bytes],
+        images: List[str] | List[bytes] | List[ImagePayload],
         prompts: Union[List[str], str] = "",
         temperature: Optional[float] = None,
         top_p: Optional[float] = None,
@@ -171,7 +376,7 @@ class SglangClientPredictor(BasePredictor):
         repetition_penalty: Optional[float] = None,
         presence_penalty: Optional[float] = None,
         no_repeat_ngram_size: Optional[int] = None,
-        max_new_tokens: Optional[int] = None,
+        max_new_tokens: Union[int, List[int], None] = None,
         max_concurrency: int = 100,
     ) -> List[str]:
         try:
@@ -195,11 +400,11 @@ class SglangClientPredictor(BasePredictor):
         if loop is not None:
             return loop.run_until_complete(task)
         else:
-            return asyncio.run(task)
+            return self.run_in_background(task).result()
 
     def stream_predict(
         self,
-        image: str | bytes,
+        image: str | bytes | ImagePayload,
         prompt: str = "",
         temperature: Optional[float] = None,
         top_p: Optional[float] = None,
@@ -227,27 +432,52 @@ class SglangClientPredictor(BasePredictor):
         request_body = self.build_request_body(image, prompt, sampling_params)
         request_body["stream"] = True
 
-        with httpx.stream(
-            "POST",
-            self.server_url,
-            json=request_body,
-            timeout=self.http_timeout,
-        ) as response:
-            pos = 0
-            for chunk in response.iter_lines():
-                if not (chunk or "").startswith("data:"):
+        # 检测到退化时断开连接，服务端随之中止请求
+        guard = self.new_generation_guard()
+        tried = set()
+        while True:
+            endpoint = self.endpoint_pool.acquire(tried)
+            start = time.time()
+            # 已经输出部分内容后失败的请求不再重试，避免重复输出
+            started = False
+            try:
+                with self._client.stream(
+                    "POST",
+                    endpoint.generate_url,
+                    json=request_body,
+                ) as response:
+                    if response.status_code >= 500:
+                        response.read()
+                    self._check_response(response)
+                    pos = 0
+                    for chunk in response.iter_lines():
+                        if not (chunk or "").startswith("data:"):
+                            continue
+                        if chunk == "data: [DONE]":
+                            break
+                        data = json.loads(chunk[5:].strip("\n"))
+                        chunk_text = data["text"][pos:]
+                        # meta_info = data["meta_info"]
+                        pos += len(chunk_text)
+                        started = True
+                        yield chunk_text
+                        if guard is not None and guard.feed(chunk_text):
+                            break
+            except (httpx.TransportError, SglangServerError) as e:
+                if self._handle_request_error(endpoint, e, tried, allow_retry=not started):
                     continue
-                if chunk == "data: [DONE]":
-                    break
-                data = json.loads(chunk[5:].strip("\n"))
-                chunk_text = data["text"][pos:]
-                # meta_info = data["meta_info"]
-                pos += len(chunk_text)
-                yield chunk_text
+                raise
+            except BaseException:
+                self.endpoint_pool.release(endpoint)
+                raise
+            self.endpoint_pool.release(endpoint, time.time() - start)
+            if guard is not None:
+                generation_guard_stats.record(guard.reason)
+            return
 
     async def aio_predict(
         self,
-        image: str | bytes,
+        image: str | bytes | ImagePayload,
         prompt: str = "",
         temperature: Optional[float] = None,
         top_p: Optional[float] = None,
@@ -276,18 +506,19 @@ class SglangClientPredictor(BasePredictor):
         request_body = self.build_request_body(image, prompt, sampling_params)
 
         if async_client is None:
-            async with httpx.AsyncClient(timeout=self.http_timeout) as client:
-                response = await client.post(self.server_url, json=request_body)
-                response_body = response.json()
-        else:
-            response = await async_client.post(self.server_url, json=request_body)
-            response_body = response.json()
+            async_client = self.get_async_client()
+        response_body = await self._aio_post_generate(request_body, async_client)
 
-        return response_body["text"]
+        async def retry(indices, retry_params):
+            retry_body = {**request_body, "sampling_params": build_retry_sampling_params(sampling_params, retry_params)}
+            return [(await self._aio_post_generate(retry_body, async_client))["text"]]
+
+        outputs = await self.aio_guard_outputs([response_body["text"]], retry, repetition_penalty, no_repeat_ngram_size)
+        return outputs[0]
 
     async def aio_batch_predict(
         self,
-        images: List[str] | List[bytes],
+        images: List[str] | List[bytes] | List[ImagePayload],
         prompts: Union[List[str], str] = "",
         temperature: Optional[float] = None,
         top_p: Optional[float] = None,
@@ -295,7 +526,7 @@ class SglangClientPredictor(BasePredictor):
         repetition_penalty: Optional[float] = None,
         presence_penalty: Optional[float] = None,
         no_repeat_ngram_size: Optional[int] = None,
-        max_new_tokens: Optional[int] = None,
+        max_new_tokens: Union[int, List[int], None] = None,
         max_concurrency: int = 100,
     ) -> List[str]:
         if not isinstance(prompts, list):
@@ -303,12 +534,13 @@ class SglangClientPredictor(BasePredictor):
 
         assert len(prompts) == len(images), "Length of prompts and images must match."
 
+        page_max_new_tokens = self.get_page_max_new_tokens(max_new_tokens, len(images))
         semaphore = asyncio.Semaphore(max_concurrency)
         outputs = [""] * len(images)
 
         async def predict_with_semaphore(
             idx: int,
-            image: str | bytes,
+            image: str | bytes | ImagePayload,
             prompt: str,
             async_client: httpx.AsyncClient,
         ):
@@ -322,22 +554,25 @@ class SglangClientPredictor(BasePredictor):
                     repetition_penalty=repetition_penalty,
                     presence_penalty=presence_penalty,
                     no_repeat_ngram_size=no_repeat_ngram_size,
-                    max_new_tokens=max_new_tokens,
+                    max_new_tokens=page_max_new_tokens[idx],
                     async_client=async_client,
                 )
                 outputs[idx] = output
 
-        async with httpx.AsyncClient(timeout=self.http_timeout) as client:
-            tasks = []
-            for idx, (prompt, image) in enumerate(zip(prompts, images)):
-                tasks.append(predict_with_semaphore(idx, image, prompt, client))
-            await asyncio.gather(*tasks)
+        client = self.get_async_client()
+        tasks = []
+        # 按创建顺序获取semaphore，预计输出长的页面先发送
+        for idx in self.schedule_order(page_max_new_tokens):
+            tasks.append(predict_with_semaphore(idx, images[idx], prompts[idx], client))
+        await asyncio.gather(*tasks)
 
+        if len(self.endpoint_pool) > 1:
+            self.log_endpoint_stats()
         return outputs
 
     async def aio_batch_predict_as_iter(
         self,
-        images: List[str] | List[bytes],
+        images: List[str] | List[bytes] | List[ImagePayload],
         prompts: Union[List[str], str] = "",
         temperature: Optional[float] = None,
         top_p: Optional[float] = None,
@@ -345,7 +580,7 @@ class SglangClientPredictor(BasePredictor):
         repetition_penalty: Optional[float] = None,
         presence_penalty: Optional[float] = None,
         no_repeat_ngram_size: Optional[int] = None,
-        max_new_tokens: Optional[int] = None,
+        max_new_tokens: Union[int, List[int], None] = None,
         max_concurrency: int = 100,
     ) -> AsyncIterable[Tuple[int, str]]:
         if not isinstance(prompts, list):
@@ -353,11 +588,12 @@ class SglangClientPredictor(BasePredictor):
 
         assert len(prompts) == len(images), "Length of prompts and images must match."
 
+        page_max_new_tokens = self.get_page_max_new_tokens(max_new_tokens, len(images))
         semaphore = asyncio.Semaphore(max_concurrency)
 
         async def predict_with_semaphore(
             idx: int,
-            image: str | bytes,
+            image: str | bytes | ImagePayload,
             prompt: str,
             async_client: httpx.AsyncClient,
         ):
@@ -371,21 +607,22 @@ class SglangClientPredictor(BasePredictor):
                     repetition_penalty=repetition_penalty,
                     presence_penalty=presence_penalty,
                     no_repeat_ngram_size=no_repeat_ngram_size,
-                    max_new_tokens=max_new_tokens,
+                    max_new_tokens=page_max_new_tokens[idx],
                     async_client=async_client,
                 )
                 return (idx, output)
 
-        async with httpx.AsyncClient(timeout=self.http_timeout) as client:
-            pending: Set[asyncio.Task[Tuple[int, str]]] = set()
+        client = self.get_async_client()
+        pending: Set[asyncio.Task[Tuple[int, str]]] = set()
 
-            for idx, (prompt, image) in enumerate(zip(prompts, images)):
-                pending.add(
-                    asyncio.create_task(
-                        predict_with_semaphore(idx, image, prompt, client),
-                    )
+        for idx in self.schedule_order(page_max_new_tokens):
+            pending.add(
+                asyncio.create_task(
+                    predict_with_semaphore(idx, images[idx], prompts[idx], client),
                 )
+            )
 
+        try:
             while len(pending) > 0:
                 done, pending = await asyncio.wait(
                     pending,
@@ -393,10 +630,14 @@ class SglangClientPredictor(BasePredictor):
                 )
                 for task in done:
                     yield task.result()
+        finally:
+            # 调用方提前结束迭代时取消剩余的请求
+            for task in pending:
+                task.cancel()
 
     async def aio_stream_predict(
         self,
-        image: str | bytes,
+        image: str | bytes | ImagePayload,
         prompt: str = "",
         temperature: Optional[float] = None,
         top_p: Optional[float] = None,
@@ -424,20 +665,45 @@ class SglangClientPredictor(BasePredictor):
         request_body = self.build_request_body(image, prompt, sampling_params)
         request_body["stream"] = True
 
-        async with httpx.AsyncClient(timeout=self.http_timeout) as client:
-            async with client.stream(
-                "POST",
-                self.server_url,
-                json=request_body,
-            ) as response:
-                pos = 0
-                async for chunk in response.aiter_lines():
-                    if not (chunk or "").startswith("data:"):
-                        continue
-                    if chunk == "data: [DONE]":
-                        break
-                    data = json.loads(chunk[5:].strip("\n"))
-                    chunk_text = data["text"][pos:]
-                    # meta_info = data["meta_info"]
-                    pos += len(chunk_text)
-                    yield chunk_text
+        # 检测到退化时断开连接，服务端随之中止请求
+        guard = self.new_generation_guard()
+        tried = set()
+        while True:
+            endpoint = self.endpoint_pool.acquire(tried)
+            start = time.time()
+            # 已经输出部分内容后失败的请求不再重试，避免重复输出
+            started = False
+            try:
+                async with self.get_async_client().stream(
+                    "POST",
+                    endpoint.generate_url,
+                    json=request_body,
+                ) as response:
+                    if response.status_code >= 500:
+                        await response.aread()
+                    self._check_response(response)
+                    pos = 0
+                    async for chunk in response.aiter_lines():
+                        if not (chunk or "").startswith("data:"):
+                            continue
+                        if chunk == "data: [DONE]":
+                            break
+                        data = json.loads(chunk[5:].strip("\n"))
+                        chunk_text = data["text"][pos:]
+                        # meta_info = data["meta_info"]
+                        pos += len(chunk_text)
+                        started = True
+                        yield chunk_text
+                        if guard is not None and guard.feed(chunk_text):
+                            break
+            except (httpx.TransportError, SglangServerError) as e:
+                if self._handle_request_error(endpoint, e, tried, allow_retry=not started):
+                    continue
+                raise
+            except BaseException:
+                self.endpoint_pool.release(endpoint)
+                raise
+            self.endpoint_pool.release(endpoint, time.time() - start)
+            if guard is not None:
+                generation_guard_stats.record(guard.reason)
+            return
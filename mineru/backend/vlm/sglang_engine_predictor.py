@@ -14,6 +14,8 @@ from .base_predictor import (
     DEFAULT_TOP_P,
     BasePredictor,
 )
+from .generation_guard import build_guard_params, build_retry_sampling_params
+from .utils import ImagePayload
 
 
 class SglangEnginePredictor(BasePredictor):
@@ -39,7 +41,9 @@ class SglangEnginePredictor(BasePredictor):
         )
         self.engine = BatchEngine(server_args=server_args)
 
-    def load_image_string(self, image: str | bytes) -> str:
+    def load_image_string(self, image: str | bytes | ImagePayload) -> str:
+        if isinstance(image, ImagePayload):
+            return image.base64
         if not isinstance(image, (str, bytes)):
             raise ValueError("Image must be a string or bytes.")
         if isinstance(image, bytes):
@@ -48,9 +52,53 @@ class SglangEnginePredictor(BasePredictor):
             return image[len("file://") :]
         return image
 
+    def build_sampling_params(
+        self,
+        temperature: Optional[float],
+        top_p: Optional[float],
+        top_k: Optional[int],
+        repetition_penalty: Optional[float],
+        presence_penalty: Optional[float],
+        no_repeat_ngram_size: Optional[int],
+        max_new_tokens: Optional[int],
+    ) -> dict:
+        if temperature is None:
+            temperature = self.temperature
+        if top_p is None:
+            top_p = self.top_p
+        if top_k is None:
+            top_k = self.top_k
+        if repetition_penalty is None:
+            repetition_penalty = self.repetition_penalty
+        if presence_penalty is None:
+            presence_penalty = self.presence_penalty
+        if no_repeat_ngram_size is None:
+            no_repeat_ngram_size = self.no_repeat_ngram_size
+        if max_new_tokens is None:
+            max_new_tokens = self.max_new_tokens
+
+        custom_params = {
+            "no_repeat_ngram_size": no_repeat_ngram_size,
+        }
+        # 由Mineru2LogitProcessor检测退化，提前结束请求
+        if self.guard_config is not None:
+            custom_params["generation_guard"] = build_guard_params(self.guard_config)
+
+        # see SamplingParams for more details
+        return {
+            "temperature": temperature,
+            "top_p": top_p,
+            "top_k": top_k,
+            "repetition_penalty": repetition_penalty,
+            "presence_penalty": presence_penalty,
+            "custom_params": custom_params,
+            "max_new_tokens": max_new_tokens,
+            "skip_special_tokens": False,
+        }
+
     def predict(
         self,
-        image: str | bytes,
+        image: str | bytes | ImagePayload,
         prompt: str = "",
         temperature: Optional[float] = None,
         top_p: Optional[float] = None,
@@ -74,7 +122,7 @@ class SglangEnginePredictor(BasePredictor):
 
     def batch_predict(
         self,
-        images: List[str] | List[bytes],
+        images: List[str] | List[bytes] | List[ImagePayload],
         prompts: Union[List[str], str] = "",
         temperature: Optional[float] = None,
         top_p: Optional[float] = None,
@@ -82,7 +130,7 @@ class SglangEnginePredictor(BasePredictor):
         repetition_penalty: Optional[float] = None,
         presence_penalty: Optional[float] = None,
         no_repeat_ngram_size: Optional[int] = None,
-        max_new_tokens: Optional[int] = None,
+        max_new_tokens: Union[int, List[int], None] = None,
     ) -> List[str]:
 
         if not isinstance(prompts, list):
@@ -91,34 +139,19 @@ class SglangEnginePredictor(BasePredictor):
         assert len(prompts) == len(images), "Length of prompts and images must match."
         prompts = [self.build_prompt(prompt) for prompt in prompts]
 
-        if temperature is None:
-            temperature = self.temperature
-        if top_p is None:
-            top_p = self.top_p
-        if top_k is None:
-            top_k = self.top_k
-        if repetition_penalty is None:
-            repetition_penalty = self.repetition_penalty
-        if presence_penalty is None:
-            presence_penalty = self.presence_penalty
-        if no_repeat_ngram_size is None:
-            no_repeat_ngram_size = self.no_repeat_ngram_size
-        if max_new_tokens is None:
-            max_new_tokens = self.max_new_tokens
-
-        # see SamplingParams for more details
-        sampling_params = {
-            "temperature": temperature,
-            "top_p": top_p,
-            "top_k": top_k,
-            "repetition_penalty": repetition_penalty,
-            "presence_penalty": presence_penalty,
-            "custom_params": {
-                "no_repeat_ngram_size": no_repeat_ngram_size,
-            },
-            "max_new_tokens": max_new_tokens,
-            "skip_special_tokens": False,
-        }
+        # 每页一个sampling_params，max_new_tokens可以按页设置
+        sampling_params = [
+            self.build_sampling_params(
+                temperature=temperature,
+                top_p=top_p,
+                top_k=top_k,
+                repetition_penalty=repetition_penalty,
+                presence_penalty=presence_penalty,
+                no_repeat_ngram_size=no_repeat_ngram_size,
+                max_new_tokens=page_max_new_tokens,
+            )
+            for page_max_new_tokens in self.get_page_max_new_tokens(max_new_tokens, len(images))
+        ]
 
         image_strings = [self.load_image_string(img) for img in images]
 
@@ -127,11 +160,21 @@ class SglangEnginePredictor(BasePredictor):
             image_data=image_strings,
             sampling_params=sampling_params,
         )
-        return [item["text"] for item in output]
+
+        def retry(indices, retry_params):
+            retry_output = self.engine.generate(
+                prompt=[prompts[i] for i in indices],
+                image_data=[image_strings[i] for i in indices],
+                sampling_params=[build_retry_sampling_params(sampling_params[i], retry_params) for i in indices],
+            )
+            return [item["text"] for item in retry_output]
+
+        outputs = [item["text"] for item in output]
+        return self.guard_outputs(outputs, retry, repetition_penalty, no_repeat_ngram_size)
 
     def stream_predict(
         self,
-        image: str | bytes,
+        image: str | bytes | ImagePayload,
         prompt: str = "",
         temperature: Optional[float] = None,
         top_p: Optional[float] = None,
@@ -145,7 +188,7 @@ class SglangEnginePredictor(BasePredictor):
 
     async def aio_predict(
         self,
-        image: str | bytes,
+        image: str | bytes | ImagePayload,
         prompt: str = "",
         temperature: Optional[float] = None,
         top_p: Optional[float] = None,
@@ -170,7 +213,7 @@ class SglangEnginePredictor(BasePredictor):
 
     async def aio_batch_predict(
         self,
-        images: List[str] | List[bytes],
+        images: List[str] | List[bytes] | List[ImagePayload],
         prompts: Union[List[str], str] = "",
         temperature: Optional[float] = None,
         top_p: Optional[float] = None,
@@ -178,7 +221,7 @@ class SglangEnginePredictor(BasePredictor):
         repetition_penalty: Optional[float] = None,
         presence_penalty: Optional[float] = None,
         no_repeat_ngram_size: Optional[int] = None,
-        max_new_tokens: Optional[int] = None,
+        max_new_tokens: Union[int, List[int], None] = None,
     ) -> List[str]:
 
         if not isinstance(prompts, list):
@@ -187,34 +230,19 @@ class SglangEnginePredictor(BasePredictor):
         assert len(prompts) == len(images), "Length of prompts and images must match."
         prompts = [self.build_prompt(prompt) for prompt in prompts]
 
-        if temperature is None:
-            temperature = self.temperature
-        if top_p is None:
-            top_p = self.top_p
-        if top_k is None:
-            top_k = self.top_k
-        if repetition_penalty is None:
-            repetition_penalty = self.repetition_penalty
-        if presence_penalty is None:
-            presence_penalty = self.presence_penalty
-        if no_repeat_ngram_size is None:
-            no_repeat_ngram_size = self.no_repeat_ngram_size
-        if max_new_tokens is None:
-            max_new_tokens = self.max_new_tokens
-
-        # see SamplingParams for more details
-        sampling_params = {
-            "temperature": temperature,
-            "top_p": top_p,
-            "top_k": top_k,
-            "repetition_penalty": repetition_penalty,
-            "presence_penalty": presence_penalty,
-            "custom_params": {
-                "no_repeat_ngram_size": no_repeat_ngram_size,
-            },
-            "max_new_tokens": max_new_tokens,
-            "skip_special_tokens": False,
-        }
+        # 每页一个sampling_params，max_new_tokens可以按页设置
+        sampling_params = [
+            self.build_sampling_params(
+                temperature=temperature,
+                top_p=top_p,
+                top_k=top_k,
+                repetition_penalty=repetition_penalty,
+                presence_penalty=presence_penalty,
+                no_repeat_ngram_size=no_repeat_ngram_size,
+                max_new_tokens=page_max_new_tokens,
+            )
+            for page_max_new_tokens in self.get_page_max_new_tokens(max_new_tokens, len(images))
+        ]
 
         image_strings = [self.load_image_string(img) for img in images]
 
@@ -226,11 +254,20 @@ class SglangEnginePredictor(BasePredictor):
         ret = []
         for item in output:  # type: ignore
             ret.append(item["text"])
-        return ret
+
+        async def retry(indices, retry_params):
+            retry_output = await self.engine.async_generate(
+                prompt=[prompts[i] for i in indices],
+                image_data=[image_strings[i] for i in indices],
+                sampling_params=[build_retry_sampling_params(sampling_params[i], retry_params) for i in indices],
+            )
+            return [item["text"] for item in retry_output]  # type: ignore
+
+        return await self.aio_guard_outputs(ret, retry, repetition_penalty, no_repeat_ngram_size)
 
     async def aio_stream_predict(
         self,
-        image: str | bytes,
+        image: str | bytes | ImagePayload,
         prompt: str = "",
         temperature: Optional[float] = None,
         top_p: Optional[float] = None,
@@ -2,13 +2,13 @@ import re
 
 from mineru.utils.cut_image import cut_image_and_table
 from mineru.utils.enum_class import BlockType, ContentType
-from mineru.utils.hash_utils import str_md5
+from mineru.utils.pdf_reader import pdfium_lock
 from mineru.backend.vlm.vlm_magic_model import MagicModel
 from mineru.version import __version__
 
 
-def token_to_page_info(token, image_dict, page, image_writer, page_index) -> dict:
-    """将token转换为页面信息"""
+def token_to_page_info(token, image_dict, page_size, image_writer, page_index) -> dict:
+    """将token转换为页面信息，page_size为pdf页面的(width, height)，由调用方在持有pdfium_lock时读取"""
     # 解析token，提取坐标和类型
     # 假设token格式为：<|box_start|>x0 y0 x1 y1<|box_end|><|ref_start|>type<|ref_end|><|md_start|>content<|md_end|>
     # 这里需要根据实际的token格式进行解析
@@ -16,8 +16,8 @@ def token_to_page_info(token, image_dict, page, image_writer, page_index) -> dic
 
     scale = image_dict["scale"]
     page_pil_img = image_dict["img_pil"]
-    page_img_md5 = str_md5(image_dict["img_base64"])
-    width, height = map(int, page.get_size())
+    page_img_md5 = image_dict["img_md5"]
+    width, height = map(int, page_size)
 
     magic_model = MagicModel(token, width, height)
     image_blocks = magic_model.get_image_blocks()
@@ -41,16 +41,29 @@ def token_to_page_info(token, image_dict, page, image_writer, page_index) -> dic
     return page_info
 
 
+def page_infos_to_middle_json(page_infos: list) -> dict:
+    """按页码顺序排列的page_info组装成middle_json"""
+    return {"pdf_info": page_infos, "_backend":"vlm", "_version_name": __version__}
+
+
+def get_page_sizes(pdf_doc, page_num) -> list:
+    """读取前page_num页的(width, height)"""
+    with pdfium_lock:
+        return [pdf_doc[index].get_size() for index in range(page_num)]
+
+
 def result_to_middle_json(token_list, images_list, pdf_doc, image_writer):
-    middle_json = {"pdf_info": [], "_backend":"vlm", "_version_name": __version__}
+    # 只在读取页面尺寸和关闭文档时访问pdfium，裁剪图片不需要持有锁
+    page_sizes = get_page_sizes(pdf_doc, len(token_list))
+    page_infos = []
     for index, token in enumerate(token_list):
-        page = pdf_doc[index]
         image_dict = images_list[index]
-        page_info = token_to_page_info(token, image_dict, page, image_writer, index)
-        middle_json["pdf_info"].append(page_info)
+        page_info = token_to_page_info(token, image_dict, page_sizes[index], image_writer, index)
+        page_infos.append(page_info)
     # 关闭pdf文档
-    pdf_doc.close()
-    return middle_json
+    with pdfium_lock:
+        pdf_doc.close()
+    return page_infos_to_middle_json(page_infos)
 
 
 if __name__ == "__main__":
@@ -1,8 +1,10 @@
 import os
 import re
-from base64 import b64decode
+from base64 import b64decode, b64encode
+from io import BytesIO
 
 import httpx
+from PIL import Image
 
 _timeout = int(os.getenv("REQUEST_TIMEOUT", "3"))
 _file_exts = (".png", ".jpg", ".jpeg", ".webp", ".gif", ".pdf")
@@ -38,3 +40,73 @@ async def aio_load_resource(uri: str) -> bytes:
     if re.match(_data_uri_regex, uri):
         return b64decode(uri.split(",")[1])
     return b64decode(uri)
+
+
+# 与模型配置中的image_grid_pinpoints="(1x1),...,(4x4)"和384的crop_size保持一致
+_anyres_patch_size = 384
+_anyres_resolutions = [
+    (w * _anyres_patch_size, h * _anyres_patch_size) for w in range(1, 5) for h in range(1, 5)
+]
+# 各编码的保存参数：png使用PIL的默认压缩级别，webp为最快档的无损编码，jpeg为高质量有损编码
+_codec_save_params = {
+    "png": ("PNG", {}),
+    "webp": ("WEBP", {"lossless": True, "quality": 0, "method": 0}),
+    "jpeg": ("JPEG", {"quality": 95}),
+}
+
+
+def select_anyres_resolution(image_size: tuple) -> tuple:
+    """与image_processing_mineru2.select_best_resolution相同的选择逻辑，客户端不需要依赖torch/transformers"""
+    original_width, original_height = image_size
+    best_fit = (0, 0)
+    max_effective_resolution = 0
+    min_wasted_resolution = float("inf")
+    for width, height in _anyres_resolutions:
+        scale = min(width / original_width, height / original_height)
+        downscaled_width, downscaled_height = int(original_width * scale), int(original_height * scale)
+        effective_resolution = min(downscaled_width * downscaled_height, original_width * original_height)
+        wasted_resolution = (width * height) - effective_resolution
+        if effective_resolution > max_effective_resolution or (
+            effective_resolution == max_effective_resolution and wasted_resolution < min_wasted_resolution
+        ):
+            max_effective_resolution = effective_resolution
+            min_wasted_resolution = wasted_resolution
+            best_fit = (width, height)
+    return best_fit
+
+
+class ImagePayload:
+    """已编码的页面图像，编码后的bytes只生成一次，base64文本在第一次访问时计算并缓存。
+
+    predictor收到ImagePayload时直接使用其中的数据，不再经过base64解码再编码的转换。
+    """
+
+    def __init__(self, data: bytes, image_format: str = "png"):
+        self.data = data
+        self.image_format = image_format
+        self._base64 = None
+
+    @property
+    def base64(self) -> str:
+        if self._base64 is None:
+            self._base64 = b64encode(self.data).decode("utf-8")
+        return self._base64
+
+    @classmethod
+    def from_pil(cls, pil_img: Image.Image, codec: str = "png", prescale: bool = False) -> "ImagePayload":
+        """prescale为True时，如果模型anyres处理会把图像缩小，就在编码前先缩小到相同的分辨率，减少传输的数据量"""
+        if codec not in _codec_save_params:
+            raise ValueError(f"Unsupported image codec: {codec}. Supports: {', '.join(_codec_save_params)}.")
+        if pil_img.mode != "RGB":
+            pil_img = pil_img.convert("RGB")
+        if prescale:
+            target_size = select_anyres_resolution(pil_img.size)
+            if target_size[0] * target_size[1] < pil_img.width * pil_img.height:
+                pil_img = pil_img.resize(target_size)
+        image_format, save_params = _codec_save_params[codec]
+        buffered = BytesIO()
+        pil_img.save(buffered, format=image_format, **save_params)
+        return cls(buffered.getvalue(), codec)
+
+    def __len__(self):
+        return len(self.data)
@@ -1,13 +1,24 @@
 # Copyright (c) Opendatalab. All rights reserved.
+import asyncio
+import queue
+import threading
 import time
 
+import pypdfium2 as pdfium
 from loguru import logger
 
 from ...data.data_reader_writer import DataWriter
-from mineru.utils.pdf_image_tools import load_images_from_pdf
+from mineru.utils.config_reader import get_vlm_image_codec, get_vlm_image_prescale_enable, get_vlm_page_budget_enable
+from mineru.utils.pdf_image_tools import load_images_from_pdf, load_page_images
+from mineru.utils.pdf_reader import pdfium_lock
+from mineru.utils.stage_queue import StageQueue
 from .base_predictor import BasePredictor
+from .generation_guard import generation_guard_stats
+from .page_complexity import check_budget_hit, estimate_page_budgets
 from .predictor import get_predictor
-from .token_to_middle_json import result_to_middle_json
+from .sglang_client_predictor import SglangClientPredictor
+from .token_to_middle_json import get_page_sizes, page_infos_to_middle_json, result_to_middle_json, token_to_page_info
+from .utils import ImagePayload
 from ...utils.models_download_utils import auto_download_and_get_model_root_path
 
 
@@ -24,9 +35,9 @@ class ModelSingleton:
         self,
         backend: str,
         model_path: str | None,
-        server_url: str | None,
+        server_url: str | list[str] | None,
     ) -> BasePredictor:
-        key = (backend, model_path, server_url)
+        key = (backend, model_path, tuple(server_url) if isinstance(server_url, list) else server_url)
         if key not in self._models:
             if backend in ['transformers', 'sglang-engine'] and not model_path:
                 model_path = auto_download_and_get_model_root_path("/","vlm")
@@ -38,52 +49,368 @@ class ModelSingleton:
         return self._models[key]
 
 
+def build_image_payloads(images_list) -> list[ImagePayload]:
+    """直接从页面位图编码出predictor使用的ImagePayload，每页只编码一次"""
+    codec = get_vlm_image_codec()
+    prescale = get_vlm_image_prescale_enable()
+    return [ImagePayload.from_pil(image_dict["img_pil"], codec, prescale) for image_dict in images_list]
+
+
+def build_page_requests(images_list, pdf_doc, predictor: BasePredictor) -> list[tuple[int, ImagePayload, int]]:
+    """
+    估计每页的max_new_tokens，返回需要推理的页面(page_idx, image_payload, max_new_tokens)。
+    空白页不需要推理，结果为空字符串。
+    """
+    if get_vlm_page_budget_enable():
+        page_budgets = estimate_page_budgets(pdf_doc, images_list, predictor.max_new_tokens)
+    else:
+        page_budgets = [predictor.max_new_tokens] * len(images_list)
+    page_indices = [page_idx for page_idx, budget in enumerate(page_budgets) if budget > 0]
+    image_payloads = build_image_payloads([images_list[page_idx] for page_idx in page_indices])
+    return [(page_idx, image_payload, page_budgets[page_idx]) for page_idx, image_payload in zip(page_indices, image_payloads)]
+
+
 def doc_analyze(
     pdf_bytes,
     image_writer: DataWriter | None,
     predictor: BasePredictor | None = None,
     backend="transformers",
     model_path: str | None = None,
-    server_url: str | None = None,
+    server_url: str | list[str] | None = None,
 ):
     if predictor is None:
         predictor = ModelSingleton().get_model(backend, model_path, server_url)
+    # generation_guard_stats是进程内累计的，日志只输出这次调用的部分
+    guard_stats_start = generation_guard_stats.stats()
 
     # load_images_start = time.time()
     images_list, pdf_doc = load_images_from_pdf(pdf_bytes)
-    images_base64_list = [image_dict["img_base64"] for image_dict in images_list]
+    page_requests = build_page_requests(images_list, pdf_doc, predictor)
     # load_images_time = round(time.time() - load_images_start, 2)
-    # logger.info(f"load images cost: {load_images_time}, speed: {round(len(images_base64_list)/load_images_time, 3)} images/s")
+    # logger.info(f"load images cost: {load_images_time}, speed: {round(len(images_list)/load_images_time, 3)} images/s")
 
     # infer_start = time.time()
-    results = predictor.batch_predict(images=images_base64_list)
+    results = [""] * len(images_list)
+    if page_requests:
+        outputs = predictor.batch_predict(
+            images=[image_payload for _, image_payload, _ in page_requests],
+            max_new_tokens=[budget for _, _, budget in page_requests],
+        )
+        for (page_idx, _, budget), output in zip(page_requests, outputs):
+            check_budget_hit(page_idx, output, budget, predictor.max_new_tokens)
+            results[page_idx] = output
     # infer_time = round(time.time() - infer_start, 2)
     # logger.info(f"infer finished, cost: {infer_time}, speed: {round(len(results)/infer_time, 3)} page/s")
 
+    generation_guard_stats.log_stats(since=guard_stats_start)
+
     middle_json = result_to_middle_json(results, images_list, pdf_doc, image_writer)
     return middle_json, results
 
 
-async def aio_doc_analyze(
+async def aio_doc_analyze_as_iter(
     pdf_bytes,
     image_writer: DataWriter | None,
     predictor: BasePredictor | None = None,
     backend="transformers",
     model_path: str | None = None,
-    server_url: str | None = None,
+    server_url: str | list[str] | None = None,
 ):
+    """
+    逐页输出的aio_doc_analyze：每个页面推理完成后立即用token_to_page_info转换并裁剪图片，
+    按完成顺序yield (page_idx, page_info, output)。
+    服务端可以用vlm_union_make([page_info], ...)把单页结果转换为Markdown/content_list，在整篇文档完成前推送给客户端。
+    """
     if predictor is None:
         predictor = ModelSingleton().get_model(backend, model_path, server_url)
+    guard_stats_start = generation_guard_stats.stats()
+
+    def load_doc():
+        # 页面尺寸在这里一并读出，之后转换page_info时不再访问pdfium，文档可以立即关闭
+        images_list, pdf_doc = load_images_from_pdf(pdf_bytes)
+        try:
+            page_requests = build_page_requests(images_list, pdf_doc, predictor)
+            page_sizes = get_page_sizes(pdf_doc, len(images_list))
+        finally:
+            with pdfium_lock:
+                pdf_doc.close()
+        return images_list, page_requests, page_sizes
 
     load_images_start = time.time()
-    images_list, pdf_doc = load_images_from_pdf(pdf_bytes)
-    images_base64_list = [image_dict["img_base64"] for image_dict in images_list]
+    images_list, page_requests, page_sizes = await asyncio.to_thread(load_doc)
     load_images_time = round(time.time() - load_images_start, 2)
-    logger.info(f"load images cost: {load_images_time}, speed: {round(len(images_base64_list)/load_images_time, 3)} images/s")
+    load_images_speed = round(len(images_list) / load_images_time, 3) if load_images_time > 0 else 0
+    logger.info(f"load images cost: {load_images_time}, speed: {load_images_speed} images/s")
+
+    async def to_page_info(page_idx, output):
+        # 裁剪图片会占用CPU，放到线程中执行，避免阻塞事件循环上的其他请求
+        return await asyncio.to_thread(
+            token_to_page_info, output, images_list[page_idx], page_sizes[page_idx], image_writer, page_idx
+        )
 
     infer_start = time.time()
-    results = await predictor.aio_batch_predict(images=images_base64_list)
+    # 空白页不需要推理，直接输出
+    inferred_pages = {page_idx for page_idx, _, _ in page_requests}
+    for page_idx in range(len(images_list)):
+        if page_idx not in inferred_pages:
+            yield page_idx, await to_page_info(page_idx, ""), ""
+    if page_requests:
+        async for request_idx, output in predictor.aio_batch_predict_as_iter(
+            images=[image_payload for _, image_payload, _ in page_requests],
+            max_new_tokens=[budget for _, _, budget in page_requests],
+        ):
+            page_idx, _, budget = page_requests[request_idx]
+            check_budget_hit(page_idx, output, budget, predictor.max_new_tokens)
+            yield page_idx, await to_page_info(page_idx, output), output
     infer_time = round(time.time() - infer_start, 2)
-    logger.info(f"infer finished, cost: {infer_time}, speed: {round(len(results)/infer_time, 3)} page/s")
-    middle_json = result_to_middle_json(results, images_list, pdf_doc, image_writer)
+    infer_speed = round(len(images_list) / infer_time, 3) if infer_time > 0 else 0
+    logger.info(f"infer finished, cost: {infer_time}, speed: {infer_speed} page/s")
+    generation_guard_stats.log_stats(since=guard_stats_start)
+
+
+async def aio_doc_analyze(
+    pdf_bytes,
+    image_writer: DataWriter | None,
+    predictor: BasePredictor | None = None,
+    backend="transformers",
+    model_path: str | None = None,
+    server_url: str | list[str] | None = None,
+):
+    page_infos = {}
+    async for page_idx, page_info, _ in aio_doc_analyze_as_iter(
+        pdf_bytes, image_writer, predictor, backend, model_path, server_url
+    ):
+        page_infos[page_idx] = page_info
+    middle_json = page_infos_to_middle_json([page_infos[page_idx] for page_idx in sorted(page_infos)])
     return middle_json
+
+
+class PageBudget:
+    """限制已渲染、但所在文档还没有全部完成的页面数，文档完成后归还"""
+
+    def __init__(self, max_pages: int):
+        self._max_pages = max_pages
+        self._pending = 0
+        self._closed = False
+        self._condition = threading.Condition()
+
+    def _available(self, num_pages: int) -> bool:
+        # 没有未完成的页面时总是允许，超过上限的大文档也能处理
+        return self._pending == 0 or self._pending + num_pages <= self._max_pages
+
+    def try_acquire(self, num_pages: int) -> bool:
+        with self._condition:
+            if self._closed or not self._available(num_pages):
+                return False
+            self._pending += num_pages
+            return True
+
+    def acquire(self, num_pages: int) -> bool:
+        """阻塞直到有足够的额度，close之后返回False"""
+        with self._condition:
+            self._condition.wait_for(lambda: self._closed or self._available(num_pages))
+            if self._closed:
+                return False
+            self._pending += num_pages
+            return True
+
+    def release(self, num_pages: int):
+        with self._condition:
+            self._pending -= num_pages
+            self._condition.notify_all()
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+
+def batch_doc_analyze(
+    pdf_bytes_list,
+    image_writer_list,
+    predictor: BasePredictor | None = None,
+    backend="transformers",
+    model_path: str | None = None,
+    server_url: str | list[str] | None = None,
+    max_concurrency: int = 100,
+    max_pending_pages: int | None = None,
+):
+    """
+    跨文档的页面批处理：所有文档的页面汇成一个请求流交给predictor。
+    sglang-client后端同时最多有max_concurrency个页面请求，其他后端每max_concurrency页调用一次batch_predict。
+    一篇文档的所有页面完成后立即转换middle_json并yield (pdf_idx, middle_json, results)，
+    调用方写出已完成文档的结果时，其余文档的渲染和推理在后台继续。
+    已渲染但所在文档尚未完成的页面不超过max_pending_pages页（默认为2*max_concurrency），用于限制峰值内存。
+    """
+    if predictor is None:
+        predictor = ModelSingleton().get_model(backend, model_path, server_url)
+    if max_pending_pages is None:
+        max_pending_pages = 2 * max_concurrency
+    guard_stats_start = generation_guard_stats.stats()
+
+    stop_event = threading.Event()
+    # 保证调用方结束后不会再有文档放入event_queue，否则其中的pdf_doc无人关闭
+    publish_lock = threading.Lock()
+    page_budget = PageBudget(max_pending_pages)
+    # 生产者可能是事件循环，不能阻塞在put上，页面数已由page_budget限制
+    event_queue = StageQueue('vlm infer->middle_json', maxsize=0)
+
+    def open_doc(pdf_idx):
+        with pdfium_lock:
+            pdf_doc = pdfium.PdfDocument(pdf_bytes_list[pdf_idx])
+            return pdf_doc, len(pdf_doc)
+
+    def close_doc(pdf_doc):
+        with pdfium_lock:
+            pdf_doc.close()
+
+    def load_doc(pdf_idx, pdf_doc, page_num):
+        # 渲染和估计输出量时各自持有pdfium_lock，调用方线程可以在其间转换已完成文档的middle_json
+        images_list = load_page_images(pdf_bytes_list[pdf_idx], pdf_doc, list(range(page_num)))
+        page_requests = build_page_requests(images_list, pdf_doc, predictor)
+        with publish_lock:
+            published = not stop_event.is_set()
+            if published:
+                event_queue.put(('doc', pdf_idx, images_list, pdf_doc))
+        if not published:
+            close_doc(pdf_doc)
+            return []
+        # 空白页不需要推理
+        inferred_pages = {page_idx for page_idx, _, _ in page_requests}
+        for page_idx in range(page_num):
+            if page_idx not in inferred_pages:
+                event_queue.put(('page', pdf_idx, page_idx, ''))
+        return page_requests
+
+    async def aio_produce():
+        semaphore = asyncio.Semaphore(max_concurrency)
+        tasks = []
+
+        async def predict_page(pdf_idx, page_idx, image_payload, max_new_tokens):
+            async with semaphore:
+                output = await predictor.aio_predict(image=image_payload, max_new_tokens=max_new_tokens)
+            check_budget_hit(page_idx, output, max_new_tokens, predictor.max_new_tokens)
+            event_queue.put(('page', pdf_idx, page_idx, output))
+
+        try:
+            for pdf_idx in range(len(pdf_bytes_list)):
+                pdf_doc, page_num = await asyncio.to_thread(open_doc, pdf_idx)
+                if stop_event.is_set() or not await asyncio.to_thread(page_budget.acquire, page_num):
+                    await asyncio.to_thread(close_doc, pdf_doc)
+                    return
+                page_requests = await asyncio.to_thread(load_doc, pdf_idx, pdf_doc, page_num)
+                # 同一文档内预计输出长的页面先发送
+                for request_idx in predictor.schedule_order([budget for _, _, budget in page_requests]):
+                    tasks.append(asyncio.create_task(predict_page(pdf_idx, *page_requests[request_idx])))
+            await asyncio.gather(*tasks)
+            event_queue.put(None)
+        except BaseException as e:
+            for task in tasks:
+                task.cancel()
+            event_queue.put(e if isinstance(e, Exception) else RuntimeError('vlm batch inference is cancelled'))
+            raise
+
+    def produce():
+        window = []
+
+        def run_window(window_pages):
+            outputs = predictor.batch_predict(
+                images=[image_payload for _, _, image_payload, _ in window_pages],
+                max_new_tokens=[budget for _, _, _, budget in window_pages],
+            )
+            for (pdf_idx, page_idx, _, budget), output in zip(window_pages, outputs):
+                check_budget_hit(page_idx, output, budget, predictor.max_new_tokens)
+                event_queue.put(('page', pdf_idx, page_idx, output))
+
+        try:
+            for pdf_idx in range(len(pdf_bytes_list)):
+                pdf_doc, page_num = open_doc(pdf_idx)
+                if not page_budget.try_acquire(page_num):
+                    # 额度不足时先推理已渲染的页面，让未完成的文档能够完成并归还额度
+                    if window:
+                        run_window(window)
+                        window = []
+                    if not page_budget.acquire(page_num):
+                        close_doc(pdf_doc)
+                        return
+                if stop_event.is_set():
+                    close_doc(pdf_doc)
+                    return
+                page_requests = load_doc(pdf_idx, pdf_doc, page_num)
+                window.extend((pdf_idx, *page_request) for page_request in page_requests)
+                while len(window) >= max_concurrency:
+                    run_window(window[:max_concurrency])
+                    window = window[max_concurrency:]
+            if window:
+                run_window(window)
+            event_queue.put(None)
+        except Exception as e:
+            event_queue.put(e)
+
+    infer_start = time.time()
+    if isinstance(predictor, SglangClientPredictor):
+        producer_future = predictor.run_in_background(aio_produce())
+        producer_thread = None
+    else:
+        producer_future = None
+        producer_thread = threading.Thread(target=produce, daemon=True)
+        producer_thread.start()
+
+    pending_docs = {}
+    finished_page_count = 0
+    try:
+        while True:
+            item = event_queue.get()
+            if item is None:
+                break
+            if isinstance(item, Exception):
+                raise item
+            if item[0] == 'doc':
+                _, pdf_idx, images_list, pdf_doc = item
+                pending_docs[pdf_idx] = {
+                    'images_list': images_list,
+                    'pdf_doc': pdf_doc,
+                    'results': [None] * len(images_list),
+                    'remaining': len(images_list),
+                }
+            else:
+                _, pdf_idx, page_idx, output = item
+                pending_docs[pdf_idx]['results'][page_idx] = output
+                pending_docs[pdf_idx]['remaining'] -= 1
+            if pending_docs[pdf_idx]['remaining'] > 0:
+                continue
+            doc = pending_docs.pop(pdf_idx)
+            results = doc['results']
+            middle_json = result_to_middle_json(results, doc['images_list'], doc['pdf_doc'], image_writer_list[pdf_idx])
+            page_num = len(doc['images_list'])
+            finished_page_count += page_num
+            page_budget.release(page_num)
+            # 页面图像不再需要，尽早释放
+            del doc
+            yield pdf_idx, middle_json, results
+        infer_time = round(time.time() - infer_start, 2)
+        logger.info(
+            f"vlm batch infer finished: {len(pdf_bytes_list)} docs, {finished_page_count} pages, cost: {infer_time}, "
+            f"speed: {round(finished_page_count / infer_time, 3) if infer_time > 0 else 0} page/s"
+        )
+        generation_guard_stats.log_stats(since=guard_stats_start)
+    finally:
+        # 提前结束或出错时让生产者尽快退出
+        with publish_lock:
+            stop_event.set()
+        page_budget.close()
+        if producer_future is not None:
+            producer_future.cancel()
+        # 已经放入队列但还没有取出的文档也需要关闭
+        pdf_docs = [doc['pdf_doc'] for doc in pending_docs.values()]
+        try:
+            while True:
+                item = event_queue.get_nowait()
+                if isinstance(item, tuple) and item[0] == 'doc':
+                    pdf_docs.append(item[3])
+        except queue.Empty:
+            pass
+        with pdfium_lock:
+            for pdf_doc in pdf_docs:
+                pdf_doc.close()
+        event_queue.log_stats()
@@ -8,16 +8,69 @@ from mineru.utils.enum_class import ContentType, BlockType, SplitFlag
 from mineru.backend.vlm.vlm_middle_json_mkcontent import merge_para_with_text
 from mineru.utils.format_utils import convert_otsl_to_html
 
+# 每个块从<|box_start|>开始到<|md_end|>或<|im_end|>结束
+BLOCK_PATTERN = re.compile(
+    r"<\|box_start\|>(.*?)<\|box_end\|><\|ref_start\|>(.*?)<\|ref_end\|><\|md_start\|>(.*?)(?:<\|md_end\|>|<\|im_end\|>)",
+    re.DOTALL,
+)
+BOX_START = "<|box_start|>"
+REF_START = "<|ref_start|>"
+REF_END = "<|ref_end|>"
+MD_END = "<|md_end|>"
+
+
+class StreamingBlockParser:
+    """增量解析stream_predict输出的文本流，每收到一个以<|md_end|>结尾的完整块就立即返回该块的文本。
+
+    只有从第一个尚未消费的<|box_start|>开始匹配到的块才会返回，
+    格式正常的输出中，返回的所有块拼接后交给MagicModel得到的结果与整页输出完全一致。
+    目前是供调用方自行消费stream_predict输出的工具类，后端的解析流程仍使用整页输出。
+    """
+
+    def __init__(self):
+        self._buffer = ""
+        # 从这个位置开始查找新的<|md_end|>，之前的文本已经查找过
+        self._scan_pos = 0
+
+    def feed(self, chunk: str) -> list[str]:
+        self._buffer += chunk
+        blocks = []
+        while True:
+            start = self._buffer.find(BOX_START)
+            if start < 0:
+                # 保留可能是半个<|box_start|>的结尾部分
+                self._buffer = self._buffer[-(len(BOX_START) - 1):]
+                self._scan_pos = 0
+                break
+            self._buffer = self._buffer[start:]
+            # 块只能在<|md_end|>处结束，收到新的<|md_end|>之前不需要重新匹配整个块
+            end = self._buffer.find(MD_END, self._scan_pos)
+            if end < 0:
+                self._scan_pos = max(len(self._buffer) - len(MD_END) + 1, 0)
+                break
+            match = BLOCK_PATTERN.match(self._buffer)
+            if match is None or not match.group(0).endswith(MD_END):
+                self._scan_pos = end + len(MD_END)
+                break
+            blocks.append(match.group(0))
+            self._buffer = self._buffer[match.end():]
+            self._scan_pos = 0
+        return blocks
+
+    def flush(self) -> list[str]:
+        """输出结束后调用，返回剩余的块（例如以<|im_end|>结束的最后一块）"""
+        blocks = [match.group(0) for match in BLOCK_PATTERN.finditer(self._buffer)]
+        self._buffer = ""
+        self._scan_pos = 0
+        return blocks
+
 
 class MagicModel:
     def __init__(self, token: str, width, height):
         self.token = token
 
         # 使用正则表达式查找所有块
-        pattern = (
-            r"<\|box_start\|>(.*?)<\|box_end\|><\|ref_start\|>(.*?)<\|ref_end\|><\|md_start\|>(.*?)(?:<\|md_end\|>|<\|im_end\|>)"
-        )
-        block_infos = re.findall(pattern, token, re.DOTALL)
+        block_infos = BLOCK_PATTERN.findall(token)
 
         blocks = []
         self.all_spans = []
@@ -74,7 +74,8 @@ from .common import do_parse, read_fn, pdf_suffixes, image_suffixes
     'server_url',
     type=str,
     help="""
-    When the backend is `sglang-client`, you need to specify the server_url, for example:`http://127.0.0.1:30000`
+    When the backend is `sglang-client`, you need to specify the server_url, for example:`http://127.0.0.1:30000`.
+    Multiple servers can be separated by commas, for example:`http://127.0.0.1:30000,http://127.0.0.1:30001`
     """,
     default=None,
 )
@@ -9,11 +9,13 @@ import pypdfium2 as pdfium
 from loguru import logger
 
 from mineru.data.data_reader_writer import FileBasedDataWriter
+from mineru.utils.config_reader import get_formula_enable, get_pipeline_streaming_enable, get_table_enable
 from mineru.utils.draw_bbox import draw_layout_bbox, draw_span_bbox
 from mineru.utils.enum_class import MakeMode
 from mineru.utils.pdf_image_tools import images_bytes_to_pdf_bytes
+from mineru.utils.result_cache import RecordingDataWriter, get_result_cache
 from mineru.backend.vlm.vlm_middle_json_mkcontent import union_make as vlm_union_make
-from mineru.backend.vlm.vlm_analyze import doc_analyze as vlm_doc_analyze
+from mineru.backend.vlm.vlm_analyze import batch_doc_analyze as vlm_batch_doc_analyze
 
 pdf_suffixes = [".pdf"]
 image_suffixes = [".png", ".jpeg", ".jpg"]
@@ -73,6 +75,139 @@ def convert_pdf_bytes_to_bytes_by_pypdfium2(pdf_bytes, start_page_id=0, end_page
     return output_bytes
 
 
+def _process_pipeline_output(
+    output_dir,
+    pdf_file_name,
+    pdf_bytes,
+    parse_method,
+    middle_json,
+    model_json,
+    f_draw_layout_bbox,
+    f_draw_span_bbox,
+    f_dump_md,
+    f_dump_middle_json,
+    f_dump_model_output,
+    f_dump_orig_pdf,
+    f_dump_content_list,
+    f_make_md_mode,
+):
+    from mineru.backend.pipeline.pipeline_middle_json_mkcontent import union_make as pipeline_union_make
+
+    local_image_dir, local_md_dir = prepare_env(output_dir, pdf_file_name, parse_method)
+    md_writer = FileBasedDataWriter(local_md_dir)
+
+    pdf_info = middle_json["pdf_info"]
+
+    if f_draw_layout_bbox:
+        draw_layout_bbox(pdf_info, pdf_bytes, local_md_dir, f"{pdf_file_name}_layout.pdf")
+
+    if f_draw_span_bbox:
+        draw_span_bbox(pdf_info, pdf_bytes, local_md_dir, f"{pdf_file_name}_span.pdf")
+
+    if f_dump_orig_pdf:
+        md_writer.write(
+            f"{pdf_file_name}_origin.pdf",
+            pdf_bytes,
+        )
+
+    if f_dump_md:
+        image_dir = str(os.path.basename(local_image_dir))
+        md_content_str = pipeline_union_make(pdf_info, f_make_md_mode, image_dir)
+        md_writer.write_string(
+            f"{pdf_file_name}.md",
+            md_content_str,
+        )
+
+    if f_dump_content_list:
+        image_dir = str(os.path.basename(local_image_dir))
+        content_list = pipeline_union_make(pdf_info, MakeMode.CONTENT_LIST, image_dir)
+        md_writer.write_string(
+            f"{pdf_file_name}_content_list.json",
+            json.dumps(content_list, ensure_ascii=False, indent=4),
+        )
+
+    if f_dump_middle_json:
+        md_writer.write_string(
+            f"{pdf_file_name}_middle.json",
+            json.dumps(middle_json, ensure_ascii=False, indent=4),
+        )
+
+    if f_dump_model_output:
+        md_writer.write_string(
+            f"{pdf_file_name}_model.json",
+            json.dumps(model_json, ensure_ascii=False, indent=4),
+        )
+
+    logger.info(f"local output dir is {local_md_dir}")
+
+
+def _process_vlm_output(
+    output_dir,
+    pdf_file_name,
+    pdf_bytes,
+    middle_json,
+    infer_result,
+    f_draw_layout_bbox,
+    f_dump_md,
+    f_dump_middle_json,
+    f_dump_model_output,
+    f_dump_orig_pdf,
+    f_dump_content_list,
+    f_make_md_mode,
+):
+    local_image_dir, local_md_dir = prepare_env(output_dir, pdf_file_name, "vlm")
+    md_writer = FileBasedDataWriter(local_md_dir)
+
+    pdf_info = middle_json["pdf_info"]
+
+    if f_draw_layout_bbox:
+        draw_layout_bbox(pdf_info, pdf_bytes, local_md_dir, f"{pdf_file_name}_layout.pdf")
+
+    if f_dump_orig_pdf:
+        md_writer.write(
+            f"{pdf_file_name}_origin.pdf",
+            pdf_bytes,
+        )
+
+    if f_dump_md:
+        image_dir = str(os.path.basename(local_image_dir))
+        md_content_str = vlm_union_make(pdf_info, f_make_md_mode, image_dir)
+        md_writer.write_string(
+            f"{pdf_file_name}.md",
+            md_content_str,
+        )
+
+    if f_dump_content_list:
+        image_dir = str(os.path.basename(local_image_dir))
+        content_list = vlm_union_make(pdf_info, MakeMode.CONTENT_LIST, image_dir)
+        md_writer.write_string(
+            f"{pdf_file_name}_content_list.json",
+            json.dumps(content_list, ensure_ascii=False, indent=4),
+        )
+
+    if f_dump_middle_json:
+        md_writer.write_string(
+            f"{pdf_file_name}_middle.json",
+            json.dumps(middle_json, ensure_ascii=False, indent=4),
+        )
+
+    if f_dump_model_output:
+        model_output = ("\n" + "-" * 50 + "\n").join(infer_result)
+        md_writer.write_string(
+            f"{pdf_file_name}_model_output.txt",
+            model_output,
+        )
+
+    logger.info(f"local output dir is {local_md_dir}")
+
+
+def _restore_cached_images(output_dir, pdf_file_name, parse_method, images):
+    local_image_dir, _ = prepare_env(output_dir, pdf_file_name, parse_method)
+    image_writer = FileBasedDataWriter(local_image_dir)
+    for path, image_bytes in images.items():
+        image_writer.write(path, image_bytes)
+
+
 def do_parse(
     output_dir,
     pdf_file_names: list[str],
@@ -95,134 +230,135 @@ def do_parse(
     end_page_id=None,
 ):
 
+    # 结果缓存，未配置MINERU_RESULT_CACHE_DIR时为None
+    result_cache = get_result_cache()
+
     if backend == "pipeline":
 
-        from mineru.backend.pipeline.pipeline_middle_json_mkcontent import union_make as pipeline_union_make
         from mineru.backend.pipeline.model_json_to_middle_json import result_to_middle_json as pipeline_result_to_middle_json
         from mineru.backend.pipeline.pipeline_analyze import doc_analyze as pipeline_doc_analyze
+        from mineru.backend.pipeline.pipeline_analyze import doc_analyze_streaming as pipeline_doc_analyze_streaming
+        from mineru.model.ocr.paddleocr2pytorch.tools.infer.predict_rec import rec_batch_stats
+
+        cache_keys = [None] * len(pdf_bytes_list)
+        if result_cache is not None:
+            formula_enable, table_enable = get_formula_enable(p_formula_enable), get_table_enable(p_table_enable)
+            for idx, pdf_bytes in enumerate(pdf_bytes_list):
+                cache_keys[idx] = result_cache.make_key(
+                    pdf_bytes, backend, parse_method, p_lang_list[idx], formula_enable, table_enable, start_page_id, end_page_id
+                )
 
         for idx, pdf_bytes in enumerate(pdf_bytes_list):
             new_pdf_bytes = convert_pdf_bytes_to_bytes_by_pypdfium2(pdf_bytes, start_page_id, end_page_id)
             pdf_bytes_list[idx] = new_pdf_bytes
 
-        infer_results, all_image_lists, all_pdf_docs, lang_list, ocr_enabled_list = pipeline_doc_analyze(pdf_bytes_list, p_lang_list, parse_method=parse_method, formula_enable=p_formula_enable,table_enable=p_table_enable)
-
-        for idx, model_list in enumerate(infer_results):
-            model_json = copy.deepcopy(model_list)
-            pdf_file_name = pdf_file_names[idx]
-            local_image_dir, local_md_dir = prepare_env(output_dir, pdf_file_name, parse_method)
-            image_writer, md_writer = FileBasedDataWriter(local_image_dir), FileBasedDataWriter(local_md_dir)
-
-            images_list = all_image_lists[idx]
-            pdf_doc = all_pdf_docs[idx]
-            _lang = lang_list[idx]
-            _ocr_enable = ocr_enabled_list[idx]
-
-            middle_json = pipeline_result_to_middle_json(model_list, images_list, pdf_doc, image_writer, _lang, _ocr_enable, p_formula_enable)
-
-            pdf_info = middle_json["pdf_info"]
-
-            pdf_bytes = pdf_bytes_list[idx]
-            if f_draw_layout_bbox:
-                draw_layout_bbox(pdf_info, pdf_bytes, local_md_dir, f"{pdf_file_name}_layout.pdf")
-
-            if f_draw_span_bbox:
-                draw_span_bbox(pdf_info, pdf_bytes, local_md_dir, f"{pdf_file_name}_span.pdf")
-
-            if f_dump_orig_pdf:
-                md_writer.write(
-                    f"{pdf_file_name}_origin.pdf",
-                    pdf_bytes,
-                )
-
-            if f_dump_md:
-                image_dir = str(os.path.basename(local_image_dir))
-                md_content_str = pipeline_union_make(pdf_info, f_make_md_mode, image_dir)
-                md_writer.write_string(
-                    f"{pdf_file_name}.md",
-                    md_content_str,
-                )
-
-            if f_dump_content_list:
-                image_dir = str(os.path.basename(local_image_dir))
-                content_list = pipeline_union_make(pdf_info, MakeMode.CONTENT_LIST, image_dir)
-                md_writer.write_string(
-                    f"{pdf_file_name}_content_list.json",
-                    json.dumps(content_list, ensure_ascii=False, indent=4),
-                )
-
-            if f_dump_middle_json:
-                md_writer.write_string(
-                    f"{pdf_file_name}_middle.json",
-                    json.dumps(middle_json, ensure_ascii=False, indent=4),
-                )
-
-            if f_dump_model_output:
-                md_writer.write_string(
-                    f"{pdf_file_name}_model.json",
-                    json.dumps(model_json, ensure_ascii=False, indent=4),
-                )
-
-            logger.info(f"local output dir is {local_md_dir}")
+        # 命中缓存的文档直接输出，其余文档进入推理
+        miss_indices = []
+        for idx, cache_key in enumerate(cache_keys):
+            cached = result_cache.get(cache_key) if cache_key is not None else None
+            if cached is None:
+                miss_indices.append(idx)
+                continue
+            _restore_cached_images(output_dir, pdf_file_names[idx], parse_method, cached['images'])
+            _process_pipeline_output(
+                output_dir, pdf_file_names[idx], pdf_bytes_list[idx], parse_method, cached['middle_json'], cached['model_output'],
+                f_draw_layout_bbox, f_draw_span_bbox, f_dump_md, f_dump_middle_json, f_dump_model_output,
+                f_dump_orig_pdf, f_dump_content_list, f_make_md_mode,
+            )
+
+        miss_pdf_bytes_list = [pdf_bytes_list[idx] for idx in miss_indices]
+        miss_lang_list = [p_lang_list[idx] for idx in miss_indices]
+        image_writer_list = []
+        for idx in miss_indices:
+            local_image_dir, _ = prepare_env(output_dir, pdf_file_names[idx], parse_method)
+            image_writer = FileBasedDataWriter(local_image_dir)
+            # 需要写缓存时记录裁剪出的图片
+            image_writer_list.append(RecordingDataWriter(image_writer) if result_cache is not None else image_writer)
+
+        def output_and_cache(miss_idx, middle_json, model_json):
+            idx = miss_indices[miss_idx]
+            if cache_keys[idx] is not None:
+                result_cache.put(cache_keys[idx], middle_json, model_json, image_writer_list[miss_idx].files)
+            _process_pipeline_output(
+                output_dir, pdf_file_names[idx], pdf_bytes_list[idx], parse_method, middle_json, model_json,
+                f_draw_layout_bbox, f_draw_span_bbox, f_dump_md, f_dump_middle_json, f_dump_model_output,
+                f_dump_orig_pdf, f_dump_content_list, f_make_md_mode,
+            )
+
+        if miss_indices:
+            if get_pipeline_streaming_enable():
+                # 流式模式：按页面窗口渲染和推理，文档完成后立即输出
+                for miss_idx, model_json, middle_json, _ in pipeline_doc_analyze_streaming(miss_pdf_bytes_list, image_writer_list, miss_lang_list, parse_method=parse_method, formula_enable=p_formula_enable, table_enable=p_table_enable):
+                    output_and_cache(miss_idx, middle_json, model_json)
+            else:
+                infer_results, all_image_lists, all_pdf_docs, lang_list, ocr_enabled_list = pipeline_doc_analyze(miss_pdf_bytes_list, miss_lang_list, parse_method=parse_method, formula_enable=p_formula_enable,table_enable=p_table_enable)
+
+                for miss_idx, model_list in enumerate(infer_results):
+                    model_json = copy.deepcopy(model_list)
+                    image_writer = image_writer_list[miss_idx]
+
+                    images_list = all_image_lists[miss_idx]
+                    pdf_doc = all_pdf_docs[miss_idx]
+                    _lang = lang_list[miss_idx]
+                    _ocr_enable = ocr_enabled_list[miss_idx]
+
+                    middle_json = pipeline_result_to_middle_json(model_list, images_list, pdf_doc, image_writer, _lang, _ocr_enable, p_formula_enable)
+
+                    output_and_cache(miss_idx, middle_json, model_json)
+
+            # 推理和middle_json后处理中的文本行识别都已完成，输出rec batch统计
+            rec_batch_stats.log_stats()
     else:
 
-        if backend.startswith("vlm-"):
-            backend = backend[4:]
+        vlm_backend = backend[4:] if backend.startswith("vlm-") else backend
 
-        f_draw_span_bbox = False
         parse_method = "vlm"
-        for idx, pdf_bytes in enumerate(pdf_bytes_list):
-            pdf_file_name = pdf_file_names[idx]
-            pdf_bytes = convert_pdf_bytes_to_bytes_by_pypdfium2(pdf_bytes, start_page_id, end_page_id)
-            local_image_dir, local_md_dir = prepare_env(output_dir, pdf_file_name, parse_method)
-            image_writer, md_writer = FileBasedDataWriter(local_image_dir), FileBasedDataWriter(local_md_dir)
-            middle_json, infer_result = vlm_doc_analyze(pdf_bytes, image_writer=image_writer, backend=backend, server_url=server_url)
-
-            pdf_info = middle_json["pdf_info"]
+        cache_keys = [None] * len(pdf_bytes_list)
+        if result_cache is not None:
+            for idx, pdf_bytes in enumerate(pdf_bytes_list):
+                cache_keys[idx] = result_cache.make_key(pdf_bytes, backend, parse_method, None, None, None, start_page_id, end_page_id)
 
-            if f_draw_layout_bbox:
-                draw_layout_bbox(pdf_info, pdf_bytes, local_md_dir, f"{pdf_file_name}_layout.pdf")
-
-            if f_draw_span_bbox:
-                draw_span_bbox(pdf_info, pdf_bytes, local_md_dir, f"{pdf_file_name}_span.pdf")
-
-            if f_dump_orig_pdf:
-                md_writer.write(
-                    f"{pdf_file_name}_origin.pdf",
-                    pdf_bytes,
-                )
-
-            if f_dump_md:
-                image_dir = str(os.path.basename(local_image_dir))
-                md_content_str = vlm_union_make(pdf_info, f_make_md_mode, image_dir)
-                md_writer.write_string(
-                    f"{pdf_file_name}.md",
-                    md_content_str,
-                )
-
-            if f_dump_content_list:
-                image_dir = str(os.path.basename(local_image_dir))
-                content_list = vlm_union_make(pdf_info, MakeMode.CONTENT_LIST, image_dir)
-                md_writer.write_string(
-                    f"{pdf_file_name}_content_list.json",
-                    json.dumps(content_list, ensure_ascii=False, indent=4),
-                )
-
-            if f_dump_middle_json:
-                md_writer.write_string(
-                    f"{pdf_file_name}_middle.json",
-                    json.dumps(middle_json, ensure_ascii=False, indent=4),
-                )
+        for idx, pdf_bytes in enumerate(pdf_bytes_list):
+            new_pdf_bytes = convert_pdf_bytes_to_bytes_by_pypdfium2(pdf_bytes, start_page_id, end_page_id)
+            pdf_bytes_list[idx] = new_pdf_bytes
 
-            if f_dump_model_output:
-                model_output = ("\n" + "-" * 50 + "\n").join(infer_result)
-                md_writer.write_string(
-                    f"{pdf_file_name}_model_output.txt",
-                    model_output,
+        # 命中缓存的文档直接输出，其余文档进入推理
+        miss_indices = []
+        for idx, cache_key in enumerate(cache_keys):
+            cached = result_cache.get(cache_key) if cache_key is not None else None
+            if cached is None:
+                miss_indices.append(idx)
+                continue
+            _restore_cached_images(output_dir, pdf_file_names[idx], parse_method, cached['images'])
+            _process_vlm_output(
+                output_dir, pdf_file_names[idx], pdf_bytes_list[idx], cached['middle_json'], cached['model_output'],
+                f_draw_layout_bbox, f_dump_md, f_dump_middle_json, f_dump_model_output,
+                f_dump_orig_pdf, f_dump_content_list, f_make_md_mode,
+            )
+
+        image_writer_list = []
+        for idx in miss_indices:
+            local_image_dir, _ = prepare_env(output_dir, pdf_file_names[idx], parse_method)
+            image_writer = FileBasedDataWriter(local_image_dir)
+            image_writer_list.append(RecordingDataWriter(image_writer) if result_cache is not None else image_writer)
+
+        # 所有文档的页面汇成一个请求流，文档完成后立即输出，其余文档的推理在后台继续
+        if len(miss_indices) > 0:
+            for miss_idx, middle_json, infer_result in vlm_batch_doc_analyze(
+                [pdf_bytes_list[idx] for idx in miss_indices], image_writer_list, backend=vlm_backend, server_url=server_url
+            ):
+                idx = miss_indices[miss_idx]
+                if cache_keys[idx] is not None:
+                    result_cache.put(cache_keys[idx], middle_json, infer_result, image_writer_list[miss_idx].files)
+                _process_vlm_output(
+                    output_dir, pdf_file_names[idx], pdf_bytes_list[idx], middle_json, infer_result,
+                    f_draw_layout_bbox, f_dump_md, f_dump_middle_json, f_dump_model_output,
+                    f_dump_orig_pdf, f_dump_content_list, f_make_md_mode,
                 )
 
-            logger.info(f"local output dir is {local_md_dir}")
-
+    if result_cache is not None:
+        result_cache.flush()
+        result_cache.log_stats()
 
 
 if __name__ == "__main__":
@@ -112,3 +112,11 @@ class S3Writer(IOWriter):
             data (bytes): the data want to write
         """
         self._s3_client.put_object(Bucket=self._bucket, Key=key, Body=data)
+
+    def delete(self, key: str):
+        """Delete file.
+
+        Args:
+            key (str): the key of file want to delete
+        """
+        self._s3_client.delete_object(Bucket=self._bucket, Key=key)
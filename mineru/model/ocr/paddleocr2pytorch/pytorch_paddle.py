@@ -86,8 +86,14 @@ class PytorchPaddleOCR(TextSystem):
         kwargs['rec_model_path'] = rec_model_path
         kwargs['rec_char_dict_path'] = os.path.join(root_dir, 'pytorchocr', 'utils', 'resources', 'dict', dict_file)
         # kwargs['rec_batch_num'] = 8
+        # rec每个batch填充后的像素数上限，为0时按rec_batch_num分batch
+        rec_batch_pixels = os.getenv('MINERU_OCR_REC_BATCH_PIXELS')
+        if rec_batch_pixels is not None:
+            kwargs['rec_batch_pixels'] = int(rec_batch_pixels)
 
         kwargs['device'] = device
+        if kwargs.get('ocr_engine') == 'onnxruntime' and device != 'cpu':
+            logger.warning(f"onnxruntime ocr engine runs on CPU, the current device {device} is not used by ocr")
 
         default_args = vars(args)
         default_args.update(kwargs)
@@ -33,6 +33,15 @@ class BaseOCRV20:
         self.net.load_state_dict(torch.load(weights_path, weights_only=True))
         # print('model is loaded: {}'.format(weights_path))
 
+    def init_engine(self, ocr_engine, model_type, weights_path):
+        """ocr_engine为onnxruntime时用onnxruntime的session替换self.net，调用方式不变"""
+        if ocr_engine != 'onnxruntime':
+            return
+        from .onnx_runtime import load_ort_net
+        ort_net = load_ort_net(self.net, model_type, weights_path)
+        if ort_net is not None:
+            self.net = ort_net
+
     def inference(self, inputs):
         with torch.no_grad():
             infer = self.net(inputs)
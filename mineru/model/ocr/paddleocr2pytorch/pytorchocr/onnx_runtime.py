@@ -0,0 +1,103 @@
+# Copyright (c) Opendatalab. All rights reserved.
+"""用onnxruntime的CPU provider运行导出的det/rec网络。
+
+OrtNet与torch网络的调用方式一致（输入NCHW的tensor，det返回{'maps': tensor}，rec返回tensor），
+TextDetector/TextRecognizer只需要替换self.net，预处理和后处理不变。
+"""
+import inspect
+import os
+
+import torch
+from loguru import logger
+
+# 导出时的动态维度，det的输入高宽都会变化，rec的输入高度固定
+DYNAMIC_AXES = {
+    'det': {0: 'batch', 2: 'height', 3: 'width'},
+    'rec': {0: 'batch', 3: 'width'},
+}
+OUTPUT_NAMES = {
+    'det': ['maps'],
+    'rec': ['preds'],
+}
+# 导出时使用的示例输入尺寸
+SAMPLE_INPUT_SHAPES = {
+    'det': (1, 3, 640, 640),
+    'rec': (1, 3, 48, 320),
+}
+OPSET_VERSION = 17
+
+
+def get_onnx_path(weights_path: str) -> str:
+    """onnx文件与torch权重放在同一目录，文件名相同"""
+    return os.path.splitext(weights_path)[0] + '.onnx'
+
+
+def export_onnx(net: torch.nn.Module, model_type: str, onnx_path: str, input_shape=None):
+    """把det/rec网络导出为batch和宽度（det还有高度）是动态维度的onnx模型"""
+    if input_shape is None:
+        input_shape = SAMPLE_INPUT_SHAPES[model_type]
+    sample_input = torch.zeros(input_shape, dtype=torch.float32, device=next(net.parameters()).device)
+    export_kwargs = {}
+    # 新版本torch默认使用dynamo导出，这里固定使用基于torchscript的导出
+    if 'dynamo' in inspect.signature(torch.onnx.export).parameters:
+        export_kwargs['dynamo'] = False
+    os.makedirs(os.path.dirname(os.path.abspath(onnx_path)), exist_ok=True)
+    # 先写到临时文件，避免多个进程同时导出时读到不完整的文件
+    tmp_path = f'{onnx_path}.{os.getpid()}.tmp'
+    with torch.no_grad():
+        torch.onnx.export(
+            net,
+            sample_input,
+            tmp_path,
+            input_names=['x'],
+            output_names=OUTPUT_NAMES[model_type],
+            dynamic_axes={'x': DYNAMIC_AXES[model_type]},
+            opset_version=OPSET_VERSION,
+            **export_kwargs,
+        )
+    os.replace(tmp_path, onnx_path)
+
+
+class OrtNet:
+    def __init__(self, onnx_path: str, model_type: str, num_threads: int = 0):
+        import onnxruntime
+
+        session_options = onnxruntime.SessionOptions()
+        session_options.graph_optimization_level = onnxruntime.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if num_threads > 0:
+            session_options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(
+            onnx_path, sess_options=session_options, providers=['CPUExecutionProvider']
+        )
+        self.model_type = model_type
+        self.input_name = self.session.get_inputs()[0].name
+        self.output_names = [output.name for output in self.session.get_outputs()]
+
+    def __call__(self, inp: torch.Tensor):
+        outputs = self.session.run(None, {self.input_name: inp.detach().cpu().numpy()})
+        outputs = [torch.from_numpy(output) for output in outputs]
+        if self.model_type == 'det':
+            return dict(zip(self.output_names, outputs))
+        return outputs[0]
+
+    def eval(self):
+        return self
+
+    def to(self, *args, **kwargs):
+        return self
+
+
+def load_ort_net(net: torch.nn.Module, model_type: str, weights_path: str, num_threads: int = 0):
+    """
+    加载weights_path对应的onnx模型，不存在时先从net导出。
+    onnxruntime不可用或导出失败时返回None，调用方继续使用torch网络。
+    """
+    onnx_path = get_onnx_path(weights_path)
+    try:
+        if not os.path.exists(onnx_path):
+            logger.info(f'exporting {model_type} model to {onnx_path}')
+            export_onnx(net, model_type, onnx_path)
+        return OrtNet(onnx_path, model_type, num_threads)
+    except Exception as e:
+        logger.warning(f'failed to load onnxruntime {model_type} model from {onnx_path}, fallback to torch: {e}')
+        return None
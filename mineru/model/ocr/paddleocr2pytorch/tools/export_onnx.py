@@ -0,0 +1,51 @@
+# Copyright (c) Opendatalab. All rights reserved.
+"""把models_config.yml中各语言的det/rec网络导出为onnx模型，供ocr_engine=onnxruntime使用。
+
+    python -m mineru.model.ocr.paddleocr2pytorch.tools.export_onnx --lang ch_lite en
+
+默认导出到torch权重所在的目录（与权重同名），运行时直接加载；指定--output_dir时导出到该目录。
+"""
+import argparse
+import os
+
+import yaml
+from loguru import logger
+
+from ..pytorch_paddle import PytorchPaddleOCR, root_dir
+from ..pytorchocr.onnx_runtime import export_onnx, get_onnx_path
+
+
+def export_lang(lang, output_dir=None, overwrite=False):
+    ocr = PytorchPaddleOCR(lang=lang, ocr_engine='torch')
+    onnx_paths = []
+    for model_type, model in [('det', ocr.text_detector), ('rec', ocr.text_recognizer)]:
+        onnx_path = get_onnx_path(model.weights_path)
+        if output_dir is not None:
+            onnx_path = os.path.join(output_dir, os.path.basename(onnx_path))
+        if os.path.exists(onnx_path) and not overwrite:
+            logger.info(f'{onnx_path} already exists, skip')
+        else:
+            export_onnx(model.net, model_type, onnx_path)
+            logger.info(f'exported {model_type} model of {lang} to {onnx_path}')
+        onnx_paths.append(onnx_path)
+    return onnx_paths
+
+
+def main():
+    models_config_path = os.path.join(root_dir, 'pytorchocr', 'utils', 'resources', 'models_config.yml')
+    with open(models_config_path) as file:
+        all_langs = list(yaml.safe_load(file)['lang'])
+
+    parser = argparse.ArgumentParser(description='export PytorchPaddleOCR det/rec models to onnx')
+    parser.add_argument('--lang', nargs='+', default=['ch_lite'], choices=all_langs + ['all'])
+    parser.add_argument('--output_dir', type=str, default=None)
+    parser.add_argument('--overwrite', action='store_true')
+    args = parser.parse_args()
+
+    langs = all_langs if 'all' in args.lang else args.lang
+    for lang in langs:
+        export_lang(lang, args.output_dir, args.overwrite)
+
+
+if __name__ == '__main__':
+    main()
@@ -116,6 +116,7 @@ class TextDetector(BaseOCRV20):
         self.load_pytorch_weights(self.weights_path)
         self.net.eval()
         self.net.to(self.device)
+        self.init_engine(args.ocr_engine, 'det', self.weights_path)
 
     def _batch_process_same_size(self, img_list):
         """
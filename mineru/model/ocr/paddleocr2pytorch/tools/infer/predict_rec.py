@@ -1,15 +1,83 @@
+import threading
+
 from PIL import Image
 import cv2
 import numpy as np
 import math
 import time
 import torch
+from loguru import logger
 from tqdm import tqdm
 
 from ...pytorchocr.base_ocr_v20 import BaseOCRV20
 from . import pytorchocr_utility as utility
 from ...pytorchocr.postprocess import build_post_process
 
+# 同一个batch中最宽的文本行不超过最窄的REC_WIDTH_BUCKET_RATIO倍，限制填充的比例
+REC_WIDTH_BUCKET_RATIO = 1.25
+
+
+def plan_rec_batches(padded_widths, height, pixel_budget, bucket_ratio=REC_WIDTH_BUCKET_RATIO):
+    """
+    按宽度从小到大把文本行分成batch，返回每个batch的下标列表（batch内宽度从小到大）。
+    padded_widths为每个文本行单独推理时的输入宽度，batch内按最宽的文本行填充，
+    填充后的像素数（batch大小 x 最大宽度 x 高度）不超过pixel_budget，窄的文本行可以组成更大的batch。
+    """
+    order = sorted(range(len(padded_widths)), key=lambda i: padded_widths[i])
+    batches = []
+    batch = []
+    bucket_start = 0
+    for i in order:
+        width = padded_widths[i]
+        if batch and (width > bucket_start * bucket_ratio or (len(batch) + 1) * width * height > pixel_budget):
+            batches.append(batch)
+            batch = []
+        if not batch:
+            bucket_start = width
+        batch.append(i)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+class RecBatchStats:
+    """进程内的rec batch统计，填充效率为各文本行单独推理所需的像素数与batch填充后像素数之比"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.batches = 0
+        self.crops = 0
+        self.required_pixels = 0
+        self.padded_pixels = 0
+
+    def record(self, padded_widths, batch_width, height):
+        with self._lock:
+            self.batches += 1
+            self.crops += len(padded_widths)
+            self.required_pixels += sum(padded_widths) * height
+            self.padded_pixels += len(padded_widths) * batch_width * height
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'batches': self.batches,
+                'crops': self.crops,
+                'avg_batch_size': round(self.crops / self.batches, 2) if self.batches > 0 else 0,
+                'padding_efficiency': round(self.required_pixels / self.padded_pixels, 4) if self.padded_pixels > 0 else 0,
+            }
+
+    def log_stats(self):
+        stats = self.stats()
+        if stats['batches'] == 0:
+            return
+        logger.info(
+            f"ocr rec batching: {stats['crops']} crops in {stats['batches']} batches, "
+            f"avg batch size {stats['avg_batch_size']}, padding efficiency {stats['padding_efficiency']}"
+        )
+
+
+rec_batch_stats = RecBatchStats()
+
 
 class TextRecognizer(BaseOCRV20):
     def __init__(self, args, **kwargs):
@@ -17,6 +85,7 @@ class TextRecognizer(BaseOCRV20):
         self.rec_image_shape = [int(v) for v in args.rec_image_shape.split(",")]
         self.character_type = args.rec_char_type
         self.rec_batch_num = args.rec_batch_num
+        self.rec_batch_pixels = args.rec_batch_pixels
         self.rec_algorithm = args.rec_algorithm
         self.max_text_length = args.max_text_length
         postprocess_params = {
@@ -93,6 +162,9 @@ class TextRecognizer(BaseOCRV20):
         self.load_state_dict(weights)
         self.net.eval()
         self.net.to(self.device)
+        if self.rec_algorithm not in ['SRN', 'SAR', 'CAN']:
+            # 这几种算法需要额外的输入或直接调用子网络，只支持torch
+            self.init_engine(args.ocr_engine, 'rec', self.weights_path)
 
     def resize_norm_img(self, img, max_wh_ratio):
         imgC, imgH, imgW = self.rec_image_shape
@@ -288,35 +360,52 @@ class TextRecognizer(BaseOCRV20):
 
         return img
 
+    def get_padded_width(self, img):
+        """文本行单独推理时的输入宽度"""
+        imgW = self.rec_image_shape[-1]
+        if self.rec_algorithm in ['SAR', 'SVTR', 'SRN', 'CAN', 'NRTR', 'ViTSTR', 'RFL']:
+            return imgW
+        imgH = self.rec_image_shape[1]
+        h, w = img.shape[0:2]
+        max_wh_ratio = max(w * 1.0 / h, imgW / imgH)
+        return max(min(int(imgH * max_wh_ratio), self.limited_max_width), self.limited_min_width)
+
+    def plan_batches(self, img_list):
+        """
+        rec_batch_pixels大于0时按填充后的像素数和宽度桶分batch，否则按宽高比排序后每rec_batch_num个一组
+        """
+        padded_widths = [self.get_padded_width(img) for img in img_list]
+        if self.rec_batch_pixels > 0:
+            batches = plan_rec_batches(padded_widths, self.rec_image_shape[1], self.rec_batch_pixels)
+        else:
+            # Sorting can speed up the recognition process
+            width_list = [img.shape[1] / float(img.shape[0]) for img in img_list]
+            indices = np.argsort(np.array(width_list), kind='stable').tolist()
+            batches = [indices[i:i + self.rec_batch_num] for i in range(0, len(indices), self.rec_batch_num)]
+        for batch in batches:
+            batch_widths = [padded_widths[i] for i in batch]
+            rec_batch_stats.record(batch_widths, max(batch_widths), self.rec_image_shape[1])
+        return batches
+
     def __call__(self, img_list, tqdm_enable=False):
         img_num = len(img_list)
-        # Calculate the aspect ratio of all text bars
-        width_list = []
-        for img in img_list:
-            width_list.append(img.shape[1] / float(img.shape[0]))
-        # Sorting can speed up the recognition process
-        indices = np.argsort(np.array(width_list))
+        batches = self.plan_batches(img_list)
 
         # rec_res = []
         rec_res = [['', 0.0]] * img_num
-        batch_num = self.rec_batch_num
         elapse = 0
-        # for beg_img_no in range(0, img_num, batch_num):
         with tqdm(total=img_num, desc='OCR-rec Predict', disable=not tqdm_enable) as pbar:
-            index = 0
-            for beg_img_no in range(0, img_num, batch_num):
-                end_img_no = min(img_num, beg_img_no + batch_num)
+            for batch_indices in batches:
                 norm_img_batch = []
                 max_wh_ratio = 0
-                for ino in range(beg_img_no, end_img_no):
-                    # h, w = img_list[ino].shape[0:2]
-                    h, w = img_list[indices[ino]].shape[0:2]
+                for img_idx in batch_indices:
+                    h, w = img_list[img_idx].shape[0:2]
                     wh_ratio = w * 1.0 / h
                     max_wh_ratio = max(max_wh_ratio, wh_ratio)
-                for ino in range(beg_img_no, end_img_no):
+                for img_idx in batch_indices:
                     if self.rec_algorithm == "SAR":
                         norm_img, _, _, valid_ratio = self.resize_norm_img_sar(
-                            img_list[indices[ino]], self.rec_image_shape)
+                            img_list[img_idx], self.rec_image_shape)
                         norm_img = norm_img[np.newaxis, :]
                         valid_ratio = np.expand_dims(valid_ratio, axis=0)
                         valid_ratios = []
@@ -324,12 +413,12 @@ class TextRecognizer(BaseOCRV20):
                         norm_img_batch.append(norm_img)
 
                     elif self.rec_algorithm == "SVTR":
-                        norm_img = self.resize_norm_img_svtr(img_list[indices[ino]],
+                        norm_img = self.resize_norm_img_svtr(img_list[img_idx],
                                                              self.rec_image_shape)
                         norm_img = norm_img[np.newaxis, :]
                         norm_img_batch.append(norm_img)
                     elif self.rec_algorithm == "SRN":
-                        norm_img = self.process_image_srn(img_list[indices[ino]],
+                        norm_img = self.process_image_srn(img_list[img_idx],
                                                           self.rec_image_shape, 8,
                                                           self.max_text_length)
                         encoder_word_pos_list = []
@@ -342,7 +431,7 @@ class TextRecognizer(BaseOCRV20):
                         gsrm_slf_attn_bias2_list.append(norm_img[4])
                         norm_img_batch.append(norm_img[0])
                     elif self.rec_algorithm == "CAN":
-                        norm_img = self.norm_img_can(img_list[indices[ino]],
+                        norm_img = self.norm_img_can(img_list[img_idx],
                                                      max_wh_ratio)
                         norm_img = norm_img[np.newaxis, :]
                         norm_img_batch.append(norm_img)
@@ -353,7 +442,7 @@ class TextRecognizer(BaseOCRV20):
                         norm_img_mask_batch.append(norm_image_mask)
                         word_label_list.append(word_label)
                     else:
-                        norm_img = self.resize_norm_img(img_list[indices[ino]],
+                        norm_img = self.resize_norm_img(img_list[img_idx],
                                                         max_wh_ratio)
                         norm_img = norm_img[np.newaxis, :]
                         norm_img_batch.append(norm_img)
@@ -429,13 +518,10 @@ class TextRecognizer(BaseOCRV20):
 
                 rec_result = self.postprocess_op(preds)
                 for rno in range(len(rec_result)):
-                    rec_res[indices[beg_img_no + rno]] = rec_result[rno]
+                    rec_res[batch_indices[rno]] = rec_result[rno]
                 elapse += time.time() - starttime
 
-                # 更新进度条，每次增加batch_size，但要注意最后一个batch可能不足batch_size
-                current_batch_size = min(batch_num, img_num - index * batch_num)
-                index += 1
-                pbar.update(current_batch_size)
+                pbar.update(len(batch_indices))
 
         # Fix NaN values in recognition results
         for i in range(len(rec_res)):
@@ -20,6 +20,8 @@ def init_args():
     parser.add_argument("--det", type=str2bool, default=True)
     parser.add_argument("--rec", type=str2bool, default=True)
     parser.add_argument("--device", type=str, default='cpu')
+    # det和rec网络的推理引擎，torch或onnxruntime
+    parser.add_argument("--ocr_engine", type=str, default='torch')
     # parser.add_argument("--ir_optim", type=str2bool, default=True)
     # parser.add_argument("--use_tensorrt", type=str2bool, default=False)
     # parser.add_argument("--use_fp16", type=str2bool, default=False)
@@ -72,6 +74,8 @@ def init_args():
     parser.add_argument("--rec_image_shape", type=str, default="3, 48, 320")
     parser.add_argument("--rec_char_type", type=str, default='ch')
     parser.add_argument("--rec_batch_num", type=int, default=6)
+    # 每个rec batch填充后的像素数上限，为0时按rec_batch_num分batch
+    parser.add_argument("--rec_batch_pixels", type=int, default=48 * 1280 * 8)
     parser.add_argument("--max_text_length", type=int, default=25)
 
     parser.add_argument("--use_space_char", type=str2bool, default=True)
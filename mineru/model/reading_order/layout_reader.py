@@ -6,6 +6,7 @@ from transformers import LayoutLMv3ForTokenClassification
 
 MAX_LEN = 510
 CLS_TOKEN_ID = 0
+PAD_TOKEN_ID = 1
 UNK_TOKEN_ID = 3
 EOS_TOKEN_ID = 2
 
@@ -74,6 +75,24 @@ def boxes2inputs(boxes: List[List[int]]) -> Dict[str, torch.Tensor]:
     }
 
 
+def batch_boxes2inputs(boxes_list: List[List[List[int]]]) -> Dict[str, torch.Tensor]:
+    """多组boxes补齐到相同长度后组成一个batch，补齐位置的attention_mask为0"""
+    max_len = max(len(boxes) for boxes in boxes_list) + 2
+    bbox = []
+    input_ids = []
+    attention_mask = []
+    for boxes in boxes_list:
+        pad_len = max_len - len(boxes) - 2
+        bbox.append([[0, 0, 0, 0]] + boxes + [[0, 0, 0, 0]] + [[0, 0, 0, 0]] * pad_len)
+        input_ids.append([CLS_TOKEN_ID] + [UNK_TOKEN_ID] * len(boxes) + [EOS_TOKEN_ID] + [PAD_TOKEN_ID] * pad_len)
+        attention_mask.append([1] + [1] * len(boxes) + [1] + [0] * pad_len)
+    return {
+        "bbox": torch.tensor(bbox),
+        "attention_mask": torch.tensor(attention_mask),
+        "input_ids": torch.tensor(input_ids),
+    }
+
+
 def prepare_inputs(
     inputs: Dict[str, torch.Tensor], model: LayoutLMv3ForTokenClassification
 ) -> Dict[str, torch.Tensor]:
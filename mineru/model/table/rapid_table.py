@@ -1,3 +1,4 @@
+import copy
 import os
 import html
 import cv2
@@ -5,8 +6,15 @@ import numpy as np
 from loguru import logger
 from rapid_table import RapidTable, RapidTableInput
 
+from mineru.utils.config_reader import get_ocr_det_canvas_enable
 from mineru.utils.enum_class import ModelPath
 from mineru.utils.models_download_utils import auto_download_and_get_model_root_path
+from mineru.utils.ocr_det_batch import batch_det
+from mineru.utils.ocr_utils import get_rotate_crop_image, merge_det_boxes, sorted_boxes
+
+TABLE_DET_BATCH_SIZE = 2
+# 表格裁剪图四周没有crop_paste留下的白边，拼接到画布上时使用更大的间隔
+TABLE_DET_CANVAS_GUTTER = 64
 
 
 def escape_html(input_string):
@@ -23,64 +31,108 @@ class RapidTableModel(object):
 
 
     def predict(self, image):
-        bgr_image = cv2.cvtColor(np.asarray(image), cv2.COLOR_RGB2BGR)
-
+        return self.batch_predict([image])[0]
+
+    def batch_predict(self, images, det_batch_size=TABLE_DET_BATCH_SIZE):
+        """分阶段批量识别表格：所有表格一起det，所有文本框一起rec，最后逐个表格推理表格结构
+
+        Returns:
+            list[(html_code, table_cell_bboxes, logic_points, elapse)]，与images一一对应，没有ocr结果的表格为(None, None, None, None)
+        """
+        rgb_images = [np.asarray(image) for image in images]
+        bgr_images = [cv2.cvtColor(image, cv2.COLOR_RGB2BGR) for image in rgb_images]
+
+        # 所有表格一起det
+        det_res_list = self.batch_ocr_det(bgr_images, det_batch_size)
+
+        # 竖版表格根据文本框的方向判断是否需要旋转，只有旋转后的表格需要重新det，其余表格复用上面的det结果
+        rotated_indices = [
+            i for i, (bgr_image, det_res) in enumerate(zip(bgr_images, det_res_list))
+            if self.is_rotated(bgr_image, det_res)
+        ]
+        for i in rotated_indices:
+            rgb_images[i] = cv2.rotate(rgb_images[i], cv2.ROTATE_90_CLOCKWISE)
+            bgr_images[i] = cv2.cvtColor(rgb_images[i], cv2.COLOR_RGB2BGR)
+        if rotated_indices:
+            rotated_det_res_list = self.batch_ocr_det([bgr_images[i] for i in rotated_indices], det_batch_size)
+            for i, det_res in zip(rotated_indices, rotated_det_res_list):
+                det_res_list[i] = det_res
+
+        # 所有表格的文本框一起rec
+        ocr_results = self.batch_ocr_rec(bgr_images, det_res_list)
+
+        results = []
+        for rgb_image, ocr_result in zip(rgb_images, ocr_results):
+            if ocr_result:
+                table_results = self.table_model(rgb_image, ocr_result)
+                html_code = table_results.pred_html
+                table_cell_bboxes = table_results.cell_bboxes
+                logic_points = table_results.logic_points
+                elapse = table_results.elapse
+                results.append((html_code, table_cell_bboxes, logic_points, elapse))
+            else:
+                results.append((None, None, None, None))
+        return results
+
+    def batch_ocr_det(self, bgr_images, det_batch_size):
+        """与ocr_engine.ocr(img, rec=False)相同的检测和文本框合并，多张表格一起推理"""
+        dt_boxes_list = batch_det(
+            self.ocr_engine.text_detector,
+            bgr_images,
+            det_batch_size,
+            det_batch_size,
+            canvas_enable=get_ocr_det_canvas_enable(),
+            gutter=TABLE_DET_CANVAS_GUTTER,
+        )
+        det_res_list = []
+        for dt_boxes in dt_boxes_list:
+            if dt_boxes is None or len(dt_boxes) == 0:
+                det_res_list.append([])
+                continue
+            det_res_list.append(merge_det_boxes(sorted_boxes(dt_boxes)))
+        return det_res_list
+
+    @staticmethod
+    def is_rotated(bgr_image, det_res):
         # First check the overall image aspect ratio (height/width)
         img_height, img_width = bgr_image.shape[:2]
         img_aspect_ratio = img_height / img_width if img_width > 0 else 1.0
         img_is_portrait = img_aspect_ratio > 1.2
-
-        if img_is_portrait:
-
-            det_res = self.ocr_engine.ocr(bgr_image, rec=False)[0]
-            # Check if table is rotated by analyzing text box aspect ratios
-            is_rotated = False
-            if det_res:
-                vertical_count = 0
-
-                for box_ocr_res in det_res:
-                    p1, p2, p3, p4 = box_ocr_res
-
-                    # Calculate width and height
-                    width = p3[0] - p1[0]
-                    height = p3[1] - p1[1]
-
-                    aspect_ratio = width / height if height > 0 else 1.0
-
-                    # Count vertical vs horizontal text boxes
-                    if aspect_ratio < 0.8:  # Taller than wide - vertical text
-                        vertical_count += 1
-                    # elif aspect_ratio > 1.2:  # Wider than tall - horizontal text
-                    #     horizontal_count += 1
-
-                # If we have more vertical text boxes than horizontal ones,
-                # and vertical ones are significant, table might be rotated
-                if vertical_count >= len(det_res) * 0.3:
-                    is_rotated = True
-
-                # logger.debug(f"Text orientation analysis: vertical={vertical_count}, det_res={len(det_res)}, rotated={is_rotated}")
-
-            # Rotate image if necessary
-            if is_rotated:
-                # logger.debug("Table appears to be in portrait orientation, rotating 90 degrees clockwise")
-                image = cv2.rotate(np.asarray(image), cv2.ROTATE_90_CLOCKWISE)
-                bgr_image = cv2.cvtColor(image, cv2.COLOR_RGB2BGR)
-
-        # Continue with OCR on potentially rotated image
-        ocr_result = self.ocr_engine.ocr(bgr_image)[0]
-        if ocr_result:
-            ocr_result = [[item[0], escape_html(item[1][0]), item[1][1]] for item in ocr_result if
-                      len(item) == 2 and isinstance(item[1], tuple)]
-        else:
-            ocr_result = None
-
-
-        if ocr_result:
-            table_results = self.table_model(np.asarray(image), ocr_result)
-            html_code = table_results.pred_html
-            table_cell_bboxes = table_results.cell_bboxes
-            logic_points = table_results.logic_points
-            elapse = table_results.elapse
-            return html_code, table_cell_bboxes, logic_points, elapse
-        else:
-            return None, None, None, None
+        if not img_is_portrait or not det_res:
+            return False
+
+        # Check if table is rotated by analyzing text box aspect ratios
+        vertical_count = 0
+        for box in det_res:
+            p1, p2, p3, p4 = box
+
+            # Calculate width and height
+            width = p3[0] - p1[0]
+            height = p3[1] - p1[1]
+
+            aspect_ratio = width / height if height > 0 else 1.0
+
+            # Count vertical vs horizontal text boxes
+            if aspect_ratio < 0.8:  # Taller than wide - vertical text
+                vertical_count += 1
+
+        # If we have more vertical text boxes than horizontal ones,
+        # and vertical ones are significant, table might be rotated
+        return vertical_count >= len(det_res) * 0.3
+
+    def batch_ocr_rec(self, bgr_images, det_res_list):
+        """所有表格的文本框一起rec，按ocr_engine的drop_score过滤，返回每个表格的[box, text, score]列表"""
+        img_crop_list, crop_indices = [], []
+        for i, (bgr_image, det_res) in enumerate(zip(bgr_images, det_res_list)):
+            for box in det_res:
+                img_crop_list.append(get_rotate_crop_image(bgr_image, copy.deepcopy(box)))
+                crop_indices.append(i)
+
+        ocr_results = [[] for _ in bgr_images]
+        if img_crop_list:
+            rec_res, _ = self.ocr_engine.text_recognizer(img_crop_list)
+            boxes = [box for det_res in det_res_list for box in det_res]
+            for i, box, (text, score) in zip(crop_indices, boxes, rec_res):
+                if score >= self.ocr_engine.drop_score:
+                    ocr_results[i].append([box.tolist(), escape_html(text), score])
+        return [ocr_result or None for ocr_result in ocr_results]
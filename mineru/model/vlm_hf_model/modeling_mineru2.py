@@ -146,7 +146,7 @@ class Mineru2QwenForCausalLM(Qwen2ForCausalLM):
         return image_features
 
     def prepare_inputs_labels_for_multimodal(
-        self, input_ids, position_ids, attention_mask, past_key_values, labels, images, image_sizes=None
+        self, input_ids, position_ids, attention_mask, past_key_values, labels, images, image_sizes=None, padding_side=None
     ):
         vision_tower = self.get_model().vision_tower
         if vision_tower is None or images is None or input_ids.shape[1] == 1:
@@ -325,9 +325,11 @@ class Mineru2QwenForCausalLM(Qwen2ForCausalLM):
         attention_mask = torch.zeros((batch_size, max_len), dtype=attention_mask.dtype, device=attention_mask.device)
         position_ids = torch.zeros((batch_size, max_len), dtype=position_ids.dtype, device=position_ids.device)
 
+        if padding_side is None:
+            padding_side = getattr(self.config, "tokenizer_padding_side", "right")
         for i, (cur_new_embed, cur_new_labels) in enumerate(zip(new_input_embeds, new_labels)):
             cur_len = cur_new_embed.shape[0]
-            if getattr(self.config, "tokenizer_padding_side", "right") == "left":
+            if padding_side == "left":
                 new_input_embeds_padded.append(
                     torch.cat(
                         (
@@ -427,13 +429,30 @@ class Mineru2QwenForCausalLM(Qwen2ForCausalLM):
     ) -> Union[GenerateOutput, torch.LongTensor]:
         position_ids = kwargs.pop("position_ids", None)
         attention_mask = kwargs.pop("attention_mask", None)
+        # prompt前缀（系统提示词）的KV cache，batch大小与inputs相同，此时inputs只包含前缀之后的部分
+        prefix_key_values = kwargs.pop("prefix_key_values", None)
         if "inputs_embeds" in kwargs:
             raise NotImplementedError("`inputs_embeds` is not supported")
 
+        # 生成时新token接在序列末尾，batch内长度不同的序列必须左padding
         inputs, position_ids, attention_mask, _, inputs_embeds, _ = self.prepare_inputs_labels_for_multimodal(
-            inputs, position_ids, attention_mask, None, None, images, image_sizes=image_sizes
+            inputs, position_ids, attention_mask, None, None, images, image_sizes=image_sizes, padding_side="left"
         )
 
+        if prefix_key_values is not None:
+            # 前缀位置用占位的embedding补齐，由cache提供对应的key/value，padding位于前缀和其余部分之间，
+            # 前缀在每个序列中的位置都相同，position_ids由attention_mask累加得到
+            batch_size, prefix_len = inputs_embeds.shape[0], prefix_key_values.get_seq_length()
+            prefix_embeds = inputs_embeds.new_zeros((batch_size, prefix_len, inputs_embeds.shape[2]))
+            inputs_embeds = torch.cat([prefix_embeds, inputs_embeds], dim=1)
+            if attention_mask is None:
+                attention_mask = torch.ones(inputs_embeds.shape[:2], dtype=torch.long, device=inputs_embeds.device)
+            else:
+                prefix_mask = attention_mask.new_ones((batch_size, prefix_len))
+                attention_mask = torch.cat([prefix_mask, attention_mask], dim=1)
+            position_ids = None
+            kwargs["past_key_values"] = prefix_key_values
+
         return super().generate(position_ids=position_ids, attention_mask=attention_mask, inputs_embeds=inputs_embeds, **kwargs)
 
     def prepare_inputs_for_generation(self, input_ids, past_key_values=None, inputs_embeds=None, **kwargs):
@@ -1,7 +1,10 @@
 from typing import List
 
+from loguru import logger
 from sglang.srt.sampling.custom_logit_processor import CustomLogitProcessor
 
+from mineru.backend.vlm.generation_guard import GenerationGuard
+
 
 class Mineru2LogitProcessor(CustomLogitProcessor):
     """
@@ -17,6 +20,10 @@ class Mineru2LogitProcessor(CustomLogitProcessor):
         Inspired by Hugging Face's NoRepeatNGramLogitsProcessor.
         This implementation is slower due to its lack of specialized optimization.
 
+    - generation_guard (dict):
+        Watches the decoded output for structural degeneration (see GenerationGuard)
+        and forces EOS once the page is detected as degenerate.
+
     - no_repeat_token_count (int):
         (Placeholder for future logic)
         Intended to prevent repeating the same token multiple times.
@@ -26,6 +33,7 @@ class Mineru2LogitProcessor(CustomLogitProcessor):
     def __init__(self) -> None:
         super().__init__()
         self._generated_ngrams = {}  # Cache of generated n-grams by request ID
+        self._guards = {}  # GenerationGuard and number of decoded tokens by request ID
         self._time = {}  # Timestamp of the last update for each request
         self._gen_step = 0  # Global generation step counter
 
@@ -38,6 +46,7 @@ class Mineru2LogitProcessor(CustomLogitProcessor):
             batch_info (List[dict]): A list of metadata dicts for each sample in the batch. Each dict must include:
                 - "__req__": Request object containing request ID and output_ids.
                 - "no_repeat_ngram_size": Size of n-gram to avoid repeating.
+                - "generation_guard" (optional): Parameters of GenerationGuard.
 
         Returns:
             FloatTensor: The modified logits tensor with banned token logits set to -inf.
@@ -55,13 +64,17 @@ class Mineru2LogitProcessor(CustomLogitProcessor):
             output_ids = req.output_ids
             ngram_size = info.get("no_repeat_ngram_size", 0)
 
+            # Record the current step for cache cleanup tracking
+            self._time[rid] = self._gen_step
+
+            if info.get("generation_guard") and self._check_guard(req, info["generation_guard"]):
+                self._force_eos(logits, idx, req)
+                continue
+
             # Skip if there are not enough tokens to form an n-gram
             if ngram_size <= 0 or len(output_ids) < ngram_size:
                 continue
 
-            # Record the current step for cache cleanup tracking
-            self._time[rid] = self._gen_step
-
             # Initialize n-gram cache for this request if it doesn't exist
             if rid not in self._generated_ngrams:
                 self._generated_ngrams[rid] = {}
@@ -85,6 +98,34 @@ class Mineru2LogitProcessor(CustomLogitProcessor):
         expired_rids = [rid for rid, last_used in self._time.items() if last_used < self._gen_step]
         for rid in expired_rids:
             self._generated_ngrams.pop(rid, None)
+            self._guards.pop(rid, None)
             self._time.pop(rid, None)
 
         return logits
+
+    def _check_guard(self, req, guard_params: dict) -> bool:
+        """Feeds the newly generated tokens of the request to its GenerationGuard."""
+        tokenizer = getattr(req, "tokenizer", None)
+        if tokenizer is None:
+            return False
+        if req.rid not in self._guards:
+            self._guards[req.rid] = [GenerationGuard(**guard_params), 0]
+        guard_state = self._guards[req.rid]
+        guard, num_decoded = guard_state
+        output_ids = req.output_ids
+        if guard.reason is None and len(output_ids) > num_decoded:
+            guard_state[1] = len(output_ids)
+            if guard.feed(tokenizer.decode(output_ids[num_decoded:])):
+                logger.warning(f"request {req.rid} degenerated ({guard.reason}) after {len(output_ids)} tokens, stop generation")
+        return guard.reason is not None
+
+    @staticmethod
+    def _force_eos(logits, idx: int, req):
+        eos_token_ids = getattr(req, "eos_token_ids", None) or set()
+        if not eos_token_ids and req.tokenizer.eos_token_id is not None:
+            eos_token_ids = {req.tokenizer.eos_token_id}
+        if not eos_token_ids:
+            return
+        logits[idx][:] = -float("inf")
+        for token in eos_token_ids:
+            logits[idx][token] = 0.0
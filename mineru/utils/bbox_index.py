@@ -0,0 +1,91 @@
+# Copyright (c) Opendatalab. All rights reserved.
+import math
+from collections import defaultdict
+
+import numpy as np
+
+from mineru.utils.boxbase_batch import to_bbox_array
+
+
+class BboxIndex:
+    """基于均匀网格分桶的bbox空间索引。
+
+    每个bbox登记到它覆盖的所有网格中，查询时只在目标bbox覆盖的网格内取候选，
+    再用numpy批量过滤出与目标bbox相交（含边界相接）的索引，返回按原始顺序排列的结果。
+    支持在遍历过程中用update修改某个bbox，用于处理合并后bbox变大的场景。
+    """
+
+    # 网格边长不小于页面跨度的1/MAX_GRID_NUM，避免大框登记到过多网格
+    MAX_GRID_NUM = 64
+
+    def __init__(self, bboxes):
+        self.bboxes = to_bbox_array(bboxes).copy()
+        self.cell_size = self._get_cell_size(self.bboxes)
+        self.cells = defaultdict(set)
+        self.update_counts = [0] * len(self.bboxes)
+        for index in range(len(self.bboxes)):
+            self._insert(index)
+
+    @classmethod
+    def _get_cell_size(cls, bboxes):
+        if len(bboxes) == 0:
+            return 1.0
+        sizes = np.maximum(bboxes[:, 2] - bboxes[:, 0], bboxes[:, 3] - bboxes[:, 1])
+        extent = max(bboxes[:, 2].max() - bboxes[:, 0].min(), bboxes[:, 3].max() - bboxes[:, 1].min())
+        return max(float(np.median(sizes)), float(extent) / cls.MAX_GRID_NUM, 1.0)
+
+    def _cell_keys(self, bbox):
+        x0, y0, x1, y1 = bbox[:4]
+        cx0, cy0 = math.floor(x0 / self.cell_size), math.floor(y0 / self.cell_size)
+        cx1, cy1 = math.floor(x1 / self.cell_size), math.floor(y1 / self.cell_size)
+        return [(cx, cy) for cx in range(cx0, cx1 + 1) for cy in range(cy0, cy1 + 1)]
+
+    def _insert(self, index):
+        for key in self._cell_keys(self.bboxes[index]):
+            self.cells[key].add(index)
+
+    def _remove(self, index):
+        for key in self._cell_keys(self.bboxes[index]):
+            self.cells[key].discard(index)
+
+    def update(self, index, bbox):
+        self._remove(index)
+        self.bboxes[index] = bbox[:4]
+        self._insert(index)
+        self.update_counts[index] += 1
+
+    def query(self, bbox) -> np.ndarray:
+        """返回与bbox相交（含边界相接）的所有bbox索引，按升序排列"""
+        candidates = set()
+        for key in self._cell_keys(bbox):
+            candidates.update(self.cells.get(key, ()))
+        if not candidates:
+            return np.empty(0, dtype=np.int64)
+        candidates = np.fromiter(candidates, dtype=np.int64, count=len(candidates))
+        candidates.sort()
+        boxes = self.bboxes[candidates]
+        x0, y0, x1, y1 = (float(v) for v in bbox[:4])
+        mask = (
+            (np.minimum(boxes[:, 2], x1) >= np.maximum(boxes[:, 0], x0))
+            & (np.minimum(boxes[:, 3], y1) >= np.maximum(boxes[:, 1], y0))
+        )
+        return candidates[mask]
+
+    def iter_intersecting_pairs(self):
+        """按 for i: for j: 双重循环的顺序产出当前相交的索引对(i, j)（含i == j）。
+
+        遍历过程中可以调用update修改bbox，如果修改的是i，会基于新的bbox重新查询剩余的j。
+        """
+        for i in range(len(self.bboxes)):
+            candidates = self.query(self.bboxes[i])
+            update_count = self.update_counts[i]
+            k = 0
+            while k < len(candidates):
+                j = int(candidates[k])
+                k += 1
+                yield i, j
+                if self.update_counts[i] != update_count:
+                    update_count = self.update_counts[i]
+                    candidates = self.query(self.bboxes[i])
+                    candidates = candidates[candidates > j]
+                    k = 0
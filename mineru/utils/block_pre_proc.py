@@ -1,10 +1,21 @@
 # Copyright (c) Opendatalab. All rights reserved.
+from collections import defaultdict
+
+import numpy as np
+
+from mineru.utils.bbox_index import BboxIndex
 from mineru.utils.boxbase import (
     calculate_iou,
     calculate_overlap_area_in_bbox1_area_ratio,
     calculate_vertical_projection_overlap_ratio,
     get_minbox_if_overlap_by_ratio
 )
+from mineru.utils.boxbase_batch import (
+    calculate_iou_matrix,
+    calculate_overlap_area_in_bbox1_area_ratio_matrix,
+    calculate_vertical_projection_overlap_ratio_matrix,
+    matrix_over_threshold
+)
 from mineru.utils.enum_class import BlockType
 
 
@@ -125,13 +136,16 @@ def fix_text_overlap_title_blocks(all_bboxes):
 
     need_remove = []
 
-    for text_block in text_blocks:
-        for title_block in title_blocks:
-            text_block_bbox = text_block[:4]
-            title_block_bbox = title_block[:4]
-            if calculate_iou(text_block_bbox, title_block_bbox) > 0.8:
-                if title_block not in need_remove:
-                    need_remove.append(title_block)
+    text_block_bboxes = [block[:4] for block in text_blocks]
+    title_block_bboxes = [block[:4] for block in title_blocks]
+    iou_matrix = matrix_over_threshold(
+        calculate_iou_matrix(text_block_bboxes, title_block_bboxes), 0.8,
+        text_block_bboxes, title_block_bboxes, calculate_iou
+    )
+    for _, title_index in zip(*np.nonzero(iou_matrix)):
+        title_block = title_blocks[title_index]
+        if title_block not in need_remove:
+            need_remove.append(title_block)
 
     if len(need_remove) > 0:
         for block in need_remove:
@@ -142,18 +156,15 @@ def fix_text_overlap_title_blocks(all_bboxes):
 
 def remove_need_drop_blocks(all_bboxes, discarded_blocks):
     need_remove = []
-    for block in all_bboxes:
-        for discarded_block in discarded_blocks:
-            block_bbox = block[:4]
-            if (
-                calculate_overlap_area_in_bbox1_area_ratio(
-                    block_bbox, discarded_block['bbox']
-                )
-                > 0.6
-            ):
-                if block not in need_remove:
-                    need_remove.append(block)
-                    break
+    block_bboxes = [block[:4] for block in all_bboxes]
+    discarded_bboxes = [discarded_block['bbox'] for discarded_block in discarded_blocks]
+    in_discarded = matrix_over_threshold(
+        calculate_overlap_area_in_bbox1_area_ratio_matrix(block_bboxes, discarded_bboxes), 0.6,
+        block_bboxes, discarded_bboxes, calculate_overlap_area_in_bbox1_area_ratio
+    ).any(axis=1)
+    for block, need_drop in zip(all_bboxes, in_discarded):
+        if need_drop and block not in need_remove:
+            need_remove.append(block)
 
     if len(need_remove) > 0:
         for block in need_remove:
@@ -174,13 +185,16 @@ def fix_interline_equation_overlap_text_blocks_with_hi_iou(all_bboxes):
 
     need_remove = []
 
-    for interline_equation_block in interline_equation_blocks:
-        for text_block in text_blocks:
-            interline_equation_block_bbox = interline_equation_block[:4]
-            text_block_bbox = text_block[:4]
-            if calculate_iou(interline_equation_block_bbox, text_block_bbox) > 0.8:
-                if text_block not in need_remove:
-                    need_remove.append(text_block)
+    interline_equation_block_bboxes = [block[:4] for block in interline_equation_blocks]
+    text_block_bboxes = [block[:4] for block in text_blocks]
+    iou_matrix = matrix_over_threshold(
+        calculate_iou_matrix(interline_equation_block_bboxes, text_block_bboxes), 0.8,
+        interline_equation_block_bboxes, text_block_bboxes, calculate_iou
+    )
+    for _, text_index in zip(*np.nonzero(iou_matrix)):
+        text_block = text_blocks[text_index]
+        if text_block not in need_remove:
+            need_remove.append(text_block)
 
     if len(need_remove) > 0:
         for block in need_remove:
@@ -191,57 +205,56 @@ def fix_interline_equation_overlap_text_blocks_with_hi_iou(all_bboxes):
 
 def find_blocks_under_footnote(all_bboxes, footnote_blocks):
     need_remove_blocks = []
-    for block in all_bboxes:
-        block_x0, block_y0, block_x1, block_y1 = block[:4]
-        for footnote_bbox in footnote_blocks:
-            footnote_x0, footnote_y0, footnote_x1, footnote_y1 = footnote_bbox
-            # 如果footnote的纵向投影覆盖了block的纵向投影的80%且block的y0大于等于footnote的y1
-            if (
-                block_y0 >= footnote_y1
-                and calculate_vertical_projection_overlap_ratio(
-                    (block_x0, block_y0, block_x1, block_y1), footnote_bbox
-                )
-                >= 0.8
-            ):
-                if block not in need_remove_blocks:
-                    need_remove_blocks.append(block)
-                    break
+    block_bboxes = [block[:4] for block in all_bboxes]
+    # 如果footnote的纵向投影覆盖了block的纵向投影的80%且block的y0大于等于footnote的y1
+    block_y0 = np.array([bbox[1] for bbox in block_bboxes], dtype=np.float64)
+    footnote_y1 = np.array([bbox[3] for bbox in footnote_blocks], dtype=np.float64)
+    under_footnote = (block_y0[:, None] >= footnote_y1[None, :]) & matrix_over_threshold(
+        calculate_vertical_projection_overlap_ratio_matrix(block_bboxes, footnote_blocks), 0.8,
+        block_bboxes, footnote_blocks, calculate_vertical_projection_overlap_ratio, or_equal=True
+    )
+    for block, need_remove in zip(all_bboxes, under_footnote.any(axis=1)):
+        if need_remove and block not in need_remove_blocks:
+            need_remove_blocks.append(block)
     return need_remove_blocks
 
 
 def remove_overlaps_min_blocks(all_bboxes):
     #  重叠block，小的不能直接删除，需要和大的那个合并成一个更大的。
     #  删除重叠blocks中较小的那些
+    #  借助空间索引只比较相交的block对，遍历顺序和判断逻辑与逐对比较所有block一致
     need_remove = []
-    for block1 in all_bboxes:
-        for block2 in all_bboxes:
-            if block1 != block2:
-                block1_bbox = block1[:4]
-                block2_bbox = block2[:4]
-                overlap_box = get_minbox_if_overlap_by_ratio(
-                    block1_bbox, block2_bbox, 0.8
-                )
-                if overlap_box is not None:
-                    block_to_remove = next(
-                        (block for block in all_bboxes if block[:4] == overlap_box),
-                        None,
-                    )
-                    if (
-                        block_to_remove is not None
-                        and block_to_remove not in need_remove
-                    ):
-                        large_block = block1 if block1 != block_to_remove else block2
-                        x1, y1, x2, y2 = large_block[:4]
-                        sx1, sy1, sx2, sy2 = block_to_remove[:4]
-                        x1 = min(x1, sx1)
-                        y1 = min(y1, sy1)
-                        x2 = max(x2, sx2)
-                        y2 = max(y2, sy2)
-                        large_block[:4] = [x1, y1, x2, y2]
-                        need_remove.append(block_to_remove)
+    bbox_index = BboxIndex(all_bboxes)
+    indices_by_bbox = defaultdict(set)
+    for index, block in enumerate(all_bboxes):
+        indices_by_bbox[tuple(block[:4])].add(index)
+    for i, j in bbox_index.iter_intersecting_pairs():
+        block1, block2 = all_bboxes[i], all_bboxes[j]
+        if block1 != block2:
+            block1_bbox = block1[:4]
+            block2_bbox = block2[:4]
+            overlap_box = get_minbox_if_overlap_by_ratio(
+                block1_bbox, block2_bbox, 0.8
+            )
+            if overlap_box is not None:
+                # 与overlap_box相同的第一个block
+                block_to_remove = all_bboxes[min(indices_by_bbox[tuple(overlap_box)])]
+                if block_to_remove not in need_remove:
+                    large_block, large_index = (block1, i) if block1 != block_to_remove else (block2, j)
+                    x1, y1, x2, y2 = large_block[:4]
+                    sx1, sy1, sx2, sy2 = block_to_remove[:4]
+                    x1 = min(x1, sx1)
+                    y1 = min(y1, sy1)
+                    x2 = max(x2, sx2)
+                    y2 = max(y2, sy2)
+                    indices_by_bbox[tuple(large_block[:4])].discard(large_index)
+                    large_block[:4] = [x1, y1, x2, y2]
+                    indices_by_bbox[tuple(large_block[:4])].add(large_index)
+                    bbox_index.update(large_index, large_block[:4])
+                    need_remove.append(block_to_remove)
 
     if len(need_remove) > 0:
         for block in need_remove:
             all_bboxes.remove(block)
 
-    return all_bboxes
\ No newline at end of file
+    return all_bboxes
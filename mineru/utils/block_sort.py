@@ -12,29 +12,47 @@ from mineru.utils.enum_class import BlockType, ModelPath
 from mineru.utils.models_download_utils import auto_download_and_get_model_root_path
 
 
+# layoutreader最高支持512line，超过LAYOUTREADER_MAX_LINES的页面使用xycut排序
+LAYOUTREADER_MAX_LINES = 200
+# layoutreader批量推理时每个batch的页面数
+LAYOUTREADER_BATCH_SIZE = 16
+
+
 def sort_blocks_by_bbox(blocks, page_w, page_h, footnote_blocks):
+    return batch_sort_blocks_by_bbox([(blocks, page_w, page_h, footnote_blocks)])[0]
+
+
+def batch_sort_blocks_by_bbox(pages):
+    """多页block一起排序，pages中每项为(blocks, page_w, page_h, footnote_blocks)，所有页面的line在layoutreader中批量推理"""
 
     """获取所有line并计算正文line的高度"""
-    line_height = get_line_height(blocks)
+    page_line_lists = []
+    for blocks, page_w, page_h, footnote_blocks in pages:
+        line_height = get_line_height(blocks)
+        page_line_lists.append(get_page_lines(blocks, page_w, page_h, line_height, footnote_blocks))
 
-    """获取所有line并对line排序"""
-    sorted_bboxes = sort_lines_by_model(blocks, page_w, page_h, line_height, footnote_blocks)
+    """对所有页面的line排序"""
+    sorted_bboxes_list = batch_sort_lines_by_model(page_line_lists, [(page_w, page_h) for _, page_w, page_h, _ in pages])
 
-    """根据line的中位数算block的序列关系"""
-    blocks = cal_block_index(blocks, sorted_bboxes)
+    sorted_blocks_list = []
+    for (blocks, _, _, _), sorted_bboxes in zip(pages, sorted_bboxes_list):
+        """根据line的中位数算block的序列关系"""
+        blocks = cal_block_index(blocks, sorted_bboxes)
 
-    """将image和table的block还原回group形式参与后续流程"""
-    blocks = revert_group_blocks(blocks)
+        """将image和table的block还原回group形式参与后续流程"""
+        blocks = revert_group_blocks(blocks)
 
-    """重排block"""
-    sorted_blocks = sorted(blocks, key=lambda b: b['index'])
+        """重排block"""
+        sorted_blocks = sorted(blocks, key=lambda b: b['index'])
 
-    """block内重排(img和table的block内多个caption或footnote的排序)"""
-    for block in sorted_blocks:
-        if block['type'] in [BlockType.IMAGE, BlockType.TABLE]:
-            block['blocks'] = sorted(block['blocks'], key=lambda b: b['index'])
+        """block内重排(img和table的block内多个caption或footnote的排序)"""
+        for block in sorted_blocks:
+            if block['type'] in [BlockType.IMAGE, BlockType.TABLE]:
+                block['blocks'] = sorted(block['blocks'], key=lambda b: b['index'])
+
+        sorted_blocks_list.append(sorted_blocks)
 
-    return sorted_blocks
+    return sorted_blocks_list
 
 
 def get_line_height(blocks):
@@ -54,7 +72,8 @@ def get_line_height(blocks):
         return 10
 
 
-def sort_lines_by_model(fix_blocks, page_w, page_h, line_height, footnote_blocks):
+def get_page_lines(fix_blocks, page_w, page_h, line_height, footnote_blocks):
+    """获取页面中所有参与排序的line，没有line的block按行高切分出虚拟line"""
     page_line_list = []
 
     def add_lines_to_block(b):
@@ -87,10 +106,51 @@ def sort_lines_by_model(fix_blocks, page_w, page_h, line_height, footnote_blocks
         footnote_block = {'bbox': block[:4]}
         add_lines_to_block(footnote_block)
 
-    if len(page_line_list) > 200:  # layoutreader最高支持512line
-        return None
+    return page_line_list
 
-    # 使用layoutreader排序
+
+def sort_lines_by_model(fix_blocks, page_w, page_h, line_height, footnote_blocks):
+    page_line_list = get_page_lines(fix_blocks, page_w, page_h, line_height, footnote_blocks)
+    return batch_sort_lines_by_model([page_line_list], [(page_w, page_h)])[0]
+
+
+def batch_sort_lines_by_model(page_line_lists, page_sizes, batch_size=LAYOUTREADER_BATCH_SIZE):
+    """对多页的line用layoutreader批量排序，返回每页排序后的line bbox列表。
+    line数超过LAYOUTREADER_MAX_LINES的页面返回None，由cal_block_index改用xycut排序。
+    """
+    sorted_bboxes_list = [None] * len(page_line_lists)
+    model_page_indices = []
+    page_boxes = {}
+    for page_index, (page_line_list, (page_w, page_h)) in enumerate(zip(page_line_lists, page_sizes)):
+        if len(page_line_list) > LAYOUTREADER_MAX_LINES:
+            logger.info(
+                f'page has {len(page_line_list)} lines, exceeds layoutreader limit {LAYOUTREADER_MAX_LINES}, fallback to xycut'
+            )
+            continue
+        if len(page_line_list) == 0:
+            sorted_bboxes_list[page_index] = []
+            continue
+        page_boxes[page_index] = scale_lines_for_layoutreader(page_line_list, page_w, page_h)
+        model_page_indices.append(page_index)
+
+    if len(model_page_indices) > 0:
+        # 按line数排序后分batch，减少补齐的长度
+        model_page_indices.sort(key=lambda i: len(page_boxes[i]))
+        model_manager = ModelSingleton()
+        model = model_manager.get_model('layoutreader')
+        for start in range(0, len(model_page_indices), batch_size):
+            batch_page_indices = model_page_indices[start:start + batch_size]
+            with torch.no_grad():
+                orders_list = do_predict_batch([page_boxes[i] for i in batch_page_indices], model)
+            for page_index, orders in zip(batch_page_indices, orders_list):
+                page_line_list = page_line_lists[page_index]
+                sorted_bboxes_list[page_index] = [page_line_list[i] for i in orders]
+
+    return sorted_bboxes_list
+
+
+def scale_lines_for_layoutreader(page_line_list, page_w, page_h):
+    """line的bbox裁剪到页面范围内并缩放到layoutreader要求的0-1000坐标"""
     x_scale = 1000.0 / page_w
     y_scale = 1000.0 / page_h
     boxes = []
@@ -125,13 +185,7 @@ def sort_lines_by_model(fix_blocks, page_w, page_h, line_height, footnote_blocks
             1000 >= right >= left >= 0 and 1000 >= bottom >= top >= 0
         ), f'Invalid box. right: {right}, left: {left}, bottom: {bottom}, top: {top}'  # noqa: E126, E121
         boxes.append([left, top, right, bottom])
-    model_manager = ModelSingleton()
-    model = model_manager.get_model('layoutreader')
-    with torch.no_grad():
-        orders = do_predict(boxes, model)
-    sorted_bboxes = [page_line_list[i] for i in orders]
-
-    return sorted_bboxes
+    return boxes
 
 
 def insert_lines_into_block(block_bbox, line_height, page_w, page_h):
@@ -226,16 +280,20 @@ class ModelSingleton:
 
 
 def do_predict(boxes: List[List[int]], model) -> List[int]:
+    return do_predict_batch([boxes], model)[0]
+
+
+def do_predict_batch(boxes_list: List[List[List[int]]], model) -> List[List[int]]:
     from mineru.model.reading_order.layout_reader import (
-        boxes2inputs, parse_logits, prepare_inputs)
+        batch_boxes2inputs, parse_logits, prepare_inputs)
 
     with warnings.catch_warnings():
         warnings.filterwarnings("ignore", category=FutureWarning, module="transformers")
 
-        inputs = boxes2inputs(boxes)
+        inputs = batch_boxes2inputs(boxes_list)
         inputs = prepare_inputs(inputs, model)
-        logits = model(**inputs).logits.cpu().squeeze(0)
-    return parse_logits(logits, len(boxes))
+        logits = model(**inputs).logits.cpu()
+    return [parse_logits(logits[i], len(boxes)) for i, boxes in enumerate(boxes_list)]
 
 
 def cal_block_index(fix_blocks, sorted_bboxes):
@@ -260,7 +318,7 @@ def cal_block_index(fix_blocks, sorted_bboxes):
                     block['lines'] = copy.deepcopy(block['real_lines'])
                     del block['real_lines']
     else:
-        # 使用xycut排序
+        # line数超过layoutreader上限的页面使用xycut排序
         block_bboxes = []
         for block in fix_blocks:
             # 如果block['bbox']任意值小于0，将其置为0
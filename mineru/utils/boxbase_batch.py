@@ -0,0 +1,149 @@
+# Copyright (c) Opendatalab. All rights reserved.
+"""boxbase中几何函数的批量版本，一次计算两组bbox之间的N×M矩阵。
+
+各函数的计算顺序与boxbase中对应的标量函数保持一致，坐标为int或float时结果逐元素相同；
+坐标来自float32等低精度类型时可能有细微差别，因此用于阈值判断时使用matrix_over_threshold，
+阈值附近的元素交给标量函数确认。
+"""
+import numpy as np
+
+# 批量计算结果用于初筛时的阈值余量，最终判断仍以boxbase中的标量函数为准
+FLOAT_TOLERANCE = 1e-6
+
+
+def to_bbox_array(bboxes) -> np.ndarray:
+    """list[bbox]转为(N, 4)的float64数组，bbox只取前4个元素"""
+    if isinstance(bboxes, np.ndarray):
+        return bboxes.astype(np.float64, copy=False).reshape(-1, 4)
+    return np.array([bbox[:4] for bbox in bboxes], dtype=np.float64).reshape(-1, 4)
+
+
+def _intersection(bboxes1, bboxes2):
+    bboxes1, bboxes2 = to_bbox_array(bboxes1), to_bbox_array(bboxes2)
+    x_left = np.maximum(bboxes1[:, None, 0], bboxes2[None, :, 0])
+    y_top = np.maximum(bboxes1[:, None, 1], bboxes2[None, :, 1])
+    x_right = np.minimum(bboxes1[:, None, 2], bboxes2[None, :, 2])
+    y_bottom = np.minimum(bboxes1[:, None, 3], bboxes2[None, :, 3])
+    intersection_area = (x_right - x_left) * (y_bottom - y_top)
+    overlapped = (x_right >= x_left) & (y_bottom >= y_top)
+    return bboxes1, bboxes2, intersection_area, overlapped
+
+
+def _area(bboxes):
+    return (bboxes[:, 2] - bboxes[:, 0]) * (bboxes[:, 3] - bboxes[:, 1])
+
+
+def calculate_overlap_area_in_bbox1_area_ratio_matrix(bboxes1, bboxes2) -> np.ndarray:
+    """matrix[i, j] = calculate_overlap_area_in_bbox1_area_ratio(bboxes1[i], bboxes2[j])"""
+    bboxes1, bboxes2, intersection_area, overlapped = _intersection(bboxes1, bboxes2)
+    bbox1_area = _area(bboxes1)[:, None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = intersection_area / bbox1_area
+    return np.where(overlapped & (bbox1_area != 0), ratio, 0.0)
+
+
+def calculate_overlap_area_2_minbox_area_ratio_matrix(bboxes1, bboxes2) -> np.ndarray:
+    """matrix[i, j] = calculate_overlap_area_2_minbox_area_ratio(bboxes1[i], bboxes2[j])"""
+    bboxes1, bboxes2, intersection_area, overlapped = _intersection(bboxes1, bboxes2)
+    min_box_area = np.minimum(_area(bboxes1)[:, None], _area(bboxes2)[None, :])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = intersection_area / min_box_area
+    return np.where(overlapped & (min_box_area != 0), ratio, 0.0)
+
+
+def calculate_iou_matrix(bboxes1, bboxes2) -> np.ndarray:
+    """matrix[i, j] = calculate_iou(bboxes1[i], bboxes2[j])"""
+    bboxes1, bboxes2, intersection_area, overlapped = _intersection(bboxes1, bboxes2)
+    bbox1_area = _area(bboxes1)[:, None]
+    bbox2_area = _area(bboxes2)[None, :]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        iou = intersection_area / (bbox1_area + bbox2_area - intersection_area)
+    return np.where(overlapped & (bbox1_area != 0) & (bbox2_area != 0), iou, 0.0)
+
+
+def calculate_vertical_projection_overlap_ratio_matrix(bboxes1, bboxes2) -> np.ndarray:
+    """matrix[i, j] = calculate_vertical_projection_overlap_ratio(bboxes1[i], bboxes2[j])"""
+    bboxes1, bboxes2 = to_bbox_array(bboxes1), to_bbox_array(bboxes2)
+    x_left = np.maximum(bboxes1[:, None, 0], bboxes2[None, :, 0])
+    x_right = np.minimum(bboxes1[:, None, 2], bboxes2[None, :, 2])
+    block1_length = (bboxes1[:, 2] - bboxes1[:, 0])[:, None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = (x_right - x_left) / block1_length
+    return np.where((x_right >= x_left) & (block1_length != 0), ratio, 0.0)
+
+
+def is_in_matrix(bboxes1, bboxes2) -> np.ndarray:
+    """matrix[i, j] = is_in(bboxes1[i], bboxes2[j])"""
+    bboxes1, bboxes2 = to_bbox_array(bboxes1), to_bbox_array(bboxes2)
+    return (
+        (bboxes1[:, None, 0] >= bboxes2[None, :, 0])
+        & (bboxes1[:, None, 1] >= bboxes2[None, :, 1])
+        & (bboxes1[:, None, 2] <= bboxes2[None, :, 2])
+        & (bboxes1[:, None, 3] <= bboxes2[None, :, 3])
+    )
+
+
+def bbox_relative_pos_matrix(bboxes1, bboxes2):
+    """bbox_relative_pos的批量版本，返回(left, right, bottom, top)四个N×M的bool矩阵"""
+    bboxes1, bboxes2 = to_bbox_array(bboxes1), to_bbox_array(bboxes2)
+    left = bboxes2[None, :, 2] < bboxes1[:, None, 0]
+    right = bboxes1[:, None, 2] < bboxes2[None, :, 0]
+    bottom = bboxes2[None, :, 3] < bboxes1[:, None, 1]
+    top = bboxes1[:, None, 3] < bboxes2[None, :, 1]
+    return left, right, bottom, top
+
+
+def bbox_distance_matrix(bboxes1, bboxes2) -> np.ndarray:
+    """matrix[i, j] = bbox_distance(bboxes1[i], bboxes2[j])"""
+    bboxes1, bboxes2 = to_bbox_array(bboxes1), to_bbox_array(bboxes2)
+    x1, y1, x1b, y1b = (bboxes1[:, None, k] for k in range(4))
+    x2, y2, x2b, y2b = (bboxes2[None, :, k] for k in range(4))
+    left, right, bottom, top = bbox_relative_pos_matrix(bboxes1, bboxes2)
+
+    def dist(px1, py1, px2, py2):
+        return np.sqrt((px1 - px2) ** 2 + (py1 - py2) ** 2)
+
+    # 与标量版本的if/elif顺序一致，先命中的条件优先
+    conditions = [
+        top & left,
+        left & bottom,
+        bottom & right,
+        right & top,
+        left,
+        right,
+        bottom,
+        top,
+    ]
+    choices = [
+        dist(x1, y1b, x2b, y2),
+        dist(x1, y1, x2b, y2b),
+        dist(x1b, y1, x2, y2b),
+        dist(x1b, y1b, x2, y2),
+        x1 - x2b,
+        x2 - x1b,
+        y1 - y2b,
+        y2 - y1b,
+    ]
+    shape = (len(bboxes1), len(bboxes2))
+    return np.select(
+        [np.broadcast_to(c, shape) for c in conditions],
+        [np.broadcast_to(c, shape) for c in choices],
+        default=0.0,
+    )
+
+
+def matrix_over_threshold(matrix, threshold, bboxes1, bboxes2, scalar_func, or_equal=False) -> np.ndarray:
+    """返回 matrix > threshold（or_equal为True时是>=）的bool矩阵。
+
+    落在阈值附近FLOAT_TOLERANCE范围内的元素用标量函数scalar_func(bboxes1[i], bboxes2[j])重新判断，
+    保证结果与逐对调用标量函数完全一致。
+    """
+    if or_equal:
+        result = matrix >= threshold + FLOAT_TOLERANCE
+    else:
+        result = matrix > threshold + FLOAT_TOLERANCE
+    uncertain = np.abs(matrix - threshold) <= FLOAT_TOLERANCE
+    for i, j in zip(*np.nonzero(uncertain)):
+        value = scalar_func(bboxes1[i], bboxes2[j])
+        result[i, j] = value >= threshold if or_equal else value > threshold
+    return result
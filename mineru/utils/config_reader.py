@@ -102,6 +102,86 @@ def get_table_enable(table_enable):
     return table_enable
 
 
+def get_ocr_engine(ocr_engine=None):
+    """pipeline中ocr det/rec网络的推理引擎，MINERU_OCR_ENGINE可选torch（默认）、onnxruntime（CPU）"""
+    ocr_engine_env = os.getenv('MINERU_OCR_ENGINE')
+    ocr_engine = (ocr_engine or 'torch') if ocr_engine_env is None else ocr_engine_env.lower()
+    if ocr_engine not in ['torch', 'onnxruntime']:
+        logger.warning(f"unsupported ocr engine: {ocr_engine}, use torch instead")
+        ocr_engine = 'torch'
+    return ocr_engine
+
+
+def get_ocr_det_canvas_enable():
+    """MINERU_OCR_DET_CANVAS_ENABLE为false时，ocr检测的批处理不再把小裁剪图拼接到画布上，只按分辨率分组padding"""
+    return os.getenv('MINERU_OCR_DET_CANVAS_ENABLE', 'true').lower() == 'true'
+
+
+def get_pipeline_streaming_enable(streaming_enable=True):
+    """pipeline后端默认使用doc_analyze_streaming，渲染、推理和middle_json构造重叠执行；MINERU_PIPELINE_STREAMING_ENABLE为false时退回整批处理"""
+    streaming_enable_env = os.getenv('MINERU_PIPELINE_STREAMING_ENABLE')
+    streaming_enable = streaming_enable if streaming_enable_env is None else streaming_enable_env.lower() == 'true'
+    return streaming_enable
+
+
+def get_result_cache_config():
+    """结果缓存配置，MINERU_RESULT_CACHE_DIR为本地目录或s3://bucket/prefix，未设置时不启用缓存"""
+    cache_dir = os.getenv('MINERU_RESULT_CACHE_DIR')
+    if not cache_dir:
+        return None
+    max_size_mb = int(os.getenv('MINERU_RESULT_CACHE_MAX_SIZE_MB', 10240))
+    return {'cache_dir': cache_dir, 'max_size': max_size_mb * 1024 * 1024}
+
+
+def get_page_cache_config():
+    """pipeline页面级推理缓存配置，MINERU_PAGE_CACHE_ENABLE为true时启用内存缓存，
+    设置MINERU_PAGE_CACHE_DB时额外用该路径的sqlite文件做持久化（此时默认启用），都未设置时不启用缓存"""
+    db_path = os.getenv('MINERU_PAGE_CACHE_DB') or None
+    enable_env = os.getenv('MINERU_PAGE_CACHE_ENABLE')
+    enable = db_path is not None if enable_env is None else enable_env.lower() == 'true'
+    if not enable:
+        return None
+    memory_size_mb = int(os.getenv('MINERU_PAGE_CACHE_MEMORY_SIZE_MB', 256))
+    db_max_size_mb = int(os.getenv('MINERU_PAGE_CACHE_DB_MAX_SIZE_MB', 4096))
+    return {
+        'memory_max_size': memory_size_mb * 1024 * 1024,
+        'db_path': db_path,
+        'db_max_size': db_max_size_mb * 1024 * 1024,
+    }
+
+
+def get_vlm_image_codec():
+    """vlm客户端发送页面图像使用的编码，MINERU_VLM_IMAGE_CODEC可选png（默认）、webp（无损）、jpeg"""
+    codec = os.getenv('MINERU_VLM_IMAGE_CODEC', 'png').lower()
+    if codec not in ['png', 'webp', 'jpeg']:
+        logger.warning(f"unsupported MINERU_VLM_IMAGE_CODEC: {codec}, use png instead")
+        codec = 'png'
+    return codec
+
+
+def get_vlm_image_prescale_enable():
+    """MINERU_VLM_IMAGE_PRESCALE为true时，发送前先把页面图像缩放到模型anyres处理时使用的分辨率"""
+    return os.getenv('MINERU_VLM_IMAGE_PRESCALE', 'false').lower() == 'true'
+
+
+def get_vlm_page_budget_enable():
+    """MINERU_VLM_PAGE_BUDGET_ENABLE为true时按页面估计max_new_tokens并跳过空白页，默认不启用，
+    所有页面都使用predictor的max_new_tokens"""
+    return os.getenv('MINERU_VLM_PAGE_BUDGET_ENABLE', 'false').lower() == 'true'
+
+
+def get_generation_guard_config():
+    """vlm生成退化检测配置，MINERU_VLM_GUARD_ENABLE为false时不启用，
+    MINERU_VLM_GUARD_RETRY为true时对被截断的页面加强重复惩罚重试一次"""
+    if os.getenv('MINERU_VLM_GUARD_ENABLE', 'true').lower() != 'true':
+        return None
+    return {
+        'max_block_chars': int(os.getenv('MINERU_VLM_GUARD_MAX_BLOCK_CHARS', 65536)),
+        'max_repeated_blocks': int(os.getenv('MINERU_VLM_GUARD_MAX_REPEATED_BLOCKS', 10)),
+        'retry': os.getenv('MINERU_VLM_GUARD_RETRY', 'false').lower() == 'true',
+    }
+
+
 def get_latex_delimiter_config():
     config = read_config()
     if config is None:
@@ -1,9 +1,11 @@
 import time
 import gc
+from collections import defaultdict
 from PIL import Image
 from loguru import logger
 import numpy as np
 
+from mineru.utils.bbox_index import BboxIndex
 from mineru.utils.boxbase import get_minbox_if_overlap_by_ratio
 
 try:
@@ -208,31 +210,34 @@ def filter_nested_tables(table_res_list, overlap_threshold=0.8, area_threshold=0
 def remove_overlaps_min_blocks(res_list):
     #  重叠block，小的不能直接删除，需要和大的那个合并成一个更大的。
     #  删除重叠blocks中较小的那些
+    #  借助空间索引只比较相交的block对，遍历顺序和判断逻辑与逐对比较所有block一致
     need_remove = []
-    for res1 in res_list:
-        for res2 in res_list:
-            if res1 != res2:
-                overlap_box = get_minbox_if_overlap_by_ratio(
-                    res1['bbox'], res2['bbox'], 0.8
-                )
-                if overlap_box is not None:
-                    res_to_remove = next(
-                        (res for res in res_list if res['bbox'] == overlap_box),
-                        None,
-                    )
-                    if (
-                        res_to_remove is not None
-                        and res_to_remove not in need_remove
-                    ):
-                        large_res = res1 if res1 != res_to_remove else res2
-                        x1, y1, x2, y2 = large_res['bbox']
-                        sx1, sy1, sx2, sy2 = res_to_remove['bbox']
-                        x1 = min(x1, sx1)
-                        y1 = min(y1, sy1)
-                        x2 = max(x2, sx2)
-                        y2 = max(y2, sy2)
-                        large_res['bbox'] = [x1, y1, x2, y2]
-                        need_remove.append(res_to_remove)
+    bbox_index = BboxIndex([res['bbox'] for res in res_list])
+    indices_by_bbox = defaultdict(set)
+    for index, res in enumerate(res_list):
+        indices_by_bbox[tuple(res['bbox'])].add(index)
+    for i, j in bbox_index.iter_intersecting_pairs():
+        res1, res2 = res_list[i], res_list[j]
+        if res1 != res2:
+            overlap_box = get_minbox_if_overlap_by_ratio(
+                res1['bbox'], res2['bbox'], 0.8
+            )
+            if overlap_box is not None:
+                # 与overlap_box相同的第一个block
+                res_to_remove = res_list[min(indices_by_bbox[tuple(overlap_box)])]
+                if res_to_remove not in need_remove:
+                    large_res, large_index = (res1, i) if res1 != res_to_remove else (res2, j)
+                    x1, y1, x2, y2 = large_res['bbox']
+                    sx1, sy1, sx2, sy2 = res_to_remove['bbox']
+                    x1 = min(x1, sx1)
+                    y1 = min(y1, sy1)
+                    x2 = max(x2, sx2)
+                    y2 = max(y2, sy2)
+                    indices_by_bbox[tuple(large_res['bbox'])].discard(large_index)
+                    large_res['bbox'] = [x1, y1, x2, y2]
+                    indices_by_bbox[tuple(large_res['bbox'])].add(large_index)
+                    bbox_index.update(large_index, large_res['bbox'])
+                    need_remove.append(res_to_remove)
 
     if len(need_remove) > 0:
         for res in need_remove:
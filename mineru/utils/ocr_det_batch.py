@@ -0,0 +1,189 @@
+# Copyright (c) Opendatalab. All rights reserved.
+"""ocr检测的批处理：把小尺寸的裁剪图拼接到固定尺寸的画布上一起检测，再把检测框映射回各裁剪图的坐标系；
+放不进画布的大图仍按分辨率分组、padding到组内最大尺寸后批量检测。"""
+from collections import defaultdict
+
+import numpy as np
+
+# 画布边长不超过det的limit_side_len(960)，检测前不会被缩放，检测框坐标与拼接前一致
+OCR_DET_CANVAS_SIZE = 960
+# 画布上裁剪图之间的白色间隔；裁剪图四周已有crop_paste留下的白边，间隔只需避免相邻裁剪图的文本被检测成同一个框
+OCR_DET_CANVAS_GUTTER = 16
+
+
+def _round_up_32(size):
+    return ((size + 32 - 1) // 32) * 32
+
+
+def pack_crops(crop_sizes, canvas_size=OCR_DET_CANVAS_SIZE, gutter=OCR_DET_CANVAS_GUTTER):
+    """按高度降序逐行（First-Fit Decreasing Height）把裁剪图排布到canvas_size×canvas_size的画布上
+
+    Args:
+        crop_sizes: list[(h, w)]
+    Returns:
+        placements: list[(canvas_index, x, y) | None]，与crop_sizes一一对应，超过画布尺寸的裁剪图为None
+        canvas_shapes: list[(h, w)]，用到的高宽向上取整到32的倍数；除最后一张外的画布基本都是排满的，
+            统一使用其中的最大尺寸，便于一起batch推理
+    """
+    placements = [None] * len(crop_sizes)
+    order = sorted(
+        (i for i, (h, w) in enumerate(crop_sizes) if h <= canvas_size and w <= canvas_size),
+        key=lambda i: -crop_sizes[i][0],
+    )
+    # shelves: [canvas_index, y, 下一个裁剪图的x]；canvas_heights: 各画布上已经用掉的高度
+    shelves, canvas_heights, canvas_widths = [], [], []
+    for i in order:
+        h, w = crop_sizes[i]
+        # 高度降序，已有的行都不低于当前裁剪图，放进第一个宽度足够的行
+        shelf = next((shelf for shelf in shelves if shelf[2] + w <= canvas_size), None)
+        if shelf is None:
+            canvas_index = next(
+                (index for index, height in enumerate(canvas_heights) if height + gutter + h <= canvas_size), None
+            )
+            if canvas_index is None:
+                canvas_index = len(canvas_heights)
+                canvas_heights.append(-gutter)
+                canvas_widths.append(0)
+            shelf = [canvas_index, canvas_heights[canvas_index] + gutter, 0]
+            canvas_heights[canvas_index] = shelf[1] + h
+            shelves.append(shelf)
+        placements[i] = (shelf[0], shelf[2], shelf[1])
+        canvas_widths[shelf[0]] = max(canvas_widths[shelf[0]], shelf[2] + w)
+        shelf[2] += w + gutter
+    canvas_shapes = [(_round_up_32(h), _round_up_32(w)) for h, w in zip(canvas_heights, canvas_widths)]
+    if len(canvas_shapes) > 1:
+        full_shape = (max(h for h, _ in canvas_shapes[:-1]), max(w for _, w in canvas_shapes[:-1]))
+        last_h, last_w = canvas_shapes[-1]
+        canvas_shapes[:-1] = [full_shape] * (len(canvas_shapes) - 1)
+        if last_h <= full_shape[0] and last_w <= full_shape[1] and last_h * last_w * 2 > full_shape[0] * full_shape[1]:
+            # 最后一张画布也比较满时与其他画布一起推理
+            canvas_shapes[-1] = full_shape
+    return placements, canvas_shapes
+
+
+def render_canvases(images, placements, canvas_shapes):
+    """把裁剪图粘贴到白色画布上"""
+    canvases = [np.full((h, w, 3), 255, dtype=np.uint8) for h, w in canvas_shapes]
+    for img, placement in zip(images, placements):
+        if placement is not None:
+            canvas_index, x, y = placement
+            h, w = img.shape[:2]
+            canvases[canvas_index][y:y + h, x:x + w] = img
+    return canvases
+
+
+def split_canvas_boxes(dt_boxes, crop_rects):
+    """把一张画布上的检测框按中心点分配给所在的裁剪图，并转换到裁剪图的坐标系
+
+    Args:
+        dt_boxes: 画布上的检测框，shape为(N, 4, 2)
+        crop_rects: list[(x, y, w, h)]，这张画布上各裁剪图的位置
+    Returns:
+        list[np.ndarray]，与crop_rects一一对应，每个元素shape为(M, 4, 2)；中心落在间隔中的框被丢弃
+    """
+    crop_boxes = [[] for _ in crop_rects]
+    if dt_boxes is None or len(dt_boxes) == 0 or len(crop_rects) == 0:
+        return [np.array(boxes) for boxes in crop_boxes]
+    rects = np.array(crop_rects, dtype=np.float32)
+    centers = np.asarray(dt_boxes, dtype=np.float32).mean(axis=1)
+    inside = (
+        (centers[:, None, 0] >= rects[None, :, 0]) & (centers[:, None, 0] < rects[None, :, 0] + rects[None, :, 2])
+        & (centers[:, None, 1] >= rects[None, :, 1]) & (centers[:, None, 1] < rects[None, :, 1] + rects[None, :, 3])
+    )
+    for box, box_inside in zip(dt_boxes, inside):
+        matched = np.flatnonzero(box_inside)
+        if len(matched) == 0:
+            continue
+        x, y, w, h = crop_rects[matched[0]]
+        box = np.array(box, dtype=np.float32) - np.array([x, y], dtype=np.float32)
+        # 与TextDetector.filter_tag_det_res一致，裁剪到图像范围内并过滤过小的框
+        box[:, 0] = np.clip(box[:, 0], 0, w - 1)
+        box[:, 1] = np.clip(box[:, 1], 0, h - 1)
+        if int(np.linalg.norm(box[0] - box[1])) <= 3 or int(np.linalg.norm(box[0] - box[3])) <= 3:
+            continue
+        crop_boxes[matched[0]].append(box)
+    return [np.array(boxes) for boxes in crop_boxes]
+
+
+def batch_det_with_canvases(text_detector, images, max_batch_size, canvas_size=OCR_DET_CANVAS_SIZE, gutter=OCR_DET_CANVAS_GUTTER):
+    """把images拼接到画布上批量检测
+
+    Returns:
+        list[np.ndarray | None]，与images一一对应的检测框，放不进画布的图像为None
+    """
+    placements, canvas_shapes = pack_crops([img.shape[:2] for img in images], canvas_size, gutter)
+    canvases = render_canvases(images, placements, canvas_shapes)
+    results = [None] * len(images)
+
+    canvas_crops = defaultdict(list)
+    for i, (img, placement) in enumerate(zip(images, placements)):
+        if placement is not None:
+            canvas_index, x, y = placement
+            canvas_crops[canvas_index].append((i, (x, y, img.shape[1], img.shape[0])))
+
+    # batch_predict要求同一batch内尺寸一致，按画布尺寸分组
+    shape_groups = defaultdict(list)
+    for canvas_index, canvas_shape in enumerate(canvas_shapes):
+        shape_groups[canvas_shape].append(canvas_index)
+    for canvas_indices in shape_groups.values():
+        batch_results = text_detector.batch_predict(
+            [canvases[canvas_index] for canvas_index in canvas_indices], min(len(canvas_indices), max_batch_size)
+        )
+        for canvas_index, (dt_boxes, _) in zip(canvas_indices, batch_results):
+            indices = [i for i, _ in canvas_crops[canvas_index]]
+            crop_rects = [rect for _, rect in canvas_crops[canvas_index]]
+            for i, boxes in zip(indices, split_canvas_boxes(dt_boxes, crop_rects)):
+                results[i] = boxes
+    return results
+
+
+def batch_det_with_padding(text_detector, images, max_batch_size):
+    """按分辨率分组，组内padding到统一尺寸后批量检测
+
+    Returns:
+        list[np.ndarray | None]，与images一一对应的检测框
+    """
+    # 将尺寸标准化到32的倍数，使用更大的分组容差，减少分组数量
+    resolution_groups = defaultdict(list)
+    for i, img in enumerate(images):
+        h, w = img.shape[:2]
+        resolution_groups[(((h + 32) // 32) * 32, ((w + 32) // 32) * 32)].append(i)
+
+    results = [None] * len(images)
+    for group_indices in resolution_groups.values():
+        # 计算目标尺寸（组内最大尺寸，向上取整到32的倍数）
+        target_h = _round_up_32(max(images[i].shape[0] for i in group_indices))
+        target_w = _round_up_32(max(images[i].shape[1] for i in group_indices))
+
+        # 白色背景，原图像粘贴到左上角
+        batch_images = []
+        for i in group_indices:
+            h, w = images[i].shape[:2]
+            padded_img = np.full((target_h, target_w, 3), 255, dtype=np.uint8)
+            padded_img[:h, :w] = images[i]
+            batch_images.append(padded_img)
+
+        batch_results = text_detector.batch_predict(batch_images, min(len(batch_images), max_batch_size))
+        for i, (dt_boxes, _) in zip(group_indices, batch_results):
+            results[i] = dt_boxes
+    return results
+
+
+def batch_det(text_detector, images, canvas_batch_size, padding_batch_size, canvas_enable=True, gutter=OCR_DET_CANVAS_GUTTER):
+    """批量检测images：小图拼接到画布上检测，放不进画布的大图（或canvas_enable为False时全部图像）按分辨率分组padding后检测
+
+    Returns:
+        list[np.ndarray | None]，与images一一对应的检测框
+    """
+    if canvas_enable:
+        results = batch_det_with_canvases(text_detector, images, canvas_batch_size, gutter=gutter)
+    else:
+        results = [None] * len(images)
+    padding_indices = [i for i, dt_boxes in enumerate(results) if dt_boxes is None]
+    if padding_indices:
+        padding_results = batch_det_with_padding(
+            text_detector, [images[i] for i in padding_indices], padding_batch_size
+        )
+        for i, dt_boxes in zip(padding_indices, padding_results):
+            results[i] = dt_boxes
+    return results
@@ -1,4 +1,6 @@
 # Copyright (c) Opendatalab. All rights reserved.
+import hashlib
+from collections.abc import Mapping
 from io import BytesIO
 
 import pypdfium2 as pdfium
@@ -6,28 +8,81 @@ from loguru import logger
 from PIL import Image
 
 from mineru.data.data_reader_writer import FileBasedDataWriter
-from mineru.utils.pdf_reader import image_to_b64str, image_to_bytes, page_to_image
+from mineru.utils.pdf_reader import image_to_b64str, image_to_bytes, page_to_image, get_pdf_render_workers, \
+    render_pages_parallel, pdfium_lock
 from .hash_utils import str_sha256
 
+# 页数少于该值时进程池的启动开销大于收益，直接串行渲染
+PARALLEL_RENDER_MIN_PAGES = 32
 
-def pdf_page_to_image(page: pdfium.PdfPage, dpi=200) -> dict:
-    """Convert pdfium.PdfDocument to image, Then convert the image to base64.
+
+class PageImage(Mapping):
+    """渲染后的页面图像，按只读字典访问'img_pil'、'scale'、'img_base64'和'img_md5'四个键。
+
+    pipeline后端只需要PIL图像和用于图片命名的指纹，不再为每一页做PNG编码和base64编码；
+    'img_base64'和'img_md5'在第一次访问时才计算并缓存，in、get、keys、items与下标访问看到的键始终一致。
+    """
+
+    KEYS = ("img_pil", "scale", "img_base64", "img_md5")
+
+    def __init__(self, img_pil: Image.Image, scale: float):
+        self.img_pil = img_pil
+        self.scale = scale
+        self._img_base64 = None
+        self._img_md5 = None
+
+    @property
+    def img_base64(self) -> str:
+        if self._img_base64 is None:
+            self._img_base64 = image_to_b64str(self.img_pil)
+        return self._img_base64
+
+    @property
+    def img_md5(self) -> str:
+        if self._img_md5 is None:
+            self._img_md5 = pil_image_md5(self.img_pil)
+        return self._img_md5
+
+    def __getitem__(self, key):
+        if key not in self.KEYS:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def __contains__(self, key):
+        # 只判断键是否存在，不触发编码
+        return key in self.KEYS
+
+    def __iter__(self):
+        return iter(self.KEYS)
+
+    def __len__(self):
+        return len(self.KEYS)
+
+
+def pil_image_md5(pil_img: Image.Image) -> str:
+    """基于原始位图数据计算页面图像指纹，比PNG编码后再哈希快得多"""
+    hasher = hashlib.md5()
+    hasher.update(f"{pil_img.mode}_{pil_img.width}_{pil_img.height}".encode("utf-8"))
+    hasher.update(pil_img.tobytes())
+    return hasher.hexdigest()
+
+
+def pdf_page_to_image(page: pdfium.PdfPage, dpi=200) -> PageImage:
+    """Convert pdfium.PdfPage to image.
 
     Args:
         page (_type_): pdfium.PdfPage
         dpi (int, optional): reset the dpi of dpi. Defaults to 200.
 
     Returns:
-        dict:  {'img_base64': str, 'img_pil': pil_img, 'scale': float }
+        PageImage:  {'img_base64': str, 'img_md5': str, 'img_pil': pil_img, 'scale': float }, 'img_base64' and 'img_md5' are computed on first access
     """
     pil_img, scale = page_to_image(page, dpi=dpi)
-    img_base64 = image_to_b64str(pil_img)
 
-    image_dict = {
-        "img_base64": img_base64,
-        "img_pil": pil_img,
-        "scale": scale,
-    }
+    image_dict = PageImage(
+        img_pil=pil_img,
+        scale=scale,
+    )
     return image_dict
 
 
@@ -37,23 +92,36 @@ def load_images_from_pdf(
     start_page_id=0,
     end_page_id=None,
 ):
-    images_list = []
-    pdf_doc = pdfium.PdfDocument(pdf_bytes)
-    pdf_page_num = len(pdf_doc)
+    with pdfium_lock:
+        pdf_doc = pdfium.PdfDocument(pdf_bytes)
+        pdf_page_num = len(pdf_doc)
     end_page_id = end_page_id if end_page_id is not None and end_page_id >= 0 else pdf_page_num - 1
     if end_page_id > pdf_page_num - 1:
         logger.warning("end_page_id is out of range, use images length")
         end_page_id = pdf_page_num - 1
 
-    for index in range(0, pdf_page_num):
-        if start_page_id <= index <= end_page_id:
-            page = pdf_doc[index]
-            image_dict = pdf_page_to_image(page, dpi=dpi)
-            images_list.append(image_dict)
+    page_indices = list(range(start_page_id, end_page_id + 1))
+    images_list = load_page_images(pdf_bytes, pdf_doc, page_indices, dpi=dpi)
 
     return images_list, pdf_doc
 
 
+def load_page_images(pdf_bytes: bytes, pdf_doc: pdfium.PdfDocument, page_indices: list[int], dpi=200) -> list[PageImage]:
+    """渲染指定页面，页数足够多时使用多进程渲染池，否则在当前进程中串行渲染。
+    逐页持有pdfium_lock，其他线程可以在两页之间访问pdfium。
+    """
+    render_workers = get_pdf_render_workers()
+    if render_workers > 1 and len(page_indices) >= PARALLEL_RENDER_MIN_PAGES:
+        rendered_pages = render_pages_parallel(pdf_bytes, page_indices, dpi=dpi, workers=render_workers)
+    else:
+        rendered_pages = []
+        for index in page_indices:
+            with pdfium_lock:
+                rendered_pages.append(page_to_image(pdf_doc[index], dpi=dpi))
+
+    return [PageImage(img_pil=pil_img, scale=scale) for pil_img, scale in rendered_pages]
+
+
 def cut_image(bbox: tuple, page_num: int, page_pil_img, return_path, image_writer: FileBasedDataWriter, scale=2):
     """从第page_num页的page中，根据bbox进行裁剪出一张jpg图片，返回图片路径 save_path：需要同时支持s3和本地,
     图片存放在save_path下，文件名是:
@@ -1,11 +1,24 @@
 # Copyright (c) Opendatalab. All rights reserved.
+import atexit
 import base64
+import itertools
+import multiprocessing
+import os
+import tempfile
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from io import BytesIO
 
 from loguru import logger
 from PIL import Image
 from pypdfium2 import PdfBitmap, PdfDocument, PdfPage
 
+# pdfium不是线程安全的，进程内所有线程打开/关闭文档、读取页面和文本层、渲染时都要持有这一把锁；
+# 使用可重入锁，持有锁的调用方可以继续调用内部会加锁的函数
+pdfium_lock = threading.RLock()
+
 
 def page_to_image(
     page: PdfPage,
@@ -14,21 +27,205 @@ def page_to_image(
 ) -> (Image.Image, float):
     scale = dpi / 72
 
-    long_side_length = max(*page.get_size())
-    if (long_side_length*scale) > max_width_or_height:
-        scale = max_width_or_height / long_side_length
+    with pdfium_lock:
+        long_side_length = max(*page.get_size())
+        if (long_side_length*scale) > max_width_or_height:
+            scale = max_width_or_height / long_side_length
 
-    bitmap: PdfBitmap = page.render(scale=scale)  # type: ignore
-    try:
-        image = bitmap.to_pil()
-    finally:
+        bitmap: PdfBitmap = page.render(scale=scale)  # type: ignore
         try:
-            bitmap.close()
-        except Exception:
-            pass
+            image = bitmap.to_pil()
+        finally:
+            try:
+                bitmap.close()
+            except Exception:
+                pass
     return image, scale
 
 
+# 每个渲染进程缓存最近打开的文档数
+RENDER_WORKER_MAX_DOCS = 4
+# 渲染进程池为最近使用的文档保留的临时文件数，正在渲染的文档不会被清理
+RENDER_POOL_MAX_DOCS = 4
+
+# 渲染进程内打开的pdf文档，doc_key -> PdfDocument，按最近使用排序
+_render_worker_docs: OrderedDict = OrderedDict()
+
+
+def _get_render_worker_doc(doc_key: int, pdf_path: str) -> PdfDocument:
+    pdf_doc = _render_worker_docs.pop(doc_key, None)
+    if pdf_doc is None:
+        # 读入内存后打开，父进程可以随时删除临时文件
+        with open(pdf_path, 'rb') as f:
+            pdf_doc = PdfDocument(f.read())
+        while len(_render_worker_docs) >= RENDER_WORKER_MAX_DOCS:
+            _, old_doc = _render_worker_docs.popitem(last=False)
+            old_doc.close()
+    _render_worker_docs[doc_key] = pdf_doc
+    return pdf_doc
+
+
+def _render_worker_pages(
+    doc_key: int,
+    pdf_path: str,
+    page_indices: list[int],
+    dpi: int,
+    max_width_or_height: int,
+) -> list[tuple[int, str, tuple[int, int], bytes, float]]:
+    # 以原始位图数据返回，避免pickle PIL图像对象
+    pdf_doc = _get_render_worker_doc(doc_key, pdf_path)
+    results = []
+    for page_index in page_indices:
+        image, scale = page_to_image(pdf_doc[page_index], dpi, max_width_or_height)
+        results.append((page_index, image.mode, image.size, image.tobytes(), scale))
+    return results
+
+
+class RenderPool:
+    """常驻的渲染进程池，进程只在第一次使用时启动一次。
+
+    pdf数据写入临时文件，各渲染进程第一次渲染某个文档时读取一次并缓存打开的文档，
+    之后同一文档的各批页面只传递文件路径和页码，不再把pdf_bytes发送给每个进程。
+    """
+
+    def __init__(self, workers: int):
+        self.workers = workers
+        # spawn启动的子进程不会继承父进程中的模型、CUDA上下文和线程
+        self.executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'))
+        self._lock = threading.Lock()
+        self._doc_keys = itertools.count()
+        # id(pdf_bytes) -> [pdf_bytes, doc_key, 临时文件路径, 正在渲染的调用数]，按最近使用排序；
+        # 持有pdf_bytes的引用，缓存期间id不会被其他对象复用
+        self._docs = OrderedDict()
+
+    def _acquire_doc(self, pdf_bytes: bytes) -> tuple[int, str]:
+        with self._lock:
+            entry = self._docs.pop(id(pdf_bytes), None)
+            if entry is None:
+                fd, pdf_path = tempfile.mkstemp(prefix='mineru_render_', suffix='.pdf')
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(pdf_bytes)
+                entry = [pdf_bytes, next(self._doc_keys), pdf_path, 0]
+            entry[3] += 1
+            self._docs[id(pdf_bytes)] = entry
+            # 超出数量时清理最久未使用且没有在渲染的文档
+            idle_keys = [key for key, (_, _, _, users) in self._docs.items() if users == 0]
+            for key in idle_keys[:max(len(self._docs) - RENDER_POOL_MAX_DOCS, 0)]:
+                _remove_file(self._docs.pop(key)[2])
+            return entry[1], entry[2]
+
+    def _release_doc(self, pdf_bytes: bytes):
+        with self._lock:
+            entry = self._docs.get(id(pdf_bytes))
+            if entry is not None:
+                entry[3] -= 1
+
+    def render(
+        self,
+        pdf_bytes: bytes,
+        page_indices: list[int],
+        dpi: int = 144,
+        max_width_or_height: int = 2560,
+    ) -> list[tuple[Image.Image, float]]:
+        doc_key, pdf_path = self._acquire_doc(pdf_bytes)
+        try:
+            # 每个进程分到多段连续页码，既能均衡负载又能让结果尽早返回
+            chunk_size = max(1, -(-len(page_indices) // (self.workers * 4)))
+            futures = [
+                self.executor.submit(
+                    _render_worker_pages, doc_key, pdf_path, page_indices[i:i + chunk_size], dpi, max_width_or_height
+                )
+                for i in range(0, len(page_indices), chunk_size)
+            ]
+            results = {}
+            for future in futures:
+                for page_index, mode, size, image_bytes, scale in future.result():
+                    results[page_index] = (Image.frombytes(mode, size, image_bytes), scale)
+        finally:
+            self._release_doc(pdf_bytes)
+        return [results[i] for i in page_indices]
+
+    def close(self):
+        self.executor.shutdown(wait=True, cancel_futures=True)
+        with self._lock:
+            for _, _, pdf_path, _ in self._docs.values():
+                _remove_file(pdf_path)
+            self._docs.clear()
+
+
+def _remove_file(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
+
+
+_render_pool: RenderPool | None = None
+_render_pool_lock = threading.Lock()
+
+
+def get_render_pool(workers: int) -> RenderPool:
+    """进程内共享的渲染进程池，进程数变化时重建"""
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is not None and _render_pool.workers != workers:
+            _render_pool.close()
+            _render_pool = None
+        if _render_pool is None:
+            _render_pool = RenderPool(workers)
+        return _render_pool
+
+
+def close_render_pool(render_pool: RenderPool | None = None):
+    """关闭共享的渲染进程池，指定render_pool时只在它仍是当前进程池时关闭"""
+    global _render_pool
+    with _render_pool_lock:
+        if _render_pool is None or (render_pool is not None and render_pool is not _render_pool):
+            return
+        closing_pool, _render_pool = _render_pool, None
+    closing_pool.close()
+
+
+atexit.register(close_render_pool)
+
+
+def get_pdf_render_workers() -> int:
+    """渲染进程数，可通过环境变量MINERU_PDF_RENDER_WORKERS设置，默认为1即串行渲染。
+    子进程以spawn方式启动，调用方的入口脚本需要有 if __name__ == '__main__' 保护。
+    """
+    return max(1, int(os.getenv('MINERU_PDF_RENDER_WORKERS', 1)))
+
+
+def render_pages_parallel(
+    pdf_bytes: bytes,
+    page_indices: list[int],
+    dpi: int = 144,
+    max_width_or_height: int = 2560,
+    workers: int | None = None,
+) -> list[tuple[Image.Image, float]]:
+    """使用常驻的进程池并行渲染pdf页面，同一文档分多次调用（如流式处理的各个页面窗口）时复用进程和已打开的文档。
+
+    返回结果与page_indices一一对应，元素为(image, scale)。
+    """
+    workers = get_pdf_render_workers() if workers is None else workers
+    if workers <= 1 or len(page_indices) <= 1:
+        with pdfium_lock:
+            doc = PdfDocument(pdf_bytes)
+        try:
+            return [page_to_image(doc[i], dpi, max_width_or_height) for i in page_indices]
+        finally:
+            with pdfium_lock:
+                doc.close()
+
+    render_pool = get_render_pool(workers)
+    try:
+        return render_pool.render(pdf_bytes, page_indices, dpi, max_width_or_height)
+    except BrokenProcessPool:
+        # 渲染进程异常退出后进程池不可再用，下次调用时重建
+        close_render_pool(render_pool)
+        raise
+
+
 def image_to_bytes(
     image: Image.Image,
     image_format: str = "PNG",  # 也可以用 "JPEG"
@@ -0,0 +1,267 @@
+# Copyright (c) Opendatalab. All rights reserved.
+"""do_parse的文档级结果缓存。
+
+以pdf内容的md5和解析参数作为key，缓存middle_json、模型输出和裁剪出的图片，
+同一份pdf以相同参数重复提交时直接复用结果，不再走推理流程。
+缓存存放在本地目录或s3上，按总大小做LRU淘汰。
+"""
+import io
+import json
+import os
+import threading
+import time
+import zipfile
+from abc import ABC, abstractmethod
+
+from loguru import logger
+
+from mineru.data.data_reader_writer import DataWriter
+from mineru.utils.config_reader import get_llm_aided_config, get_result_cache_config, get_s3_config_dict, \
+    parse_bucket_key
+from mineru.utils.hash_utils import bytes_md5, dict_md5
+from mineru.version import __version__
+
+INDEX_KEY = 'index.json'
+# 命中时只在内存中记录访问时间，最多每隔这么多秒合并写回index.json一次
+INDEX_FLUSH_INTERVAL = 60
+
+
+class ResultCacheStorage(ABC):
+    """缓存的存储后端，按key读写完整的二进制数据"""
+
+    @abstractmethod
+    def read(self, key: str) -> bytes | None:
+        """key不存在时返回None"""
+        pass
+
+    @abstractmethod
+    def write(self, key: str, data: bytes) -> None:
+        pass
+
+    @abstractmethod
+    def delete(self, key: str) -> None:
+        pass
+
+
+class LocalResultCacheStorage(ResultCacheStorage):
+    def __init__(self, cache_dir: str):
+        self._cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def read(self, key: str) -> bytes | None:
+        try:
+            with open(os.path.join(self._cache_dir, key), 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def write(self, key: str, data: bytes) -> None:
+        # 先写临时文件再替换，避免并发读到写了一半的数据
+        path = os.path.join(self._cache_dir, key)
+        tmp_path = f'{path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+
+    def delete(self, key: str) -> None:
+        try:
+            os.remove(os.path.join(self._cache_dir, key))
+        except FileNotFoundError:
+            pass
+
+
+class S3ResultCacheStorage(ResultCacheStorage):
+    def __init__(self, s3_path: str):
+        from botocore.exceptions import ClientError
+        from mineru.data.io.s3 import S3Reader, S3Writer
+
+        bucket, prefix = parse_bucket_key(s3_path.rstrip('/') + '/')
+        s3_config = get_s3_config_dict(s3_path)
+        self._prefix = prefix
+        self._client_error = ClientError
+        self._reader = S3Reader(bucket, s3_config['ak'], s3_config['sk'], s3_config['endpoint'])
+        self._writer = S3Writer(bucket, s3_config['ak'], s3_config['sk'], s3_config['endpoint'])
+
+    def read(self, key: str) -> bytes | None:
+        try:
+            return self._reader.read(self._prefix + key)
+        except self._client_error as e:
+            if e.response.get('Error', {}).get('Code') in ['NoSuchKey', '404']:
+                return None
+            raise
+
+    def write(self, key: str, data: bytes) -> None:
+        self._writer.write(self._prefix + key, data)
+
+    def delete(self, key: str) -> None:
+        self._writer.delete(self._prefix + key)
+
+
+class RecordingDataWriter(DataWriter):
+    """透传写入到writer，同时在内存中记录写入的文件，用于把裁剪出的图片放入缓存"""
+
+    def __init__(self, writer: DataWriter):
+        self._writer = writer
+        self.files = {}
+
+    def write(self, path: str, data: bytes) -> None:
+        self._writer.write(path, data)
+        self.files[path] = data
+
+
+class ResultCache:
+    """content-addressed的文档结果缓存，index.json中记录每个条目的大小和最后访问时间，用于LRU淘汰。
+
+    命中只更新内存中的访问时间，在put、flush或距上次写回超过INDEX_FLUSH_INTERVAL秒时合并写回index.json，
+    避免每次命中都读写整个index。写回时重新读取index并保留较新的访问时间，多个进程共享缓存目录时
+    最多丢失部分访问时间，只影响淘汰顺序。
+    """
+
+    def __init__(self, storage: ResultCacheStorage, max_size: int):
+        self._storage = storage
+        self._max_size = max_size
+        self._lock = threading.Lock()
+        # 尚未写回index的命中，key -> {'size', 'last_access'}
+        self._pending_access = {}
+        self._last_flush = time.time()
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+
+    @staticmethod
+    def make_key(pdf_bytes, backend, parse_method, lang, formula_enable, table_enable, start_page_id, end_page_id) -> str:
+        options = {
+            'backend': backend,
+            'parse_method': parse_method,
+            'lang': lang,
+            'formula_enable': formula_enable,
+            'table_enable': table_enable,
+            'start_page_id': start_page_id,
+            'end_page_id': end_page_id,
+            'version': __version__,
+            # llm辅助的标题分级会改变middle_json，配置不同时不能复用结果
+            'llm_aided_config': get_llm_aided_config(),
+        }
+        return f'{bytes_md5(pdf_bytes)}_{dict_md5(options)}'
+
+    def _load_index(self) -> dict:
+        index_bytes = self._storage.read(INDEX_KEY)
+        if index_bytes is None:
+            return {}
+        try:
+            return json.loads(index_bytes)
+        except json.JSONDecodeError:
+            logger.warning('result cache index is broken, rebuild it')
+            return {}
+
+    def _save_index(self, index: dict):
+        self._storage.write(INDEX_KEY, json.dumps(index).encode('utf-8'))
+
+    def _merge_pending_access(self, index: dict):
+        for key, entry in self._pending_access.items():
+            if key not in index or index[key]['last_access'] < entry['last_access']:
+                index[key] = entry
+        self._pending_access = {}
+        self._last_flush = time.time()
+
+    def flush(self):
+        """把内存中记录的访问时间写回index.json"""
+        with self._lock:
+            if not self._pending_access:
+                return
+            index = self._load_index()
+            self._merge_pending_access(index)
+            self._save_index(index)
+
+    def get(self, key: str) -> dict | None:
+        """命中时返回{'middle_json', 'model_output', 'images'}，images为{图片路径: 图片bytes}"""
+        data = self._storage.read(f'{key}.zip')
+        if data is None:
+            self.misses += 1
+            return None
+        with zipfile.ZipFile(io.BytesIO(data)) as zf:
+            result = {
+                'middle_json': json.loads(zf.read('middle.json')),
+                'model_output': json.loads(zf.read('model_output.json')),
+                'images': {
+                    name[len('images/'):]: zf.read(name) for name in zf.namelist() if name.startswith('images/')
+                },
+            }
+        with self._lock:
+            self._pending_access[key] = {'size': len(data), 'last_access': time.time()}
+            flush_due = time.time() - self._last_flush >= INDEX_FLUSH_INTERVAL
+        if flush_due:
+            self.flush()
+        self.hits += 1
+        return result
+
+    def put(self, key: str, middle_json, model_output, images: dict):
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as zf:
+            zf.writestr('middle.json', json.dumps(middle_json, ensure_ascii=False), compress_type=zipfile.ZIP_DEFLATED)
+            zf.writestr('model_output.json', json.dumps(model_output, ensure_ascii=False), compress_type=zipfile.ZIP_DEFLATED)
+            # 图片本身已经是压缩格式，不再压缩
+            for path, image_bytes in images.items():
+                zf.writestr(f'images/{path}', image_bytes, compress_type=zipfile.ZIP_STORED)
+        data = buffer.getvalue()
+        if len(data) > self._max_size:
+            logger.warning(f'result {key} is larger than result cache max size, skip caching')
+            return
+        self._storage.write(f'{key}.zip', data)
+        self.writes += 1
+
+        with self._lock:
+            index = self._load_index()
+            self._merge_pending_access(index)
+            index[key] = {'size': len(data), 'last_access': time.time()}
+            total_size = sum(entry['size'] for entry in index.values())
+            # 超过容量时按最后访问时间从旧到新淘汰
+            for old_key, entry in sorted(index.items(), key=lambda item: item[1]['last_access']):
+                if total_size <= self._max_size:
+                    break
+                if old_key == key:
+                    continue
+                self._storage.delete(f'{old_key}.zip')
+                total_size -= entry['size']
+                del index[old_key]
+                self.evictions += 1
+            self._save_index(index)
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 4) if total > 0 else 0,
+            'writes': self.writes,
+            'evictions': self.evictions,
+        }
+
+    def log_stats(self):
+        stats = self.stats()
+        logger.info(
+            f"result cache: hits {stats['hits']}, misses {stats['misses']}, hit rate {stats['hit_rate']}, "
+            f"writes {stats['writes']}, evictions {stats['evictions']}"
+        )
+
+
+_result_cache = None
+_result_cache_dir = None
+
+
+def get_result_cache() -> ResultCache | None:
+    """按MINERU_RESULT_CACHE_DIR配置返回进程内共享的ResultCache，未配置时返回None"""
+    global _result_cache, _result_cache_dir
+    cache_config = get_result_cache_config()
+    if cache_config is None:
+        return None
+    if _result_cache is None or _result_cache_dir != cache_config['cache_dir']:
+        cache_dir = cache_config['cache_dir']
+        if cache_dir.startswith('s3://'):
+            storage = S3ResultCacheStorage(cache_dir)
+        else:
+            storage = LocalResultCacheStorage(cache_dir)
+        _result_cache = ResultCache(storage, cache_config['max_size'])
+        _result_cache_dir = cache_dir
+    return _result_cache
@@ -1,15 +1,28 @@
 # Copyright (c) Opendatalab. All rights reserved.
+import numpy as np
+
 from mineru.utils.boxbase import calculate_overlap_area_in_bbox1_area_ratio
+from mineru.utils.boxbase_batch import calculate_overlap_area_in_bbox1_area_ratio_matrix, matrix_over_threshold
 from mineru.utils.enum_class import BlockType, ContentType
 from mineru.utils.ocr_utils import __is_overlaps_y_exceeds_threshold
 
 
 def fill_spans_in_blocks(blocks, spans, radio):
     """将allspans中的span按位置关系，放入blocks中."""
+    span_bboxes = [span['bbox'] for span in spans]
+    block_bboxes = [block[0:4] for block in blocks]
+    # 一次算出所有span和block的重叠关系，[i, j]表示第i个span是否在第j个block中
+    overlap_matrix = matrix_over_threshold(
+        calculate_overlap_area_in_bbox1_area_ratio_matrix(span_bboxes, block_bboxes), radio,
+        span_bboxes, block_bboxes, calculate_overlap_area_in_bbox1_area_ratio
+    )
+    # 已经放入某个block的span不再参与后续block的分配
+    span_assigned = np.zeros(len(spans), dtype=bool)
+
     block_with_spans = []
-    for block in blocks:
+    for block_index, block in enumerate(blocks):
         block_type = block[7]
-        block_bbox = block[0:4]
+        block_bbox = block_bboxes[block_index]
         block_dict = {
             'type': block_type,
             'bbox': block_bbox,
@@ -20,19 +33,17 @@ def fill_spans_in_blocks(blocks, spans, radio):
         ]:
             block_dict['group_id'] = block[-1]
         block_spans = []
-        for span in spans:
-            span_bbox = span['bbox']
-            if calculate_overlap_area_in_bbox1_area_ratio(span_bbox, block_bbox) > radio and span_block_type_compatible(
-                    span['type'], block_type):
+        for span_index in np.flatnonzero(overlap_matrix[:, block_index] & ~span_assigned):
+            span = spans[span_index]
+            if span_block_type_compatible(span['type'], block_type):
                 block_spans.append(span)
+                span_assigned[span_index] = True
 
         block_dict['spans'] = block_spans
         block_with_spans.append(block_dict)
 
-        # 从spans删除已经放入block_spans中的span
-        if len(block_spans) > 0:
-            for span in block_spans:
-                spans.remove(span)
+    # 从spans删除已经放入block_spans中的span
+    spans[:] = [span for span, assigned in zip(spans, span_assigned) if not assigned]
 
     return block_with_spans, spans
 
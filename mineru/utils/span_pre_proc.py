@@ -1,15 +1,22 @@
 # Copyright (c) Opendatalab. All rights reserved.
+import math
 import re
 import statistics
+from collections import defaultdict
 
 import cv2
 import numpy as np
 from loguru import logger
 
+from mineru.utils.bbox_index import BboxIndex
 from mineru.utils.boxbase import calculate_overlap_area_in_bbox1_area_ratio, calculate_iou, \
     get_minbox_if_overlap_by_ratio
+from mineru.utils.boxbase_batch import FLOAT_TOLERANCE, calculate_iou_matrix, \
+    calculate_overlap_area_2_minbox_area_ratio_matrix, calculate_overlap_area_in_bbox1_area_ratio_matrix, \
+    matrix_over_threshold
 from mineru.utils.enum_class import BlockType, ContentType
 from mineru.utils.pdf_image_tools import get_crop_img
+from mineru.utils.pdf_reader import pdfium_lock
 from mineru.utils.pdf_text_tool import get_page
 
 
@@ -28,28 +35,37 @@ def remove_outside_spans(spans, all_bboxes, all_discarded_blocks):
     other_block_bboxes = get_block_bboxes(all_bboxes, other_block_type)
     discarded_block_bboxes = get_block_bboxes(all_discarded_blocks, [BlockType.DISCARDED])
 
+    span_bboxes = [span['bbox'] for span in spans]
+
+    def any_overlap(block_bboxes, threshold):
+        """每个span与block_bboxes中任意一个的重叠面积占span面积的比例是否超过threshold"""
+        ratio_matrix = calculate_overlap_area_in_bbox1_area_ratio_matrix(span_bboxes, block_bboxes)
+        return matrix_over_threshold(
+            ratio_matrix, threshold, span_bboxes, block_bboxes, calculate_overlap_area_in_bbox1_area_ratio
+        ).any(axis=1)
+
+    in_discarded = any_overlap(discarded_block_bboxes, 0.4)
+    in_image = any_overlap(image_bboxes, 0.5)
+    in_table = any_overlap(table_bboxes, 0.5)
+    in_other = any_overlap(other_block_bboxes, 0.5)
+
     new_spans = []
 
-    for span in spans:
-        span_bbox = span['bbox']
+    for index, span in enumerate(spans):
         span_type = span['type']
 
-        if any(calculate_overlap_area_in_bbox1_area_ratio(span_bbox, block_bbox) > 0.4 for block_bbox in
-               discarded_block_bboxes):
+        if in_discarded[index]:
             new_spans.append(span)
             continue
 
         if span_type == ContentType.IMAGE:
-            if any(calculate_overlap_area_in_bbox1_area_ratio(span_bbox, block_bbox) > 0.5 for block_bbox in
-                   image_bboxes):
+            if in_image[index]:
                 new_spans.append(span)
         elif span_type == ContentType.TABLE:
-            if any(calculate_overlap_area_in_bbox1_area_ratio(span_bbox, block_bbox) > 0.5 for block_bbox in
-                   table_bboxes):
+            if in_table[index]:
                 new_spans.append(span)
         else:
-            if any(calculate_overlap_area_in_bbox1_area_ratio(span_bbox, block_bbox) > 0.5 for block_bbox in
-                   other_block_bboxes):
+            if in_other[index]:
                 new_spans.append(span)
 
     return new_spans
@@ -58,27 +74,33 @@ def remove_outside_spans(spans, all_bboxes, all_discarded_blocks):
 def remove_overlaps_low_confidence_spans(spans):
     dropped_spans = []
     #  删除重叠spans中置信度低的的那些
-    for span1 in spans:
-        for span2 in spans:
-            if span1 != span2:
-                # span1 或 span2 任何一个都不应该在 dropped_spans 中
-                if span1 in dropped_spans or span2 in dropped_spans:
-                    continue
+    # 借助空间索引只比较相交的span对，遍历顺序和判断逻辑与逐对比较所有span一致
+    group_ids = get_value_group_ids(spans)
+    dropped_groups = set()
+    bbox_index = BboxIndex([span['bbox'] for span in spans])
+    for i, span1 in enumerate(spans):
+        if group_ids[i] in dropped_groups:
+            continue
+        candidates = bbox_index.query(span1['bbox'])
+        # 批量计算iou做初筛，阈值留出浮点误差余量，最终以calculate_iou的结果为准
+        candidates = candidates[calculate_iou_matrix([span1['bbox']], bbox_index.bboxes[candidates])[0] > 0.9 - FLOAT_TOLERANCE]
+        for j in candidates:
+            span2 = spans[j]
+            # span1 和 span2 值相等时跳过，任何一个都不应该在 dropped_spans 中
+            if group_ids[i] == group_ids[j]:
+                continue
+            if group_ids[i] in dropped_groups or group_ids[j] in dropped_groups:
+                continue
+            if calculate_iou(span1['bbox'], span2['bbox']) > 0.9:
+                if span1['score'] < span2['score']:
+                    need_remove_index = i
                 else:
-                    if calculate_iou(span1['bbox'], span2['bbox']) > 0.9:
-                        if span1['score'] < span2['score']:
-                            span_need_remove = span1
-                        else:
-                            span_need_remove = span2
-                        if (
-                            span_need_remove is not None
-                            and span_need_remove not in dropped_spans
-                        ):
-                            dropped_spans.append(span_need_remove)
+                    need_remove_index = j
+                dropped_groups.add(group_ids[need_remove_index])
+                dropped_spans.append(spans[need_remove_index])
 
     if len(dropped_spans) > 0:
-        for span_need_remove in dropped_spans:
-            spans.remove(span_need_remove)
+        remove_value_groups(spans, group_ids, dropped_groups)
 
     return spans, dropped_spans
 
@@ -86,25 +108,69 @@ def remove_overlaps_low_confidence_spans(spans):
 def remove_overlaps_min_spans(spans):
     dropped_spans = []
     #  删除重叠spans中较小的那些
-    for span1 in spans:
-        for span2 in spans:
-            if span1 != span2:
-                # span1 或 span2 任何一个都不应该在 dropped_spans 中
-                if span1 in dropped_spans or span2 in dropped_spans:
-                    continue
-                else:
-                    overlap_box = get_minbox_if_overlap_by_ratio(span1['bbox'], span2['bbox'], 0.65)
-                    if overlap_box is not None:
-                        span_need_remove = next((span for span in spans if span['bbox'] == overlap_box), None)
-                        if span_need_remove is not None and span_need_remove not in dropped_spans:
-                            dropped_spans.append(span_need_remove)
+    # 借助空间索引只比较相交的span对，遍历顺序和判断逻辑与逐对比较所有span一致
+    group_ids = get_value_group_ids(spans)
+    dropped_groups = set()
+    first_index_by_bbox = {}
+    for index, span in enumerate(spans):
+        first_index_by_bbox.setdefault(tuple(span['bbox']), index)
+    bbox_index = BboxIndex([span['bbox'] for span in spans])
+    for i, span1 in enumerate(spans):
+        if group_ids[i] in dropped_groups:
+            continue
+        candidates = bbox_index.query(span1['bbox'])
+        candidates = candidates[calculate_overlap_area_2_minbox_area_ratio_matrix([span1['bbox']], bbox_index.bboxes[candidates])[0] > 0.65 - FLOAT_TOLERANCE]
+        for j in candidates:
+            span2 = spans[j]
+            # span1 和 span2 值相等时跳过，任何一个都不应该在 dropped_spans 中
+            if group_ids[i] == group_ids[j]:
+                continue
+            if group_ids[i] in dropped_groups or group_ids[j] in dropped_groups:
+                continue
+            overlap_box = get_minbox_if_overlap_by_ratio(span1['bbox'], span2['bbox'], 0.65)
+            if overlap_box is not None:
+                # 与overlap_box相同的第一个span
+                need_remove_index = first_index_by_bbox[tuple(overlap_box)]
+                if group_ids[need_remove_index] not in dropped_groups:
+                    dropped_groups.add(group_ids[need_remove_index])
+                    dropped_spans.append(spans[need_remove_index])
+
     if len(dropped_spans) > 0:
-        for span_need_remove in dropped_spans:
-            spans.remove(span_need_remove)
+        remove_value_groups(spans, group_ids, dropped_groups)
 
     return spans, dropped_spans
 
 
+def get_value_group_ids(spans):
+    """值相等的span分到同一组，返回每个span的组号（span之间的比较和in判断都是按值进行的）"""
+    group_ids = []
+    groups_by_bbox = {}
+    group_num = 0
+    for span in spans:
+        bbox_groups = groups_by_bbox.setdefault(tuple(span['bbox']), [])
+        for group_id, group_span in bbox_groups:
+            if group_span == span:
+                group_ids.append(group_id)
+                break
+        else:
+            bbox_groups.append((group_num, span))
+            group_ids.append(group_num)
+            group_num += 1
+    return group_ids
+
+
+def remove_value_groups(spans, group_ids, remove_groups):
+    """就地删除spans中每个待删除组的第一个span，与依次调用spans.remove的结果一致"""
+    remove_groups = set(remove_groups)
+    new_spans = []
+    for span, group_id in zip(spans, group_ids):
+        if group_id in remove_groups:
+            remove_groups.discard(group_id)
+        else:
+            new_spans.append(span)
+    spans[:] = new_spans
+
+
 def __replace_ligatures(text: str):
     ligatures = {
         'ﬁ': 'fi', 'ﬂ': 'fl', 'ﬀ': 'ff', 'ﬃ': 'ffi', 'ﬄ': 'ffl', 'ﬅ': 'ft', 'ﬆ': 'st'
@@ -121,7 +187,9 @@ def __replace_unicode(text: str):
 """pdf_text dict方案 char级别"""
 def txt_spans_extract(pdf_page, spans, pil_img, scale, all_bboxes, all_discarded_blocks):
 
-    page_dict = get_page(pdf_page)
+    # 只有读取文本层时访问pdfium
+    with pdfium_lock:
+        page_dict = get_page(pdf_page)
 
     page_all_chars = []
     page_all_lines = []
@@ -152,19 +220,28 @@ def txt_spans_extract(pdf_page, spans, pil_img, scale, all_bboxes, all_discarded
     unuseful_spans = []
     # 纵向span的两个特征：1. 高度超过多个line 2. 高宽比超过某个值
     vertical_spans = []
-    for span in spans:
-        if span['type'] in [ContentType.TEXT]:
-            for block in all_bboxes + all_discarded_blocks:
-                if block[7] in [BlockType.IMAGE_BODY, BlockType.TABLE_BODY, BlockType.INTERLINE_EQUATION]:
-                    continue
-                if calculate_overlap_area_in_bbox1_area_ratio(span['bbox'], block[0:4]) > 0.5:
-                    if span['height'] > median_span_height * 3 and span['height'] > span['width'] * 3:
-                        vertical_spans.append(span)
-                    elif block in all_bboxes:
-                        useful_spans.append(span)
-                    else:
-                        unuseful_spans.append(span)
-                    break
+    text_spans = [span for span in spans if span['type'] in [ContentType.TEXT]]
+    text_blocks = [
+        block for block in all_bboxes + all_discarded_blocks
+        if block[7] not in [BlockType.IMAGE_BODY, BlockType.TABLE_BODY, BlockType.INTERLINE_EQUATION]
+    ]
+    text_span_bboxes = [span['bbox'] for span in text_spans]
+    text_block_bboxes = [block[0:4] for block in text_blocks]
+    in_block_matrix = matrix_over_threshold(
+        calculate_overlap_area_in_bbox1_area_ratio_matrix(text_span_bboxes, text_block_bboxes), 0.5,
+        text_span_bboxes, text_block_bboxes, calculate_overlap_area_in_bbox1_area_ratio
+    )
+    for span, in_block in zip(text_spans, in_block_matrix):
+        block_indices = np.flatnonzero(in_block)
+        if len(block_indices) > 0:
+            # 只看第一个满足条件的block
+            block = text_blocks[block_indices[0]]
+            if span['height'] > median_span_height * 3 and span['height'] > span['width'] * 3:
+                vertical_spans.append(span)
+            elif block in all_bboxes:
+                useful_spans.append(span)
+            else:
+                unuseful_spans.append(span)
 
     """垂直的span框直接用line进行填充"""
     if len(vertical_spans) > 0:
@@ -213,9 +290,13 @@ def fill_char_in_spans(spans, all_chars):
     # 简单从上到下排一下序
     spans = sorted(spans, key=lambda x: x['bbox'][1])
 
-    for char in all_chars:
+    # char的中心点必须在span的上下边界之间，按y方向分带索引span，每个char只和中心点所在带内的span比较
+    band_height, span_bands = get_span_y_bands(spans)
 
-        for span in spans:
+    for char in all_chars:
+        char_center_y = (char['bbox'][1] + char['bbox'][3]) / 2
+        for span_index in span_bands.get(math.floor(char_center_y / band_height), ()):
+            span = spans[span_index]
             if calculate_char_in_span(char['bbox'], span['bbox'], char['char']):
                 span['chars'].append(char)
                 break
@@ -231,6 +312,17 @@ def fill_char_in_spans(spans, all_chars):
     return need_ocr_spans
 
 
+def get_span_y_bands(spans):
+    """按y方向把页面切成高度为span高度中位数的带，返回带高和每个带覆盖到的span下标（保持spans中的顺序）"""
+    span_heights = [span['bbox'][3] - span['bbox'][1] for span in spans]
+    band_height = max(statistics.median(span_heights), 1) if span_heights else 1
+    span_bands = defaultdict(list)
+    for span_index, span in enumerate(spans):
+        for band in range(math.floor(span['bbox'][1] / band_height), math.floor(span['bbox'][3] / band_height) + 1):
+            span_bands[band].append(span_index)
+    return band_height, span_bands
+
+
 LINE_STOP_FLAG = ('.', '!', '?', '。', '！', '？', ')', '）', '"', '”', ':', '：', ';', '；', ']', '】', '}', '}', '>', '》', '、', ',', '，', '-', '—', '–',)
 LINE_START_FLAG = ('(', '（', '"', '“', '【', '{', '《', '<', '「', '『', '【', '[',)
 
@@ -283,18 +375,19 @@ def chars_to_content(span):
         # Calculate the median width
         median_width = statistics.median(char_widths)
 
-        content = ''
-        for char in span['chars']:
+        chars = span['chars']
+        content_list = []
+        for char_index, char in enumerate(chars):
 
             # 如果下一个char的x0和上一个char的x1距离超过0.25个字符宽度，则需要在中间插入一个空格
             char1 = char
-            char2 = span['chars'][span['chars'].index(char) + 1] if span['chars'].index(char) + 1 < len(span['chars']) else None
+            char2 = chars[char_index + 1] if char_index + 1 < len(chars) else None
             if char2 and char2['bbox'][0] - char1['bbox'][2] > median_width * 0.25 and char['char'] != ' ' and char2['char'] != ' ':
-                content += f"{char['char']} "
+                content_list.append(f"{char['char']} ")
             else:
-                content += char['char']
+                content_list.append(char['char'])
 
-        content = __replace_unicode(content)
+        content = __replace_unicode(''.join(content_list))
         content = __replace_ligatures(content)
         content = __replace_ligatures(content)
         span['content'] = content.strip()
@@ -0,0 +1,56 @@
+# Copyright (c) Opendatalab. All rights reserved.
+import queue
+import time
+
+from loguru import logger
+
+
+class StageQueue(queue.Queue):
+    """流水线相邻阶段之间的有界队列，同时统计队列深度和两端的等待时间。
+
+    生产者等待时间长、平均深度接近maxsize，说明下游阶段是瓶颈；
+    消费者等待时间长、平均深度接近0，说明上游阶段是瓶颈。
+    """
+
+    def __init__(self, name: str, maxsize: int = 1):
+        super().__init__(maxsize)
+        self.name = name
+        self.put_count = 0
+        self.depth_sum = 0
+        self.max_depth = 0
+        self.put_wait_time = 0.0
+        self.get_wait_time = 0.0
+
+    def put(self, item, block=True, timeout=None):
+        start = time.time()
+        super().put(item, block, timeout)
+        self.put_wait_time += time.time() - start
+        depth = self.qsize()
+        self.put_count += 1
+        self.depth_sum += depth
+        self.max_depth = max(self.max_depth, depth)
+
+    def get(self, block=True, timeout=None):
+        start = time.time()
+        item = super().get(block, timeout)
+        self.get_wait_time += time.time() - start
+        return item
+
+    def stats(self) -> dict:
+        return {
+            'name': self.name,
+            'maxsize': self.maxsize,
+            'put_count': self.put_count,
+            'avg_depth': round(self.depth_sum / self.put_count, 2) if self.put_count > 0 else 0,
+            'max_depth': self.max_depth,
+            'producer_wait': round(self.put_wait_time, 2),
+            'consumer_wait': round(self.get_wait_time, 2),
+        }
+
+    def log_stats(self):
+        stats = self.stats()
+        logger.info(
+            f"queue {stats['name']}: avg depth {stats['avg_depth']}/{stats['maxsize']}, "
+            f"max depth {stats['max_depth']}, producer wait {stats['producer_wait']}s, "
+            f"consumer wait {stats['consumer_wait']}s"
+        )
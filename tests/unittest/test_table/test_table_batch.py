@@ -0,0 +1,183 @@
+import cv2
+import numpy as np
+import pytest
+import torch
+
+from mineru.model.ocr.paddleocr2pytorch.pytorch_paddle import PytorchPaddleOCR, root_dir
+from mineru.model.ocr.paddleocr2pytorch.pytorchocr.modeling.architectures.base_model import BaseModel
+from mineru.model.ocr.paddleocr2pytorch.tools.infer import pytorchocr_utility as utility
+from mineru.model.ocr.paddleocr2pytorch.tools.infer.predict_system import TextSystem
+from mineru.model.table.rapid_table import RapidTableModel, escape_html
+
+DET_MODEL = 'ch_PP-OCRv5_det_infer'
+REC_MODEL = 'en_PP-OCRv4_rec_infer'
+REC_DICT_PATH = str(root_dir / 'pytorchocr' / 'utils' / 'resources' / 'dict' / 'en_dict.txt')
+
+
+class ContourDetector:
+    """把黑色的文本当作检测结果的检测器，记录每次推理的图像尺寸"""
+
+    def __init__(self):
+        self.calls = []
+
+    def detect(self, img):
+        mask = (img[:, :, 0] < 128).astype(np.uint8)
+        # 同一行的字符连成一个文本框
+        mask = cv2.dilate(mask, np.ones((3, 15), np.uint8))
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        boxes = []
+        for contour in contours:
+            x, y, w, h = cv2.boundingRect(contour)
+            boxes.append([[x, y], [x + w - 1, y], [x + w - 1, y + h - 1], [x, y + h - 1]])
+        return np.array(boxes, dtype=np.float32)
+
+    def __call__(self, img):
+        self.calls.append([img.shape[:2]])
+        return self.detect(img), 0
+
+    def batch_predict(self, img_list, max_batch_size=8):
+        results = []
+        for i in range(0, len(img_list), max_batch_size):
+            batch_imgs = img_list[i:i + max_batch_size]
+            self.calls.append([img.shape[:2] for img in batch_imgs])
+            results.extend((self.detect(img), 0) for img in batch_imgs)
+        return results
+
+
+class RecordingTableStructure:
+    """记录输入的表格结构模型，表格结构识别需要下载slanet_plus模型，这里只验证传入的图像和ocr结果"""
+
+    def __init__(self):
+        self.inputs = []
+
+    def __call__(self, img, ocr_result):
+        self.inputs.append((img, ocr_result))
+
+        class Output:
+            pred_html = f'<html><body><table><tr><td>{len(ocr_result)}</td></tr></table></body></html>'
+            cell_bboxes = np.zeros((0, 8))
+            logic_points = np.zeros((0, 4))
+            elapse = 0
+
+        return Output()
+
+
+@pytest.fixture(scope='module')
+def model_dir(tmp_path_factory):
+    # 随机初始化的权重，只用于比较批量和逐个识别的结果
+    model_dir = tmp_path_factory.mktemp('table_ocr_models')
+    torch.manual_seed(0)
+    for model_name, kwargs in [(DET_MODEL, {}), (REC_MODEL, {'out_channels': 97})]:
+        weights_path = str(model_dir / f'{model_name}.pth')
+        torch.save(BaseModel(utility.get_arch_config(weights_path), **kwargs).state_dict(), weights_path)
+    return model_dir
+
+
+def build_table_model(model_dir):
+    args = utility.init_args().parse_args([])
+    args.det_model_path = str(model_dir / f'{DET_MODEL}.pth')
+    args.rec_model_path = str(model_dir / f'{REC_MODEL}.pth')
+    args.rec_char_dict_path = REC_DICT_PATH
+    ocr_engine = PytorchPaddleOCR.__new__(PytorchPaddleOCR)
+    TextSystem.__init__(ocr_engine, args)
+    ocr_engine.text_detector = ContourDetector()
+    # 随机权重的识别分数较低
+    ocr_engine.drop_score = 0
+    table_model = RapidTableModel.__new__(RapidTableModel)
+    table_model.ocr_engine = ocr_engine
+    table_model.table_model = RecordingTableStructure()
+    return table_model
+
+
+def make_table(seed, rows, cols, vertical=False):
+    rng = np.random.RandomState(seed)
+    # 单元格文本较短，识别时都填充到最小宽度，批量与逐个识别的结果相同
+    cell_w, cell_h = 150, 40
+    table = np.full((rows * cell_h + 20, cols * cell_w + 20, 3), 255, dtype=np.uint8)
+    for row in range(rows):
+        for col in range(cols):
+            text = ''.join(rng.choice(list('abcdefghijklmnopqrstuvwxyz0123456789<>&'), rng.randint(3, 7)))
+            cv2.putText(table, text, (10 + col * cell_w + 8, 10 + row * cell_h + 28), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 0), 2)
+    if vertical:
+        # 逆时针旋转后的表格，文本行是竖直的
+        table = cv2.rotate(table, cv2.ROTATE_90_COUNTERCLOCKWISE)
+    return cv2.cvtColor(table, cv2.COLOR_BGR2RGB)
+
+
+def serial_ocr(table_model, rgb_image):
+    # 与原来逐个表格识别时相同：先判断是否旋转，再对旋转后的图像完整ocr
+    bgr_image = cv2.cvtColor(rgb_image, cv2.COLOR_RGB2BGR)
+    det_res = table_model.ocr_engine.ocr(bgr_image, rec=False)[0]
+    if table_model.is_rotated(bgr_image, det_res):
+        rgb_image = cv2.rotate(rgb_image, cv2.ROTATE_90_CLOCKWISE)
+        bgr_image = cv2.cvtColor(rgb_image, cv2.COLOR_RGB2BGR)
+    ocr_result = table_model.ocr_engine.ocr(bgr_image)[0]
+    return rgb_image, [[item[0], escape_html(item[1][0]), item[1][1]] for item in ocr_result]
+
+
+def test_batch_predict_matches_serial_ocr(model_dir):
+    tables = [
+        make_table(0, 6, 5),
+        make_table(1, 12, 2),
+        make_table(2, 5, 6, vertical=True),
+        make_table(3, 3, 4),
+    ]
+    table_model = build_table_model(model_dir)
+    # 第2个表格是竖版但没有旋转，第3个表格需要旋转
+    assert [table.shape[0] > table.shape[1] * 1.2 for table in tables] == [False, True, True, False]
+
+    results = table_model.batch_predict(tables, det_batch_size=4)
+    detector_calls = table_model.ocr_engine.text_detector.calls
+    # 所有表格拼接到画布上一起det，只有旋转的表格旋转后再det一次
+    *table_det_calls, rotated_det_call = detector_calls
+    assert sum(len(shapes) for shapes in table_det_calls) < len(tables)
+    assert len(rotated_det_call) == 1
+
+    for table, (html_code, _, _, _), (image, ocr_result) in zip(tables, results, table_model.table_model.inputs):
+        expected_image, expected_ocr_result = serial_ocr(table_model, table)
+        np.testing.assert_array_equal(image, expected_image)
+        assert [item[0] for item in ocr_result] == [item[0] for item in expected_ocr_result]
+        assert [item[1] for item in ocr_result] == [item[1] for item in expected_ocr_result]
+        np.testing.assert_allclose([item[2] for item in ocr_result], [item[2] for item in expected_ocr_result], atol=1e-5)
+        assert html_code.endswith('</html>')
+    assert table_model.table_model.inputs[2][0].shape[0] < table_model.table_model.inputs[2][0].shape[1]
+
+
+def test_batch_predict_without_text(model_dir):
+    table_model = build_table_model(model_dir)
+    blank = np.full((200, 300, 3), 255, dtype=np.uint8)
+    assert table_model.batch_predict([blank, make_table(0, 2, 2)])[0] == (None, None, None, None)
+    assert len(table_model.table_model.inputs) == 1
+
+
+if __name__ == '__main__':
+    import tempfile
+    import time
+    from pathlib import Path
+
+    from mineru.model.ocr.paddleocr2pytorch.tools.infer.predict_det import TextDetector
+
+    # 逐个表格predict与分阶段batch_predict的det/rec调用次数和ocr耗时（随机权重的det/rec网络）
+    tables = [make_table(seed, 4 + seed % 5, 2 + seed % 4) for seed in range(12)]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        torch.manual_seed(0)
+        for model_name, kwargs in [(DET_MODEL, {}), (REC_MODEL, {'out_channels': 97})]:
+            weights_path = str(Path(tmp_dir) / f'{model_name}.pth')
+            torch.save(BaseModel(utility.get_arch_config(weights_path), **kwargs).state_dict(), weights_path)
+        table_model = build_table_model(Path(tmp_dir))
+        args = utility.init_args().parse_args([])
+        args.det_model_path = str(Path(tmp_dir) / f'{DET_MODEL}.pth')
+        table_model.ocr_engine.text_detector = TextDetector(args)
+        forward_calls = {'det': 0, 'rec': 0}
+        table_model.ocr_engine.text_detector.net.register_forward_hook(lambda *_: forward_calls.update(det=forward_calls['det'] + 1))
+        table_model.ocr_engine.text_recognizer.net.register_forward_hook(lambda *_: forward_calls.update(rec=forward_calls['rec'] + 1))
+        for name, predict in [
+            ('per table', lambda: [table_model.predict(table) for table in tables]),
+            ('batched', lambda: table_model.batch_predict(tables)),
+        ]:
+            predict()
+            forward_calls.update(det=0, rec=0)
+            start = time.perf_counter()
+            predict()
+            cost = time.perf_counter() - start
+            print(f"{name}: {forward_calls['det']} det calls, {forward_calls['rec']} rec calls, {cost / len(tables):.2f} s/table")
@@ -0,0 +1,222 @@
+import copy
+import random
+import sys
+import time
+
+import pytest
+
+from mineru.utils.block_pre_proc import remove_overlaps_min_blocks
+from mineru.utils.boxbase import calculate_iou, get_minbox_if_overlap_by_ratio
+from mineru.utils.model_utils import remove_overlaps_min_blocks as remove_overlaps_min_res_blocks
+from mineru.utils.span_pre_proc import remove_overlaps_low_confidence_spans, remove_overlaps_min_spans
+
+
+# 以下为基于逐对比较的原始实现，作为等价性测试的参照
+def reference_remove_overlaps_low_confidence_spans(spans):
+    dropped_spans = []
+    for span1 in spans:
+        for span2 in spans:
+            if span1 != span2:
+                if span1 in dropped_spans or span2 in dropped_spans:
+                    continue
+                else:
+                    if calculate_iou(span1['bbox'], span2['bbox']) > 0.9:
+                        if span1['score'] < span2['score']:
+                            span_need_remove = span1
+                        else:
+                            span_need_remove = span2
+                        if (
+                            span_need_remove is not None
+                            and span_need_remove not in dropped_spans
+                        ):
+                            dropped_spans.append(span_need_remove)
+
+    if len(dropped_spans) > 0:
+        for span_need_remove in dropped_spans:
+            spans.remove(span_need_remove)
+
+    return spans, dropped_spans
+
+
+def reference_remove_overlaps_min_spans(spans):
+    dropped_spans = []
+    for span1 in spans:
+        for span2 in spans:
+            if span1 != span2:
+                if span1 in dropped_spans or span2 in dropped_spans:
+                    continue
+                else:
+                    overlap_box = get_minbox_if_overlap_by_ratio(span1['bbox'], span2['bbox'], 0.65)
+                    if overlap_box is not None:
+                        span_need_remove = next((span for span in spans if span['bbox'] == overlap_box), None)
+                        if span_need_remove is not None and span_need_remove not in dropped_spans:
+                            dropped_spans.append(span_need_remove)
+    if len(dropped_spans) > 0:
+        for span_need_remove in dropped_spans:
+            spans.remove(span_need_remove)
+
+    return spans, dropped_spans
+
+
+def reference_remove_overlaps_min_blocks(all_bboxes):
+    need_remove = []
+    for block1 in all_bboxes:
+        for block2 in all_bboxes:
+            if block1 != block2:
+                block1_bbox = block1[:4]
+                block2_bbox = block2[:4]
+                overlap_box = get_minbox_if_overlap_by_ratio(
+                    block1_bbox, block2_bbox, 0.8
+                )
+                if overlap_box is not None:
+                    block_to_remove = next(
+                        (block for block in all_bboxes if block[:4] == overlap_box),
+                        None,
+                    )
+                    if (
+                        block_to_remove is not None
+                        and block_to_remove not in need_remove
+                    ):
+                        large_block = block1 if block1 != block_to_remove else block2
+                        x1, y1, x2, y2 = large_block[:4]
+                        sx1, sy1, sx2, sy2 = block_to_remove[:4]
+                        x1 = min(x1, sx1)
+                        y1 = min(y1, sy1)
+                        x2 = max(x2, sx2)
+                        y2 = max(y2, sy2)
+                        large_block[:4] = [x1, y1, x2, y2]
+                        need_remove.append(block_to_remove)
+
+    if len(need_remove) > 0:
+        for block in need_remove:
+            all_bboxes.remove(block)
+
+    return all_bboxes
+
+
+def reference_remove_overlaps_min_res_blocks(res_list):
+    need_remove = []
+    for res1 in res_list:
+        for res2 in res_list:
+            if res1 != res2:
+                overlap_box = get_minbox_if_overlap_by_ratio(
+                    res1['bbox'], res2['bbox'], 0.8
+                )
+                if overlap_box is not None:
+                    res_to_remove = next(
+                        (res for res in res_list if res['bbox'] == overlap_box),
+                        None,
+                    )
+                    if (
+                        res_to_remove is not None
+                        and res_to_remove not in need_remove
+                    ):
+                        large_res = res1 if res1 != res_to_remove else res2
+                        x1, y1, x2, y2 = large_res['bbox']
+                        sx1, sy1, sx2, sy2 = res_to_remove['bbox']
+                        x1 = min(x1, sx1)
+                        y1 = min(y1, sy1)
+                        x2 = max(x2, sx2)
+                        y2 = max(y2, sy2)
+                        large_res['bbox'] = [x1, y1, x2, y2]
+                        need_remove.append(res_to_remove)
+
+    if len(need_remove) > 0:
+        for res in need_remove:
+            res_list.remove(res)
+
+    return res_list, need_remove
+
+
+def make_bboxes(rng, num, page_size, max_size, float_coords=False):
+    """生成包含重复框、相同面积框和嵌套框的随机bbox"""
+    bboxes = []
+    for _ in range(num):
+        choice = rng.random()
+        if bboxes and choice < 0.1:
+            # 完全重复
+            bboxes.append(list(rng.choice(bboxes)))
+            continue
+        if bboxes and choice < 0.4:
+            # 在已有框附近抖动
+            x0, y0, x1, y1 = rng.choice(bboxes)
+            dx, dy = rng.randint(-2, 2), rng.randint(-2, 2)
+            bboxes.append([x0 + dx, y0 + dy, x1 + dx + rng.randint(-2, 2), y1 + dy + rng.randint(-2, 2)])
+            continue
+        x0 = rng.randint(0, page_size)
+        y0 = rng.randint(0, page_size)
+        w = rng.randint(0, max_size)
+        h = rng.randint(0, max_size // 4 + 1)
+        bboxes.append([x0, y0, x0 + w, y0 + h])
+    if float_coords:
+        bboxes = [[v * 0.73 for v in bbox] for bbox in bboxes]
+    return bboxes
+
+
+def make_spans(rng, num, page_size=200, max_size=40, float_coords=False):
+    spans = []
+    for bbox in make_bboxes(rng, num, page_size, max_size, float_coords):
+        spans.append({'bbox': bbox, 'type': 'text', 'score': rng.choice([0.5, 0.8, 0.9, 1.0])})
+    # 制造部分完全相同的span
+    for _ in range(num // 10):
+        spans.insert(rng.randrange(len(spans) + 1), copy.deepcopy(rng.choice(spans)))
+    return spans
+
+
+def make_blocks(rng, num, page_size=200, max_size=40):
+    blocks = []
+    for bbox in make_bboxes(rng, num, page_size, max_size):
+        blocks.append(bbox + [None, None, None, rng.choice(['text', 'title']), None, None, None, None, rng.choice([0.5, 0.9])])
+    return blocks
+
+
+@pytest.mark.parametrize('seed', range(30))
+@pytest.mark.parametrize('float_coords', [False, True])
+def test_remove_overlaps_spans_equivalence(seed, float_coords):
+    rng = random.Random(seed)
+    spans = make_spans(rng, rng.randint(0, 300), float_coords=float_coords)
+
+    expected = reference_remove_overlaps_low_confidence_spans(copy.deepcopy(spans))
+    assert remove_overlaps_low_confidence_spans(copy.deepcopy(spans)) == expected
+
+    expected = reference_remove_overlaps_min_spans(copy.deepcopy(spans))
+    assert remove_overlaps_min_spans(copy.deepcopy(spans)) == expected
+
+
+@pytest.mark.parametrize('seed', range(30))
+def test_remove_overlaps_min_blocks_equivalence(seed):
+    rng = random.Random(seed)
+    blocks = make_blocks(rng, rng.randint(0, 200))
+
+    assert remove_overlaps_min_blocks(copy.deepcopy(blocks)) == reference_remove_overlaps_min_blocks(copy.deepcopy(blocks))
+
+    res_list = [{'bbox': block[:4], 'category_id': 1, 'score': block[12]} for block in blocks]
+    assert remove_overlaps_min_res_blocks(copy.deepcopy(res_list)) == reference_remove_overlaps_min_res_blocks(copy.deepcopy(res_list))
+
+
+def run_benchmark(num_spans, with_reference):
+    rng = random.Random(0)
+    # 页面尺寸随span数量放大，保持span密度基本不变
+    page_size = int(900 * (num_spans / 1000) ** 0.5)
+    spans = make_spans(rng, num_spans, page_size=page_size, max_size=page_size // 7)
+    blocks = make_blocks(rng, num_spans // 5, page_size=page_size, max_size=page_size // 7)
+    for name, func, reference_func, data in [
+        ('remove_overlaps_low_confidence_spans', remove_overlaps_low_confidence_spans, reference_remove_overlaps_low_confidence_spans, spans),
+        ('remove_overlaps_min_spans', remove_overlaps_min_spans, reference_remove_overlaps_min_spans, spans),
+        ('remove_overlaps_min_blocks', remove_overlaps_min_blocks, reference_remove_overlaps_min_blocks, blocks),
+    ]:
+        start = time.time()
+        func(copy.deepcopy(data))
+        message = f'{name}: {len(data)} items, bbox index {time.time() - start:.3f}s'
+        if with_reference:
+            start = time.time()
+            reference_func(copy.deepcopy(data))
+            message += f', pairwise {time.time() - start:.3f}s'
+        print(message)
+
+
+if __name__ == '__main__':
+    # 合成密集页面做性能对比：python tests/unittest/test_utils/test_bbox_index.py [num_spans]
+    # 逐对比较的实现在5000个span时需要数分钟，因此只在num_spans不超过1000时一起测
+    _num_spans = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    run_benchmark(_num_spans, with_reference=_num_spans <= 1000)
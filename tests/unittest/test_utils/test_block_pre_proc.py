@@ -0,0 +1,187 @@
+import copy
+import random
+
+import numpy as np
+import pytest
+
+from mineru.utils.block_pre_proc import fix_interline_equation_overlap_text_blocks_with_hi_iou, \
+    fix_text_overlap_title_blocks, find_blocks_under_footnote, remove_need_drop_blocks
+from mineru.utils.boxbase import calculate_iou, calculate_overlap_area_in_bbox1_area_ratio, \
+    calculate_vertical_projection_overlap_ratio
+from mineru.utils.enum_class import BlockType, ContentType
+from mineru.utils.span_block_fix import fill_spans_in_blocks, span_block_type_compatible
+
+
+# 以下为基于逐对比较的原始实现，作为等价性测试的参照
+def reference_fix_text_overlap_title_blocks(all_bboxes):
+    text_blocks = [block for block in all_bboxes if block[7] == BlockType.TEXT]
+    title_blocks = [block for block in all_bboxes if block[7] == BlockType.TITLE]
+
+    need_remove = []
+    for text_block in text_blocks:
+        for title_block in title_blocks:
+            if calculate_iou(text_block[:4], title_block[:4]) > 0.8:
+                if title_block not in need_remove:
+                    need_remove.append(title_block)
+
+    for block in need_remove:
+        all_bboxes.remove(block)
+    return all_bboxes
+
+
+def reference_remove_need_drop_blocks(all_bboxes, discarded_blocks):
+    need_remove = []
+    for block in all_bboxes:
+        for discarded_block in discarded_blocks:
+            if calculate_overlap_area_in_bbox1_area_ratio(block[:4], discarded_block['bbox']) > 0.6:
+                if block not in need_remove:
+                    need_remove.append(block)
+                    break
+
+    for block in need_remove:
+        all_bboxes.remove(block)
+    return all_bboxes
+
+
+def reference_fix_interline_equation_overlap_text_blocks_with_hi_iou(all_bboxes):
+    text_blocks = [block for block in all_bboxes if block[7] == BlockType.TEXT]
+    interline_equation_blocks = [block for block in all_bboxes if block[7] == BlockType.INTERLINE_EQUATION]
+
+    need_remove = []
+    for interline_equation_block in interline_equation_blocks:
+        for text_block in text_blocks:
+            if calculate_iou(interline_equation_block[:4], text_block[:4]) > 0.8:
+                if text_block not in need_remove:
+                    need_remove.append(text_block)
+
+    for block in need_remove:
+        all_bboxes.remove(block)
+    return all_bboxes
+
+
+def reference_find_blocks_under_footnote(all_bboxes, footnote_blocks):
+    need_remove_blocks = []
+    for block in all_bboxes:
+        block_x0, block_y0, block_x1, block_y1 = block[:4]
+        for footnote_bbox in footnote_blocks:
+            footnote_x0, footnote_y0, footnote_x1, footnote_y1 = footnote_bbox
+            if (
+                block_y0 >= footnote_y1
+                and calculate_vertical_projection_overlap_ratio(
+                    (block_x0, block_y0, block_x1, block_y1), footnote_bbox
+                )
+                >= 0.8
+            ):
+                if block not in need_remove_blocks:
+                    need_remove_blocks.append(block)
+                    break
+    return need_remove_blocks
+
+
+def reference_fill_spans_in_blocks(blocks, spans, radio):
+    block_with_spans = []
+    for block in blocks:
+        block_type = block[7]
+        block_bbox = block[0:4]
+        block_dict = {
+            'type': block_type,
+            'bbox': block_bbox,
+        }
+        if block_type in [
+            BlockType.IMAGE_BODY, BlockType.IMAGE_CAPTION, BlockType.IMAGE_FOOTNOTE,
+            BlockType.TABLE_BODY, BlockType.TABLE_CAPTION, BlockType.TABLE_FOOTNOTE
+        ]:
+            block_dict['group_id'] = block[-1]
+        block_spans = []
+        for span in spans:
+            if calculate_overlap_area_in_bbox1_area_ratio(span['bbox'], block_bbox) > radio and span_block_type_compatible(
+                    span['type'], block_type):
+                block_spans.append(span)
+
+        block_dict['spans'] = block_spans
+        block_with_spans.append(block_dict)
+
+        for span in block_spans:
+            spans.remove(span)
+
+    return block_with_spans, spans
+
+
+BLOCK_TYPES = [
+    BlockType.TEXT, BlockType.TITLE, BlockType.INTERLINE_EQUATION, BlockType.IMAGE_BODY, BlockType.IMAGE_CAPTION,
+    BlockType.TABLE_BODY, BlockType.TABLE_FOOTNOTE, BlockType.DISCARDED,
+]
+SPAN_TYPES = [
+    ContentType.TEXT, ContentType.INLINE_EQUATION, ContentType.INTERLINE_EQUATION, ContentType.IMAGE, ContentType.TABLE,
+]
+
+
+def make_bboxes(rng, num, page_size=200, max_size=40, coord_type='int'):
+    """生成包含重复框、抖动框和嵌套框的随机bbox，抖动框的重叠比例经常落在阈值附近"""
+    bboxes = []
+    for _ in range(num):
+        choice = rng.random()
+        if bboxes and choice < 0.1:
+            bboxes.append(list(rng.choice(bboxes)))
+            continue
+        if bboxes and choice < 0.4:
+            x0, y0, x1, y1 = rng.choice(bboxes)
+            dx, dy = rng.randint(-2, 2), rng.randint(-2, 2)
+            bboxes.append([x0 + dx, y0 + dy, x1 + dx + rng.randint(-2, 2), y1 + dy + rng.randint(-2, 2)])
+            continue
+        if bboxes and choice < 0.5:
+            x0, y0, x1, y1 = rng.choice(bboxes)
+            bboxes.append([x0 + rng.randint(0, 3), y0 + rng.randint(0, 3), x1 - rng.randint(0, 3), y1 - rng.randint(0, 3)])
+            continue
+        x0 = rng.randint(0, page_size)
+        y0 = rng.randint(0, page_size)
+        bboxes.append([x0, y0, x0 + rng.randint(0, max_size), y0 + rng.randint(0, max_size // 2)])
+    if coord_type == 'float':
+        bboxes = [[v * 0.73 for v in bbox] for bbox in bboxes]
+    elif coord_type == 'float32':
+        # 模型输出的坐标可能是float32，批量结果和标量结果在阈值附近会有细微差别
+        bboxes = [[np.float32(v * 0.73) for v in bbox] for bbox in bboxes]
+    return bboxes
+
+
+def make_blocks(rng, bboxes):
+    blocks = []
+    for group_id, bbox in enumerate(bboxes):
+        blocks.append(bbox + [None, None, None, rng.choice(BLOCK_TYPES), None, None, None, None, rng.choice([0.5, 0.9]), group_id])
+    return blocks
+
+
+@pytest.mark.parametrize('seed', range(30))
+@pytest.mark.parametrize('coord_type', ['int', 'float', 'float32'])
+def test_block_pre_proc_equivalence(seed, coord_type):
+    rng = random.Random(seed)
+    bboxes = make_bboxes(rng, rng.randint(0, 150), coord_type=coord_type)
+    blocks = make_blocks(rng, bboxes)
+
+    expected = reference_fix_text_overlap_title_blocks(copy.deepcopy(blocks))
+    assert fix_text_overlap_title_blocks(copy.deepcopy(blocks)) == expected
+
+    expected = reference_fix_interline_equation_overlap_text_blocks_with_hi_iou(copy.deepcopy(blocks))
+    assert fix_interline_equation_overlap_text_blocks_with_hi_iou(copy.deepcopy(blocks)) == expected
+
+    # discarded和footnote取自同一批bbox，与blocks之间有大量重复和贴边的情况
+    discarded_blocks = [{'bbox': bbox} for bbox in rng.sample(bboxes, len(bboxes) // 5)]
+    expected = reference_remove_need_drop_blocks(copy.deepcopy(blocks), discarded_blocks)
+    assert remove_need_drop_blocks(copy.deepcopy(blocks), discarded_blocks) == expected
+
+    footnote_blocks = rng.sample(bboxes, len(bboxes) // 5)
+    expected = reference_find_blocks_under_footnote(copy.deepcopy(blocks), footnote_blocks)
+    assert find_blocks_under_footnote(copy.deepcopy(blocks), footnote_blocks) == expected
+
+
+@pytest.mark.parametrize('seed', range(30))
+@pytest.mark.parametrize('coord_type', ['int', 'float', 'float32'])
+@pytest.mark.parametrize('radio', [0.5, 0.6])
+def test_fill_spans_in_blocks_equivalence(seed, coord_type, radio):
+    rng = random.Random(seed)
+    bboxes = make_bboxes(rng, rng.randint(0, 300), coord_type=coord_type)
+    blocks = make_blocks(rng, rng.sample(bboxes, len(bboxes) // 4))
+    spans = [{'bbox': bbox, 'type': rng.choice(SPAN_TYPES)} for bbox in bboxes]
+
+    expected = reference_fill_spans_in_blocks(copy.deepcopy(blocks), copy.deepcopy(spans), radio)
+    assert fill_spans_in_blocks(copy.deepcopy(blocks), copy.deepcopy(spans), radio) == expected
@@ -0,0 +1,57 @@
+import copy
+import random
+
+import numpy as np
+import torch
+from transformers import LayoutLMv3Config, LayoutLMv3ForTokenClassification
+
+from mineru.utils import block_sort
+from mineru.utils.block_sort import batch_sort_blocks_by_bbox, do_predict, do_predict_batch, sort_blocks_by_bbox
+
+
+def make_model():
+    # 随机初始化的小模型，只用于验证批量推理和逐页推理的结果一致
+    torch.manual_seed(0)
+    config = LayoutLMv3Config(
+        hidden_size=96, coordinate_size=16, shape_size=16, num_hidden_layers=2, num_attention_heads=4,
+        intermediate_size=128, num_labels=510, visual_embed=False,
+    )
+    return LayoutLMv3ForTokenClassification(config).eval()
+
+
+def make_page(rng, num_blocks, page_w=600, page_h=800):
+    blocks = []
+    for _ in range(num_blocks):
+        x, y = rng.randint(0, page_w - 80), rng.randint(0, page_h - 20)
+        blocks.append({
+            'type': 'text',
+            'bbox': [x, y, x + 80, y + 20],
+            'lines': [{'bbox': [x, y, x + 80, y + 10], 'spans': []}, {'bbox': [x, y + 10, x + 80, y + 20], 'spans': []}],
+        })
+    return blocks, page_w, page_h, []
+
+
+def test_do_predict_batch_equals_single():
+    model = make_model()
+    rng = random.Random(0)
+    boxes_list = []
+    for num_boxes in [3, 50, 7, 120, 1]:
+        boxes = []
+        for _ in range(num_boxes):
+            x, y = rng.randint(0, 900), rng.randint(0, 900)
+            boxes.append([x, y, x + rng.randint(0, 100), y + rng.randint(0, 100)])
+        boxes_list.append(boxes)
+    with torch.no_grad():
+        assert do_predict_batch(boxes_list, model) == [do_predict(boxes, model) for boxes in boxes_list]
+
+
+def test_batch_sort_blocks_by_bbox(monkeypatch):
+    monkeypatch.setitem(block_sort.ModelSingleton._models, 'layoutreader', make_model())
+    rng = random.Random(0)
+    # 150个block有300行，超过layoutreader上限，使用xycut排序
+    pages = [make_page(rng, num_blocks) for num_blocks in (5, 30, 150, 2, 0)]
+    # xycut排序前会打乱bbox顺序，固定随机种子
+    np.random.seed(0)
+    expected = [sort_blocks_by_bbox(*copy.deepcopy(page)) for page in pages]
+    np.random.seed(0)
+    assert batch_sort_blocks_by_bbox(copy.deepcopy(pages)) == expected
@@ -0,0 +1,69 @@
+import random
+
+import numpy as np
+import pytest
+
+from mineru.utils.boxbase import bbox_distance, bbox_relative_pos, calculate_iou, \
+    calculate_overlap_area_2_minbox_area_ratio, calculate_overlap_area_in_bbox1_area_ratio, \
+    calculate_vertical_projection_overlap_ratio, is_in
+from mineru.utils.boxbase_batch import bbox_distance_matrix, bbox_relative_pos_matrix, calculate_iou_matrix, \
+    calculate_overlap_area_2_minbox_area_ratio_matrix, calculate_overlap_area_in_bbox1_area_ratio_matrix, \
+    calculate_vertical_projection_overlap_ratio_matrix, is_in_matrix, matrix_over_threshold
+
+
+def make_bboxes(rng, num, float_coords):
+    bboxes = []
+    for _ in range(num):
+        x0, y0 = rng.randint(0, 100), rng.randint(0, 100)
+        # 包含宽或高为0的bbox
+        bbox = [x0, y0, x0 + rng.randint(0, 30), y0 + rng.randint(0, 30)]
+        if float_coords:
+            bbox = [v * 0.37 for v in bbox]
+        bboxes.append(bbox)
+    return bboxes
+
+
+@pytest.mark.parametrize('seed', range(5))
+@pytest.mark.parametrize('float_coords', [False, True])
+@pytest.mark.parametrize('matrix_func, scalar_func', [
+    (calculate_overlap_area_in_bbox1_area_ratio_matrix, calculate_overlap_area_in_bbox1_area_ratio),
+    (calculate_overlap_area_2_minbox_area_ratio_matrix, calculate_overlap_area_2_minbox_area_ratio),
+    (calculate_iou_matrix, calculate_iou),
+    (calculate_vertical_projection_overlap_ratio_matrix, calculate_vertical_projection_overlap_ratio),
+    (is_in_matrix, is_in),
+    (bbox_distance_matrix, bbox_distance),
+])
+def test_matrix_equals_scalar(seed, float_coords, matrix_func, scalar_func):
+    rng = random.Random(seed)
+    bboxes1 = make_bboxes(rng, 40, float_coords)
+    bboxes2 = make_bboxes(rng, 30, float_coords)
+    matrix = matrix_func(bboxes1, bboxes2)
+    assert matrix.shape == (len(bboxes1), len(bboxes2))
+    expected = np.array([[scalar_func(bbox1, bbox2) for bbox2 in bboxes2] for bbox1 in bboxes1])
+    assert np.array_equal(matrix, expected)
+
+
+def test_relative_pos_matrix():
+    rng = random.Random(0)
+    bboxes1 = make_bboxes(rng, 20, False)
+    bboxes2 = make_bboxes(rng, 20, False)
+    matrices = bbox_relative_pos_matrix(bboxes1, bboxes2)
+    for i, bbox1 in enumerate(bboxes1):
+        for j, bbox2 in enumerate(bboxes2):
+            assert tuple(bool(m[i, j]) for m in matrices) == bbox_relative_pos(bbox1, bbox2)
+
+
+def test_empty_input():
+    assert calculate_iou_matrix([], [[0, 0, 1, 1]]).shape == (0, 1)
+    assert bbox_distance_matrix([[0, 0, 1, 1]], []).shape == (1, 0)
+
+
+def test_matrix_over_threshold():
+    # float32坐标下批量结果和标量结果可能有细微差别，阈值附近以标量函数为准
+    bboxes1 = [[np.float32(0), np.float32(0), np.float32(10), np.float32(10)]]
+    bboxes2 = [[0, 0, 5, 10], [0, 0, 6, 10]]
+    matrix = calculate_overlap_area_in_bbox1_area_ratio_matrix(bboxes1, bboxes2)
+    result = matrix_over_threshold(matrix, 0.5, bboxes1, bboxes2, calculate_overlap_area_in_bbox1_area_ratio)
+    assert result.tolist() == [[False, True]]
+    result = matrix_over_threshold(matrix, 0.5, bboxes1, bboxes2, calculate_overlap_area_in_bbox1_area_ratio, or_equal=True)
+    assert result.tolist() == [[True, True]]
@@ -0,0 +1,266 @@
+import json
+import random
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from mineru.backend.vlm.generation_guard import (
+    TAIL_WINDOW,
+    GenerationGuard,
+    GenerationGuardStats,
+    check_output,
+    generation_guard_stats,
+)
+from mineru.backend.vlm.sglang_client_predictor import SglangClientPredictor
+
+GUARD_CONFIG = {'max_block_chars': 65536, 'max_repeated_blocks': 10, 'retry': False}
+
+
+def make_block(content, block_type='text', bbox='100 100 500 200'):
+    return f'<|box_start|>{bbox}<|box_end|><|ref_start|>{block_type}<|ref_end|><|md_start|>{content}<|md_end|>\n'
+
+
+NORMAL_OUTPUT = ''.join(make_block(f'paragraph {i} ' * 20, bbox=f'100 {i} 500 {i + 10}') for i in range(300))
+REPEATED_BLOCKS_OUTPUT = make_block('title', 'title') + make_block('same line') * 12
+REPEATED_TAIL_OUTPUT = make_block('intro') + '<|box_start|>100 300 500 900<|box_end|><|ref_start|>table<|ref_end|><|md_start|>' + '<fcel>1<fcel>2<nl>' * 1000
+BLOCK_TOO_LONG_OUTPUT = make_block('intro') + '<|box_start|>100 300 500 900<|box_end|><|ref_start|>text<|ref_end|><|md_start|>' + ''.join(
+    f'word{i} ' for i in range(10000)
+)
+# 正常的长表格：一个table块超过max_block_chars，但没有循环
+LONG_TABLE_OUTPUT = make_block('intro') + make_block(
+    ''.join(f'<fcel>cell {i}<fcel>{i * 7919 % 10007}<nl>' for i in range(4000)), 'table'
+) + make_block('after table')
+DEGENERATED_OUTPUTS = {
+    'repeated_blocks': REPEATED_BLOCKS_OUTPUT,
+    'repeated_tail': REPEATED_TAIL_OUTPUT,
+    'block_too_long': BLOCK_TOO_LONG_OUTPUT,
+}
+
+
+def feed_in_chunks(text, chunk_sizes):
+    guard = GenerationGuard()
+    pos = 0
+    while pos < len(text):
+        size = chunk_sizes()
+        if guard.feed(text[pos : pos + size]):
+            return guard.reason, pos + size
+        pos += size
+    return guard.reason, len(text)
+
+
+def test_normal_output_not_triggered():
+    assert check_output(NORMAL_OUTPUT, GUARD_CONFIG) is None
+    # 重复的块之间有其他块时不算连续重复
+    alternating = (make_block('header', 'header') + make_block('body text')) * 20
+    assert check_output(alternating, GUARD_CONFIG) is None
+    # image块没有内容，不参与重复统计
+    assert check_output(make_block('', 'image') * 20, GUARD_CONFIG) is None
+
+
+def test_long_table_not_triggered():
+    assert len(LONG_TABLE_OUTPUT) > GUARD_CONFIG['max_block_chars']
+    assert check_output(LONG_TABLE_OUTPUT, GUARD_CONFIG) is None
+    rng = random.Random(0)
+    assert feed_in_chunks(LONG_TABLE_OUTPUT, lambda: rng.randint(1, 300))[0] is None
+    # table之后的块仍然检测长度
+    assert check_output(LONG_TABLE_OUTPUT + BLOCK_TOO_LONG_OUTPUT, GUARD_CONFIG) == 'block_too_long'
+
+
+@pytest.mark.parametrize('reason', sorted(DEGENERATED_OUTPUTS))
+def test_degenerated_output_triggered(reason):
+    assert check_output(DEGENERATED_OUTPUTS[reason], GUARD_CONFIG) == reason
+
+
+@pytest.mark.parametrize('reason', sorted(DEGENERATED_OUTPUTS))
+def test_result_independent_of_chunking(reason):
+    text = DEGENERATED_OUTPUTS[reason]
+    rng = random.Random(0)
+    results = {
+        feed_in_chunks(text, lambda: 1)[0],
+        feed_in_chunks(text, lambda: 7)[0],
+        feed_in_chunks(text, lambda: rng.randint(1, 300))[0],
+        feed_in_chunks(text, lambda: len(text))[0],
+    }
+    assert results == {reason}
+    assert feed_in_chunks(NORMAL_OUTPUT, lambda: rng.randint(1, 300))[0] is None
+
+
+def test_triggered_early():
+    # 逐token输入时在循环开始后不久就结束，不需要等到max_new_tokens
+    _, stop_pos = feed_in_chunks(REPEATED_TAIL_OUTPUT, lambda: 3)
+    assert stop_pos <= len(make_block('intro')) + 200 + 2 * TAIL_WINDOW
+    _, stop_pos = feed_in_chunks(REPEATED_BLOCKS_OUTPUT, lambda: 3)
+    assert stop_pos < len(REPEATED_BLOCKS_OUTPUT) - len(make_block('same line'))
+
+
+class RecordingGuard(GenerationGuard):
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+
+    def feed(self, text):
+        self.chunks.append(text)
+        return super().feed(text)
+
+
+def test_hf_stopping_criteria_decodes_incrementally():
+    import torch
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers
+    from transformers import PreTrainedTokenizerFast
+
+    from mineru.backend.vlm.hf_predictor import _GuardStoppingCriteria
+
+    # 按字节切分的tokenizer，中文和emoji被拆成多个token
+    vocab = {char: i for i, char in enumerate(sorted(pre_tokenizers.ByteLevel.alphabet()))}
+    tokenizer = Tokenizer(models.BPE(vocab, []))
+    tokenizer.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    tokenizer.decoder = decoders.ByteLevel()
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=tokenizer)
+
+    texts = [make_block('表格 abc') + '中文', make_block('ab😀cd') + 'naïve!!']
+    rows = [tokenizer(text).input_ids for text in texts]
+    assert len(rows[0]) == len(rows[1])
+    guards = [RecordingGuard(), RecordingGuard()]
+    criteria = _GuardStoppingCriteria(tokenizer, guards)
+    for length in range(1, len(rows[0]) + 1):
+        criteria(torch.tensor([ids[:length] for ids in rows]), None)
+    for guard, text in zip(guards, texts):
+        assert ''.join(guard.chunks) == text
+        assert all('\ufffd' not in chunk for chunk in guard.chunks)
+
+
+def test_stats():
+    stats = GenerationGuardStats()
+    stats.record(None)
+    stats.record('repeated_tail')
+    stats.record('repeated_tail')
+    stats.record_retry(True)
+    stats.record_retry(False)
+    assert stats.stats() == {'checked': 3, 'triggered': {'repeated_tail': 2}, 'retried': 2, 'recovered': 1}
+    # 只统计since之后新增的部分
+    since = stats.stats()
+    stats.record('repeated_blocks')
+    stats.record(None)
+    assert stats.stats(since) == {'checked': 2, 'triggered': {'repeated_blocks': 1}, 'retried': 0, 'recovered': 0}
+
+
+class StubSglangHandler(BaseHTTPRequestHandler):
+    """repetition_penalty为1.0时返回退化的输出，记录请求的sampling_params"""
+
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        self._send_json({'model_path': 'stub'})
+
+    def do_POST(self):
+        request_body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        sampling_params = request_body['sampling_params']
+        self.server.sampling_params.append(sampling_params)
+        text = REPEATED_BLOCKS_OUTPUT if sampling_params['repetition_penalty'] == 1.0 else NORMAL_OUTPUT
+        if not request_body.get('stream'):
+            self._send_json({'text': text})
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Connection', 'close')
+        self.end_headers()
+        try:
+            for end in range(100, len(text) + 100, 100):
+                self.wfile.write(f"data: {json.dumps({'text': text[:end]})}\n\n".encode('utf-8'))
+                self.wfile.flush()
+                self.server.sent_chunks += 1
+            self.wfile.write(b'data: [DONE]\n\n')
+        except (BrokenPipeError, ConnectionResetError):
+            pass
+        self.close_connection = True
+
+
+class StubSglangServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), StubSglangHandler)
+        self.sampling_params = []
+        self.sent_chunks = 0
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+
+@pytest.fixture
+def server():
+    stub_server = StubSglangServer()
+    yield stub_server
+    stub_server.shutdown()
+    stub_server.server_close()
+
+
+def test_sglang_client_sends_guard_params_and_records_stats(server, monkeypatch):
+    monkeypatch.delenv('MINERU_VLM_GUARD_ENABLE', raising=False)
+    monkeypatch.delenv('MINERU_VLM_GUARD_RETRY', raising=False)
+    predictor = SglangClientPredictor(server.url)
+    before = generation_guard_stats.stats()
+    assert predictor.predict(b'image') == REPEATED_BLOCKS_OUTPUT
+    after = generation_guard_stats.stats()
+    assert after['checked'] == before['checked'] + 1
+    assert after['triggered'].get('repeated_blocks', 0) == before['triggered'].get('repeated_blocks', 0) + 1
+    assert server.sampling_params[0]['custom_params']['generation_guard'] == {'max_block_chars': 65536, 'max_repeated_blocks': 10}
+    predictor.close()
+
+
+def test_sglang_client_retries_degenerated_page(server, monkeypatch):
+    monkeypatch.setenv('MINERU_VLM_GUARD_RETRY', 'true')
+    predictor = SglangClientPredictor(server.url)
+    before = generation_guard_stats.stats()
+    assert predictor.batch_predict([b'image'] * 3) == [NORMAL_OUTPUT] * 3
+    after = generation_guard_stats.stats()
+    assert after['retried'] == before['retried'] + 3
+    assert after['recovered'] == before['recovered'] + 3
+    retry_params = server.sampling_params[-1]
+    assert retry_params['repetition_penalty'] == 1.05
+    assert retry_params['custom_params']['no_repeat_ngram_size'] == 35
+    predictor.close()
+
+
+def test_sglang_client_stream_stops_on_degeneration(server):
+    predictor = SglangClientPredictor(server.url)
+    output = ''.join(predictor.stream_predict(b'image'))
+    assert check_output(output, GUARD_CONFIG) == 'repeated_blocks'
+    assert len(output) < len(REPEATED_BLOCKS_OUTPUT)
+    predictor.close()
+
+
+def test_guard_disabled(server, monkeypatch):
+    monkeypatch.setenv('MINERU_VLM_GUARD_ENABLE', 'false')
+    predictor = SglangClientPredictor(server.url)
+    before = generation_guard_stats.stats()
+    assert predictor.predict(b'image') == REPEATED_BLOCKS_OUTPUT
+    assert ''.join(predictor.stream_predict(b'image')) == REPEATED_BLOCKS_OUTPUT
+    assert generation_guard_stats.stats() == before
+    assert 'generation_guard' not in server.sampling_params[0]['custom_params']
+    predictor.close()
+
+
+if __name__ == '__main__':
+    import time
+
+    # 逐token输入时每个字符的检测开销
+    for name, text in [('normal', NORMAL_OUTPUT * 3), *DEGENERATED_OUTPUTS.items()]:
+        start = time.perf_counter()
+        reason, stop_pos = feed_in_chunks(text, lambda: 3)
+        cost = time.perf_counter() - start
+        print(f'{name}: reason {reason}, stopped at {stop_pos}/{len(text)} chars, {cost * 1e6 / stop_pos:.3f} us/char')
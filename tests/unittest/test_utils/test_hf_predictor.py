@@ -0,0 +1,193 @@
+import string
+from io import BytesIO
+
+import numpy as np
+import pytest
+import torch
+import transformers
+from packaging import version
+from PIL import Image
+
+pytestmark = pytest.mark.skipif(
+    version.parse(transformers.__version__) >= version.parse('5.0.0'),
+    reason='vlm_hf_model requires transformers<5',
+)
+
+
+def build_predictor(tmp_path, batch_size, prefix_cache=True, hidden_size=32, num_hidden_layers=2):
+    import threading
+
+    from tokenizers import Tokenizer, decoders, models, pre_tokenizers
+    from transformers import PreTrainedTokenizerFast, SiglipVisionConfig
+
+    from mineru.backend.vlm.base_predictor import BasePredictor
+    from mineru.backend.vlm.hf_predictor import HuggingfacePredictor
+    from mineru.model.vlm_hf_model import Mineru2QwenForCausalLM
+    from mineru.model.vlm_hf_model.configuration_mineru2 import Mineru2QwenConfig
+
+    # 随机初始化的小模型，只用于比较逐页生成和batch生成的结果
+    vision_tower_path = str(tmp_path / 'siglip-tiny')
+    SiglipVisionConfig(
+        hidden_size=32, intermediate_size=64, num_hidden_layers=2, num_attention_heads=4, image_size=384, patch_size=48
+    ).save_pretrained(vision_tower_path)
+
+    special_tokens = ['<|endoftext|>', '<|im_start|>', '<|im_end|>', '<image>']
+    vocab = {token: i for i, token in enumerate(special_tokens + list(string.printable))}
+    tokenizer = Tokenizer(models.WordLevel(vocab, unk_token='<|endoftext|>'))
+    tokenizer.pre_tokenizer = pre_tokenizers.Split('', 'isolated')
+    tokenizer.decoder = decoders.Fuse()
+    tokenizer = PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer, pad_token='<|endoftext|>', eos_token='<|im_end|>',
+        additional_special_tokens=special_tokens,
+    )
+
+    config = Mineru2QwenConfig(
+        vocab_size=len(vocab), hidden_size=hidden_size, intermediate_size=2 * hidden_size,
+        num_hidden_layers=num_hidden_layers, num_attention_heads=4, num_key_value_heads=2, max_position_embeddings=4096, mm_hidden_size=32, mm_vision_tower=vision_tower_path,
+        image_token_index=vocab['<image>'], eos_token_id=vocab['<|im_end|>'],
+    )
+    torch.manual_seed(0)
+    model = Mineru2QwenForCausalLM(config).eval()
+    with torch.no_grad():
+        model.get_model().image_newline.normal_()
+
+    predictor = object.__new__(HuggingfacePredictor)
+    BasePredictor.__init__(predictor, max_new_tokens=30)
+    predictor.tokenizer = tokenizer
+    predictor.model = model
+    predictor.image_processor = model.get_model().vision_tower.image_processor
+    predictor.eos_token_id = config.eos_token_id
+    predictor.batch_size = batch_size
+    predictor.prefix_cache = prefix_cache
+    predictor._prefix_caches = {}
+    predictor._prefix_cache_lock = threading.Lock()
+    return predictor
+
+
+def make_images():
+    rng = np.random.RandomState(0)
+    images = []
+    for width, height in [(400, 500), (800, 300), (300, 300), (900, 1200), (500, 700)]:
+        buffer = BytesIO()
+        Image.fromarray(rng.randint(0, 255, (height, width, 3), dtype=np.uint8)).save(buffer, 'PNG')
+        images.append(buffer.getvalue())
+    return images
+
+
+@pytest.mark.parametrize('batch_size', [1, 3, 8])
+def test_batch_predict_matches_predict(tmp_path, batch_size):
+    predictor = build_predictor(tmp_path, batch_size)
+    images = make_images()
+    prompts = ['Document Parsing:', 'Table Recognition:', 'Document Parsing:', 'Text Recognition:', 'Formula Recognition:']
+
+    serial_outputs = [predictor.predict(image, prompt) for image, prompt in zip(images, prompts)]
+    assert predictor.batch_predict(images, prompts) == serial_outputs
+
+
+def test_stream_predict_matches_predict(tmp_path):
+    predictor = build_predictor(tmp_path, 1)
+    for image in make_images():
+        chunks = list(predictor.stream_predict(image))
+        assert ''.join(chunks).strip() == predictor.predict(image)
+
+
+def test_stream_predict_early_stop(tmp_path):
+    predictor = build_predictor(tmp_path, 1)
+    stream = predictor.stream_predict(make_images()[0])
+    next(stream)
+    # 提前关闭时后台的generate线程会结束
+    stream.close()
+
+
+def test_generation_guard_stops_each_sequence(tmp_path):
+    predictor = build_predictor(tmp_path, 3)
+    images = make_images()
+    unguarded_outputs = [predictor.predict(image) for image in images]
+
+    # 没有<|box_start|>的输出超过max_block_chars个字符后被判定为退化
+    predictor.guard_config = {'max_block_chars': 4, 'max_repeated_blocks': 10, 'retry': False}
+    serial_outputs = [predictor.predict(image) for image in images]
+    assert predictor.batch_predict(images) == serial_outputs
+    assert ''.join(predictor.stream_predict(images[0])).strip() == serial_outputs[0]
+    for output, unguarded_output in zip(serial_outputs, unguarded_outputs):
+        assert unguarded_output.startswith(output)
+        assert len(output) <= 5
+    assert max(len(output) for output in unguarded_outputs) > 5
+
+
+def test_batch_predict_with_page_max_new_tokens(tmp_path):
+    predictor = build_predictor(tmp_path, 3)
+    images = make_images()
+    page_max_new_tokens = [5, 30, 12, 1, 20]
+    serial_outputs = [
+        predictor.predict(image, max_new_tokens=max_new_tokens) for image, max_new_tokens in zip(images, page_max_new_tokens)
+    ]
+    assert predictor.batch_predict(images, max_new_tokens=page_max_new_tokens) == serial_outputs
+
+
+def test_prefix_cache_matches_full_prefill(tmp_path):
+    predictor = build_predictor(tmp_path, 3)
+    reference = build_predictor(tmp_path, 3, prefix_cache=False)
+    images = make_images()
+    prompts = ['Document Parsing:', 'Table Recognition:', 'Document Parsing:', 'Text Recognition:', 'Formula Recognition:']
+
+    serial_outputs = [reference.predict(image, prompt) for image, prompt in zip(images, prompts)]
+    assert [predictor.predict(image, prompt) for image, prompt in zip(images, prompts)] == serial_outputs
+    assert predictor.batch_predict(images, prompts) == serial_outputs
+    assert ''.join(predictor.stream_predict(images[0], prompts[0])).strip() == serial_outputs[0]
+    # 系统提示词只prefill一次，缓存本身不会被generate修改
+    assert len(predictor._prefix_caches) == 1
+    prefix_key_values = next(iter(predictor._prefix_caches.values()))
+    assert prefix_key_values.get_seq_length() == len(next(iter(predictor._prefix_caches)))
+    assert predictor.predict(images[1], prompts[1]) == serial_outputs[1]
+
+
+def test_prefix_cache_with_different_system_prompts(tmp_path):
+    predictor = build_predictor(tmp_path, 3)
+    reference = build_predictor(tmp_path, 3, prefix_cache=False)
+    images = make_images()[:2]
+    # 前缀不同的prompt不共用cache，batch中前缀不一致时不使用cache
+    prompts = [
+        '<|im_start|>system\nA<|im_end|><|im_start|>user\n<image>\nText Recognition:<|im_end|><|im_start|>assistant\n',
+        '<|im_start|>system\nB<|im_end|><|im_start|>user\n<image>\nText Recognition:<|im_end|><|im_start|>assistant\n',
+    ]
+    serial_outputs = [reference.predict(image, prompt) for image, prompt in zip(images, prompts)]
+    assert [predictor.predict(image, prompt) for image, prompt in zip(images, prompts)] == serial_outputs
+    assert len(predictor._prefix_caches) == 2
+    assert predictor.batch_predict(images, prompts) == serial_outputs
+
+
+if __name__ == '__main__':
+    import tempfile
+    import time
+    from pathlib import Path
+
+    from mineru.model.vlm_hf_model.image_processing_mineru2 import process_images
+
+    # CPU上比较完整prefill和复用系统提示词KV cache时每页的prefill耗时（只生成一个token，不含图像预处理）
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        image_objs = [Image.open(BytesIO(image)) for image in make_images()]
+        for hidden_size in [32, 512]:
+            for prefix_cache in [False, True]:
+                predictor = build_predictor(Path(tmp_dir), 1, prefix_cache, hidden_size=hidden_size, num_hidden_layers=8)
+                prompt = predictor.build_prompt('')
+                image_tensors = [
+                    process_images([image_obj], predictor.image_processor, predictor.model.config)[0].unsqueeze(0)
+                    for image_obj in image_objs
+                ]
+
+                def prefill(image_obj, image_tensor):
+                    prompt_ids, prefix_key_values = predictor._tokenize_prompts([prompt])
+                    with torch.inference_mode():
+                        predictor.model.generate(
+                            torch.tensor(prompt_ids), images=image_tensor, image_sizes=[[*image_obj.size]],
+                            prefix_key_values=prefix_key_values, max_new_tokens=1, do_sample=False, pad_token_id=0,
+                        )
+
+                prefill(image_objs[0], image_tensors[0])
+                start = time.perf_counter()
+                for _ in range(5):
+                    for image_obj, image_tensor in zip(image_objs, image_tensors):
+                        prefill(image_obj, image_tensor)
+                cost = (time.perf_counter() - start) / (5 * len(image_objs))
+                print(f'hidden_size={hidden_size}, prefix_cache={prefix_cache}: {cost * 1000:.2f} ms/page')
@@ -0,0 +1,109 @@
+import io
+import sys
+import time
+from base64 import b64decode, b64encode
+
+import numpy as np
+import pytest
+from PIL import Image, ImageDraw
+
+from mineru.backend.vlm.sglang_client_predictor import SglangClientPredictor
+from mineru.backend.vlm.utils import ImagePayload, load_resource, select_anyres_resolution
+from mineru.utils.pdf_image_tools import image_to_b64str
+
+
+def make_page_image(width=1224, height=1584):
+    """白底黑字的模拟页面，接近200dpi渲染的文档页"""
+    image = Image.new('RGB', (width, height), 'white')
+    draw = ImageDraw.Draw(image)
+    for i, y in enumerate(range(80, height - 80, 24)):
+        draw.text((80, y), f'line {i} ' + 'lorem ipsum dolor sit amet ' * 4, fill='black')
+    draw.rectangle((100, 300, 600, 500), outline=(200, 30, 30), width=3)
+    return image
+
+
+def decode(payload: ImagePayload) -> Image.Image:
+    return Image.open(io.BytesIO(payload.data)).convert('RGB')
+
+
+@pytest.mark.parametrize('codec', ['png', 'webp'])
+def test_lossless_codecs_round_trip(codec):
+    image = make_page_image()
+    payload = ImagePayload.from_pil(image, codec)
+    assert payload.image_format == codec
+    assert np.array_equal(np.asarray(decode(payload)), np.asarray(image))
+
+
+def test_jpeg_codec_is_close():
+    image = make_page_image()
+    decoded = np.asarray(decode(ImagePayload.from_pil(image, 'jpeg')), dtype=np.int16)
+    assert np.abs(decoded - np.asarray(image, dtype=np.int16)).mean() < 2
+
+
+def test_unsupported_codec():
+    with pytest.raises(ValueError):
+        ImagePayload.from_pil(make_page_image(), 'gif')
+
+
+def test_payload_matches_previous_base64_path():
+    # 旧的调用链：png base64 -> load_resource解码 -> build_request_body再编码
+    image = make_page_image()
+    old_image_data = b64encode(load_resource(image_to_b64str(image))).decode('utf-8')
+    predictor = object.__new__(SglangClientPredictor)
+    payload = ImagePayload.from_pil(image)
+    request_body = predictor.build_request_body(payload, 'prompt', {})
+    assert request_body['image_data'] is payload.base64
+    assert b64decode(request_body['image_data']) == payload.data
+    old_pixels = np.asarray(Image.open(io.BytesIO(b64decode(old_image_data))))
+    assert np.array_equal(np.asarray(decode(payload)), old_pixels)
+    # bytes输入保持原有行为
+    assert predictor.build_request_body(payload.data, 'prompt', {})['image_data'] == payload.base64
+
+
+@pytest.mark.parametrize('size, expected, sent_size', [
+    ((1700, 2200), (1536, 1536), (1536, 1536)),
+    ((2200, 1700), (1536, 1536), (1536, 1536)),
+    ((1224, 1584), (1536, 1536), (1224, 1584)),
+    ((300, 400), (384, 768), (300, 400)),
+])
+def test_prescale_to_anyres_resolution(size, expected, sent_size):
+    assert select_anyres_resolution(size) == expected
+    payload = ImagePayload.from_pil(make_page_image(*size), prescale=True)
+    # 只在模型会缩小图像时预先缩小，会被放大的图像按原尺寸发送
+    assert decode(payload).size == sent_size
+    # 缩放后的尺寸再选择时保持不变，服务端不会再缩放一次
+    assert select_anyres_resolution(sent_size) == expected
+
+
+def test_select_anyres_resolution_matches_model():
+    image_processing = pytest.importorskip('mineru.model.vlm_hf_model.image_processing_mineru2')
+    resolutions = [(w * 384, h * 384) for w in range(1, 5) for h in range(1, 5)]
+    for size in [(1224, 1584), (1700, 2200), (595, 842), (2000, 500), (3000, 3000), (64, 64)]:
+        assert select_anyres_resolution(size) == image_processing.select_best_resolution(size, resolutions)
+
+
+def run_benchmark(num_pages=20):
+    """对比旧调用链和各编码方式的单页耗时与传输大小"""
+    images = [make_page_image(1700, 2200) for _ in range(num_pages)]
+    predictor = object.__new__(SglangClientPredictor)
+
+    def old_path(image):
+        return predictor.build_request_body(load_resource(image_to_b64str(image)), '', {})
+
+    cases = [('png base64 -> bytes -> base64', old_path)]
+    for codec in ['png', 'webp', 'jpeg']:
+        for prescale in [False, True]:
+            cases.append((
+                f'ImagePayload {codec}{", prescale" if prescale else ""}',
+                lambda image, c=codec, p=prescale: predictor.build_request_body(ImagePayload.from_pil(image, c, p), '', {})
+            ))
+    for name, build in cases:
+        start = time.time()
+        sizes = [len(build(image)['image_data']) for image in images]
+        elapsed = time.time() - start
+        print(f'{name}: {elapsed / num_pages * 1000:.1f} ms/page, {sum(sizes) / num_pages / 1024:.1f} KB/page')
+
+
+if __name__ == '__main__':
+    # 页面图像编码对比：python tests/unittest/test_utils/test_image_payload.py [num_pages]
+    run_benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 20)
@@ -0,0 +1,280 @@
+import copy
+import random
+
+import pytest
+
+from mineru.backend.pipeline.pipeline_magic_model import MagicModel
+from mineru.utils.boxbase import bbox_distance, bbox_relative_pos, calculate_iou, is_in
+from mineru.utils.enum_class import CategoryId
+
+
+# 以下为基于逐对比较的原始实现，作为等价性测试的参照
+def reference_fix_by_remove_high_iou_and_low_confidence(self):
+    need_remove_list = []
+    layout_dets = self._MagicModel__page_model_info['layout_dets']
+    for layout_det1 in layout_dets:
+        for layout_det2 in layout_dets:
+            if layout_det1 == layout_det2:
+                continue
+            if layout_det1['category_id'] in [0, 1, 2, 3, 4, 5, 6, 7, 8, 9] and layout_det2['category_id'] in [0, 1, 2, 3, 4, 5, 6, 7, 8, 9]:
+                if (
+                    calculate_iou(layout_det1['bbox'], layout_det2['bbox'])
+                    > 0.9
+                ):
+                    if layout_det1['score'] < layout_det2['score']:
+                        layout_det_need_remove = layout_det1
+                    else:
+                        layout_det_need_remove = layout_det2
+
+                    if layout_det_need_remove not in need_remove_list:
+                        need_remove_list.append(layout_det_need_remove)
+                else:
+                    continue
+            else:
+                continue
+    for need_remove in need_remove_list:
+        layout_dets.remove(need_remove)
+
+
+def reference_fix_footnote(self):
+    # 3: figure, 5: table, 7: footnote
+    footnotes = []
+    figures = []
+    tables = []
+
+    for obj in self._MagicModel__page_model_info['layout_dets']:
+        if obj['category_id'] == 7:
+            footnotes.append(obj)
+        elif obj['category_id'] == 3:
+            figures.append(obj)
+        elif obj['category_id'] == 5:
+            tables.append(obj)
+    dis_figure_footnote = {}
+    dis_table_footnote = {}
+
+    for i in range(len(footnotes)):
+        for j in range(len(figures)):
+            pos_flag_count = sum(1 if x else 0 for x in bbox_relative_pos(footnotes[i]['bbox'], figures[j]['bbox']))
+            if pos_flag_count > 1:
+                continue
+            dis_figure_footnote[i] = min(
+                self._bbox_distance(figures[j]['bbox'], footnotes[i]['bbox']),
+                dis_figure_footnote.get(i, float('inf')),
+            )
+    for i in range(len(footnotes)):
+        for j in range(len(tables)):
+            pos_flag_count = sum(1 if x else 0 for x in bbox_relative_pos(footnotes[i]['bbox'], tables[j]['bbox']))
+            if pos_flag_count > 1:
+                continue
+            dis_table_footnote[i] = min(
+                self._bbox_distance(tables[j]['bbox'], footnotes[i]['bbox']),
+                dis_table_footnote.get(i, float('inf')),
+            )
+    for i in range(len(footnotes)):
+        if i not in dis_figure_footnote:
+            continue
+        if dis_table_footnote.get(i, float('inf')) > dis_figure_footnote[i]:
+            footnotes[i]['category_id'] = CategoryId.ImageFootnote
+
+
+def reference_bbox_distance(self, bbox1, bbox2):
+    left, right, bottom, top = bbox_relative_pos(bbox1, bbox2)
+    flags = [left, right, bottom, top]
+    count = sum([1 if v else 0 for v in flags])
+    if count > 1:
+        return float('inf')
+    if left or right:
+        l1 = bbox1[3] - bbox1[1]
+        l2 = bbox2[3] - bbox2[1]
+    else:
+        l1 = bbox1[2] - bbox1[0]
+        l2 = bbox2[2] - bbox2[0]
+
+    if l2 > l1 and (l2 - l1) / l1 > 0.3:
+        return float('inf')
+
+    return bbox_distance(bbox1, bbox2)
+
+
+def reference_reduct_overlap(self, bboxes):
+    N = len(bboxes)
+    keep = [True] * N
+    for i in range(N):
+        for j in range(N):
+            if i == j:
+                continue
+            if is_in(bboxes[i]['bbox'], bboxes[j]['bbox']):
+                keep[i] = False
+    return [bboxes[i] for i in range(N) if keep[i]]
+
+
+def reference_tie_up_category_by_distance_v3(self, subject_category_id, object_category_id):
+    layout_dets = self._MagicModel__page_model_info['layout_dets']
+    subjects = self._MagicModel__reduct_overlap(
+        [{'bbox': x['bbox'], 'score': x['score']} for x in layout_dets if x['category_id'] == subject_category_id]
+    )
+    objects = self._MagicModel__reduct_overlap(
+        [{'bbox': x['bbox'], 'score': x['score']} for x in layout_dets if x['category_id'] == object_category_id]
+    )
+
+    ret = []
+    N = len(subjects)
+    subjects.sort(key=lambda x: x['bbox'][0] ** 2 + x['bbox'][1] ** 2)
+    objects.sort(key=lambda x: x['bbox'][0] ** 2 + x['bbox'][1] ** 2)
+
+    OBJ_IDX_OFFSET = 10000
+    SUB_BIT_KIND, OBJ_BIT_KIND = 0, 1
+
+    all_boxes_with_idx = [(i, SUB_BIT_KIND, sub['bbox'][0], sub['bbox'][1]) for i, sub in enumerate(subjects)] + [(i + OBJ_IDX_OFFSET, OBJ_BIT_KIND, obj['bbox'][0], obj['bbox'][1]) for i, obj in enumerate(objects)]
+    seen_idx = set()
+    seen_sub_idx = set()
+
+    while N > len(seen_sub_idx):
+        candidates = [v for v in all_boxes_with_idx if v[0] not in seen_idx]
+        if len(candidates) == 0:
+            break
+        left_x = min([v[2] for v in candidates])
+        top_y = min([v[3] for v in candidates])
+        candidates.sort(key=lambda x: (x[2] - left_x) ** 2 + (x[3] - top_y) ** 2)
+
+        fst_idx, fst_kind, left_x, top_y = candidates[0]
+        candidates.sort(key=lambda x: (x[2] - left_x) ** 2 + (x[3] - top_y) ** 2)
+        nxt = None
+        for i in range(1, len(candidates)):
+            if candidates[i][1] ^ fst_kind == 1:
+                nxt = candidates[i]
+                break
+        if nxt is None:
+            break
+
+        if fst_kind == SUB_BIT_KIND:
+            sub_idx, obj_idx = fst_idx, nxt[0] - OBJ_IDX_OFFSET
+        else:
+            sub_idx, obj_idx = nxt[0], fst_idx - OBJ_IDX_OFFSET
+
+        pair_dis = bbox_distance(subjects[sub_idx]['bbox'], objects[obj_idx]['bbox'])
+        nearest_dis = float('inf')
+        for i in range(N):
+            if i in seen_idx or i == sub_idx:
+                continue
+            nearest_dis = min(nearest_dis, bbox_distance(subjects[i]['bbox'], objects[obj_idx]['bbox']))
+
+        if pair_dis >= 3 * nearest_dis:
+            seen_idx.add(sub_idx)
+            continue
+
+        seen_idx.add(sub_idx)
+        seen_idx.add(obj_idx + OBJ_IDX_OFFSET)
+        seen_sub_idx.add(sub_idx)
+        ret.append({
+            'sub_bbox': {'bbox': subjects[sub_idx]['bbox'], 'score': subjects[sub_idx]['score']},
+            'obj_bboxes': [{'score': objects[obj_idx]['score'], 'bbox': objects[obj_idx]['bbox']}],
+            'sub_idx': sub_idx,
+        })
+
+    for i in range(len(objects)):
+        j = i + OBJ_IDX_OFFSET
+        if j in seen_idx:
+            continue
+        seen_idx.add(j)
+        nearest_dis, nearest_sub_idx = float('inf'), -1
+        for k in range(len(subjects)):
+            dis = bbox_distance(objects[i]['bbox'], subjects[k]['bbox'])
+            if dis < nearest_dis:
+                nearest_dis = dis
+                nearest_sub_idx = k
+
+        for k in range(len(subjects)):
+            if k != nearest_sub_idx:
+                continue
+            if k in seen_sub_idx:
+                for kk in range(len(ret)):
+                    if ret[kk]['sub_idx'] == k:
+                        ret[kk]['obj_bboxes'].append({'score': objects[i]['score'], 'bbox': objects[i]['bbox']})
+                        break
+            else:
+                ret.append({
+                    'sub_bbox': {'bbox': subjects[k]['bbox'], 'score': subjects[k]['score']},
+                    'obj_bboxes': [{'score': objects[i]['score'], 'bbox': objects[i]['bbox']}],
+                    'sub_idx': k,
+                })
+            seen_sub_idx.add(k)
+            seen_idx.add(k)
+
+    for i in range(len(subjects)):
+        if i in seen_sub_idx:
+            continue
+        ret.append({
+            'sub_bbox': {'bbox': subjects[i]['bbox'], 'score': subjects[i]['score']},
+            'obj_bboxes': [],
+            'sub_idx': i,
+        })
+
+    return ret
+
+
+class ReferenceMagicModel(MagicModel):
+    """用原始实现替换矩阵化的方法，其余流程与MagicModel一致"""
+    _MagicModel__fix_by_remove_high_iou_and_low_confidence = reference_fix_by_remove_high_iou_and_low_confidence
+    _MagicModel__fix_footnote = reference_fix_footnote
+    _MagicModel__reduct_overlap = reference_reduct_overlap
+    _MagicModel__tie_up_category_by_distance_v3 = reference_tie_up_category_by_distance_v3
+    _bbox_distance = reference_bbox_distance
+
+
+def make_page_model_info(rng, num, page_size=200, grid=5):
+    """生成包含重复框、嵌套框和等距框的随机layout_dets，坐标落在网格上以便制造距离相同的情况"""
+    layout_dets = []
+    for _ in range(num):
+        choice = rng.random()
+        if layout_dets and choice < 0.1:
+            # 完全重复的框，类别和置信度可能不同
+            layout_det = copy.deepcopy(rng.choice(layout_dets))
+            layout_det['category_id'] = rng.choice([3, 4, 5, 6, 7])
+            layout_det['score'] = rng.choice([0.5, 0.9])
+            layout_dets.append(layout_det)
+            continue
+        if layout_dets and choice < 0.25:
+            # 嵌套在已有框内
+            x0, y0, _, _, x1, y1, _, _ = rng.choice(layout_dets)['poly']
+            x0, y0 = x0 + grid * rng.randint(0, 2), y0 + grid * rng.randint(0, 2)
+            x1, y1 = x1 - grid * rng.randint(0, 2), y1 - grid * rng.randint(0, 2)
+        else:
+            x0 = grid * rng.randint(0, page_size // grid)
+            y0 = grid * rng.randint(0, page_size // grid)
+            x1 = x0 + grid * rng.randint(0, 8)
+            y1 = y0 + grid * rng.randint(0, 4)
+        layout_dets.append({
+            'category_id': rng.choice([0, 1, 2, 3, 3, 4, 4, 5, 5, 6, 6, 7, 7, 7, 15]),
+            'poly': [x0, y0, x1, y0, x1, y1, x0, y1],
+            'score': rng.choice([0.03, 0.5, 0.8, 0.9, 1.0]),
+        })
+    return {'layout_dets': layout_dets}
+
+
+@pytest.mark.parametrize('seed', range(40))
+@pytest.mark.parametrize('scale', [1, 0.73])
+def test_magic_model_equivalence(seed, scale):
+    rng = random.Random(seed)
+    page_model_info = make_page_model_info(rng, rng.randint(0, 80))
+
+    expected_model = ReferenceMagicModel(copy.deepcopy(page_model_info), scale)
+    magic_model = MagicModel(copy.deepcopy(page_model_info), scale)
+
+    assert magic_model._MagicModel__page_model_info == expected_model._MagicModel__page_model_info
+    assert magic_model.get_imgs() == expected_model.get_imgs()
+    assert magic_model.get_tables() == expected_model.get_tables()
+
+
+def test_tie_up_equal_distance_uses_first_subject():
+    # 两个table各自配对一个caption后，剩下的caption到两个table等距，应与原始实现一样挂到排序在前的table上
+    page_model_info = {'layout_dets': [
+        {'category_id': 5, 'poly': [0, 20, 40, 20, 40, 40, 0, 40], 'score': 0.9},
+        {'category_id': 5, 'poly': [0, 80, 40, 80, 40, 100, 0, 100], 'score': 0.9},
+        {'category_id': 6, 'poly': [0, 0, 40, 0, 40, 15, 0, 15], 'score': 0.9},
+        {'category_id': 6, 'poly': [0, 105, 40, 105, 40, 120, 0, 120], 'score': 0.9},
+        {'category_id': 6, 'poly': [100, 55, 140, 55, 140, 65, 100, 65], 'score': 0.9},
+    ]}
+    expected = ReferenceMagicModel(copy.deepcopy(page_model_info), 1).get_tables()
+    assert [len(table['table_caption_list']) for table in expected] == [2, 1]
+    assert MagicModel(copy.deepcopy(page_model_info), 1).get_tables() == expected
@@ -0,0 +1,160 @@
+import cv2
+import numpy as np
+
+from mineru.utils.ocr_det_batch import (
+    OCR_DET_CANVAS_GUTTER,
+    OCR_DET_CANVAS_SIZE,
+    batch_det_with_canvases,
+    batch_det_with_padding,
+    pack_crops,
+    render_canvases,
+    split_canvas_boxes,
+)
+
+
+def random_crops(num, seed=0):
+    # 与batch_analyze中crop_img(crop_paste_x=50, crop_paste_y=50)得到的裁剪图类似，四周各有50像素白边
+    rng = np.random.RandomState(seed)
+    crops = []
+    for _ in range(num):
+        h, w = int(rng.randint(20, 200)), int(rng.randint(40, 700))
+        crop = np.full((h + 100, w + 100, 3), 255, dtype=np.uint8)
+        for y in range(50, 50 + h - 12, 24):
+            line_w = int(rng.randint(w // 2, w + 1))
+            crop[y + 2:y + 14, 50:50 + line_w] = 0
+        crops.append(crop)
+    return crops
+
+
+class ContourDetector:
+    """把黑色的文本行当作检测结果的检测器，用于验证拼接和坐标映射"""
+
+    def __init__(self):
+        self.batch_shapes = []
+
+    def detect(self, img):
+        mask = (img[:, :, 0] < 128).astype(np.uint8)
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+        boxes = []
+        for contour in contours:
+            x, y, w, h = cv2.boundingRect(contour)
+            boxes.append([[x, y], [x + w - 1, y], [x + w - 1, y + h - 1], [x, y + h - 1]])
+        return np.array(boxes, dtype=np.float32)
+
+    def batch_predict(self, img_list, max_batch_size=8):
+        results = []
+        for i in range(0, len(img_list), max_batch_size):
+            batch_imgs = img_list[i:i + max_batch_size]
+            assert len({img.shape for img in batch_imgs}) == 1
+            self.batch_shapes.append((len(batch_imgs),) + batch_imgs[0].shape[:2])
+            results.extend((self.detect(img), 0) for img in batch_imgs)
+        return results
+
+
+def sort_boxes(boxes):
+    return sorted(np.asarray(boxes).reshape(-1, 8).tolist())
+
+
+def test_pack_crops():
+    crops = random_crops(60) + [np.full((1200, 300, 3), 255, dtype=np.uint8)]
+    sizes = [crop.shape[:2] for crop in crops]
+    placements, canvas_shapes = pack_crops(sizes)
+    # 超过画布尺寸的图像不参与拼接
+    assert placements[-1] is None
+    assert all(placement is not None for placement in placements[:-1])
+    assert max(placement[0] for placement in placements[:-1]) + 1 == len(canvas_shapes)
+    assert len(canvas_shapes) < len(crops) // 5
+    # 除最后一张外的画布尺寸相同
+    assert len(set(canvas_shapes[:-1])) == 1
+    for canvas_index, (canvas_h, canvas_w) in enumerate(canvas_shapes):
+        assert canvas_h % 32 == 0 and canvas_w % 32 == 0
+        assert canvas_h <= OCR_DET_CANVAS_SIZE and canvas_w <= OCR_DET_CANVAS_SIZE
+        rects = [
+            (x, y, w, h) for (index, x, y), (h, w) in zip(placements[:-1], sizes[:-1]) if index == canvas_index
+        ]
+        for i, (x, y, w, h) in enumerate(rects):
+            assert x + w <= canvas_w and y + h <= canvas_h
+            # 裁剪图之间至少间隔gutter
+            for x2, y2, w2, h2 in rects[i + 1:]:
+                assert (
+                    x + w + OCR_DET_CANVAS_GUTTER <= x2 or x2 + w2 + OCR_DET_CANVAS_GUTTER <= x
+                    or y + h + OCR_DET_CANVAS_GUTTER <= y2 or y2 + h2 + OCR_DET_CANVAS_GUTTER <= y
+                )
+    assert pack_crops([(300, 400), (200, 500)]) == ([(0, 0, 0), (0, 416, 0)], [(320, 928)])
+    assert pack_crops([]) == ([], [])
+
+
+def test_split_canvas_boxes():
+    crop_rects = [(0, 0, 200, 100), (232, 0, 300, 80)]
+    dt_boxes = np.array([
+        [[10, 10], [190, 10], [190, 40], [10, 40]],
+        # 超出裁剪图范围的部分被裁掉
+        [[240, 20], [560, 20], [560, 50], [240, 50]],
+        # 中心在间隔中
+        [[195, 10], [240, 10], [240, 40], [195, 40]],
+    ], dtype=np.float32)
+    boxes = split_canvas_boxes(dt_boxes, crop_rects)
+    assert sort_boxes(boxes[0]) == sort_boxes(dt_boxes[0])
+    assert sort_boxes(boxes[1]) == sort_boxes([[[8, 20], [299, 20], [299, 50], [8, 50]]])
+    assert [len(b) for b in split_canvas_boxes(np.array([]), crop_rects)] == [0, 0]
+
+
+def test_canvas_boxes_match_single_detection():
+    crops = random_crops(40, seed=1) + [np.full((1000, 1200, 3), 255, dtype=np.uint8)]
+    detector = ContourDetector()
+    results = batch_det_with_canvases(detector, crops, max_batch_size=4)
+    assert results[-1] is None
+    for crop, boxes in zip(crops[:-1], results[:-1]):
+        assert sort_boxes(boxes) == sort_boxes(detector.detect(crop))
+    # 尺寸相同的画布按batch一起检测
+    placements, canvas_shapes = pack_crops([crop.shape[:2] for crop in crops])
+    assert sum(shape[0] for shape in detector.batch_shapes) == len(canvas_shapes)
+    assert len(detector.batch_shapes) <= -(-len(canvas_shapes) // 4) + 1
+    canvases = render_canvases(crops, placements, canvas_shapes)
+    assert [canvas.shape[:2] for canvas in canvases] == canvas_shapes
+
+
+def test_padding_boxes_match_single_detection():
+    crops = random_crops(20, seed=2)
+    results = batch_det_with_padding(ContourDetector(), crops, max_batch_size=16)
+    for crop, boxes in zip(crops, results):
+        assert sort_boxes(boxes) == sort_boxes(ContourDetector().detect(crop))
+
+
+if __name__ == '__main__':
+    import tempfile
+    import time
+    from pathlib import Path
+
+    import torch
+
+    from mineru.model.ocr.paddleocr2pytorch.pytorchocr.modeling.architectures.base_model import BaseModel
+    from mineru.model.ocr.paddleocr2pytorch.tools.infer import pytorchocr_utility as utility
+    from mineru.model.ocr.paddleocr2pytorch.tools.infer.predict_det import TextDetector
+
+    # 文本较多的页面（每页30个文本区域，共8页）上，按分辨率分组padding和拼接画布两种方式的det调用次数与耗时
+    pages = [random_crops(30, seed) for seed in range(8)]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        torch.manual_seed(0)
+        weights_path = str(Path(tmp_dir) / 'ch_PP-OCRv5_det_infer.pth')
+        torch.save(BaseModel(utility.get_arch_config(weights_path)).state_dict(), weights_path)
+        args = utility.init_args().parse_args([])
+        args.det_model_path = weights_path
+        detector = TextDetector(args)
+        forward_calls = []
+        detector.net.register_forward_hook(lambda module, inputs, outputs: forward_calls.append(inputs[0].shape))
+        for name, batch_det, max_batch_size in [
+            ('resolution groups', batch_det_with_padding, 16),
+            ('canvas tiling', batch_det_with_canvases, 2),
+        ]:
+            batch_det(detector, pages[0], max_batch_size)
+            forward_calls.clear()
+            start = time.perf_counter()
+            # 与BatchAnalyze相同，一次处理多页的所有裁剪图
+            batch_det(detector, sum(pages, []), max_batch_size)
+            cost = time.perf_counter() - start
+            pixels = sum(shape[0] * shape[2] * shape[3] for shape in forward_calls)
+            print(
+                f'{name}: {len(forward_calls) / len(pages):.1f} det calls/page, '
+                f'{pixels / len(pages) / 1e6:.2f} Mpixels/page, {cost / len(pages):.2f} s/page'
+            )
@@ -0,0 +1,135 @@
+import cv2
+import numpy as np
+import pytest
+import torch
+
+pytest.importorskip('onnx')
+pytest.importorskip('onnxruntime')
+
+from mineru.model.ocr.paddleocr2pytorch.pytorch_paddle import root_dir
+from mineru.model.ocr.paddleocr2pytorch.pytorchocr.modeling.architectures.base_model import BaseModel
+from mineru.model.ocr.paddleocr2pytorch.pytorchocr.onnx_runtime import OrtNet
+from mineru.model.ocr.paddleocr2pytorch.tools.infer import pytorchocr_utility as utility
+from mineru.model.ocr.paddleocr2pytorch.tools.infer.predict_det import TextDetector
+from mineru.model.ocr.paddleocr2pytorch.tools.infer.predict_rec import TextRecognizer
+from mineru.utils.config_reader import get_ocr_engine
+
+# 与CPU上默认使用的ch_lite相同的det/rec结构
+DET_MODEL = 'ch_PP-OCRv5_det_infer'
+REC_MODEL = 'ch_PP-OCRv5_rec_infer'
+REC_OUT_CHANNELS = 18385
+REC_DICT_PATH = str(root_dir / 'pytorchocr' / 'utils' / 'resources' / 'dict' / 'ppocrv5_dict.txt')
+
+
+def save_random_models(model_dir):
+    # 随机初始化的权重，只用于比较torch和onnxruntime的结果
+    torch.manual_seed(0)
+    for model_name, kwargs in [(DET_MODEL, {}), (REC_MODEL, {'out_channels': REC_OUT_CHANNELS})]:
+        weights_path = str(model_dir / f'{model_name}.pth')
+        net = BaseModel(utility.get_arch_config(weights_path), **kwargs)
+        torch.save(net.state_dict(), weights_path)
+    return model_dir
+
+
+@pytest.fixture(scope='module')
+def model_dir(tmp_path_factory):
+    return save_random_models(tmp_path_factory.mktemp('ocr_models'))
+
+
+def build_args(model_dir, ocr_engine):
+    args = utility.init_args().parse_args([])
+    args.det_model_path = str(model_dir / f'{DET_MODEL}.pth')
+    args.rec_model_path = str(model_dir / f'{REC_MODEL}.pth')
+    args.rec_char_dict_path = REC_DICT_PATH
+    args.ocr_engine = ocr_engine
+    return args
+
+
+def make_page(seed=0, num_lines=20, width=800, height=1000):
+    rng = np.random.RandomState(seed)
+    page = np.full((height, width, 3), 255, dtype=np.uint8)
+    lines = []
+    for i in range(num_lines):
+        y = 40 + i * (height - 80) // num_lines
+        x = int(rng.randint(20, 120))
+        text = ''.join(rng.choice(list('abcdefghijklmnopqrstuvwxyz0123456789 '), rng.randint(8, 40)))
+        cv2.putText(page, text, (x, y), cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 0, 0), 2)
+        (text_width, text_height), _ = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, 0.8, 2)
+        lines.append(page[y - text_height - 6 : y + 6, x - 4 : x + text_width + 4].copy())
+    return page, lines
+
+
+def test_get_ocr_engine(monkeypatch):
+    monkeypatch.delenv('MINERU_OCR_ENGINE', raising=False)
+    assert get_ocr_engine() == 'torch'
+    assert get_ocr_engine('onnxruntime') == 'onnxruntime'
+    monkeypatch.setenv('MINERU_OCR_ENGINE', 'onnxruntime')
+    assert get_ocr_engine() == 'onnxruntime'
+    monkeypatch.setenv('MINERU_OCR_ENGINE', 'tensorrt')
+    assert get_ocr_engine('onnxruntime') == 'torch'
+
+
+def test_detector_parity(model_dir):
+    torch_detector = TextDetector(build_args(model_dir, 'torch'))
+    ort_detector = TextDetector(build_args(model_dir, 'onnxruntime'))
+    assert isinstance(ort_detector.net, OrtNet)
+    assert (model_dir / f'{DET_MODEL}.onnx').exists()
+
+    # 动态的batch和高宽
+    for shape in [(1, 3, 640, 480), (2, 3, 320, 960)]:
+        inp = torch.from_numpy(np.random.RandomState(1).rand(*shape).astype(np.float32))
+        with torch.no_grad():
+            expected = torch_detector.net(inp)['maps'].numpy()
+        np.testing.assert_allclose(ort_detector.net(inp)['maps'].numpy(), expected, atol=1e-4)
+
+    for seed in range(2):
+        page, _ = make_page(seed)
+        torch_boxes, _ = torch_detector(page)
+        ort_boxes, _ = ort_detector(page)
+        assert len(ort_boxes) == len(torch_boxes)
+        np.testing.assert_allclose(ort_boxes, torch_boxes, atol=1)
+
+
+def test_recognizer_parity(model_dir):
+    torch_recognizer = TextRecognizer(build_args(model_dir, 'torch'))
+    ort_recognizer = TextRecognizer(build_args(model_dir, 'onnxruntime'))
+    assert isinstance(ort_recognizer.net, OrtNet)
+
+    _, lines = make_page(0)
+    torch_res, _ = torch_recognizer(lines)
+    ort_res, _ = ort_recognizer(lines)
+    assert [text for text, _ in ort_res] == [text for text, _ in torch_res]
+    np.testing.assert_allclose([score for _, score in ort_res], [score for _, score in torch_res], atol=1e-4)
+
+
+def test_fallback_to_torch(model_dir, tmp_path):
+    # 无法导出onnx时继续使用torch网络
+    args = build_args(model_dir, 'onnxruntime')
+    weights_path = tmp_path / f'{DET_MODEL}.pth'
+    weights_path.write_bytes((model_dir / f'{DET_MODEL}.pth').read_bytes())
+    (tmp_path / f'{DET_MODEL}.onnx').write_bytes(b'not an onnx model')
+    args.det_model_path = str(weights_path)
+    detector = TextDetector(args)
+    assert isinstance(detector.net, torch.nn.Module)
+
+
+if __name__ == '__main__':
+    import tempfile
+    import time
+    from pathlib import Path
+
+    # CPU上torch和onnxruntime的ocr吞吐（每页det一次，rec识别页面中的所有文本行）
+    pages = [make_page(seed, num_lines=30, width=1200, height=1600) for seed in range(4)]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        bench_model_dir = save_random_models(Path(tmp_dir))
+        for ocr_engine in ['torch', 'onnxruntime']:
+            detector = TextDetector(build_args(bench_model_dir, ocr_engine))
+            recognizer = TextRecognizer(build_args(bench_model_dir, ocr_engine))
+            detector(pages[0][0])
+            recognizer(pages[0][1])
+            start = time.perf_counter()
+            for page, lines in pages * 2:
+                detector(page)
+                recognizer(lines)
+            cost = time.perf_counter() - start
+            print(f'{ocr_engine}: {len(pages) * 2 / cost:.2f} pages/s')
@@ -0,0 +1,129 @@
+import PIL.Image
+import pytest
+
+from mineru.backend.pipeline import pipeline_analyze
+from mineru.backend.pipeline import page_cache
+from mineru.backend.pipeline.page_cache import MemoryPageStore, PageResultCache, SqlitePageStore
+
+
+def make_image(color):
+    return PIL.Image.new('RGB', (32, 32), color)
+
+
+def make_key(image, **kwargs):
+    options = dict(ocr_enable=False, lang='ch', formula_enable=True, table_enable=True)
+    options.update(kwargs)
+    return PageResultCache.make_key(image, **options)
+
+
+def test_make_key():
+    assert make_key(make_image('white')) == make_key(make_image('white'))
+    assert make_key(make_image('white')) != make_key(make_image('black'))
+    assert make_key(make_image('white')) != make_key(make_image('white'), ocr_enable=True)
+    assert make_key(make_image('white')) != make_key(make_image('white'), lang='en')
+
+
+@pytest.mark.parametrize('env_name, env_value', [
+    ('MINERU_OCR_ENGINE', 'onnxruntime'),
+    ('MINERU_OCR_DET_CANVAS_ENABLE', 'false'),
+    ('MINERU_MODEL_SOURCE', 'modelscope'),
+])
+def test_make_key_depends_on_model_options(monkeypatch, env_name, env_value):
+    for name in ['MINERU_OCR_ENGINE', 'MINERU_OCR_DET_CANVAS_ENABLE', 'MINERU_MODEL_SOURCE']:
+        monkeypatch.delenv(name, raising=False)
+    key = make_key(make_image('white'))
+    monkeypatch.setenv(env_name, env_value)
+    assert make_key(make_image('white')) != key
+
+
+def test_make_key_depends_on_weights(monkeypatch):
+    key = make_key(make_image('white'))
+    # 更换模型权重后不能复用旧的结果
+    monkeypatch.setattr(page_cache.ModelPath, 'slanet_plus', 'models/TabRec/SlanetPlus/slanet-plus-v2.onnx')
+    assert make_key(make_image('white')) != key
+    monkeypatch.undo()
+    monkeypatch.setenv('MINERU_MODEL_SOURCE', 'local')
+    monkeypatch.setattr(page_cache, 'get_local_models_dir', lambda: {'pipeline': '/models/a'})
+    local_key = make_key(make_image('white'))
+    monkeypatch.setattr(page_cache, 'get_local_models_dir', lambda: {'pipeline': '/models/b'})
+    assert make_key(make_image('white')) != local_key
+
+
+def test_memory_store_lru():
+    store = MemoryPageStore(max_size=25)
+    store.put('a', 'x' * 10)
+    store.put('b', 'x' * 10)
+    assert store.get('a') is not None
+    # 超出容量时淘汰最久未访问的b
+    assert store.put('c', 'x' * 10) == 1
+    assert store.get('b') is None
+    assert store.get('a') is not None
+    assert store.get('c') is not None
+    # 超过总容量的条目不缓存
+    assert store.put('d', 'x' * 30) == 0
+    assert store.get('d') is None
+
+
+def test_sqlite_store_lru(tmp_path):
+    db_path = str(tmp_path / 'page_cache.db')
+    store = SqlitePageStore(db_path, max_size=25)
+    store.put('a', 'x' * 10)
+    store.put('b', 'x' * 10)
+    assert store.get('a') is not None
+    assert store.put('c', 'x' * 10) == 1
+    assert store.get('b') is None
+    assert len(store) == 2
+    store.close()
+    # 重新打开后数据仍在
+    store = SqlitePageStore(db_path, max_size=25)
+    assert store.get('a') == 'x' * 10
+    store.close()
+
+
+def test_page_cache_two_levels(tmp_path):
+    db_path = str(tmp_path / 'page_cache.db')
+    key = make_key(make_image('white'))
+    result = [{'category_id': 1, 'poly': [0, 0, 10, 0, 10, 10, 0, 10], 'score': 0.9}]
+
+    cache = PageResultCache(memory_max_size=1024, db_path=db_path, db_max_size=1024)
+    assert cache.get(key) is None
+    cache.put(key, result)
+    cached_result = cache.get(key)
+    assert cached_result == result
+    # 修改取出的结果不影响缓存
+    cached_result[0]['score'] = 0
+    assert cache.get(key) == result
+
+    # 新的进程内缓存从sqlite中取回结果
+    cache = PageResultCache(memory_max_size=1024, db_path=db_path, db_max_size=1024)
+    assert cache.get(key) == result
+    assert cache.stats() == {'hits': 1, 'misses': 0, 'hit_rate': 1.0, 'writes': 0, 'evictions': 0}
+
+
+def test_batch_image_analyze_with_page_cache(monkeypatch, tmp_path):
+    monkeypatch.setenv('MINERU_PAGE_CACHE_DB', str(tmp_path / 'page_cache.db'))
+    calls = []
+
+    def fake_batch_image_analyze(images_with_extra_info, formula_enable=True, table_enable=True):
+        calls.append(len(images_with_extra_info))
+        return [[{'category_id': 1, 'color': list(image.getpixel((0, 0)))}] for image, _, _ in images_with_extra_info]
+
+    monkeypatch.setattr(pipeline_analyze, '_batch_image_analyze', fake_batch_image_analyze)
+
+    colors = ['white', 'black', 'white', 'red']
+    images_with_extra_info = [(make_image(color), False, 'ch') for color in colors]
+    expected = [[{'category_id': 1, 'color': list(make_image(color).getpixel((0, 0)))}] for color in colors]
+
+    results = pipeline_analyze.batch_image_analyze(images_with_extra_info)
+    # 同一批中重复的页面只推理一次
+    assert calls == [3]
+    assert results == expected
+    assert results[0] is not results[2]
+
+    results = pipeline_analyze.batch_image_analyze(images_with_extra_info)
+    assert calls == [3]
+    assert results == expected
+
+    # ocr设置不同时不能复用结果
+    pipeline_analyze.batch_image_analyze([(make_image('white'), True, 'ch')])
+    assert calls == [3, 1]
@@ -0,0 +1,126 @@
+import ctypes
+import io
+
+import pypdfium2 as pdfium
+import pypdfium2.raw as pdfium_c
+from PIL import Image
+
+from mineru.backend.vlm.page_complexity import (
+    BASE_TOKENS,
+    MIN_MAX_NEW_TOKENS,
+    TOKENS_PER_CHAR,
+    check_budget_hit,
+    estimate_page_budgets,
+    get_graphics_coverage,
+    get_image_coverage,
+    get_text_chars,
+)
+from mineru.utils.pdf_image_tools import load_images_from_pdf
+
+MAX_NEW_TOKENS = 16384
+
+
+def add_text(pdf, page, text, y):
+    text_object = pdfium_c.FPDFPageObj_NewTextObj(pdf.raw, b'Helvetica', 8.0)
+    buffer = ctypes.create_string_buffer((text + '\0').encode('utf-16-le'))
+    pdfium_c.FPDFText_SetText(text_object, ctypes.cast(buffer, ctypes.POINTER(pdfium_c.FPDF_WCHAR)))
+    pdfium_c.FPDFPageObj_Transform(text_object, 1, 0, 0, 1, 10, y)
+    pdfium_c.FPDFPage_InsertObject(page.raw, text_object)
+
+
+def add_image(pdf, page, width, height):
+    image = pdfium.PdfImage.new(pdf)
+    image.set_bitmap(pdfium.PdfBitmap.from_pil(Image.new('RGB', (100, 100), (120, 120, 120))))
+    image.set_matrix(pdfium.PdfMatrix().scale(width, height))
+    page.insert_obj(image)
+
+
+def add_rect(page, left, bottom, width, height):
+    rect = pdfium_c.FPDFPageObj_CreateNewRect(left, bottom, width, height)
+    pdfium_c.FPDFPageObj_SetFillColor(rect, 0, 0, 0, 255)
+    pdfium_c.FPDFPath_SetDrawMode(rect, pdfium_c.FPDF_FILLMODE_ALTERNATE, 0)
+    pdfium_c.FPDFPage_InsertObject(page.raw, rect)
+
+
+def make_pdf():
+    pdf = pdfium.PdfDocument.new()
+    # 0: 空白页
+    pdf.new_page(300, 400)
+    # 1: 少量文字
+    page = pdf.new_page(300, 400)
+    add_text(pdf, page, 'Chapter 1', 350)
+    page.gen_content()
+    # 2: 大量文字
+    page = pdf.new_page(300, 400)
+    for line in range(45):
+        add_text(pdf, page, f'line {line:02d} abcdefghijklmnopqrstuvwxyz0123456789', 390 - 8 * line)
+    page.gen_content()
+    # 3: 整页扫描图像
+    page = pdf.new_page(300, 400)
+    add_image(pdf, page, 300, 400)
+    page.gen_content()
+    # 4: 带插图的文字页
+    page = pdf.new_page(300, 400)
+    add_text(pdf, page, 'Figure 1: a small figure', 100)
+    add_image(pdf, page, 150, 100)
+    page.gen_content()
+    # 5: 矢量绘制的柱状图，只有坐标轴标签在文本层中
+    page = pdf.new_page(300, 400)
+    add_text(pdf, page, 'Q1 Q2 Q3 Q4', 50)
+    for bar in range(4):
+        add_rect(page, 40 + 60 * bar, 70, 40, 60 + 40 * bar)
+    page.gen_content()
+    # 6: 带分隔线的文字页
+    page = pdf.new_page(300, 400)
+    add_text(pdf, page, 'Section 2', 350)
+    add_rect(page, 10, 340, 280, 1)
+    page.gen_content()
+    buffer = io.BytesIO()
+    pdf.save(buffer)
+    return buffer.getvalue()
+
+
+def test_page_stats():
+    pdf_doc = pdfium.PdfDocument(make_pdf())
+    assert [get_text_chars(pdf_doc[page_idx]) for page_idx in range(7)] == [0, 8, 45 * 42, 0, 20, 8, 8]
+    coverages = [get_image_coverage(pdf_doc[page_idx]) for page_idx in range(7)]
+    assert coverages[:3] == [0.0, 0.0, 0.0]
+    assert coverages[3] == 1.0
+    assert abs(coverages[4] - 0.125) < 1e-6
+    assert coverages[5:] == [0.0, 0.0]
+    graphics_coverages = [get_graphics_coverage(pdf_doc[page_idx]) for page_idx in range(7)]
+    assert graphics_coverages[:5] == coverages[:5]
+    assert abs(graphics_coverages[5] - 40 * (60 + 100 + 140 + 180) / (300 * 400)) < 1e-3
+    assert graphics_coverages[6] < 0.01
+    pdf_doc.close()
+
+
+def test_estimate_page_budgets():
+    images_list, pdf_doc = load_images_from_pdf(make_pdf())
+    budgets = estimate_page_budgets(pdf_doc, images_list, MAX_NEW_TOKENS)
+    pdf_doc.close()
+    assert budgets == [
+        0,
+        MIN_MAX_NEW_TOKENS,
+        BASE_TOKENS + TOKENS_PER_CHAR * 45 * 42,
+        MAX_NEW_TOKENS,
+        # 有插图或矢量图形的页面不按文本层估计
+        MAX_NEW_TOKENS,
+        MAX_NEW_TOKENS,
+        MIN_MAX_NEW_TOKENS,
+    ]
+    # 估计值不超过max_new_tokens
+    images_list, pdf_doc = load_images_from_pdf(make_pdf())
+    assert max(estimate_page_budgets(pdf_doc, images_list, 1024)) == 1024
+    pdf_doc.close()
+
+
+def test_check_budget_hit():
+    output = '<|box_start|>100 100 500 200<|box_end|><|ref_start|>text<|ref_end|><|md_start|>hello<|md_end|>'
+    assert not check_budget_hit(0, output, MIN_MAX_NEW_TOKENS, MAX_NEW_TOKENS)
+    assert not check_budget_hit(0, output + '<|im_end|>\n', MIN_MAX_NEW_TOKENS, MAX_NEW_TOKENS)
+    assert not check_budget_hit(0, '', MIN_MAX_NEW_TOKENS, MAX_NEW_TOKENS)
+    # 截断在块的中间
+    assert check_budget_hit(0, output + '<|box_start|>100 300 500 400<|box_end|><|ref_start|>text', MIN_MAX_NEW_TOKENS, MAX_NEW_TOKENS)
+    # 使用完整max_new_tokens的页面不是估计值造成的截断
+    assert not check_budget_hit(0, output[:-5], MAX_NEW_TOKENS, MAX_NEW_TOKENS)
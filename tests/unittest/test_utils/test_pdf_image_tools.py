@@ -0,0 +1,92 @@
+import ctypes
+import io
+
+import pypdfium2 as pdfium
+import pypdfium2.raw as pdfium_c
+
+from mineru.data.data_reader_writer import FileBasedDataWriter
+from mineru.utils import pdf_image_tools
+from mineru.utils.pdf_image_tools import PageImage, cut_image, load_images_from_pdf, pil_image_md5
+from mineru.utils.pdf_reader import image_to_b64str, pdfium_lock
+
+
+def make_pdf(page_num):
+    """每页的文字位置不同，页面图像各不相同"""
+    pdf = pdfium.PdfDocument.new()
+    for page_idx in range(page_num):
+        page = pdf.new_page(300, 400)
+        text_object = pdfium_c.FPDFPageObj_NewTextObj(pdf.raw, b'Helvetica', 14.0)
+        buffer = ctypes.create_string_buffer((f'page {page_idx}\0').encode('utf-16-le'))
+        pdfium_c.FPDFText_SetText(text_object, ctypes.cast(buffer, ctypes.POINTER(pdfium_c.FPDF_WCHAR)))
+        pdfium_c.FPDFPageObj_Transform(text_object, 1, 0, 0, 1, 20, 350 - 20 * page_idx)
+        pdfium_c.FPDFPage_InsertObject(page.raw, text_object)
+        page.gen_content()
+    buffer = io.BytesIO()
+    pdf.save(buffer)
+    pdf.close()
+    return buffer.getvalue()
+
+
+def load_images(pdf_bytes):
+    images_list, pdf_doc = load_images_from_pdf(pdf_bytes, dpi=100)
+    with pdfium_lock:
+        pdf_doc.close()
+    return images_list
+
+
+def count_encoding(monkeypatch):
+    encoded = []
+
+    def counting_image_to_b64str(image):
+        encoded.append(image)
+        return image_to_b64str(image)
+
+    monkeypatch.setattr(pdf_image_tools, 'image_to_b64str', counting_image_to_b64str)
+    return encoded
+
+
+def test_page_image_encodes_lazily(monkeypatch):
+    encoded = count_encoding(monkeypatch)
+    images_list = load_images(make_pdf(3))
+    # 渲染后只有PIL图像和缩放比例，没有做PNG和base64编码；所有键始终可见
+    for image_dict in images_list:
+        assert isinstance(image_dict, PageImage)
+        assert set(image_dict) == set(image_dict.keys()) == {'img_pil', 'scale', 'img_md5', 'img_base64'}
+        assert len(image_dict) == 4
+        assert 'img_base64' in image_dict and 'img_md5' in image_dict and 'other' not in image_dict
+    assert encoded == []
+
+    image_dict = images_list[1]
+    assert image_dict['img_md5'] == image_dict.img_md5 == pil_image_md5(image_dict['img_pil'])
+    assert encoded == []
+    # 第一次访问时编码并缓存，下标、get和属性访问得到同一个值
+    img_base64 = image_dict.get('img_base64')
+    assert img_base64 == image_to_b64str(image_dict['img_pil'])
+    assert image_dict['img_base64'] is img_base64
+    assert image_dict.img_base64 is img_base64
+    assert encoded == [image_dict['img_pil']]
+    assert image_dict.get('other') is None
+    assert dict(image_dict.items()) == {
+        'img_pil': image_dict.img_pil, 'scale': image_dict.scale,
+        'img_md5': image_dict.img_md5, 'img_base64': img_base64,
+    }
+
+
+def test_image_names_are_stable(tmp_path, monkeypatch):
+    encoded = count_encoding(monkeypatch)
+    pdf_bytes = make_pdf(3)
+    first_images, second_images = load_images(pdf_bytes), load_images(pdf_bytes)
+    # 页面指纹只与页面位图有关，重新渲染后不变，不同页面不同
+    assert [image_dict['img_md5'] for image_dict in first_images] == [image_dict['img_md5'] for image_dict in second_images]
+    assert len({image_dict['img_md5'] for image_dict in first_images}) == 3
+
+    bbox = (20, 40, 120, 100)
+    image_writer = FileBasedDataWriter(str(tmp_path))
+    for page_idx, (first, second) in enumerate(zip(first_images, second_images)):
+        first_path = cut_image(bbox, page_idx, first['img_pil'], first['img_md5'], image_writer, scale=first['scale'])
+        second_path = cut_image(bbox, page_idx, second['img_pil'], second['img_md5'], image_writer, scale=second['scale'])
+        assert first_path == second_path
+        assert (tmp_path / first_path).exists()
+    # 裁剪图片不需要页面的编码数据
+    assert encoded == []
+    assert len(list(tmp_path.iterdir())) == 3
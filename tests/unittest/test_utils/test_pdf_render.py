@@ -0,0 +1,123 @@
+import ctypes
+import io
+import os
+
+import pypdfium2 as pdfium
+import pypdfium2.raw as pdfium_c
+import pytest
+
+from mineru.utils import pdf_reader
+from mineru.utils.pdf_reader import close_render_pool, get_render_pool, render_pages_parallel
+
+
+def make_pdf(page_num, doc_id=0):
+    """每页的文字和矩形位置各不相同，渲染结果可以区分页面"""
+    pdf = pdfium.PdfDocument.new()
+    for page_idx in range(page_num):
+        page = pdf.new_page(300 + 10 * (page_idx % 3), 400)
+        text_object = pdfium_c.FPDFPageObj_NewTextObj(pdf.raw, b'Helvetica', 14.0)
+        buffer = ctypes.create_string_buffer((f'doc {doc_id} page {page_idx}\0').encode('utf-16-le'))
+        pdfium_c.FPDFText_SetText(text_object, ctypes.cast(buffer, ctypes.POINTER(pdfium_c.FPDF_WCHAR)))
+        pdfium_c.FPDFPageObj_Transform(text_object, 1, 0, 0, 1, 20, 350 - 10 * page_idx)
+        pdfium_c.FPDFPage_InsertObject(page.raw, text_object)
+        rect = pdfium_c.FPDFPageObj_CreateNewRect(20 + 5 * page_idx, 50, 100, 40 + page_idx)
+        pdfium_c.FPDFPageObj_SetFillColor(rect, 40 * (page_idx % 6), 0, 200, 255)
+        pdfium_c.FPDFPath_SetDrawMode(rect, pdfium_c.FPDF_FILLMODE_ALTERNATE, 0)
+        pdfium_c.FPDFPage_InsertObject(page.raw, rect)
+        page.gen_content()
+    buffer = io.BytesIO()
+    pdf.save(buffer)
+    pdf.close()
+    return buffer.getvalue()
+
+
+@pytest.fixture
+def render_pool():
+    # 进程池是进程内共享的，测试结束后关闭，清理临时文件
+    yield get_render_pool(2)
+    close_render_pool()
+
+
+def assert_same_pages(pages, expected_pages):
+    assert len(pages) == len(expected_pages)
+    for (image, scale), (expected_image, expected_scale) in zip(pages, expected_pages):
+        assert scale == expected_scale
+        assert (image.mode, image.size) == (expected_image.mode, expected_image.size)
+        assert image.tobytes() == expected_image.tobytes()
+
+
+def test_parallel_render_matches_serial(render_pool):
+    pdf_bytes = make_pdf(12)
+    page_indices = [7, 0, 3, 11, 1, 2, 10, 4]
+    expected_pages = render_pages_parallel(pdf_bytes, page_indices, dpi=100, workers=1)
+    assert_same_pages(render_pages_parallel(pdf_bytes, page_indices, dpi=100, workers=2), expected_pages)
+    # 限制长边时的缩放比例也一致
+    assert_same_pages(
+        render_pages_parallel(pdf_bytes, page_indices, dpi=300, max_width_or_height=500, workers=2),
+        render_pages_parallel(pdf_bytes, page_indices, dpi=300, max_width_or_height=500, workers=1),
+    )
+
+
+def test_render_pool_is_reused(render_pool, monkeypatch):
+    monkeypatch.setattr(pdf_reader, 'RENDER_POOL_MAX_DOCS', 2)
+    pdf_bytes = make_pdf(10)
+    # 同一文档的多个页面窗口使用同一个进程池和同一份临时文件
+    windows = [[0, 1, 2, 3], [4, 5, 6], [7, 8, 9]]
+    for window in windows:
+        assert_same_pages(
+            render_pages_parallel(pdf_bytes, window, workers=2),
+            render_pages_parallel(pdf_bytes, window, workers=1),
+        )
+        assert get_render_pool(2) is render_pool
+    worker_pids = set(render_pool.executor._processes)
+    assert len(render_pool._docs) == 1
+    (_, _, pdf_path, users), = render_pool._docs.values()
+    assert users == 0
+    with open(pdf_path, 'rb') as f:
+        assert f.read() == pdf_bytes
+
+    # 超过RENDER_POOL_MAX_DOCS个文档时，最久未使用的临时文件被删除
+    other_docs = [make_pdf(3, doc_id) for doc_id in range(1, 3)]
+    for other_pdf_bytes in other_docs:
+        render_pages_parallel(other_pdf_bytes, [0, 1, 2], workers=2)
+    assert len(render_pool._docs) == 2
+    assert not os.path.exists(pdf_path)
+    # 已启动的渲染进程一直在使用，没有重新启动
+    assert worker_pids <= set(render_pool.executor._processes)
+
+    # 文档被清理后再次渲染，重新写入临时文件
+    assert_same_pages(
+        render_pages_parallel(pdf_bytes, [9, 8], workers=2),
+        render_pages_parallel(pdf_bytes, [9, 8], workers=1),
+    )
+    pdf_paths = [pdf_path for _, _, pdf_path, _ in render_pool._docs.values()]
+    close_render_pool()
+    assert not any(os.path.exists(pdf_path) for pdf_path in pdf_paths)
+
+
+if __name__ == '__main__':
+    # 渲染速度基准：python tests/unittest/test_utils/test_pdf_render.py <pdf_path> [max_workers]
+    import sys
+    import time
+
+    from loguru import logger
+
+    with open(sys.argv[1], 'rb') as f:
+        pdf_bytes = f.read()
+    max_workers = int(sys.argv[2]) if len(sys.argv) > 2 else os.cpu_count() or 1
+    doc = pdfium.PdfDocument(pdf_bytes)
+    page_indices = list(range(len(doc)))
+    doc.close()
+
+    workers = 1
+    while workers <= max_workers:
+        # 第一次调用启动进程池，第二次调用是流式处理中后续页面窗口的耗时
+        for call in ['first call', 'reused pool']:
+            start = time.time()
+            render_pages_parallel(pdf_bytes, page_indices, dpi=200, workers=workers)
+            cost = time.time() - start
+            logger.info(
+                f'workers: {workers}, {call}, pages: {len(page_indices)}, cost: {round(cost, 2)}s, '
+                f'speed: {round(len(page_indices) / cost, 2)} pages/s'
+            )
+        workers *= 2
@@ -0,0 +1,263 @@
+import ctypes
+import functools
+import io
+import os
+import threading
+import time
+import types
+
+import pypdfium2 as pdfium
+import pypdfium2.raw as pdfium_c
+import pytest
+import torch
+from transformers import LayoutLMv3Config, LayoutLMv3ForTokenClassification
+
+from mineru.backend.pipeline import model_json_to_middle_json, pipeline_analyze
+from mineru.backend.pipeline.pipeline_analyze import doc_analyze_streaming
+from mineru.data.data_reader_writer import FileBasedDataWriter
+from mineru.utils import block_sort
+from mineru.utils.config_reader import get_pipeline_streaming_enable
+from mineru.utils.pdf_reader import pdfium_lock
+from mineru.utils.stage_queue import StageQueue
+
+# threading.Thread按target命名为'Thread-N (render_stage)'
+STAGE_THREAD_NAMES = ('(render_stage)', '(middle_json_stage)')
+
+
+def add_text(pdf, page, text, y):
+    text_object = pdfium_c.FPDFPageObj_NewTextObj(pdf.raw, b'Helvetica', 12.0)
+    buffer = ctypes.create_string_buffer((text + '\0').encode('utf-16-le'))
+    pdfium_c.FPDFText_SetText(text_object, ctypes.cast(buffer, ctypes.POINTER(pdfium_c.FPDF_WCHAR)))
+    pdfium_c.FPDFPageObj_Transform(text_object, 1, 0, 0, 1, 40, y)
+    pdfium_c.FPDFPage_InsertObject(page.raw, text_object)
+
+
+def make_pdf(page_num, doc_id=0):
+    """每页两行文字，文字在(35, 36, 270, 54)和(35, 86, 270, 104)内（页面坐标，原点在左上角）"""
+    pdf = pdfium.PdfDocument.new()
+    for page_idx in range(page_num):
+        page = pdf.new_page(300, 400)
+        add_text(pdf, page, f'doc {doc_id} page {page_idx} first line', 350)
+        add_text(pdf, page, f'doc {doc_id} page {page_idx} second line', 300)
+        page.gen_content()
+    buffer = io.BytesIO()
+    pdf.save(buffer)
+    pdf.close()
+    return buffer.getvalue()
+
+
+def fake_batch_image_analyze(images_with_extra_info, formula_enable=True, table_enable=True, image_block=False):
+    """每页两个文本块，各包含一个需要从文本层填充文字的span；image_block为True时再加一个需要裁剪保存的图片块"""
+    results = []
+    for image, _, _ in images_with_extra_info:
+        scale = image.width / 300
+        layout_dets = [
+            (1, [30, 40, 280, 40, 280, 60, 30, 60], {}),
+            (1, [30, 90, 280, 90, 280, 110, 30, 110], {}),
+            (15, [35, 36, 270, 36, 270, 54, 35, 54], {'text': ''}),
+            (15, [35, 86, 270, 86, 270, 104, 35, 104], {'text': ''}),
+        ]
+        if image_block:
+            layout_dets.append((3, [30, 30, 280, 30, 280, 110, 30, 110], {}))
+        results.append([
+            {'category_id': category_id, 'poly': [coord * scale for coord in poly], 'score': 1.0, **extra}
+            for category_id, poly, extra in layout_dets
+        ])
+    return results
+
+
+@pytest.fixture
+def streaming_env(monkeypatch):
+    # 随机初始化的layoutreader，不需要下载模型
+    torch.manual_seed(0)
+    config = LayoutLMv3Config(
+        hidden_size=96, coordinate_size=16, shape_size=16, num_hidden_layers=2, num_attention_heads=4,
+        intermediate_size=128, num_labels=510, visual_embed=False,
+    )
+    monkeypatch.setitem(block_sort.ModelSingleton._models, 'layoutreader', LayoutLMv3ForTokenClassification(config).eval())
+    monkeypatch.setattr(pipeline_analyze, 'batch_image_analyze', fake_batch_image_analyze)
+    monkeypatch.setenv('MINERU_MIN_BATCH_INFERENCE_SIZE', '2')
+
+
+@pytest.fixture
+def opened_docs(monkeypatch):
+    """记录doc_analyze_streaming打开的文档，以及关闭时是否持有pdfium_lock"""
+    docs = []
+
+    class TrackingPdfDocument(pdfium.PdfDocument):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.closed_with_lock = None
+            docs.append(self)
+
+        def close(self, *args, **kwargs):
+            if self.raw and self.closed_with_lock is None:
+                self.closed_with_lock = pdfium_lock._is_owned()
+            return super().close(*args, **kwargs)
+
+    monkeypatch.setattr(pipeline_analyze, 'pdfium', types.SimpleNamespace(PdfDocument=TrackingPdfDocument))
+    return docs
+
+
+def assert_docs_closed(docs, doc_num):
+    assert len(docs) == doc_num
+    assert [doc.closed_with_lock for doc in docs] == [True] * doc_num
+
+
+def run_streaming(tmp_path, pdf_bytes_list):
+    writers = [FileBasedDataWriter(str(tmp_path / f'doc_{pdf_idx}')) for pdf_idx in range(len(pdf_bytes_list))]
+    return doc_analyze_streaming(pdf_bytes_list, writers, ['en'] * len(pdf_bytes_list), parse_method='txt')
+
+
+def stage_threads():
+    return [thread for thread in threading.enumerate() if thread.name.endswith(STAGE_THREAD_NAMES)]
+
+
+def wait_stage_threads_exit(timeout=5):
+    deadline = time.time() + timeout
+    while stage_threads() and time.time() < deadline:
+        time.sleep(0.01)
+    return stage_threads() == []
+
+
+def test_stage_queue_stats():
+    stage_queue = StageQueue('producer->consumer', maxsize=2)
+    assert stage_queue.stats()['avg_depth'] == 0
+
+    def consume():
+        time.sleep(0.2)
+        while stage_queue.get() is not None:
+            time.sleep(0.02)
+
+    consumer = threading.Thread(target=consume)
+    consumer.start()
+    for item in range(5):
+        stage_queue.put(item)
+    stage_queue.put(None)
+    consumer.join()
+    stats = stage_queue.stats()
+    assert stats['put_count'] == 6
+    # 消费者慢，队列经常是满的，生产者等待
+    assert stats['max_depth'] == 2
+    assert stats['avg_depth'] > 1
+    assert stats['producer_wait'] >= 0.1
+    stage_queue.log_stats()
+
+
+def test_streaming_enabled_by_default(monkeypatch):
+    monkeypatch.delenv('MINERU_PIPELINE_STREAMING_ENABLE', raising=False)
+    assert get_pipeline_streaming_enable()
+    monkeypatch.setenv('MINERU_PIPELINE_STREAMING_ENABLE', 'false')
+    assert not get_pipeline_streaming_enable()
+
+
+def test_streaming_yields_documents(streaming_env, tmp_path):
+    outputs = list(run_streaming(tmp_path, [make_pdf(3, 0), make_pdf(1, 1), make_pdf(2, 2)]))
+    assert [pdf_idx for pdf_idx, _, _, _ in outputs] == [0, 1, 2]
+    for (pdf_idx, model_list, middle_json, ocr_enable), page_num in zip(outputs, [3, 1, 2]):
+        assert not ocr_enable
+        assert len(model_list) == len(middle_json['pdf_info']) == page_num
+        for page_idx, page_info in enumerate(middle_json['pdf_info']):
+            assert page_info['page_idx'] == page_idx
+            spans = [span['content'] for block in page_info['para_blocks'] for line in block['lines'] for span in line['spans']]
+            assert spans == [f'doc {pdf_idx} page {page_idx} first line', f'doc {pdf_idx} page {page_idx} second line']
+    assert wait_stage_threads_exit()
+
+
+def test_streaming_matches_doc_analyze(streaming_env, tmp_path, monkeypatch):
+    monkeypatch.setattr(pipeline_analyze, 'batch_image_analyze', functools.partial(fake_batch_image_analyze, image_block=True))
+    # 每个窗口2页，窗口跨越文档边界
+    pdf_bytes_list = [make_pdf(3, 0), make_pdf(1, 1), make_pdf(2, 2)]
+    streaming_outputs = list(run_streaming(tmp_path / 'streaming', pdf_bytes_list))
+
+    infer_results, all_image_lists, all_pdf_docs, _, ocr_enabled_list = pipeline_analyze.doc_analyze(
+        pdf_bytes_list, ['en'] * len(pdf_bytes_list), parse_method='txt'
+    )
+    assert [pdf_idx for pdf_idx, _, _, _ in streaming_outputs] == [0, 1, 2]
+    for pdf_idx, model_list, middle_json, ocr_enable in streaming_outputs:
+        # 与do_parse相同，model.json是转换middle_json之前的模型输出
+        assert model_list == infer_results[pdf_idx]
+        image_dir = tmp_path / 'batch' / f'doc_{pdf_idx}'
+        expected_middle_json = model_json_to_middle_json.result_to_middle_json(
+            infer_results[pdf_idx], all_image_lists[pdf_idx], all_pdf_docs[pdf_idx],
+            FileBasedDataWriter(str(image_dir)), 'en', ocr_enabled_list[pdf_idx],
+        )
+        assert ocr_enable == ocr_enabled_list[pdf_idx]
+        assert middle_json == expected_middle_json
+        # 裁剪出的图片按页面图像的指纹命名，两种方式得到的文件名和内容都相同
+        image_names = sorted(os.listdir(image_dir))
+        assert len(image_names) == len(model_list)
+        assert sorted(os.listdir(tmp_path / 'streaming' / f'doc_{pdf_idx}')) == image_names
+        for image_name in image_names:
+            assert (tmp_path / 'streaming' / f'doc_{pdf_idx}' / image_name).read_bytes() == (image_dir / image_name).read_bytes()
+    assert wait_stage_threads_exit()
+
+
+def test_streaming_render_error(streaming_env, opened_docs, tmp_path, monkeypatch):
+    load_page_images = pipeline_analyze.load_page_images
+    render_calls = []
+
+    def failing_load_page_images(*args, **kwargs):
+        render_calls.append(args[2])
+        if len(render_calls) == 2:
+            raise RuntimeError('render failed')
+        return load_page_images(*args, **kwargs)
+
+    monkeypatch.setattr(pipeline_analyze, 'load_page_images', failing_load_page_images)
+    with pytest.raises(RuntimeError, match='render failed'):
+        list(run_streaming(tmp_path, [make_pdf(6)]))
+    assert wait_stage_threads_exit()
+    assert_docs_closed(opened_docs, 1)
+
+
+def test_streaming_infer_error(streaming_env, opened_docs, tmp_path, monkeypatch):
+    batches = []
+
+    def failing_batch_image_analyze(images_with_extra_info, *args, **kwargs):
+        batches.append(len(images_with_extra_info))
+        if len(batches) == 2:
+            raise RuntimeError('infer failed')
+        return fake_batch_image_analyze(images_with_extra_info)
+
+    monkeypatch.setattr(pipeline_analyze, 'batch_image_analyze', failing_batch_image_analyze)
+    with pytest.raises(RuntimeError, match='infer failed'):
+        list(run_streaming(tmp_path, [make_pdf(1, 0), make_pdf(5, 1)]))
+    assert batches == [2, 2]
+    assert wait_stage_threads_exit()
+    # 第一篇文档已经交给调用方，第二篇在出错时关闭
+    assert_docs_closed(opened_docs, 2)
+
+
+def test_streaming_middle_json_error(streaming_env, opened_docs, tmp_path, monkeypatch):
+    page_model_info_to_page_blocks = model_json_to_middle_json.page_model_info_to_page_blocks
+
+    def failing_page_model_info_to_page_blocks(page_model_info, image_dict, page, image_writer, page_index, **kwargs):
+        if page_index == 3:
+            raise RuntimeError('middle_json failed')
+        return page_model_info_to_page_blocks(page_model_info, image_dict, page, image_writer, page_index, **kwargs)
+
+    monkeypatch.setattr(model_json_to_middle_json, 'page_model_info_to_page_blocks', failing_page_model_info_to_page_blocks)
+    with pytest.raises(RuntimeError, match='middle_json failed'):
+        list(run_streaming(tmp_path, [make_pdf(8)]))
+    assert wait_stage_threads_exit()
+    assert_docs_closed(opened_docs, 1)
+
+
+def test_streaming_early_exit(streaming_env, opened_docs, tmp_path, monkeypatch):
+    load_page_images = pipeline_analyze.load_page_images
+    render_calls = []
+
+    def counting_load_page_images(*args, **kwargs):
+        render_calls.append(args[2])
+        return load_page_images(*args, **kwargs)
+
+    monkeypatch.setattr(pipeline_analyze, 'load_page_images', counting_load_page_images)
+    generator = run_streaming(tmp_path, [make_pdf(1, 0)] + [make_pdf(4, doc_id) for doc_id in range(1, 11)])
+    pdf_idx, _, middle_json, _ = next(generator)
+    assert pdf_idx == 0 and len(middle_json['pdf_info']) == 1
+    assert [doc.closed_with_lock for doc in opened_docs] == [True] + [None] * 10
+    generator.close()
+    assert wait_stage_threads_exit()
+    assert_docs_closed(opened_docs, 11)
+    # 渲染阶段最多比推理提前队列长度加上正在渲染的窗口，不会渲染完所有的21个窗口
+    assert len(render_calls) < 10
@@ -0,0 +1,128 @@
+import cv2
+import numpy as np
+import pytest
+import torch
+
+from mineru.model.ocr.paddleocr2pytorch.pytorch_paddle import root_dir
+from mineru.model.ocr.paddleocr2pytorch.pytorchocr.modeling.architectures.base_model import BaseModel
+from mineru.model.ocr.paddleocr2pytorch.tools.infer import pytorchocr_utility as utility
+from mineru.model.ocr.paddleocr2pytorch.tools.infer.predict_rec import (
+    REC_WIDTH_BUCKET_RATIO,
+    RecBatchStats,
+    TextRecognizer,
+    plan_rec_batches,
+    rec_batch_stats,
+)
+
+HEIGHT = 48
+REC_MODEL = 'en_PP-OCRv4_rec_infer'
+REC_DICT_PATH = str(root_dir / 'pytorchocr' / 'utils' / 'resources' / 'dict' / 'en_dict.txt')
+
+
+def random_widths(num, seed=0):
+    rng = np.random.RandomState(seed)
+    # 大量短标签和少量很长的表格行
+    return [int(w) for w in np.concatenate([rng.randint(60, 320, num * 3 // 4), rng.randint(320, 1280, num - num * 3 // 4)])]
+
+
+def test_plan_rec_batches():
+    widths = [max(width, 320) for width in random_widths(200)]
+    pixel_budget = HEIGHT * 1280 * 8
+    batches = plan_rec_batches(widths, HEIGHT, pixel_budget)
+    assert sorted(i for batch in batches for i in batch) == list(range(len(widths)))
+    for batch in batches:
+        batch_widths = [widths[i] for i in batch]
+        assert batch_widths == sorted(batch_widths)
+        assert len(batch) == 1 or len(batch) * max(batch_widths) * HEIGHT <= pixel_budget
+        assert max(batch_widths) <= min(batch_widths) * REC_WIDTH_BUCKET_RATIO
+    # 窄的文本行组成更大的batch
+    assert len(batches[0]) > len(batches[-1])
+    assert len(batches[0]) == pixel_budget // (HEIGHT * max(widths[i] for i in batches[0]))
+    # 超过预算的单个文本行单独成batch
+    assert plan_rec_batches([320, 2000, 330], HEIGHT, HEIGHT * 1000) == [[0, 2], [1]]
+    assert plan_rec_batches([], HEIGHT, pixel_budget) == []
+
+
+def test_rec_batch_stats():
+    stats = RecBatchStats()
+    stats.record([320, 320], 320, HEIGHT)
+    stats.record([400, 600], 600, HEIGHT)
+    assert stats.stats() == {'batches': 2, 'crops': 4, 'avg_batch_size': 2.0, 'padding_efficiency': round(1640 / 1840, 4)}
+
+
+@pytest.fixture(scope='module')
+def model_dir(tmp_path_factory):
+    # 随机初始化的权重，只用于比较不同分batch方式的结果
+    model_dir = tmp_path_factory.mktemp('rec_models')
+    torch.manual_seed(0)
+    weights_path = str(model_dir / f'{REC_MODEL}.pth')
+    torch.save(BaseModel(utility.get_arch_config(weights_path), out_channels=97).state_dict(), weights_path)
+    return model_dir
+
+
+def build_recognizer(model_dir, rec_batch_pixels):
+    args = utility.init_args().parse_args([])
+    args.rec_model_path = str(model_dir / f'{REC_MODEL}.pth')
+    args.rec_char_dict_path = REC_DICT_PATH
+    args.rec_batch_pixels = rec_batch_pixels
+    return TextRecognizer(args)
+
+
+def make_crops(widths, seed=0):
+    rng = np.random.RandomState(seed)
+    crops = []
+    for width in widths:
+        crop = np.full((32, width, 3), 255, dtype=np.uint8)
+        text = ''.join(rng.choice(list('abcdefghijklmnopqrstuvwxyz0123456789'), max(width // 18, 1)))
+        cv2.putText(crop, text, (2, 24), cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 0, 0), 1)
+        crops.append(crop)
+    return crops
+
+
+def test_recognizer_results_in_input_order(model_dir):
+    recognizer = build_recognizer(model_dir, HEIGHT * 1280 * 8)
+    # 填充宽度都是320的短文本行，batch推理与逐个推理的结果相同
+    crops = make_crops([40, 120, 60, 200, 90, 150, 30, 180] * 3)
+    single_res = [recognizer([crop])[0][0] for crop in crops]
+    before = rec_batch_stats.stats()
+    batch_res, _ = recognizer(crops)
+    assert [text for text, _ in batch_res] == [text for text, _ in single_res]
+    np.testing.assert_allclose([score for _, score in batch_res], [score for _, score in single_res], atol=1e-5)
+    after = rec_batch_stats.stats()
+    assert after['crops'] == before['crops'] + len(crops)
+    assert after['batches'] == before['batches'] + 1
+
+
+def test_legacy_fixed_batches(model_dir):
+    recognizer = build_recognizer(model_dir, 0)
+    widths = [40, 600, 120, 900, 60]
+    batches = recognizer.plan_batches(make_crops(widths))
+    assert [len(batch) for batch in batches] == [5]
+    recognizer.rec_batch_num = 2
+    assert recognizer.plan_batches(make_crops(widths)) == [[0, 4], [2, 1], [3]]
+
+
+if __name__ == '__main__':
+    import tempfile
+    import time
+    from pathlib import Path
+
+    # 短标签和长表格行混合时，固定batch和按像素预算分batch的填充效率与耗时（每次调用识别一个表格的20个文本行）
+    tables = [make_crops([w * 32 // HEIGHT for w in random_widths(20, seed)], seed) for seed in range(10)]
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        torch.manual_seed(0)
+        weights_path = str(Path(tmp_dir) / f'{REC_MODEL}.pth')
+        torch.save(BaseModel(utility.get_arch_config(weights_path), out_channels=97).state_dict(), weights_path)
+        for name, rec_batch_pixels in [('fixed rec_batch_num=6', 0), ('pixel budget', HEIGHT * 1280 * 8)]:
+            recognizer = build_recognizer(Path(tmp_dir), rec_batch_pixels)
+            recognizer(tables[0])
+            stats = RecBatchStats()
+            for crops in tables:
+                for batch in recognizer.plan_batches(crops):
+                    batch_widths = [recognizer.get_padded_width(crops[i]) for i in batch]
+                    stats.record(batch_widths, max(batch_widths), HEIGHT)
+            start = time.perf_counter()
+            for crops in tables:
+                recognizer(crops)
+            cost = time.perf_counter() - start
+            print(f'{name}: {stats.stats()}, {sum(len(crops) for crops in tables) / cost:.1f} crops/s')
@@ -0,0 +1,89 @@
+import json
+
+from mineru.utils import result_cache
+from mineru.utils.result_cache import LocalResultCacheStorage, RecordingDataWriter, ResultCache
+from mineru.data.data_reader_writer import DummyDataWriter
+
+
+def make_key(pdf_bytes, **kwargs):
+    options = dict(backend='pipeline', parse_method='auto', lang='ch', formula_enable=True, table_enable=True,
+                   start_page_id=0, end_page_id=None)
+    options.update(kwargs)
+    return ResultCache.make_key(pdf_bytes, **options)
+
+
+def test_make_key():
+    assert make_key(b'pdf') == make_key(b'pdf')
+    assert make_key(b'pdf') != make_key(b'other pdf')
+    assert make_key(b'pdf') != make_key(b'pdf', lang='en')
+    assert make_key(b'pdf') != make_key(b'pdf', end_page_id=3)
+
+
+def test_put_get(tmp_path):
+    cache = ResultCache(LocalResultCacheStorage(str(tmp_path)), max_size=1024 * 1024)
+    key = make_key(b'pdf')
+    assert cache.get(key) is None
+
+    middle_json = {'pdf_info': [{'page_idx': 0}]}
+    model_output = [{'layout_dets': []}]
+    cache.put(key, middle_json, model_output, {'a.jpg': b'\xff\xd8image'})
+    assert cache.get(key) == {'middle_json': middle_json, 'model_output': model_output, 'images': {'a.jpg': b'\xff\xd8image'}}
+    assert cache.stats() == {'hits': 1, 'misses': 1, 'hit_rate': 0.5, 'writes': 1, 'evictions': 0}
+
+
+def test_lru_eviction(tmp_path):
+    image = bytes(range(256)) * 16
+    # 容量只够放下两个条目
+    cache = ResultCache(LocalResultCacheStorage(str(tmp_path)), max_size=int(len(image) * 2.5))
+    keys = [make_key(f'pdf{i}'.encode()) for i in range(3)]
+    cache.put(keys[0], {}, [], {'a.jpg': image})
+    cache.put(keys[1], {}, [], {'a.jpg': image})
+    # 访问第一个条目后，最久未访问的是第二个
+    assert cache.get(keys[0]) is not None
+    cache.put(keys[2], {}, [], {'a.jpg': image})
+    assert cache.get(keys[1]) is None
+    assert cache.get(keys[0]) is not None
+    assert cache.get(keys[2]) is not None
+    assert cache.evictions == 1
+
+
+def test_recording_data_writer():
+    writer = RecordingDataWriter(DummyDataWriter())
+    writer.write('a.jpg', b'data')
+    assert writer.files == {'a.jpg': b'data'}
+
+
+def test_hits_do_not_rewrite_index(tmp_path, monkeypatch):
+    storage = LocalResultCacheStorage(str(tmp_path))
+    cache = ResultCache(storage, max_size=1024 * 1024)
+    key = make_key(b'pdf')
+    cache.put(key, {}, [], {})
+    index_bytes = storage.read('index.json')
+    put_access = json.loads(index_bytes)[key]['last_access']
+
+    index_writes = []
+    write = storage.write
+    monkeypatch.setattr(storage, 'write', lambda path, data: (index_writes.append(path), write(path, data)))
+    for _ in range(5):
+        assert cache.get(key) is not None
+    # 命中只记录在内存中，index.json不变
+    assert index_writes == []
+    assert storage.read('index.json') == index_bytes
+
+    cache.flush()
+    assert index_writes == ['index.json']
+    assert json.loads(storage.read('index.json'))[key]['last_access'] > put_access
+    # 没有新的命中时flush不再写index
+    cache.flush()
+    assert index_writes == ['index.json']
+
+
+def test_hits_flush_after_interval(tmp_path, monkeypatch):
+    storage = LocalResultCacheStorage(str(tmp_path))
+    cache = ResultCache(storage, max_size=1024 * 1024)
+    key = make_key(b'pdf')
+    cache.put(key, {}, [], {})
+    put_access = json.loads(storage.read('index.json'))[key]['last_access']
+    monkeypatch.setattr(result_cache, 'INDEX_FLUSH_INTERVAL', 0)
+    assert cache.get(key) is not None
+    assert json.loads(storage.read('index.json'))[key]['last_access'] > put_access
@@ -0,0 +1,320 @@
+import asyncio
+import json
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import httpx
+import pytest
+
+from mineru.backend.vlm.sglang_client_predictor import SglangClientPredictor, SglangServerError
+
+
+class StubSglangHandler(BaseHTTPRequestHandler):
+    """模拟sglang server的/health_generate、/get_model_info和/generate接口，支持keep-alive"""
+
+    protocol_version = 'HTTP/1.1'
+    # 响应头和响应体一起发送，避免Nagle算法和延迟ACK拖慢keep-alive连接上的请求
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        # 每个新的TCP连接会创建一个handler
+        with self.server.lock:
+            self.server.connection_count += 1
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/health_generate':
+            if self.server.fail_health:
+                self.send_error(503)
+                return
+            self._send_json({})
+        elif self.path == '/get_model_info':
+            self._send_json({'model_path': 'stub'})
+        else:
+            self.send_error(404)
+
+    def do_POST(self):
+        request_body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+        text = f"echo:{request_body['text'][-20:]}"
+        with self.server.lock:
+            self.server.request_count += 1
+            self.server.max_new_tokens.append(request_body['sampling_params']['max_new_tokens'])
+        if self.server.fail_generate:
+            self.send_error(500)
+            return
+        if self.server.delay:
+            time.sleep(self.server.delay)
+        if not request_body.get('stream'):
+            self._send_json({'text': text})
+            return
+        lines = [f"data: {json.dumps({'text': text[:i]})}\n\n" for i in range(1, len(text) + 1)]
+        data = (''.join(lines) + 'data: [DONE]\n\n').encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+class StubSglangServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), StubSglangHandler)
+        self.lock = threading.Lock()
+        self.connection_count = 0
+        self.request_count = 0
+        self.max_new_tokens = []
+        self.fail_health = False
+        self.fail_generate = False
+        self.delay = 0
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self.thread.start()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def reset_counts(self):
+        with self.lock:
+            self.connection_count = 0
+            self.request_count = 0
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+@pytest.fixture
+def server():
+    stub_server = StubSglangServer()
+    yield stub_server
+    stub_server.stop()
+
+
+def test_predict_reuses_connection(server):
+    predictor = SglangClientPredictor(server.url)
+    server.reset_counts()
+    outputs = [predictor.predict(b'image', f'prompt {i}') for i in range(10)]
+    assert outputs == [f"echo:{predictor.build_prompt(f'prompt {i}')[-20:]}" for i in range(10)]
+    # 复用健康检查时建立的连接
+    assert server.connection_count == 0
+    predictor.close()
+
+
+def test_batch_predict_reuses_connections_across_calls(server):
+    predictor = SglangClientPredictor(server.url)
+    prompts = [f'prompt {i}' for i in range(20)]
+    expected = [f"echo:{predictor.build_prompt(prompt)[-20:]}" for prompt in prompts]
+    server.reset_counts()
+    assert predictor.batch_predict([b'image'] * 20, prompts, max_concurrency=4) == expected
+    first_connection_count = server.connection_count
+    assert first_connection_count <= 4
+    # 后续的文档复用已有的连接
+    for _ in range(3):
+        assert predictor.batch_predict([b'image'] * 20, prompts, max_concurrency=4) == expected
+    assert server.connection_count == first_connection_count
+    predictor.close()
+
+
+def test_batch_predict_longest_first(server):
+    predictor = SglangClientPredictor(server.url)
+    prompts = [f'prompt {i}' for i in range(6)]
+    expected = [f"echo:{predictor.build_prompt(prompt)[-20:]}" for prompt in prompts]
+    page_max_new_tokens = [2048, 8192, None, 4096, 2048, 16000]
+    assert predictor.batch_predict([b'image'] * 6, prompts, max_new_tokens=page_max_new_tokens, max_concurrency=1) == expected
+    # 每页使用自己的max_new_tokens，预计输出长的页面先发送，None使用默认值
+    assert server.max_new_tokens == [16384, 16000, 8192, 4096, 2048, 2048]
+    predictor.close()
+
+
+def test_stream_predict(server):
+    predictor = SglangClientPredictor(server.url)
+    expected = f"echo:{predictor.build_prompt('prompt')[-20:]}"
+    assert ''.join(predictor.stream_predict(b'image', 'prompt')) == expected
+
+    async def collect():
+        return ''.join([chunk async for chunk in predictor.aio_stream_predict(b'image', 'prompt')])
+
+    assert asyncio.run(collect()) == expected
+    predictor.close()
+
+
+def test_aio_batch_predict_in_running_loop(server):
+    predictor = SglangClientPredictor(server.url)
+    prompts = [f'prompt {i}' for i in range(10)]
+
+    async def run():
+        outputs = await predictor.aio_batch_predict([b'image'] * 10, prompts, max_concurrency=2)
+        results = {}
+        async for idx, output in predictor.aio_batch_predict_as_iter([b'image'] * 10, prompts, max_concurrency=2):
+            results[idx] = output
+        return outputs, [results[i] for i in range(10)]
+
+    server.reset_counts()
+    outputs, iter_outputs = asyncio.run(run())
+    assert outputs == iter_outputs == [f"echo:{predictor.build_prompt(prompt)[-20:]}" for prompt in prompts]
+    assert server.connection_count <= 2
+    predictor.close()
+
+
+@pytest.fixture
+def servers():
+    stub_servers = [StubSglangServer(), StubSglangServer()]
+    yield stub_servers
+    for stub_server in stub_servers:
+        stub_server.stop()
+
+
+def get_unused_url():
+    stub_server = StubSglangServer()
+    url = stub_server.url
+    stub_server.stop()
+    return url
+
+
+def test_multi_endpoint_round_robin(servers):
+    predictor = SglangClientPredictor(','.join(server.url for server in servers))
+    assert [endpoint.base_url for endpoint in predictor.endpoint_pool.endpoints] == [server.url for server in servers]
+    for server in servers:
+        server.reset_counts()
+    outputs = [predictor.predict(b'image', f'prompt {i}') for i in range(10)]
+    assert outputs == [f"echo:{predictor.build_prompt(f'prompt {i}')[-20:]}" for i in range(10)]
+    # 串行请求时进行中的请求数都为0，按轮转顺序分配
+    assert [server.request_count for server in servers] == [5, 5]
+    stats = predictor.get_endpoint_stats()
+    assert [item['requests'] for item in stats] == [5, 5]
+    assert all(item['healthy'] and item['in_flight'] == 0 and item['failures'] == 0 for item in stats)
+    predictor.close()
+
+
+def test_multi_endpoint_least_loaded(servers):
+    servers[0].delay = 0.05
+    predictor = SglangClientPredictor([server.url for server in servers])
+    prompts = [f'prompt {i}' for i in range(40)]
+    outputs = predictor.batch_predict([b'image'] * 40, prompts, max_concurrency=8)
+    assert outputs == [f"echo:{predictor.build_prompt(prompt)[-20:]}" for prompt in prompts]
+    # 慢的服务端上积压的请求更多，新的请求会优先分配给快的服务端
+    stats = predictor.get_endpoint_stats()
+    assert stats[0]['requests'] + stats[1]['requests'] == 40
+    assert stats[1]['requests'] > stats[0]['requests']
+    assert stats[0]['avg_latency'] > stats[1]['avg_latency']
+    predictor.close()
+
+
+def test_retry_and_eject_failing_endpoint(servers):
+    predictor = SglangClientPredictor([server.url for server in servers], health_check_interval=0)
+    servers[0].fail_generate = True
+    prompts = [f'prompt {i}' for i in range(10)]
+    expected = [f"echo:{predictor.build_prompt(prompt)[-20:]}" for prompt in prompts]
+    assert predictor.predict(b'image', prompts[0]) == expected[0]
+    assert predictor.batch_predict([b'image'] * 10, prompts, max_concurrency=4) == expected
+    assert ''.join(predictor.stream_predict(b'image', prompts[0])) == expected[0]
+    stats = predictor.get_endpoint_stats()
+    assert not stats[0]['healthy'] and stats[0]['failures'] == 1
+    assert stats[1]['healthy'] and stats[1]['requests'] == 12
+    predictor.close()
+
+
+def test_all_endpoints_failing(servers):
+    predictor = SglangClientPredictor([server.url for server in servers], health_check_interval=0)
+    for server in servers:
+        server.fail_generate = True
+    with pytest.raises(SglangServerError):
+        predictor.predict(b'image', 'prompt')
+    assert [item['failures'] for item in predictor.get_endpoint_stats()] == [1, 1]
+    predictor.close()
+
+
+def test_unreachable_endpoint_at_startup(server):
+    unused_url = get_unused_url()
+    predictor = SglangClientPredictor([unused_url, server.url], health_check_interval=0)
+    assert not predictor.get_endpoint_stats()[0]['healthy']
+    assert predictor.predict(b'image', 'prompt') == f"echo:{predictor.build_prompt('prompt')[-20:]}"
+    assert predictor.get_endpoint_stats()[1]['requests'] == 1
+    predictor.close()
+    with pytest.raises(RuntimeError):
+        SglangClientPredictor(unused_url)
+
+
+def test_health_check_readmits_endpoint(servers):
+    predictor = SglangClientPredictor([server.url for server in servers], health_check_interval=0.05)
+    servers[0].fail_health = True
+    deadline = time.time() + 5
+    while predictor.get_endpoint_stats()[0]['healthy'] and time.time() < deadline:
+        time.sleep(0.01)
+    assert not predictor.get_endpoint_stats()[0]['healthy']
+    # 被摘除的服务端不再分配请求
+    servers[0].reset_counts()
+    for i in range(4):
+        predictor.predict(b'image', f'prompt {i}')
+    assert servers[0].request_count == 0
+    servers[0].fail_health = False
+    while not predictor.get_endpoint_stats()[0]['healthy'] and time.time() < deadline:
+        time.sleep(0.01)
+    assert predictor.get_endpoint_stats()[0]['healthy']
+    predictor.close()
+
+
+def run_benchmark(num_docs=20, pages_per_doc=50, max_concurrency=16):
+    """对比每次新建连接的旧实现和复用连接池的实现：requests/s和新建的TCP连接数"""
+    stub_server = StubSglangServer()
+    predictor = SglangClientPredictor(stub_server.url)
+    prompts = [f'prompt {i}' for i in range(pages_per_doc)]
+    images = [b'image'] * pages_per_doc
+
+    def one_shot_predict(prompt):
+        # 旧实现的predict：每次请求都用httpx.post新建连接
+        request_body = predictor.build_request_body(b'image', predictor.build_prompt(prompt), predictor.build_sampling_params(
+            None, None, None, None, None, None, None))
+        return httpx.post(predictor.server_url, json=request_body, timeout=predictor.http_timeout).json()['text']
+
+    async def one_shot_batch_predict():
+        # 旧实现的aio_batch_predict：每篇文档新建一个AsyncClient
+        semaphore = asyncio.Semaphore(max_concurrency)
+        async with httpx.AsyncClient(timeout=predictor.http_timeout) as client:
+            async def run_one(prompt):
+                async with semaphore:
+                    return await predictor.aio_predict(b'image', prompt, async_client=client)
+            return await asyncio.gather(*[run_one(prompt) for prompt in prompts])
+
+    cases = [
+        ('predict, one-shot httpx.post', lambda: [one_shot_predict(prompt) for prompt in prompts]),
+        ('predict, pooled client', lambda: [predictor.predict(b'image', prompt) for prompt in prompts]),
+        ('batch_predict, client per document', lambda: asyncio.run(one_shot_batch_predict())),
+        ('batch_predict, pooled client', lambda: predictor.batch_predict(images, prompts, max_concurrency=max_concurrency)),
+    ]
+    for name, run_doc in cases:
+        stub_server.reset_counts()
+        start = time.time()
+        for _ in range(num_docs):
+            run_doc()
+        elapsed = time.time() - start
+        print(
+            f'{name}: {stub_server.request_count} requests, {stub_server.request_count / elapsed:.1f} requests/s, '
+            f'{stub_server.connection_count} connections'
+        )
+    predictor.close()
+    stub_server.stop()
+
+
+if __name__ == '__main__':
+    # 本地stub server上的连接复用对比：python tests/unittest/test_utils/test_sglang_client_predictor.py [num_docs] [pages_per_doc]
+    _num_docs = int(sys.argv[1]) if len(sys.argv) > 1 else 20
+    _pages_per_doc = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+    run_benchmark(_num_docs, _pages_per_doc)
@@ -0,0 +1,104 @@
+import copy
+import random
+import statistics
+import sys
+import time
+
+import pytest
+
+from mineru.utils import span_pre_proc
+from mineru.utils.span_pre_proc import calculate_char_in_span, fill_char_in_spans, LINE_START_FLAG, LINE_STOP_FLAG
+
+
+# 逐个char扫描全部span的原始实现，作为等价性测试的参照
+def reference_chars_to_content(span):
+    if len(span['chars']) == 0:
+        pass
+    else:
+        span['chars'] = sorted(span['chars'], key=lambda x: x['char_idx'])
+        char_widths = [char['bbox'][2] - char['bbox'][0] for char in span['chars']]
+        median_width = statistics.median(char_widths)
+
+        content = ''
+        for char in span['chars']:
+            char1 = char
+            char2 = span['chars'][span['chars'].index(char) + 1] if span['chars'].index(char) + 1 < len(span['chars']) else None
+            if char2 and char2['bbox'][0] - char1['bbox'][2] > median_width * 0.25 and char['char'] != ' ' and char2['char'] != ' ':
+                content += f"{char['char']} "
+            else:
+                content += char['char']
+
+        content = getattr(span_pre_proc, '__replace_unicode')(content)
+        content = getattr(span_pre_proc, '__replace_ligatures')(content)
+        content = getattr(span_pre_proc, '__replace_ligatures')(content)
+        span['content'] = content.strip()
+
+    del span['chars']
+
+
+def reference_fill_char_in_spans(spans, all_chars):
+    spans = sorted(spans, key=lambda x: x['bbox'][1])
+
+    for char in all_chars:
+        for span in spans:
+            if calculate_char_in_span(char['bbox'], span['bbox'], char['char']):
+                span['chars'].append(char)
+                break
+
+    need_ocr_spans = []
+    for span in spans:
+        reference_chars_to_content(span)
+        if len(span['content']) * span['height'] < span['width'] * 0.5:
+            need_ocr_spans.append(span)
+        del span['height'], span['width']
+    return need_ocr_spans
+
+
+def make_page(rng, num_lines, chars_per_line, float_coords=False):
+    """生成按行排布的span和char，span之间有上下重叠，char带有随机抖动和行首尾标点"""
+    spans = []
+    chars = []
+    char_idx = 0
+    alphabet = 'abcdefg 中文' + ''.join(LINE_STOP_FLAG[:5]) + ''.join(LINE_START_FLAG[:5])
+    for line in range(num_lines):
+        y0 = line * 12 + rng.randint(-3, 3)
+        x0 = rng.randint(0, 50)
+        width = chars_per_line * 6
+        for segment in range(rng.randint(1, 3)):
+            span_x0 = x0 + segment * (width + 10)
+            bbox = [span_x0, y0, span_x0 + width, y0 + 10 + rng.randint(-2, 6)]
+            if float_coords:
+                bbox = [v + 0.25 for v in bbox]
+            spans.append({'bbox': bbox, 'type': 'text', 'content': '', 'chars': [],
+                          'height': bbox[3] - bbox[1], 'width': bbox[2] - bbox[0]})
+            for k in range(chars_per_line):
+                cx0 = span_x0 + k * 6 + rng.uniform(-4, 4)
+                cy0 = y0 + rng.uniform(-4, 4)
+                chars.append({'char': rng.choice(alphabet), 'bbox': [cx0, cy0, cx0 + 5, cy0 + 9], 'char_idx': char_idx})
+                char_idx += 1
+    rng.shuffle(chars)
+    return spans, chars
+
+
+@pytest.mark.parametrize('seed', range(20))
+@pytest.mark.parametrize('float_coords', [False, True])
+def test_fill_char_in_spans_equivalence(seed, float_coords):
+    rng = random.Random(seed)
+    spans, chars = make_page(rng, rng.randint(0, 40), rng.randint(1, 20), float_coords)
+    expected_spans = copy.deepcopy(spans)
+    expected = reference_fill_char_in_spans(expected_spans, chars)
+    actual_spans = copy.deepcopy(spans)
+    actual = fill_char_in_spans(actual_spans, chars)
+    assert actual == expected
+    assert actual_spans == expected_spans
+
+
+if __name__ == '__main__':
+    # 合成密集文本层页面做性能对比：python tests/unittest/test_utils/test_span_pre_proc.py [num_lines] [chars_per_line]
+    _num_lines = int(sys.argv[1]) if len(sys.argv) > 1 else 250
+    _chars_per_line = int(sys.argv[2]) if len(sys.argv) > 2 else 100
+    _spans, _chars = make_page(random.Random(0), _num_lines, _chars_per_line)
+    for _name, _func in [('y band index', fill_char_in_spans), ('linear scan', reference_fill_char_in_spans)]:
+        _start = time.time()
+        _func(copy.deepcopy(_spans), _chars)
+        print(f'{_name}: {len(_chars)} chars, {len(_spans)} spans, {time.time() - _start:.3f}s')
@@ -0,0 +1,85 @@
+import random
+
+from mineru.backend.vlm import vlm_magic_model
+from mineru.backend.vlm.vlm_magic_model import BLOCK_PATTERN, StreamingBlockParser
+
+OUTPUT = (
+    "<|box_start|>088 119 472 571<|box_end|><|ref_start|>image<|ref_end|><|md_start|>![]('img_url')<|md_end|>\n"
+    "<|box_start|>079 582 482 608<|box_end|><|ref_start|>image_caption<|ref_end|><|md_start|>Fig. 2. (a) Schematic.<|md_end|>\n"
+    "<|box_start|>079 624 285 638<|box_end|><|ref_start|>title<|ref_end|><|md_start|># 2.2. Zero flow day analysis<|md_end|>\n"
+    "<|box_start|>076 813 368 853<|box_end|><|ref_start|>equation<|ref_end|><|md_start|>\\[\nN=a+b\n\\]<|md_end|>\n"
+    "<|box_start|>525 833 926 895<|box_end|><|ref_start|>text<|ref_end|><|md_start|>A critical value of \\(t\\)<|im_end|>"
+)
+
+
+def parse_stream(text, chunk_sizes):
+    parser = StreamingBlockParser()
+    emitted = []
+    pos = 0
+    for size in chunk_sizes:
+        emitted.append(parser.feed(text[pos:pos + size]))
+        pos += size
+    emitted.append(parser.feed(text[pos:]))
+    emitted.append(parser.flush())
+    return emitted
+
+
+def test_blocks_emitted_at_md_end():
+    emitted = parse_stream(OUTPUT, [1] * len(OUTPUT))
+    # 每个块在收到<|md_end|>的最后一个字符时返回
+    pos = 0
+    for index, blocks in enumerate(emitted[:len(OUTPUT)]):
+        pos += 1
+        if blocks:
+            assert len(blocks) == 1
+            assert OUTPUT[:pos].endswith('<|md_end|>')
+    all_blocks = [block for blocks in emitted for block in blocks]
+    assert len(all_blocks) == 5
+    # 以<|im_end|>结束的最后一块在flush时返回
+    assert emitted[-1] == [all_blocks[-1]]
+
+
+def test_same_blocks_as_full_output():
+    rng = random.Random(0)
+    texts = [
+        OUTPUT,
+        'noise' + OUTPUT,
+        OUTPUT.replace('<|ref_end|><|md_start|>![]', '<|md_start|>![]'),
+        '<|box_start|>bad<|md_end|>\n' + OUTPUT,
+        OUTPUT[:-len('<|im_end|>')],
+        OUTPUT.replace('Schematic.<|md_end|>', 'Schematic.<|im_end|> tail<|md_end|>'),
+    ]
+    for text in texts:
+        for _ in range(20):
+            chunk_sizes = [rng.randint(1, 30) for _ in range(len(text) // 10)]
+            blocks = [block for emitted in parse_stream(text, chunk_sizes) for block in emitted]
+            assert BLOCK_PATTERN.findall(''.join(blocks)) == BLOCK_PATTERN.findall(text)
+
+
+class CountingPattern:
+    def __init__(self, pattern):
+        self.pattern = pattern
+        self.scanned = 0
+
+    def match(self, string, *args):
+        self.scanned += len(string)
+        return self.pattern.match(string, *args)
+
+    def finditer(self, string):
+        return self.pattern.finditer(string)
+
+
+def test_long_block_matched_once(monkeypatch):
+    pattern = CountingPattern(BLOCK_PATTERN)
+    monkeypatch.setattr(vlm_magic_model, 'BLOCK_PATTERN', pattern)
+    long_block = (
+        '<|box_start|>100 100 900 900<|box_end|><|ref_start|>table<|ref_end|><|md_start|>'
+        + '<fcel>cell<nl>' * 2000 + '<|md_end|>\n'
+    )
+    text = long_block + OUTPUT
+    emitted = parse_stream(text, [3] * (len(text) // 3))
+    blocks = [block for blocks in emitted for block in blocks]
+    assert blocks[0] == long_block.rstrip('\n')
+    assert len(blocks) == 6
+    # 逐token输入时只在收到<|md_end|>后匹配一次，不会每收到一段文本都从块的开头重新匹配
+    assert pattern.scanned < 2 * len(text)
@@ -0,0 +1,354 @@
+import asyncio
+import io
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pypdfium2 as pdfium
+import pypdfium2.raw as pdfium_c
+import pytest
+
+from mineru.backend.vlm.base_predictor import BasePredictor
+from mineru.backend.vlm.sglang_client_predictor import SglangClientPredictor
+from mineru.backend.vlm.vlm_analyze import aio_doc_analyze, aio_doc_analyze_as_iter, batch_doc_analyze, doc_analyze
+from mineru.data.data_reader_writer import FileBasedDataWriter
+
+GATE_TIMEOUT = 5
+PAGE_OUTPUT = '<|box_start|>100 100 500 200<|box_end|><|ref_start|>text<|ref_end|><|md_start|>hello<|md_end|>'
+
+
+class StubSglangHandler(BaseHTTPRequestHandler):
+    """返回固定页面结果的sglang server，统计同时处理的请求数。
+    设置了gate_size时，请求在同时处理的请求数达到gate_size之前一直等待（最多GATE_TIMEOUT秒）。
+    """
+
+    protocol_version = 'HTTP/1.1'
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, body):
+        data = json.dumps(body).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path == '/get_model_info':
+            self._send_json({'model_path': 'stub'})
+        else:
+            self._send_json({})
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        with self.server.lock:
+            self.server.request_count += 1
+            self.server.in_flight += 1
+            self.server.max_in_flight = max(self.server.max_in_flight, self.server.in_flight)
+            # delays中按请求到达顺序指定每个请求的耗时
+            delay = self.server.delays.pop(0) if self.server.delays else self.server.delay
+            if self.server.gate_size is not None and self.server.in_flight >= self.server.gate_size:
+                self.server.gate.set()
+        if self.server.gate_size is not None:
+            self.server.gate.wait(GATE_TIMEOUT)
+        time.sleep(delay)
+        with self.server.lock:
+            self.server.in_flight -= 1
+        self._send_json({'text': PAGE_OUTPUT})
+
+
+class StubSglangServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, delay=0.05):
+        super().__init__(('127.0.0.1', 0), StubSglangHandler)
+        self.lock = threading.Lock()
+        self.delay = delay
+        self.delays = []
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self.request_count = 0
+        self.gate_size = None
+        self.gate = threading.Event()
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+
+class RecordingBatchPredictor(BasePredictor):
+    """记录每次batch_predict的页数，返回固定页面结果"""
+
+    def __init__(self):
+        super().__init__()
+        self.batch_sizes = []
+        self.max_new_tokens_list = []
+
+    def predict(self, image, prompt='', *args, **kwargs):
+        return PAGE_OUTPUT
+
+    def batch_predict(self, images, prompts='', *args, max_new_tokens=None, **kwargs):
+        self.batch_sizes.append(len(images))
+        self.max_new_tokens_list.extend(self.get_page_max_new_tokens(max_new_tokens, len(images)))
+        return [PAGE_OUTPUT] * len(images)
+
+    def stream_predict(self, image, prompt='', *args, **kwargs):
+        yield PAGE_OUTPUT
+
+
+def make_pdf(page_num, blank_pages=()):
+    """没有文本层的页面，除blank_pages外每页画一个黑色矩形，避免被当作空白页跳过"""
+    pdf = pdfium.PdfDocument.new()
+    for page_idx in range(page_num):
+        page = pdf.new_page(300, 400)
+        if page_idx not in blank_pages:
+            rect = pdfium_c.FPDFPageObj_CreateNewRect(50, 300, 200, 20)
+            pdfium_c.FPDFPageObj_SetFillColor(rect, 0, 0, 0, 255)
+            pdfium_c.FPDFPath_SetDrawMode(rect, pdfium_c.FPDF_FILLMODE_ALTERNATE, 0)
+            pdfium_c.FPDFPage_InsertObject(page.raw, rect)
+            pdfium_c.FPDFPage_GenerateContent(page.raw)
+        page.close()
+    buffer = io.BytesIO()
+    pdf.save(buffer)
+    pdf.close()
+    return buffer.getvalue()
+
+
+def make_writers(tmp_path, num):
+    return [FileBasedDataWriter(str(tmp_path / f'doc_{i}')) for i in range(num)]
+
+
+@pytest.fixture
+def server():
+    stub_server = StubSglangServer()
+    yield stub_server
+    stub_server.shutdown()
+    stub_server.server_close()
+
+
+def test_sglang_client_pages_from_all_documents_run_concurrently(server, tmp_path):
+    predictor = SglangClientPredictor(server.url)
+    pdf_bytes_list = [make_pdf(2) for _ in range(8)]
+    expected = [doc_analyze(pdf_bytes, FileBasedDataWriter(str(tmp_path / 'expected')), predictor) for pdf_bytes in pdf_bytes_list]
+    # 逐篇处理时服务端同时只有2个请求
+    assert server.max_in_flight <= 2
+
+    # 服务端在同时有3个请求之前不返回，逐篇处理时会一直等到超时
+    server.gate_size = 3
+    outputs = {}
+    for pdf_idx, middle_json, results in batch_doc_analyze(pdf_bytes_list, make_writers(tmp_path, 8), predictor):
+        assert pdf_idx not in outputs
+        outputs[pdf_idx] = (middle_json, results)
+    assert sorted(outputs) == list(range(8))
+    assert server.gate.is_set()
+    for pdf_idx, (middle_json, results) in enumerate(expected):
+        assert outputs[pdf_idx][1] == results
+        assert outputs[pdf_idx][0] == middle_json
+    predictor.close()
+
+
+def test_sglang_client_respects_max_concurrency(server, tmp_path):
+    predictor = SglangClientPredictor(server.url)
+    pdf_bytes_list = [make_pdf(3) for _ in range(6)]
+    outputs = list(batch_doc_analyze(pdf_bytes_list, make_writers(tmp_path, 6), predictor, max_concurrency=4))
+    assert sorted(pdf_idx for pdf_idx, _, _ in outputs) == list(range(6))
+    assert server.max_in_flight <= 4
+    predictor.close()
+
+
+def test_batch_predict_windows_span_documents(tmp_path):
+    predictor = RecordingBatchPredictor()
+    page_nums = [1, 3, 2, 20, 1, 2]
+    pdf_bytes_list = [make_pdf(page_num) for page_num in page_nums]
+    outputs = {
+        pdf_idx: (middle_json, results)
+        for pdf_idx, middle_json, results in batch_doc_analyze(
+            pdf_bytes_list, make_writers(tmp_path, len(page_nums)), predictor, max_concurrency=4, max_pending_pages=8
+        )
+    }
+    assert sorted(outputs) == list(range(len(page_nums)))
+    for pdf_idx, page_num in enumerate(page_nums):
+        middle_json, results = outputs[pdf_idx]
+        assert results == [PAGE_OUTPUT] * page_num
+        assert len(middle_json['pdf_info']) == page_num
+    # 每批最多max_concurrency页，第一批包含多篇文档的页面
+    assert sum(predictor.batch_sizes) == sum(page_nums)
+    assert max(predictor.batch_sizes) <= 4
+    assert predictor.batch_sizes[0] == 4
+
+
+def test_early_exit_stops_producer(server, tmp_path):
+    predictor = SglangClientPredictor(server.url)
+    pdf_bytes_list = [make_pdf(2) for _ in range(20)]
+    generator = batch_doc_analyze(pdf_bytes_list, make_writers(tmp_path, 20), predictor, max_concurrency=2, max_pending_pages=4)
+    pdf_idx, middle_json, results = next(generator)
+    assert results == [PAGE_OUTPUT] * 2
+    generator.close()
+    # 关闭后常驻事件循环仍可继续使用
+    assert predictor.batch_predict([b'image'] * 3) == [PAGE_OUTPUT] * 3
+    predictor.close()
+
+
+def test_early_exit_closes_queued_documents(tmp_path, monkeypatch):
+    opened_docs = []
+
+    class RecordingPdfDocument(pdfium.PdfDocument):
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            opened_docs.append(self)
+
+    class NotifyingBatchPredictor(RecordingBatchPredictor):
+        def __init__(self, page_num):
+            super().__init__()
+            self.page_num = page_num
+            self.done = threading.Event()
+
+        def batch_predict(self, images, *args, **kwargs):
+            outputs = super().batch_predict(images, *args, **kwargs)
+            if sum(self.batch_sizes) == self.page_num:
+                self.done.set()
+            return outputs
+
+    pdf_bytes_list = [make_pdf(1) for _ in range(10)]
+    monkeypatch.setattr(pdfium, 'PdfDocument', RecordingPdfDocument)
+    predictor = NotifyingBatchPredictor(10)
+    generator = batch_doc_analyze(pdf_bytes_list, make_writers(tmp_path, 10), predictor, max_concurrency=2, max_pending_pages=20)
+    next(generator)
+    # 生产者已经把所有文档放入队列，调用方还没有取出
+    assert predictor.done.wait(GATE_TIMEOUT)
+    generator.close()
+    assert len(opened_docs) == 10
+    assert all(pdf_doc.raw is None for pdf_doc in opened_docs)
+
+
+def test_aio_doc_analyze_as_iter_yields_pages_as_they_finish(server, tmp_path):
+    predictor = SglangClientPredictor(server.url)
+    pdf_bytes = make_pdf(4)
+    expected_middle_json, expected_results = doc_analyze(pdf_bytes, FileBasedDataWriter(str(tmp_path / 'expected')), predictor)
+
+    async def collect():
+        start = time.time()
+        pages = []
+        async for page_idx, page_info, output in aio_doc_analyze_as_iter(pdf_bytes, FileBasedDataWriter(str(tmp_path)), predictor):
+            pages.append((time.time() - start, page_idx, page_info, output))
+        return pages
+
+    # 最先到达的请求最慢，其余页面先完成
+    server.delays = [1.0]
+    pages = asyncio.run(collect())
+    assert sorted(page_idx for _, page_idx, _, _ in pages) == [0, 1, 2, 3]
+    assert pages[0][0] < 0.8 <= pages[-1][0]
+    for _, page_idx, page_info, output in pages:
+        assert page_info == expected_middle_json['pdf_info'][page_idx]
+        assert output == expected_results[page_idx]
+
+    middle_json = asyncio.run(aio_doc_analyze(pdf_bytes, FileBasedDataWriter(str(tmp_path)), predictor))
+    assert middle_json == expected_middle_json
+    predictor.close()
+
+
+def test_aio_doc_analyze_as_iter_early_exit(server, tmp_path):
+    predictor = SglangClientPredictor(server.url)
+
+    async def first_page():
+        pages = aio_doc_analyze_as_iter(make_pdf(6), FileBasedDataWriter(str(tmp_path)), predictor)
+        _, page_info, _ = await pages.__anext__()
+        await pages.aclose()
+        await asyncio.sleep(0.1)
+        # 剩余的请求被取消，事件循环上没有残留的任务
+        return page_info, [task for task in asyncio.all_tasks() if task is not asyncio.current_task()]
+
+    server.delays = [0.05] + [5.0] * 5
+    page_info, remaining_tasks = asyncio.run(first_page())
+    assert remaining_tasks == []
+    assert page_info['para_blocks'][0]['lines'][0]['spans'][0]['content'] == 'hello'
+    predictor.close()
+
+
+def test_aio_doc_analyze_with_default_as_iter(tmp_path):
+    # 没有重写aio_batch_predict_as_iter的predictor整批完成后按顺序输出
+    predictor = RecordingBatchPredictor()
+    pdf_bytes = make_pdf(3)
+    expected_middle_json, _ = doc_analyze(pdf_bytes, FileBasedDataWriter(str(tmp_path)), predictor)
+    assert asyncio.run(aio_doc_analyze(pdf_bytes, FileBasedDataWriter(str(tmp_path)), predictor)) == expected_middle_json
+
+
+@pytest.fixture
+def pdfium_overlap(monkeypatch):
+    """记录是否有两个线程同时在pdfium中取页面或渲染"""
+    state = {'active': 0, 'overlap': False}
+    state_lock = threading.Lock()
+
+    def track(func):
+        def wrapper(*args, **kwargs):
+            with state_lock:
+                state['active'] += 1
+                state['overlap'] |= state['active'] > 1
+            try:
+                # 放大两次调用重叠的窗口
+                time.sleep(0.002)
+                return func(*args, **kwargs)
+            finally:
+                with state_lock:
+                    state['active'] -= 1
+        return wrapper
+
+    monkeypatch.setattr(pdfium.PdfDocument, 'get_page', track(pdfium.PdfDocument.get_page))
+    monkeypatch.setattr(pdfium.PdfPage, 'render', track(pdfium.PdfPage.render))
+    monkeypatch.setattr(pdfium.PdfPage, 'get_size', track(pdfium.PdfPage.get_size))
+    return state
+
+
+def test_concurrent_aio_doc_analyze(tmp_path, pdfium_overlap):
+    predictor = RecordingBatchPredictor()
+    pdf_bytes_list = [make_pdf(6), make_pdf(5, blank_pages=(1,)), make_pdf(4)]
+    expected = [doc_analyze(pdf_bytes, FileBasedDataWriter(str(tmp_path / 'expected')), predictor)[0] for pdf_bytes in pdf_bytes_list]
+    assert not pdfium_overlap['overlap']
+
+    async def analyze_all():
+        # 多个请求同时在工作线程中渲染、估计输出量和裁剪图片
+        return await asyncio.gather(*[
+            aio_doc_analyze(pdf_bytes, FileBasedDataWriter(str(tmp_path / f'doc_{pdf_idx}')), predictor)
+            for pdf_idx, pdf_bytes in enumerate(pdf_bytes_list)
+        ])
+
+    assert asyncio.run(analyze_all()) == expected
+    # 所有pdfium调用都持有同一把锁，不会同时进入pdfium
+    assert not pdfium_overlap['overlap']
+
+
+def test_blank_pages_are_inferred_by_default(tmp_path):
+    predictor = RecordingBatchPredictor()
+    _, results = doc_analyze(make_pdf(3, blank_pages=(1,)), FileBasedDataWriter(str(tmp_path)), predictor)
+    assert results == [PAGE_OUTPUT] * 3
+    assert predictor.batch_sizes == [3]
+
+
+def test_blank_pages_are_skipped(server, tmp_path, monkeypatch):
+    monkeypatch.setenv('MINERU_VLM_PAGE_BUDGET_ENABLE', 'true')
+    blank_pages = (0, 2)
+    pdf_bytes = make_pdf(4, blank_pages)
+    predictor = RecordingBatchPredictor()
+    middle_json, results = doc_analyze(pdf_bytes, FileBasedDataWriter(str(tmp_path)), predictor)
+    assert results == ['', PAGE_OUTPUT, '', PAGE_OUTPUT]
+    assert predictor.batch_sizes == [2]
+    # 没有文本层的页面无法估计输出量，使用默认的max_new_tokens
+    assert predictor.max_new_tokens_list == [predictor.max_new_tokens] * 2
+    for page_idx, page_info in enumerate(middle_json['pdf_info']):
+        assert page_info['page_idx'] == page_idx
+        assert (page_info['para_blocks'] == []) == (page_idx in blank_pages)
+
+    # 其他入口跳过同样的页面，结果一致
+    outputs = list(batch_doc_analyze([pdf_bytes], make_writers(tmp_path, 1), predictor))
+    assert outputs[0][1] == middle_json and outputs[0][2] == results
+    sglang_predictor = SglangClientPredictor(server.url)
+    assert asyncio.run(aio_doc_analyze(pdf_bytes, FileBasedDataWriter(str(tmp_path)), sglang_predictor)) == middle_json
+    assert server.request_count == 2
+    sglang_predictor.close()